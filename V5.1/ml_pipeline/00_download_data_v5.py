@@ -1,9 +1,13 @@
-import yfinance as yf
 import pandas as pd
 import json
 import os
+import sys
 from datetime import datetime, timedelta
-import time
+
+# 共用元件 (repo 根目錄下的 common/)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.bar_store import BarStore
+from common.raw_dataset import write_raw_dataset
 
 def get_asset_tickers(file_path):
     """Reads the asset pool JSON and returns a list of yfinance-compatible tickers."""
@@ -21,40 +25,17 @@ def get_asset_tickers(file_path):
     return tickers
 
 def download_data(tickers, start_date, end_date, interval, prepost=False):
-    """Downloads historical data for a list of tickers with retry logic."""
-    print(f"Downloading {interval} data for {len(tickers)} tickers from {start_date} to {end_date}...")
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            # yfinance download
-            df = yf.download(
-                tickers,
-                start=start_date,
-                end=end_date,
-                interval=interval,
-                auto_adjust=True,
-                prepost=prepost,
-                threads=True,
-                timeout=30
-            )
-            # Check if the dataframe is empty or contains only NaNs
-            if not df.empty and not df.isnull().all().all():
-                # On success, print a message and return the dataframe
-                print(f"Successfully downloaded data on attempt {attempt + 1}.")
-                return df
-            else:
-                print(f"Attempt {attempt + 1} of {max_retries} failed: No data returned.")
-        except Exception as e:
-            print(f"Attempt {attempt + 1} of {max_retries} failed with error: {e}")
-
-        # If not the last attempt, wait before retrying
-        if attempt < max_retries - 1:
-            print("Waiting 5 seconds before retrying...")
-            time.sleep(5)
-
-    # If all retries fail, return an empty DataFrame
-    print("All download attempts failed.")
-    return pd.DataFrame()
+    """
+    Loads historical data for a list of tickers via the shared BarStore -> {symbol: DataFrame}.
+    只下載本地尚未覆蓋的區間 (失敗的區間不會被標記，下次執行會自動重試)。
+    """
+    print(f"Loading {interval} data for {len(tickers)} tickers from {start_date} to {end_date}...")
+    bars = BarStore().get_bars(tickers, start_date, end_date, interval=interval, prepost=prepost)
+    if not bars:
+        print("No data returned.")
+    else:
+        print(f"Loaded {len(bars)}/{len(tickers)} tickers.")
+    return bars
 
 def main():
     """Main function to download and save ticker, macro, and sector data (V5.1)."""
@@ -92,39 +73,33 @@ def main():
 
     # --- 1. Download Ticker Data (Stocks) ---
     print("\n--- Starting Ticker Data Download ---")
-    daily_tickers_df = download_data(tickers, ten_years_ago, end_date, interval='1d')
-    hourly_tickers_df = download_data(tickers, two_years_ago, end_date, interval='60m', prepost=True)
-
-    # Combine into a single dictionary
-    raw_tickers_data = {
-        'daily': daily_tickers_df,
-        'hourly': hourly_tickers_df
-    }
+    daily_tickers = download_data(tickers, ten_years_ago, end_date, interval='1d')
+    hourly_tickers = download_data(tickers, two_years_ago, end_date, interval='60m', prepost=True)
 
-    # Save ticker data
-    tickers_output_path = os.path.join(output_dir, 'raw_tickers_data.pkl')
-    pd.to_pickle(raw_tickers_data, tickers_output_path)
-    print(f"Ticker data saved to {tickers_output_path}")
+    # Save ticker data (long-format symbol/year partitioned Parquet，取代 raw_tickers_data.pkl)
+    write_raw_dataset(daily_tickers, os.path.join(output_dir, 'daily'))
+    write_raw_dataset(hourly_tickers, os.path.join(output_dir, 'hourly'))
+    print(f"Ticker data saved to {output_dir}")
 
     # --- 2. Download Macro Data (Market Context) ---
     print("\n--- Starting Macro Data Download ---")
     # For macro, we mainly need daily data for L1 features
-    daily_macro_df = download_data(macro_symbols, ten_years_ago, end_date, interval='1d')
+    daily_macro = download_data(macro_symbols, ten_years_ago, end_date, interval='1d')
 
     # Save macro data
-    macro_output_path = os.path.join(output_dir, 'raw_macro_data.pkl')
-    pd.to_pickle(daily_macro_df, macro_output_path)
-    print(f"Macro data saved to {macro_output_path}")
+    macro_output_dir = os.path.join(output_dir, 'macro')
+    write_raw_dataset(daily_macro, macro_output_dir)
+    print(f"Macro data saved to {macro_output_dir}")
     
     # --- 3. Download Sector Data (V5.1 Orthogonal Features) ---
     print("\n--- Starting Sector ETF Download (V5.1) ---")
     # We download Daily data for sectors to build Relative Strength & Sector RSI context
-    daily_sector_df = download_data(sector_symbols, ten_years_ago, end_date, interval='1d')
+    daily_sector = download_data(sector_symbols, ten_years_ago, end_date, interval='1d')
     
     # Save sector data
-    sector_output_path = os.path.join(output_dir, 'raw_sector_data.pkl')
-    pd.to_pickle(daily_sector_df, sector_output_path)
-    print(f"Sector data saved to {sector_output_path}")
+    sector_output_dir = os.path.join(output_dir, 'sector')
+    write_raw_dataset(daily_sector, sector_output_dir)
+    print(f"Sector data saved to {sector_output_dir}")
 
     print("\nV5.1 Data download process completed successfully.")
 
@@ -1,5 +1,13 @@
 import pandas as pd
 import os
+import sys
+
+# 共用元件 (repo 根目錄下的 common/)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.raw_dataset import dataset_exists, stream_to_parquet
+
+# Raw dataset 欄位為小寫，V5.1 下游沿用 yfinance 大寫欄位
+V5_1_COLUMNS = {'open': 'Open', 'high': 'High', 'low': 'Low', 'close': 'Close', 'volume': 'Volume'}
 
 def process_and_save(df, output_path, name):
     """
@@ -47,6 +55,18 @@ def process_and_save(df, output_path, name):
         df.to_parquet(output_path)
         print(f"  - Saved flat DataFrame to {output_path}")
 
+def process_legacy_pickles(raw_data_dir, output_dir):
+    """Formats raw_*.pkl produced by older versions of step 00."""
+    raw_tickers = pd.read_pickle(os.path.join(raw_data_dir, 'raw_tickers_data.pkl'))
+    raw_macro = pd.read_pickle(os.path.join(raw_data_dir, 'raw_macro_data.pkl'))
+    process_and_save(raw_tickers.get('daily'), os.path.join(output_dir, 'universe_daily.parquet'), "Ticker Data (Daily)")
+    process_and_save(raw_tickers.get('hourly'), os.path.join(output_dir, 'universe_60m.parquet'), "Ticker Data (60m)")
+    process_and_save(raw_macro, os.path.join(output_dir, 'market_indicators.parquet'), "Macro Data (Daily)")
+
+    sector_pkl_path = os.path.join(raw_data_dir, 'raw_sector_data.pkl')
+    if os.path.exists(sector_pkl_path):
+        process_and_save(pd.read_pickle(sector_pkl_path), os.path.join(output_dir, 'sector_daily.parquet'), "Sector Data (Daily)")
+
 def main():
     # --- Setup Paths ---
     SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -56,10 +76,13 @@ def main():
     # Ensure output directory exists (though usually created in step 00)
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-    # Input Files (From Step 00)
-    tickers_pkl_path = os.path.join(RAW_DATA_DIR, 'raw_tickers_data.pkl')
-    macro_pkl_path = os.path.join(RAW_DATA_DIR, 'raw_macro_data.pkl')
-    sector_pkl_path = os.path.join(RAW_DATA_DIR, 'raw_sector_data.pkl') # V5.1 New
+    # Input Datasets (From Step 00): symbol/year partitioned Parquet
+    raw_inputs = {
+        'daily': os.path.join(RAW_DATA_DIR, 'daily'),
+        'hourly': os.path.join(RAW_DATA_DIR, 'hourly'),
+        'macro': os.path.join(RAW_DATA_DIR, 'macro'),
+        'sector': os.path.join(RAW_DATA_DIR, 'sector'),  # V5.1 New
+    }
 
     # Output Files (For Step 01 Feature Engineering)
     universe_daily_path = os.path.join(OUTPUT_DIR, 'universe_daily.parquet')
@@ -67,56 +90,30 @@ def main():
     market_indicators_path = os.path.join(OUTPUT_DIR, 'market_indicators.parquet')
     sector_daily_path = os.path.join(OUTPUT_DIR, 'sector_daily.parquet') # V5.1 New
 
-    # --- Load Data ---
-    print("Loading raw pickle files...")
-    
-    # Check for essential files
-    if not os.path.exists(tickers_pkl_path) or not os.path.exists(macro_pkl_path):
-        print("Error: Essential raw data files (tickers/macro) not found. Please run 00_download_data_v5.py first.")
+    if not dataset_exists(raw_inputs['daily']) or not dataset_exists(raw_inputs['macro']):
+        legacy_pkl_path = os.path.join(RAW_DATA_DIR, 'raw_tickers_data.pkl')
+        if os.path.exists(legacy_pkl_path):
+            print("Raw datasets not found; falling back to legacy raw pickle files...")
+            process_legacy_pickles(RAW_DATA_DIR, OUTPUT_DIR)
+        else:
+            print("Error: Essential raw datasets (daily/macro) not found. Please run 00_download_data_v5.py first.")
         return
-        
-    raw_tickers = pd.read_pickle(tickers_pkl_path)
-    raw_macro = pd.read_pickle(macro_pkl_path)
-    
-    # Load Sector Data (V5.1)
-    raw_sector = None
-    if os.path.exists(sector_pkl_path):
-        raw_sector = pd.read_pickle(sector_pkl_path)
-    else:
-        print("Warning: Sector data not found. V5.1 orthogonal features may not work.")
-
-    print("Load complete.")
 
-    # --- 1. Process Tickers (Daily) ---
-    # raw_tickers is a dict {'daily': df, 'hourly': df}
-    process_and_save(
-        raw_tickers.get('daily'), 
-        universe_daily_path, 
-        "Ticker Data (Daily)"
-    )
-
-    # --- 2. Process Tickers (60m) ---
-    process_and_save(
-        raw_tickers.get('hourly'), 
-        universe_60m_path, 
-        "Ticker Data (60m)"
-    )
+    if not dataset_exists(raw_inputs['sector']):
+        print("Warning: Sector data not found. V5.1 orthogonal features may not work.")
 
-    # --- 3. Process Macro (Daily) ---
-    # raw_macro is a single DataFrame
-    process_and_save(
-        raw_macro, 
-        market_indicators_path, 
-        "Macro Data (Daily)"
-    )
-    
-    # --- 4. Process Sector (Daily) - V5.1 New ---
-    if raw_sector is not None:
-        process_and_save(
-            raw_sector,
-            sector_daily_path,
-            "Sector Data (Daily)"
-        )
+    # 逐標的串流：每次只持有一個 symbol 的資料，輸出 (symbol, timestamp) panel
+    jobs = [
+        ('daily', universe_daily_path, "Ticker Data (Daily)"),
+        ('hourly', universe_60m_path, "Ticker Data (60m)"),
+        ('macro', market_indicators_path, "Macro Data (Daily)"),
+        ('sector', sector_daily_path, "Sector Data (Daily)"),
+    ]
+    for key, output_path, name in jobs:
+        if not dataset_exists(raw_inputs[key]):
+            continue
+        print(f"\nProcessing {name}...")
+        stream_to_parquet(raw_inputs[key], output_path, index=('symbol', 'timestamp'), rename=V5_1_COLUMNS)
 
     print("\nStep 0-2: Data Formatting Complete.")
 
@@ -1,8 +1,17 @@
 import pandas as pd
-import pandas_ta as ta
 import numpy as np
 import os
+import sys
 import json
+import argparse
+
+# 共用元件 (repo 根目錄下的 common/)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.cross_rank import CrossSection
+from common.feature_graph import FeatureGraph
+from common.group_features import GroupMap, gather, member_index, relative
+from common.indicators import as_wide, atr, bbands_pctb, pct_change, rsi, sma
+from common.session_features import join_session_features, session_features
 
 # --- V5.1 Sector Mapping Configuration ---
 SECTOR_MAP = {
@@ -45,6 +54,15 @@ SECTOR_MAP = {
     'NEE': 'XLU', 'DUK': 'XLU', 'SO': 'XLU', 'VST': 'XLU', 'CEG': 'XLU'
 }
 
+# SECTOR_MAP 的群組是 sector ETF：只用 sector_df 的 ETF 價格，缺價格時特徵為 NaN (不以成員合成指數冒名)
+SECTOR_ETFS = frozenset(SECTOR_MAP.values())
+
+# 群組相對特徵：新特徵 = (個股欄位, 群組基準欄位)，各一次向量化 gather
+GROUP_RELATIVE = {
+    'RSI_Divergence': ('RSI_14', 'RSI_14'),
+    'Rel_Strength_Daily': ('Ret_1d', 'Ret_1d'),
+}
+
 def load_data(data_dir):
     """Loads standardized parquet data."""
     universe_path = os.path.join(data_dir, 'universe_daily.parquet')
@@ -120,116 +138,135 @@ def build_market_features(market_df):
     print(f"  - Market Features shape: {features.shape}")
     return features
 
-def build_stock_features(universe_df, market_features, sector_df=None):
+def build_feature_graph():
+    """
+    Per-symbol feature DAG (common.feature_graph)：每個特徵宣告輸入與參數，
+    重建時只重算新增 / 失效的節點，以及原始資料有變動的標的。
+    Sector 特徵需要跨標的查表，仍在 build_stock_features 中計算 (本身很便宜)。
+    """
+    graph = FeatureGraph(['Open', 'High', 'Low', 'Close', 'Volume'])
+
+    # --- 1. Base Strategy Indicators (V5) ---
+    # min_bars: 與 pandas_ta 相同，K 棒數不足的標的整段為 NaN
+    graph.add('RSI_2', rsi, ['Close'], {'length': 2}, min_bars=3)
+    graph.add('RSI_14', rsi, ['Close'], {'length': 14}, min_bars=15)
+    graph.add('SMA_200', sma, ['Close'], {'length': 200}, min_bars=200)
+    graph.add('Dist_SMA_200', lambda close, sma_200: (close / sma_200) - 1, ['Close', 'SMA_200'])
+
+    # Bollinger Bands %B
+    graph.add('BB_PctB', bbands_pctb, ['Close'], {'length': 20, 'std': 2.0}, min_bars=20)
+
+    # Volatility (ATR)
+    graph.add('ATR_14', atr, ['High', 'Low', 'Close'], {'length': 14}, min_bars=15)
+    graph.add('ATR_Norm', lambda atr_14, close: atr_14 / close, ['ATR_14', 'Close'])
+
+    # Volume
+    graph.add('Vol_MA_20', sma, ['Volume'], {'length': 20}, min_bars=20)
+    graph.add('Rel_Vol', lambda volume, vol_ma_20: volume / vol_ma_20, ['Volume', 'Vol_MA_20'])
+
+    # --- 2. V5.1 Microstructure Features ---
+    # Volume Structure: Is volume expanding on down moves?
+    graph.add('Down_Vol_Prop', lambda open_, close, volume, vol_ma_20: (volume * (close < open_)) / (vol_ma_20 + 1),
+              ['Open', 'Close', 'Volume', 'Vol_MA_20'])
+
+    # 日報酬 (Rel_Strength_Daily 用)
+    graph.add('Ret_1d', pct_change, ['Close'])
+    return graph
+
+def _rsi_14(close):
+    if len(close) >= 15:
+        return as_wide(rsi(close.to_numpy(dtype=np.float64), 14), close)
+    return close * np.nan  # 與 ta.rsi 回傳 None 相同：全部 NaN
+
+def build_group_benchmarks(cs, group_map, sec_closes=None, etf_groups=SECTOR_ETFS):
+    """
+    Group benchmark RSI_14 / Ret_1d as (date x group) frames on the stock dates (cs.dates)。
+    ETF 群組 (etf_groups 或 sector_df 中有的 ETF) 以 ETF 收盤價計算 (在 ETF 自己的日期上算，再對齊)，
+    沒有該 ETF 價格 (沒有 sector_df 或下載失敗) 時為 NaN；
+    其他群組 (GICS 名稱、分群標籤) 以成員等權日報酬合成的指數計算。
+    沒有任何群組有基準來源 (沒有 sector_df 且全是 ETF 群組) 時回傳 None。
+    """
+    groups = group_map.groups
+    priced = sec_closes.columns if sec_closes is not None else pd.Index([])
+    is_etf = groups.isin(list(etf_groups)) | groups.isin(priced)
+    etf, synth = groups[is_etf], groups[~is_etf]
+    if sec_closes is None and not len(synth):
+        return None
+
+    parts = {'RSI_14': [], 'Ret_1d': []}
+    if len(etf):
+        unpriced = etf.difference(priced)
+        if len(unpriced):
+            print(f"  - Warning: no sector ETF prices for {list(unpriced)}; their group features stay NaN.")
+        close = sec_closes.reindex(columns=etf) if sec_closes is not None else pd.DataFrame(
+            np.nan, index=cs.dates, columns=etf)
+        parts['RSI_14'].append(_rsi_14(close).reindex(cs.dates))
+        parts['Ret_1d'].append(close.pct_change().reindex(cs.dates))
+    if len(synth):
+        print(f"  - Synthetic group benchmarks (equal-weight members): {len(synth)} groups")
+        close = pd.DataFrame(member_index(cs['Ret_1d'], group_map.codes(cs.symbols, synth), len(synth)),
+                             index=cs.dates, columns=synth)
+        parts['RSI_14'].append(_rsi_14(close))
+        parts['Ret_1d'].append(close.pct_change())
+    return {col: pd.concat(frames, axis=1) for col, frames in parts.items()}
+
+def build_stock_features(universe_df, market_features, sector_df=None, cache_dir=None, workers=1,
+                         group_map=None):
     """
     Calculates stock-level features for L2 (Strategy) & L3 (Ranking).
     Includes V5.1 Orthogonal Sector Features.
+    group_map (common.group_features.GroupMap) 預設為 SECTOR_MAP；群組相對特徵見 GROUP_RELATIVE。
+    全部指標以 common.indicators 在 (bar x symbol) 矩陣上向量化計算 (不再逐標的迴圈)；
+    cache_dir 指定時經由 feature graph 快取，只重算有變動的部分；
+    workers > 1 時把標的切給多個行程 (原始 OHLCV 以 shared memory 共用)。
     """
     print("Building Stock Features (L0)...")
-    
+
+    group_map = GroupMap(SECTOR_MAP) if group_map is None else group_map
+
     # Pre-process Sector Data if available
-    sector_metrics = {}
+    sec_closes = None
     if sector_df is not None:
         print("  - Pre-computing Sector RSI and Returns...")
-        
+
         # [Fix] Ensure Sector Data is Numeric
         for col in ['Close']:
             if col in sector_df.columns:
                 sector_df[col] = pd.to_numeric(sector_df[col], errors='coerce')
 
-        # Unstack sector close prices
+        # Unstack sector close prices -> (timestamp x sector ETF)，所有 ETF 一次計算
         sec_closes = sector_df['Close'].unstack(level='symbol')
-        
-        for col in sec_closes.columns:
-            # Calculate RSI for each sector ETF
-            try:
-                rsi = ta.rsi(sec_closes[col], length=14)
-                ret = sec_closes[col].pct_change()
-                sector_metrics[col] = {'RSI': rsi, 'Ret': ret}
-            except Exception as e:
-                print(f"    ! Warning: Failed to calc sector metrics for {col}: {e}")
-            
+
     # Process Stock Features
     universe_df = universe_df.sort_index(level=['symbol', 'timestamp'])
-    grouped = universe_df.groupby(level='symbol')
-    
-    feature_list = []
-    
-    for symbol, group in grouped:
-        # Avoid SettingWithCopyWarning
-        df = group.copy().reset_index(level='symbol', drop=True)
-        
-        # --- [CRITICAL FIX] Ensure Numeric Types ---
-        # yfinance sometimes returns objects. This fixes 'TypeError: ufunc isnan not supported'
-        numeric_cols = ['Open', 'High', 'Low', 'Close', 'Volume']
-        for col in numeric_cols:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-        # -------------------------------------------
-        
-        # --- 1. Base Strategy Indicators (V5) ---
-        try:
-            df['RSI_2'] = ta.rsi(df['Close'], length=2)
-            df['RSI_14'] = ta.rsi(df['Close'], length=14)
-            df['SMA_200'] = ta.sma(df['Close'], length=200)
-            df['Dist_SMA_200'] = (df['Close'] / df['SMA_200']) - 1
-            
-            # Bollinger Bands %B
-            bbands = ta.bbands(df['Close'], length=20, std=2)
-            if bbands is not None:
-                df = pd.concat([df, bbands], axis=1)
-                bb_p_cols = [c for c in bbands.columns if c.startswith('BBP_')]
-                if bb_p_cols:
-                    df.rename(columns={bb_p_cols[0]: 'BB_PctB'}, inplace=True)
-            
-            # Volatility (ATR)
-            df['ATR_14'] = ta.atr(df['High'], df['Low'], df['Close'], length=14)
-            df['ATR_Norm'] = df['ATR_14'] / df['Close']
-            
-            # Volume
-            df['Vol_MA_20'] = ta.sma(df['Volume'], length=20)
-            df['Rel_Vol'] = df['Volume'] / df['Vol_MA_20']
-            
-            # --- 2. V5.1 Microstructure Features ---
-            # Volume Structure: Is volume expanding on down moves?
-            is_down = (df['Close'] < df['Open']).astype(int)
-            df['Down_Vol_Prop'] = (df['Volume'] * is_down) / (df['Vol_MA_20'] + 1)
-            
-            # --- 3. V5.1 Orthogonal Sector Features ---
-            if sector_metrics:
-                sec_ticker = SECTOR_MAP.get(symbol)
-                if sec_ticker and sec_ticker in sector_metrics:
-                    sec_data = sector_metrics[sec_ticker]
-                    
-                    if sec_data['RSI'] is not None:
-                         # Use index alignment (safe for daily data)
-                        df['Sector_RSI_14'] = sec_data['RSI']
-                        df['RSI_Divergence'] = df['RSI_14'] - df['Sector_RSI_14']
-                        
-                        stock_ret = df['Close'].pct_change()
-                        df['Rel_Strength_Daily'] = stock_ret - sec_data['Ret']
-                    else:
-                        df['Sector_RSI_14'] = np.nan
-                        df['RSI_Divergence'] = np.nan
-                        df['Rel_Strength_Daily'] = np.nan
-                else:
-                    df['Sector_RSI_14'] = np.nan
-                    df['RSI_Divergence'] = np.nan
-                    df['Rel_Strength_Daily'] = np.nan
-
-        except Exception as e:
-            # Catch individual ticker errors to prevent whole pipeline crash
-            print(f"Error calculating features for {symbol}: {e}")
-            continue
-        
-        # --- Final Cleanup ---
-        df['symbol'] = symbol
-        feature_list.append(df)
-        
-    # Combine
-    full_features = pd.concat(feature_list)
-    full_features = full_features.reset_index().set_index(['symbol', 'timestamp']).sort_index()
-    
+
+    # --- [CRITICAL FIX] Ensure Numeric Types ---
+    # yfinance sometimes returns objects. This fixes 'TypeError: ufunc isnan not supported'
+    df = universe_df.copy()
+    numeric_cols = ['Open', 'High', 'Low', 'Close', 'Volume']
+    for col in numeric_cols:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    # -------------------------------------------
+
+    features = build_feature_graph().compute(df, cache_dir=cache_dir, workers=workers)
+    for col in features.columns:
+        df[col] = features[col].to_numpy()
+
+    # --- 3. V5.1 Orthogonal Sector Features (group-relative) ---
+    # 沒有 sector_df 且群組全是 sector ETF 時沒有基準可比，與原本相同不產生這些欄位
+    cs = bench = None
+    if len(group_map):
+        cs = CrossSection.from_long(df, sorted({col for col, _ in GROUP_RELATIVE.values()}))
+        bench = build_group_benchmarks(cs, group_map, sec_closes)
+    if bench is not None:
+        codes = group_map.codes(cs.symbols, bench['RSI_14'].columns)
+        df['Sector_RSI_14'] = cs.to_series(gather(bench['RSI_14'].to_numpy(), codes)).to_numpy()
+        for name, (col, bench_col) in GROUP_RELATIVE.items():
+            df[name] = cs.to_series(relative(cs[col], bench[bench_col].to_numpy(), codes)).to_numpy()
+
+    full_features = df.reorder_levels(['symbol', 'timestamp']).sort_index()
+
     # Define columns to keep
     base_cols = [
         'Open', 'High', 'Low', 'Close', 'Volume',
@@ -255,7 +292,7 @@ def build_stock_features(universe_df, market_features, sector_df=None):
     print(f"  - Stock Features shape: {full_features.shape}")
     return full_features
 
-def main():
+def main(workers=1, groups_path=None):
     # --- Setup Paths ---
     SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
     DATA_DIR = os.path.join(SCRIPT_DIR, 'data')
@@ -273,7 +310,22 @@ def main():
     print(f"Saved Market Features to {market_out_path}")
     
     # 3. Build Stock Features (For L2/L3)
-    stock_features = build_stock_features(universe_df, market_features, sector_df)
+    # 各特徵節點的快取 (刪除此資料夾即可強制全部重算)
+    feature_cache_dir = os.path.join(FEATURES_DIR, 'cache')
+    # 群組對照 (預設 SECTOR_MAP；--groups 可改用 GICS 檔或分群結果)
+    group_map = GroupMap.read(groups_path) if groups_path else None
+    stock_features = build_stock_features(universe_df, market_features, sector_df,
+                                          cache_dir=feature_cache_dir, workers=workers,
+                                          group_map=group_map)
+
+    # 3b. Intraday Session Features (universe_60m：跳空 / 盤前 / 開盤區間 / 尾盤 / VWAP，美東時間)
+    hourly_path = os.path.join(DATA_DIR, 'universe_60m.parquet')
+    if os.path.exists(hourly_path):
+        print("Building Session Features from 60m bars...")
+        session = session_features(pd.read_parquet(hourly_path), first_minutes=60, last_minutes=30)
+        stock_features = join_session_features(stock_features, session)
+        print(f"  - Session features: {list(session.columns)} ({len(session)} symbol-days)")
+
     stock_out_path = os.path.join(FEATURES_DIR, 'stock_features_L0.parquet')
     stock_features.to_parquet(stock_out_path)
     print(f"Saved Stock Features to {stock_out_path}")
@@ -281,4 +333,8 @@ def main():
     print("\nStep 1: L0 Feature Engineering Complete (V5.1).")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=1, help='processes for the stock feature build')
+    parser.add_argument('--groups', default=None, help='symbol -> group map (.json dict or .csv symbol,group)')
+    args = parser.parse_args()
+    main(workers=args.workers, groups_path=args.groups)
\ No newline at end of file
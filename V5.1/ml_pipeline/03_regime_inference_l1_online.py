@@ -0,0 +1,116 @@
+import pandas as pd
+import numpy as np
+import os
+import sys
+import json
+import time
+import argparse
+import joblib
+
+# 共用元件 (repo 根目錄下的 common/)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.regime_filter import RegimeFilter
+
+# 每日線上推論：載入 03_train_regime_model_l1_rolling 存下的最新模型，
+# HMM 以 forward filter 逐日更新 (不必每天對整段資料重跑 Viterbi)，IsolationForest 單列評分。
+# 狀態存在 models/regime_filter_state.json，下次只處理 checkpoint 之後的新資料。
+
+def load_filter(models_dir):
+    """載入最新模型與 regime_model_meta.json，建立 RegimeFilter；回傳 (filter, meta)。"""
+    meta_path = os.path.join(models_dir, 'regime_model_meta.json')
+    if not os.path.exists(meta_path):
+        raise FileNotFoundError(f"{meta_path} not found. Run 03_train_regime_model_l1_rolling.py first.")
+    with open(meta_path, 'r') as f:
+        meta = json.load(f)
+    filt = RegimeFilter(
+        joblib.load(os.path.join(models_dir, 'hmm_model.joblib')),
+        joblib.load(os.path.join(models_dir, 'hmm_scaler.joblib')),
+        joblib.load(os.path.join(models_dir, 'iso_forest.joblib')),
+        joblib.load(os.path.join(models_dir, 'hmm_state_map.joblib')),
+        meta['hmm_cols'], meta['iso_cols'])
+    return filt, meta
+
+def run_live(filt, meta, market_df, state_path):
+    """從 checkpoint 接續 (沒有 checkpoint 時從最新模型的第一個 OOS 日開始)，處理新資料並存回 checkpoint。"""
+    if filt.restore(state_path) and filt.last_timestamp is not None:
+        new_rows = market_df[market_df.index > pd.Timestamp(filt.last_timestamp)]
+    else:
+        new_rows = market_df[market_df.index >= pd.Timestamp(meta['test_start'])]
+    if new_rows.empty:
+        print(f"No new rows since {filt.last_timestamp}; regime state unchanged.")
+        return None
+
+    t0 = time.perf_counter()
+    out = None
+    for ts, row in zip(new_rows.index, new_rows.to_dict('records')):
+        out = filt.update(row, ts)
+    elapsed = time.perf_counter() - t0
+    filt.save(state_path)
+
+    probs = ', '.join(f"{p:.3f}" for p in out['probs'])
+    print(f"Ingested {len(new_rows)} row(s) in {elapsed * 1e6 / len(new_rows):.0f} us/row "
+          f"(filter has seen {filt.n_obs} days)")
+    print(f"{filt.last_timestamp}: HMM_State={out['HMM_State']} (P[Bull, Chop, Crash] = {probs}), "
+          f"Anomaly_Score={out['Anomaly_Score']:.4f}, Is_Anomaly={out['Is_Anomaly']}")
+    return out
+
+def run_replay(filt, meta, market_df, signals_path, hmm_model, scaler):
+    """
+    離線驗證：從 test_start 重播最新模型的 OOS 窗，與批次結果比較。
+    - Anomaly_Score / Is_Anomaly 應與 regime_signals.parquet 完全相同
+    - filtered 機率應等於 hmm.predict_proba(前綴)[-1]
+    - HMM_State：批次為整個窗的 Viterbi 路徑 (使用窗內之後的資料)，只報告一致率
+    """
+    window = market_df[market_df.index >= pd.Timestamp(meta['test_start'])]
+    filt.reset()
+    online = filt.replay(window)
+    batch = pd.read_parquet(signals_path).reindex(window.index)
+
+    score_exact = np.array_equal(online['Anomaly_Score'].to_numpy(), batch['Anomaly_Score'].to_numpy())
+    flag_exact = np.array_equal(online['Is_Anomaly'].to_numpy(), batch['Is_Anomaly'].to_numpy())
+
+    X = scaler.transform(window[meta['hmm_cols']].ffill().fillna(0))
+    order = filt.order
+    ref_probs = np.array([hmm_model.predict_proba(X[:t + 1])[-1][order] for t in range(len(X))])
+    prob_cols = [f'Prob_State_{k}' for k in range(filt.n_states)]
+    prob_err = np.abs(online[prob_cols].to_numpy() - ref_probs).max()
+    agreement = (online['HMM_State'] == batch['HMM_State']).mean()
+
+    print(f"\n--- Replay Check ({window.index[0].date()} ~ {window.index[-1].date()}, {len(window)} days) ---")
+    print(f"Anomaly_Score identical to batch: {score_exact} | Is_Anomaly identical: {flag_exact}")
+    print(f"Filtered probs vs predict_proba(prefix): max abs diff {prob_err:.2e}")
+    print(f"HMM_State agreement with batch Viterbi: {agreement:.1%} (filter is causal, Viterbi is not)")
+    ok = score_exact and flag_exact and prob_err < 1e-8
+    print("Replay check: OK" if ok else "Replay check: MISMATCH")
+    return ok
+
+def main(replay=False, reset=False):
+    # --- 路徑設定 ---
+    SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+    FEATURES_DIR = os.path.join(SCRIPT_DIR, 'features')
+    MODELS_DIR = os.path.join(SCRIPT_DIR, 'models')
+    SIGNALS_DIR = os.path.join(SCRIPT_DIR, 'signals')
+    STATE_PATH = os.path.join(MODELS_DIR, 'regime_filter_state.json')
+
+    market_path = os.path.join(FEATURES_DIR, 'market_features_L0.parquet')
+    if not os.path.exists(market_path):
+        raise FileNotFoundError(f"Market features not found at {market_path}")
+    market_df = pd.read_parquet(market_path).sort_index()
+    filt, meta = load_filter(MODELS_DIR)
+
+    if replay:
+        run_replay(filt, meta, market_df, os.path.join(SIGNALS_DIR, 'regime_signals.parquet'),
+                   joblib.load(os.path.join(MODELS_DIR, 'hmm_model.joblib')),
+                   joblib.load(os.path.join(MODELS_DIR, 'hmm_scaler.joblib')))
+        return
+    if reset and os.path.exists(STATE_PATH):
+        os.remove(STATE_PATH)
+        print(f"Removed {STATE_PATH}")
+    run_live(filt, meta, market_df, STATE_PATH)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--replay', action='store_true', help='replay the latest OOS window and compare with batch signals')
+    parser.add_argument('--reset', action='store_true', help='discard the saved filter state before ingesting')
+    args = parser.parse_args()
+    main(replay=args.replay, reset=args.reset)
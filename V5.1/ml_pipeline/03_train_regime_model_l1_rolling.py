@@ -1,18 +1,33 @@
 import pandas as pd
 import numpy as np
 import os
+import sys
+import time
+import argparse
 import joblib
+import json
 from hmmlearn.hmm import GaussianHMM
 from sklearn.ensemble import IsolationForest
 from sklearn.preprocessing import StandardScaler
 from datetime import datetime
 
+# 共用元件 (repo 根目錄下的 common/)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.walk_forward import run_walk_forward
+from common.model_registry import ModelRegistry
+
 # --- 設定隨機種子 ---
-np.random.seed(42)
+SEED = 42  # 各折的 seed 由此推導 (common.walk_forward.fold_seed)
+np.random.seed(SEED)
 
 # --- 參數設定 (滾動視窗) ---
 TRAIN_WINDOW = 252 * 2  # 訓練窗口：2 年 (約 504 交易日)
 REFIT_STEP = 63         # 重訓練頻率：3 個月 (約 63 交易日)
+WARM_START_MIX = 0.01   # warm start 時 startprob / transmat 混入少量均勻分佈 (EM 無法離開為 0 的機率)
+
+# --- 特徵欄位 (線上推論 03_regime_inference_l1_online 由 models/regime_model_meta.json 讀取) ---
+HMM_COLS = ['SPY_Ret', 'IWO_Vol_21d', 'SPY_IWO_Div_21d']
+ISO_COLS = ['IWO_Vol_21d', 'SPY_Vol_21d', 'VIX_Change_1d', 'VIX_Gap', 'SPY_IWO_Div_21d', 'TNX_Change_5d']
 
 def load_features(features_dir):
     """載入 L0 市場特徵數據"""
@@ -23,15 +38,31 @@ def load_features(features_dir):
     df = pd.read_parquet(path)
     return df.sort_index()
 
-def train_and_predict_fold(train_df, test_df, n_components=3):
+def warm_start_hmm(hmm_model, prev_artifacts, scaler):
     """
-    單一 Fold 的訓練與預測流程
+    以上一折的 HMM 參數作為 EM 起點 (取代隨機 / k-means 初始化)。
+    上一折的 means / covars 是在上一折 scaler 的空間，先換回原始尺度再以本折 scaler 標準化。
+    """
+    prev_model, prev_scaler = prev_artifacts['hmm_model'], prev_artifacts['hmm_scaler']
+    ratio = prev_scaler.scale_ / scaler.scale_
+    hmm_model.means_ = (prev_model.means_ * prev_scaler.scale_ + prev_scaler.mean_ - scaler.mean_) / scaler.scale_
+    hmm_model.covars_ = prev_model.covars_ * np.outer(ratio, ratio)
+    uniform = 1.0 / prev_model.n_components
+    hmm_model.startprob_ = (1 - WARM_START_MIX) * prev_model.startprob_ + WARM_START_MIX * uniform
+    hmm_model.transmat_ = (1 - WARM_START_MIX) * prev_model.transmat_ + WARM_START_MIX * uniform
+    hmm_model.init_params = ''  # fit() 不再重設上面的參數
+    return hmm_model
+
+def fit_fold(train_df, n_components=3, seed=42, n_jobs=-1, prev_artifacts=None):
+    """
+    單一 Fold 的訓練 (只用 train_df)：回傳 artifacts dict，訓練數據過少時回傳 None。
+    prev_artifacts = 上一折的 artifacts：有值時 HMM 由上一折的參數 warm start。
     """
     # ==========================
     # 1. 準備數據 (Fit Scaler on TRAIN only)
     # ==========================
-    hmm_cols = ['SPY_Ret', 'IWO_Vol_21d', 'SPY_IWO_Div_21d']
-    iso_cols = ['IWO_Vol_21d', 'SPY_Vol_21d', 'VIX_Change_1d', 'VIX_Gap', 'SPY_IWO_Div_21d', 'TNX_Change_5d']
+    hmm_cols = HMM_COLS
+    iso_cols = ISO_COLS
     
     # 清理 NaN (僅針對訓練集，測試集若有 NaN 需填補或跳過)
     X_train_hmm = train_df[hmm_cols].dropna()
@@ -43,16 +74,21 @@ def train_and_predict_fold(train_df, test_df, n_components=3):
     scaler = StandardScaler()
     X_train_scaled = scaler.fit_transform(X_train_hmm)
     
-    # 準備測試數據 (使用訓練集的 Scaler 轉換)
-    # 注意：測試集可能有 NaN (如剛開盤)，這裡簡單用 0 填補或 forward fill，實際交易需更嚴謹
-    X_test_hmm = test_df[hmm_cols].fillna(method='ffill').fillna(0)
-    X_test_scaled = scaler.transform(X_test_hmm)
-    
     # ==========================
     # 2. 訓練 HMM (Regime Detection)
     # ==========================
-    hmm_model = GaussianHMM(n_components=n_components, covariance_type="full", n_iter=100, random_state=42, verbose=False)
+    hmm_model = GaussianHMM(n_components=n_components, covariance_type="full", n_iter=100, random_state=seed, verbose=False)
+    warm = prev_artifacts is not None and prev_artifacts['hmm_model'].n_components == n_components
+    if warm:
+        warm_start_hmm(hmm_model, prev_artifacts, scaler)
+    t_fit = time.perf_counter()
     hmm_model.fit(X_train_scaled)
+    fit_stats = {
+        'warm_start': warm,
+        'n_iter': hmm_model.monitor_.iter,
+        'converged': hmm_model.monitor_.converged,
+        'fit_seconds': time.perf_counter() - t_fit,
+    }
     
     # --- 動態狀態映射 (Dynamic State Mapping) ---
     # 每次訓練後的 State 0,1,2 意義不同，需根據波動率 (IWO_Vol_21d) 重新定義
@@ -74,46 +110,123 @@ def train_and_predict_fold(train_df, test_df, n_components=3):
     sorted_states = sorted(state_vol_means, key=lambda x: x[1])
     state_map = {old_id: new_id for new_id, (old_id, _) in enumerate(sorted_states)}
     
-    # --- 預測測試集 (OOS) ---
-    hidden_states_oos = hmm_model.predict(X_test_scaled)
-    mapped_states_oos = np.array([state_map[s] for s in hidden_states_oos])
-    
     # ==========================
     # 3. 訓練 Isolation Forest (Anomaly Detection)
     # ==========================
     X_train_iso = train_df[iso_cols].fillna(0)
-    X_test_iso = test_df[iso_cols].fillna(0)
     
-    iso_model = IsolationForest(contamination=0.05, random_state=42, n_jobs=-1)
+    iso_model = IsolationForest(contamination=0.05, random_state=seed, n_jobs=n_jobs)
     iso_model.fit(X_train_iso)
     
+    # 我們需要最後一個訓練好的模型用於 "Live Trading" (存檔用)
+    return {
+        'hmm_model': hmm_model,
+        'hmm_scaler': scaler,
+        'iso_model': iso_model,
+        'state_map': state_map,
+        'fit_stats': fit_stats
+    }
+
+def predict_fold(artifacts, test_df):
+    """以單一 Fold 的模型預測測試集 (OOS)。"""
+    # 準備測試數據 (使用訓練集的 Scaler 轉換)
+    # 注意：測試集可能有 NaN (如剛開盤)，這裡簡單用 0 填補或 forward fill，實際交易需更嚴謹
+    X_test_hmm = test_df[HMM_COLS].fillna(method='ffill').fillna(0)
+    X_test_scaled = artifacts['hmm_scaler'].transform(X_test_hmm)
+    
+    # --- 預測測試集 (OOS) ---
+    state_map = artifacts['state_map']
+    hidden_states_oos = artifacts['hmm_model'].predict(X_test_scaled)
+    mapped_states_oos = np.array([state_map[s] for s in hidden_states_oos])
+    
     # 預測 OOS
     # predict: -1 = Anomaly, 1 = Normal
+    X_test_iso = test_df[ISO_COLS].fillna(0)
+    iso_model = artifacts['iso_model']
     is_anomaly_oos = iso_model.predict(X_test_iso)
     anomaly_scores_oos = -iso_model.decision_function(X_test_iso)
     
     # 轉換為 0/1 (1 = Anomaly)
     is_anomaly_oos = np.where(is_anomaly_oos == -1, 1, 0)
     
-    # ==========================
-    # 4. 打包結果
-    # ==========================
-    # 我們需要最後一個訓練好的模型用於 "Live Trading" (存檔用)
-    artifacts = {
-        'hmm_model': hmm_model,
-        'hmm_scaler': scaler,
-        'iso_model': iso_model,
-        'state_map': state_map
-    }
-    
     oos_result_df = pd.DataFrame(index=test_df.index)
     oos_result_df['HMM_State'] = mapped_states_oos
     oos_result_df['Is_Anomaly'] = is_anomaly_oos
     oos_result_df['Anomaly_Score'] = anomaly_scores_oos
-    
-    return oos_result_df, artifacts
+    return oos_result_df
 
-def main():
+def train_and_predict_fold(train_df, test_df, n_components=3, seed=42, n_jobs=-1, prev=None, registry=None):
+    """
+    單一 Fold 的訓練與預測流程
+    seed 由 walk-forward executor 依折編號推導 (HMM / IsolationForest 共用)；
+    平行執行多折時 n_jobs=1，避免每個行程再各自開滿 IsolationForest 的執行緒。
+    prev = 上一折的 (oos_df, artifacts)：有值時 HMM 由上一折的參數 warm start。
+    registry (common.model_registry.ModelRegistry)：訓練資料、參數與程式碼都沒變的折直接載入已訓練的模型，
+    測試集 (資料延長後最後一折會變長) 每次都重新預測。
+    """
+    prev_artifacts = prev[1] if prev is not None else None
+    fit = lambda: fit_fold(train_df, n_components, seed, n_jobs, prev_artifacts)
+    if registry is None:
+        artifacts = fit()
+        from_registry = False
+    else:
+        params = {
+            'n_components': n_components, 'seed': seed, 'hmm_n_iter': 100, 'contamination': 0.05,
+            # warm start 的結果取決於上一折的模型
+            'warm_from': prev_artifacts.get('registry_key') if prev_artifacts is not None else None,
+            'warm_start_mix': WARM_START_MIX,
+        }
+        key = registry.key('regime_l1', train_df[list(dict.fromkeys(HMM_COLS + ISO_COLS))], params,
+                           code=fit_fold, libs=('numpy', 'sklearn', 'hmmlearn'))
+        misses = registry.misses
+        artifacts = registry.get_or_fit('regime_l1', key, fit,
+                                        info={'train_start': train_df.index[0], 'train_end': train_df.index[-1]})
+        from_registry = registry.misses == misses
+        if artifacts is not None:
+            artifacts['registry_key'] = key
+    if artifacts is None:
+        return None
+    artifacts['from_registry'] = from_registry
+    return predict_fold(artifacts, test_df), artifacts
+
+def print_refit_report(folds, models_dir):
+    """HMM 每折的 EM 迭代次數 / 是否收斂 / 訓練時間，以及 state_map 是否與上一折不同。"""
+    rows = []
+    prev_map = None
+    for fold, result in folds:
+        if result is None:
+            continue
+        artifacts = result[1]
+        stats = artifacts['fit_stats']
+        rows.append({
+            'fold': fold.id + 1,
+            'test_start': result[0].index.min(),
+            'from_registry': artifacts.get('from_registry', False),
+            'warm_start': stats['warm_start'],
+            'n_iter': stats['n_iter'],
+            'converged': stats['converged'],
+            'fit_seconds': stats['fit_seconds'],
+            'state_map_changed': prev_map is not None and artifacts['state_map'] != prev_map,
+        })
+        prev_map = artifacts['state_map']
+    if not rows:
+        return
+    report = pd.DataFrame(rows)
+    report_path = os.path.join(models_dir, 'hmm_refit_report.csv')
+    report.to_csv(report_path, index=False)
+
+    print("\n--- HMM Refit Report ---")
+    print(f"Folds: {len(report)} | Loaded from registry: {int(report['from_registry'].sum())} "
+          f"| Warm-started: {int(report['warm_start'].sum())}")
+    print(f"EM iterations: mean {report['n_iter'].mean():.1f}, max {report['n_iter'].max()} "
+          f"| Not converged: {int((~report['converged']).sum())}")
+    # 從 registry 載入的折，fit_seconds 是當初訓練的時間
+    print(f"Total HMM refit time: {report['fit_seconds'].sum():.2f}s "
+          f"({report['fit_seconds'].mean() * 1000:.0f} ms / fold, incl. folds loaded from registry)")
+    print(f"state_map changes between folds: {int(report['state_map_changed'].sum())}")
+    print(f"Report saved to {report_path}")
+
+def main(workers=1, warm_start=False, refit_step=REFIT_STEP, refit=False):
     # --- 路徑設定 ---
     SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
     FEATURES_DIR = os.path.join(SCRIPT_DIR, 'features')
@@ -122,6 +235,8 @@ def main():
     
     os.makedirs(MODELS_DIR, exist_ok=True)
     os.makedirs(SIGNALS_DIR, exist_ok=True)
+    # 各折已訓練的模型 (訓練資料 / 參數 / 程式碼 / 函式庫版本不變時直接載入)
+    registry = ModelRegistry(os.path.join(MODELS_DIR, 'registry'), refit=refit)
     
     # 1. 載入數據
     market_df = load_features(FEATURES_DIR)
@@ -129,38 +244,27 @@ def main():
     
     # 2. 執行滾動視窗訓練 (Rolling Window Training)
     print(f"\n--- Starting Rolling Window Training ---")
-    print(f"Window Size: {TRAIN_WINDOW} days, Step Size: {REFIT_STEP} days")
+    print(f"Window Size: {TRAIN_WINDOW} days, Step Size: {refit_step} days, "
+          f"Workers: {workers}, HMM Warm Start: {warm_start}")
     
+    # 各折彼此獨立：交給 walk-forward executor (workers > 1 時平行)，結果依折的順序回傳
+    # warm start 時每折以上一折的 HMM 起始 (chain，依序執行)
+    folds = run_walk_forward(market_df, train_and_predict_fold, TRAIN_WINDOW, refit_step,
+                             workers=workers, seed=SEED, chain=warm_start,
+                             n_jobs=1 if workers > 1 and not warm_start else -1, registry=registry)
+
     oos_predictions = []
     latest_artifacts = None
-    
-    # 從足夠的數據開始滾動
-    # Range: [Start of Test Data] -> End
-    for i in range(TRAIN_WINDOW, len(market_df), REFIT_STEP):
-        # 定義窗口
-        # Train: [i - TRAIN_WINDOW : i]
-        # Test:  [i : i + REFIT_STEP]
-        train_idx = market_df.index[i - TRAIN_WINDOW : i]
-        
-        end_loc = min(i + REFIT_STEP, len(market_df))
-        test_idx = market_df.index[i : end_loc]
-        
-        if len(test_idx) == 0:
-            break
-            
-        train_df = market_df.loc[train_idx]
-        test_df = market_df.loc[test_idx]
-        
-        test_start_date = test_df.index.min().date()
-        test_end_date = test_df.index.max().date()
-        
-        print(f"Processing Fold: Train[{train_df.index.min().date()} ~ {train_df.index.max().date()}] -> Predict[{test_start_date} ~ {test_end_date}]")
-        
-        result_df, artifacts = train_and_predict_fold(train_df, test_df)
-        
-        if result_df is not None:
-            oos_predictions.append(result_df)
-            latest_artifacts = artifacts # 保存最後一折的模型作為「最新模型」
+    latest_test_start = None
+    for fold, result in folds:
+        if result is None:
+            print(f"  - Fold {fold.id + 1}: not enough training data, skipped.")
+            continue
+        result_df, artifacts = result
+        oos_predictions.append(result_df)
+        latest_artifacts = artifacts # 保存最後一折的模型作為「最新模型」
+        latest_test_start = result_df.index.min()
+    print_refit_report(folds, MODELS_DIR)
     
     # 3. 合併所有 OOS 預測
     if oos_predictions:
@@ -190,6 +294,10 @@ def main():
             joblib.dump(latest_artifacts['hmm_scaler'], os.path.join(MODELS_DIR, 'hmm_scaler.joblib'))
             joblib.dump(latest_artifacts['iso_model'], os.path.join(MODELS_DIR, 'iso_forest.joblib'))
             joblib.dump(latest_artifacts['state_map'], os.path.join(MODELS_DIR, 'hmm_state_map.joblib'))
+            # 線上推論 (forward filter) 從最新模型的第一個 OOS 日開始
+            meta = {'test_start': str(latest_test_start), 'hmm_cols': HMM_COLS, 'iso_cols': ISO_COLS}
+            with open(os.path.join(MODELS_DIR, 'regime_model_meta.json'), 'w') as f:
+                json.dump(meta, f, indent=2)
             print(f"Latest Models saved to {MODELS_DIR} (Ready for Live Trading)")
             
         print("\nStep 2: L1 Rolling Regime Identification (100% OOS) Complete.")
@@ -199,4 +307,10 @@ def main():
         print("Error: No predictions generated. Check data length.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=1, help='processes for the walk-forward folds')
+    parser.add_argument('--warm-start', action='store_true', help="initialize each fold's HMM from the previous fold")
+    parser.add_argument('--refit-step', type=int, default=REFIT_STEP, help='days between refits (e.g. 5 = weekly)')
+    parser.add_argument('--refit', action='store_true', help='ignore the model registry and refit every fold')
+    args = parser.parse_args()
+    main(workers=args.workers, warm_start=args.warm_start, refit_step=args.refit_step, refit=args.refit)
\ No newline at end of file
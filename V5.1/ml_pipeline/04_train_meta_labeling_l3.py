@@ -3,10 +3,40 @@
 import pandas as pd
 import numpy as np
 import os
+import sys
+import json
+import argparse
 import joblib
 import lightgbm as lgb
 from sklearn.model_selection import TimeSeriesSplit
 
+# 共用元件 (repo 根目錄下的 common/)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.model_registry import ModelRegistry
+from common.cross_rank import quantile_grades
+from common.lgb_dataset import BinnedRankingData
+
+FEATURE_COLS = [
+    'Sector_RSI_14', 'RSI_Divergence', 'Rel_Strength_Daily', # Orthogonal
+    'Down_Vol_Prop', 'Rel_Vol', # Microstructure
+    'ATR_Norm', # Volatility
+    'HMM_State', 'Anomaly_Score', # Regime
+    'IWO_Vol_21d', 'SPY_IWO_Div_21d', 'VIX_Change_1d' # Macro
+]
+N_SPLITS = 5
+LGBM_PARAMS = {
+    'objective': 'lambdarank',
+    'metric': 'ndcg',
+    'ndcg_eval_at': [1, 3, 5],
+    'boosting_type': 'gbdt',
+    'n_estimators': 150,
+    'learning_rate': 0.05,
+    'num_leaves': 31,
+    'label_gain': [0, 1, 3, 7],
+    'random_state': 42,
+    'verbose': -1
+}
+
 def load_data(base_dir):
     """
     Loads all features and signals constructed in previous steps.
@@ -66,66 +96,122 @@ def prepare_ranking_data(stock_df, market_df, regime_df):
     
     return df_rank
 
-def train_l3_ranker(df):
+def fit_ranker(X_train, y_train, lgbm_params, eval_set=None):
     """
-    Trains LGBMRanker using Walk-Forward Validation and collects Out-of-Sample predictions.
+    Fits one LGBMRanker (query groups = consecutive rows of the same timestamp).
+    eval_set = (X_test, y_test): logs NDCG@1/3/5 on the test fold into model.best_score_.
+    """
+    q_train = X_train.groupby(level='timestamp', sort=False).size().values
+    model = lgb.LGBMRanker(**lgbm_params)
+    if eval_set is None:
+        model.fit(X_train, y_train, group=q_train)
+        return model
+    X_test, y_test = eval_set
+    q_test = X_test.groupby(level='timestamp', sort=False).size().values
+    model.fit(
+        X_train, y_train, 
+        group=q_train,
+        eval_set=[(X_test, y_test)],
+        eval_group=[q_test],
+        eval_at=[1, 3, 5],
+        callbacks=[lgb.log_evaluation(0)]
+    )
+    return model
+
+def fit_or_load_ranker(registry, X_train, y_train, lgbm_params, eval_set=None):
+    """
+    fit_ranker() through the model registry: reruns with the same rows / params / code load the fitted model.
+    The eval fold is part of the key because best_score_ is computed on it.
+    """
+    if registry is None:
+        return fit_ranker(X_train, y_train, lgbm_params, eval_set)
+    data = [X_train, y_train] + (list(eval_set) if eval_set is not None else [])
+    key = registry.key('l3_ranker', data, lgbm_params, code=fit_ranker, libs=('numpy', 'lightgbm'))
+    timestamps = X_train.index.get_level_values('timestamp')
+    info = {'rows': len(X_train), 'train_start': timestamps.min(), 'train_end': timestamps.max()}
+    return registry.get_or_fit('l3_ranker', key, lambda: fit_ranker(X_train, y_train, lgbm_params, eval_set), info=info)
+
+def fit_or_load_binned_ranker(registry, binned, X_train, y_train, train_days, eval_set=None, eval_days=None):
+    """
+    Same as fit_or_load_ranker() but trains a lgb.Booster on row subsets of the shared binned Dataset
+    (common.lgb_dataset.BinnedRankingData); train_days / eval_days = (first_day, end_day) positions in unique_dates.
+    The bin mappers come from binned.bin_days (the first fold's training days), so binned.key is part of the
+    registry key.
+    """
+    fit = lambda: binned.train(train_days, valid=eval_days)
+    if registry is None:
+        return fit()
+    data = [X_train, y_train] + (list(eval_set) if eval_set is not None else [])
+    params = dict(binned.params, num_boost_round=binned.num_boost_round, shared_bins=binned.key)
+    key = registry.key('l3_ranker_binned', data, params, code=BinnedRankingData.train, libs=('numpy', 'lightgbm'))
+    timestamps = X_train.index.get_level_values('timestamp')
+    info = {'rows': len(X_train), 'train_start': timestamps.min(), 'train_end': timestamps.max()}
+    return registry.get_or_fit('l3_ranker_binned', key, fit, info=info)
+
+def best_ndcg(model, k=3):
+    """NDCG@k on the eval fold (LGBMRanker.best_score_ / Booster.best_score)."""
+    best_score = model.best_score_ if isinstance(model, lgb.LGBMModel) else model.best_score
+    return best_score['valid_0'][f'ndcg@{k}']
+
+def ranking_matrix(df):
+    """
+    Features X (fillna 0) and LambdaRank grades y, rows sorted by timestamp (one query group per day).
     """
-    print("\n--- Training L3 Ranker (LambdaRank) with Walk-Forward OOS Prediction ---")
-    
     # --- 1. Feature Selection ---
-    feature_cols = [
-        'Sector_RSI_14', 'RSI_Divergence', 'Rel_Strength_Daily', # Orthogonal
-        'Down_Vol_Prop', 'Rel_Vol', # Microstructure
-        'ATR_Norm', # Volatility
-        'HMM_State', 'Anomaly_Score', # Regime
-        'IWO_Vol_21d', 'SPY_IWO_Div_21d', 'VIX_Change_1d' # Macro
-    ]
-    
-    valid_features = [c for c in feature_cols if c in df.columns]
+    valid_features = [c for c in FEATURE_COLS if c in df.columns]
     print(f"  - Features used ({len(valid_features)}): {valid_features}")
     
     X = df[valid_features].copy()
     X = X.fillna(0)
     
     # Discretize Target for LambdaRank
-    def get_daily_grades(group):
-        if len(group) < 4:
-            return (group > 0).astype(int)
-        try:
-            return pd.qcut(group.rank(method='first'), q=[0, 0.5, 0.8, 0.95, 1.0], labels=[0, 1, 2, 3]).astype(int)
-        except Exception:
-            return (group > 0).astype(int)
-
-    y_grades = df['Target_Return'].groupby(level='timestamp', group_keys=False).apply(get_daily_grades)
+    # Per day: qcut of rank(method='first') at [0, 0.5, 0.8, 0.95, 1.0] -> grades 0-3;
+    # days with < 4 candidates (or a failed qcut) fall back to (Target_Return > 0).
+    # quantile_grades computes all days at once (same grades as the per-day groupby.apply).
+    y_grades = quantile_grades(df['Target_Return'], level='timestamp', q=[0, 0.5, 0.8, 0.95, 1.0], min_size=4)
     y = y_grades
     
     # --- 2. Create Groups for Ranking ---
     X = X.sort_index(level='timestamp')
     y = y.reindex(X.index)
     
+    return X, y, valid_features
+
+def train_l3_ranker(df, registry=None, binned_cache_dir=None, lgbm_params=None):
+    """
+    Trains LGBMRanker using Walk-Forward Validation and collects Out-of-Sample predictions.
+    registry (common.model_registry.ModelRegistry): folds whose data and params are unchanged are loaded, not refit.
+    binned_cache_dir: bin the candidate matrix once (cached as a LightGBM binary file there) and train every fold
+    on a row subset of it. Bin edges come from the first fold's training days only (no test-period features), so
+    fold 1 is identical to per-fold binning and later folds differ slightly; the final model is refit with
+    full-sample bins (identical to LGBMRanker.fit). None (default) = per-fold LGBMRanker.fit.
+    lgbm_params: LGBMRanker params (default LGBM_PARAMS; 04_tune_l3_ranker writes tuned ones).
+    """
+    print("\n--- Training L3 Ranker (LambdaRank) with Walk-Forward OOS Prediction ---")
+    
+    X, y, valid_features = ranking_matrix(df)
+    
     timestamps = X.index.get_level_values('timestamp')
     unique_dates = timestamps.unique()
     
     print(f"  - Training over {len(unique_dates)} unique days.")
     
     # --- 3. Walk-Forward Validation & OOS Collection ---
-    n_splits = 5
-    lgbm_params = {
-        'objective': 'lambdarank',
-        'metric': 'ndcg',
-        'ndcg_eval_at': [1, 3, 5],
-        'boosting_type': 'gbdt',
-        'n_estimators': 150,
-        'learning_rate': 0.05,
-        'num_leaves': 31,
-        'label_gain': [0, 1, 3, 7],
-        'random_state': 42,
-        'verbose': -1
-    }
+    n_splits = N_SPLITS
+    if lgbm_params is None:
+        lgbm_params = LGBM_PARAMS
     
     tscv = TimeSeriesSplit(n_splits=n_splits)
     metrics = []
     
+    binned = None
+    if binned_cache_dir is not None:
+        # 分箱邊界只取第一折的訓練期：每一折的訓練期都包含它，測試期的特徵分佈不會滲入
+        first_train = next(tscv.split(unique_dates))[0]
+        binned = BinnedRankingData(X, y, timestamps, lgbm_params, cache_dir=binned_cache_dir,
+                                   bin_days=(0, first_train[-1] + 1))
+        print(f"  - Binned dataset {'loaded from' if binned.from_cache else 'saved to'} {binned.path}")
+    
     # [Modify] Initialize OOS Score Container (Default NaN)
     oos_scores = pd.Series(data=np.nan, index=X.index, name='L3_Rank_Score')
     
@@ -140,23 +226,20 @@ def train_l3_ranker(df):
         X_train, y_train = X[train_mask], y[train_mask]
         X_test, y_test = X[test_mask], y[test_mask]
         
-        # Prepare Groups
-        q_train = X_train.groupby(level='timestamp', sort=False).size().values
-        q_test = X_test.groupby(level='timestamp', sort=False).size().values
-        
         # Train (Fit on Past)
-        model = lgb.LGBMRanker(**lgbm_params)
-        model.fit(
-            X_train, y_train, 
-            group=q_train,
-            eval_set=[(X_test, y_test)],
-            eval_group=[q_test],
-            eval_at=[1, 3, 5],
-            callbacks=[lgb.log_evaluation(0)]
-        )
+        if binned is None:
+            model = fit_or_load_ranker(registry, X_train, y_train, lgbm_params, eval_set=(X_test, y_test))
+        else:
+            # TimeSeriesSplit folds are contiguous day ranges
+            model = fit_or_load_binned_ranker(
+                registry, binned, X_train, y_train,
+                train_days=(train_date_idx[0], train_date_idx[-1] + 1),
+                eval_set=(X_test, y_test),
+                eval_days=(test_date_idx[0], test_date_idx[-1] + 1)
+            )
         
         # Log metric
-        val_score = model.best_score_['valid_0']['ndcg@3']
+        val_score = best_ndcg(model, k=3)
         print(f"  Fold {fold+1}: NDCG@3 = {val_score:.4f} (Test Range: {test_dates.min().date()} to {test_dates.max().date()})")
         metrics.append(val_score)
         
@@ -167,14 +250,19 @@ def train_l3_ranker(df):
 
     # --- 4. Final Retrain (For Future/Live Trading ONLY) ---
     print("Retraining final Ranker on all data (for future inference)...")
-    final_model = lgb.LGBMRanker(**lgbm_params)
-    q_all = X.groupby(level='timestamp', sort=False).size().values
-    final_model.fit(X, y, group=q_all)
+    if binned is None:
+        final_model = fit_or_load_ranker(registry, X, y, lgbm_params)
+        split_importance = final_model.feature_importances_
+    else:
+        # 全資料重訓沒有測試期，改用全部資料的分箱 (與 LGBMRanker.fit 相同)
+        full_binned = BinnedRankingData(X, y, timestamps, lgbm_params, cache_dir=binned_cache_dir)
+        final_model = fit_or_load_binned_ranker(registry, full_binned, X, y, train_days=(0, full_binned.n_days))
+        split_importance = final_model.feature_importance(importance_type='split')
     
     # Feature Importance
     importances = pd.DataFrame({
         'Feature': valid_features,
-        'Importance': final_model.feature_importances_
+        'Importance': split_importance
     }).sort_values(by='Importance', ascending=False)
     
     print("\n[L3 Ranker Feature Importance]")
@@ -193,8 +281,29 @@ def train_l3_ranker(df):
     
     return final_model, df_oos, np.mean(metrics)
 
-def main():
+def load_tuned_params(models_dir):
+    """LGBMRanker params selected by 04_tune_l3_ranker (models/l3_tuned_params.json)."""
+    path = os.path.join(models_dir, 'l3_tuned_params.json')
+    if not os.path.exists(path):
+        print(f"Warning: {path} not found (run 04_tune_l3_ranker.py first). Using default LGBM_PARAMS.")
+        return None
+    with open(path, 'r') as f:
+        tuned = json.load(f)
+    if 'holdout_score' not in tuned:
+        print(f"Warning: {path} was selected without a held-out period (re-run 04_tune_l3_ranker.py). "
+              "Using default LGBM_PARAMS.")
+        return None
+    print(f"Using tuned LGBMRanker params (held-out NDCG@{tuned['k']} = {tuned['holdout_score']:.4f}, "
+          f"baseline {tuned['baseline_holdout_score']:.4f}): {tuned['search_params']}")
+    return tuned['params']
+
+def main(refit=False, binned_cache=False, tuned_params=False):
     SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+    models_dir = os.path.join(SCRIPT_DIR, 'models')
+    lgbm_params = load_tuned_params(models_dir) if tuned_params else None
+    
+    # Fitted fold models (loaded when rows / params / code / library versions are unchanged)
+    registry = ModelRegistry(os.path.join(models_dir, 'registry'), refit=refit)
     
     # 1. Load Data
     stock_f, market_f, regime_s = load_data(SCRIPT_DIR)
@@ -204,10 +313,12 @@ def main():
     
     # 3. Train Ranker & Get OOS Scores
     # Note: result_df will now only contain OOS rows
-    model, result_df, avg_ndcg = train_l3_ranker(rank_df)
+    binned_cache_dir = os.path.join(models_dir, 'lgb_cache') if binned_cache else None
+    model, result_df, avg_ndcg = train_l3_ranker(rank_df, registry, binned_cache_dir=binned_cache_dir,
+                                                  lgbm_params=lgbm_params)
+    print(f"[Model Registry] Loaded {registry.hits} fitted model(s), trained {registry.misses}.")
     
     # 4. Save Artifacts
-    models_dir = os.path.join(SCRIPT_DIR, 'models')
     signals_dir = os.path.join(SCRIPT_DIR, 'signals')
     
     os.makedirs(models_dir, exist_ok=True)
@@ -225,4 +336,11 @@ def main():
     print("Step 3: L3 Learning-to-Rank (OOS Mode) Complete.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--refit', action='store_true', help='ignore the model registry and refit every fold')
+    parser.add_argument('--binned-cache', action='store_true',
+                        help='bin the candidate matrix once (models/lgb_cache) and train folds on row subsets of it')
+    parser.add_argument('--tuned-params', action='store_true',
+                        help='use the LGBMRanker params selected by 04_tune_l3_ranker.py (models/l3_tuned_params.json)')
+    args = parser.parse_args()
+    main(refit=args.refit, binned_cache=args.binned_cache, tuned_params=args.tuned_params)
\ No newline at end of file
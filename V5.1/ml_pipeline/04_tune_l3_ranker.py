@@ -0,0 +1,132 @@
+# V5.1/ml_pipeline/04_tune_l3_ranker.py (Walk-Forward Hyperparameter Search)
+
+import os
+import sys
+import json
+import argparse
+import importlib.util
+import time
+import pandas as pd
+
+# 共用元件 (repo 根目錄下的 common/)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.lgb_dataset import BinnedRankingData
+from common.ranker_search import (SEARCH_SPACE, TrialStore, day_folds, evaluate_holdout, hyperband,
+                                  sample_candidates, split_holdout, study_key, successive_halving, trial_id)
+
+# 以 walk-forward OOS 折的 NDCG@k 挑選 04_train_meta_labeling_l3 的 LGBMRanker 參數。
+# 折與 04 相同 (TimeSeriesSplit(5) over days)；successive halving / Hyperband 只讓表現好的候選跑後面的折。
+# 最後 --holdout-folds 折不參與搜尋：勝出者與手動 LGBM_PARAMS 在這段期間重新評分，報告的是這個分數。
+# 結果逐筆存在 models/l3_search/trials.jsonl，中斷後重跑會接續；最佳參數寫入 models/l3_tuned_params.json，
+# 04_train_meta_labeling_l3.py --tuned-params 使用。
+
+def get_script_dir():
+    """Returns the directory of the currently running script."""
+    return os.path.dirname(os.path.abspath(__file__))
+
+def load_l3_module(script_dir):
+    """載入 04_train_meta_labeling_l3 (檔名以數字開頭，無法直接 import)。"""
+    path = os.path.join(script_dir, '04_train_meta_labeling_l3.py')
+    spec = importlib.util.spec_from_file_location('train_meta_labeling_l3', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def main(method='hyperband', n_candidates=27, eta=3, scale=3, k=3, workers=1, seed=42, top=10, holdout_folds=1):
+    print("=== V5.1 L3 Ranker Walk-Forward Hyperparameter Search ===")
+    script_dir = get_script_dir()
+    models_dir = os.path.join(script_dir, 'models')
+    search_dir = os.path.join(models_dir, 'l3_search')
+    l3 = load_l3_module(script_dir)
+
+    # 1. 與 04 相同的候選、特徵與等級
+    stock_f, market_f, regime_s = l3.load_data(script_dir)
+    rank_df = l3.prepare_ranking_data(stock_f, market_f, regime_s)
+    X, y, _ = l3.ranking_matrix(rank_df)
+    timestamps = X.index.get_level_values('timestamp')
+
+    # 2. 分箱一次，所有候選 / 折共用 (feature_pre_filter=False 才能搜尋 min_child_samples)；
+    #    分箱邊界只取第一折的訓練期 (與 04 --binned-cache 相同)，測試期的特徵分佈不會滲入任何一折
+    base_params = dict(l3.LGBM_PARAMS, feature_pre_filter=False)
+    all_folds = day_folds(timestamps.nunique(), n_splits=l3.N_SPLITS)
+    folds, holdout = split_holdout(all_folds, holdout_folds)
+    data = BinnedRankingData(X, y, timestamps, base_params, cache_dir=os.path.join(models_dir, 'lgb_cache'),
+                             bin_days=all_folds[0][0])
+    store = TrialStore(os.path.join(search_dir, 'trials.jsonl'), study_key(data, folds, base_params))
+    dates = timestamps.unique()
+    holdout_range = (dates[holdout[0][1][0]].date(), dates[holdout[-1][1][1] - 1].date())
+    print(f"  - {len(X)} candidates over {data.n_days} days, {len(folds)} walk-forward search folds")
+    print(f"  - Held out from the search: last {len(holdout)} fold(s), {holdout_range[0]} to {holdout_range[1]}")
+    print(f"  - Trial store: {store.path} ({len(store)} fold results of this study already done)")
+
+    # 3. 搜尋；手動設定的 LGBM_PARAMS (空的候選) 一律跑滿所有折作為對照
+    t0 = time.perf_counter()
+    baseline = trial_id({})
+    successive_halving(data, folds, [{}], base_params, store, eta=eta, min_folds=len(folds), k=k,
+                       workers=workers, verbose=False)
+    if method == 'hyperband':
+        board = hyperband(data, folds, SEARCH_SPACE, base_params, store, eta=eta, scale=scale, k=k,
+                          workers=workers, seed=seed)
+    else:
+        successive_halving(data, folds, sample_candidates(SEARCH_SPACE, n_candidates, seed=seed), base_params,
+                           store, eta=eta, k=k, workers=workers)
+        board = store.leaderboard(len(folds), k)
+    print(f"Search finished in {time.perf_counter() - t0:.1f}s ({len(store)} fold results in store)")
+
+    # 4. 報告與輸出
+    metric = f'mean_ndcg@{k}'
+    board.insert(1, 'baseline', board['trial'] == baseline)
+    board.to_csv(os.path.join(search_dir, 'leaderboard.csv'), index=False)
+    complete = board[board['folds'] == len(folds)]
+    best = complete.iloc[0]
+    base_score = complete.loc[complete['baseline'], metric].iloc[0]
+
+    pd.set_option('display.width', 200)
+    print(f"\n[Top {top} by OOS mean NDCG@{k} (all {len(folds)} search folds)]")
+    print(complete.head(top).to_string(index=False))
+    print(f"\nSearch folds (optimistic, used for selection) - Baseline LGBM_PARAMS: {base_score:.4f} | "
+          f"Best: {best[metric]:.4f} (trial {best['trial']})")
+
+    # 5. 勝出者與對照組在保留折上重新評分 (搜尋沒看過這段期間)
+    search_params = store.records[(best['trial'], 0)]['params']  # 原始型別 (leaderboard 的整數欄可能變成 float)
+    held = evaluate_holdout(data, holdout, {best['trial']: search_params, baseline: {}}, base_params, k=k)
+    best_holdout, base_holdout = held.loc[best['trial'], 'mean'], held.loc[baseline, 'mean']
+    print(f"Held-out {holdout_range[0]} to {holdout_range[1]} - Baseline LGBM_PARAMS: {base_holdout:.4f} | "
+          f"Best: {best_holdout:.4f} (NDCG@{k})")
+    if best_holdout <= base_holdout:
+        print("Warning: the search winner does not beat the baseline on the held-out folds.")
+
+    tuned = {
+        'params': dict(l3.LGBM_PARAMS, **search_params),
+        'search_params': search_params,
+        'trial': best['trial'],
+        'k': k,
+        'holdout_score': float(best_holdout),
+        'baseline_holdout_score': float(base_holdout),
+        'holdout_range': [str(d) for d in holdout_range],
+        'search_score': float(best[metric]),
+        'baseline_search_score': float(base_score),
+        'study': store.study,
+        'method': method,
+    }
+    out_path = os.path.join(models_dir, 'l3_tuned_params.json')
+    with open(out_path, 'w') as f:
+        json.dump(tuned, f, indent=2)
+    print(f"Leaderboard saved to {search_dir}/leaderboard.csv")
+    print(f"Tuned params saved to {out_path} (use: 04_train_meta_labeling_l3.py --tuned-params)")
+    return tuned
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--method', default='hyperband', choices=['hyperband', 'halving'])
+    parser.add_argument('--candidates', type=int, default=27, help='initial candidates for --method halving')
+    parser.add_argument('--eta', type=int, default=3, help='keep the top 1/eta of the candidates at each rung')
+    parser.add_argument('--scale', type=float, default=3, help='candidate multiplier of each Hyperband bracket')
+    parser.add_argument('--k', type=int, default=3, choices=[1, 3, 5], help='select by OOS NDCG@k')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--holdout-folds', type=int, default=1,
+                        help='last walk-forward folds kept out of the search and used to report the winner')
+    args = parser.parse_args()
+    main(method=args.method, n_candidates=args.candidates, eta=args.eta, scale=args.scale, k=args.k,
+         workers=args.workers, seed=args.seed, holdout_folds=args.holdout_folds)
@@ -1,10 +1,15 @@
 import pandas as pd
 import numpy as np
 import os
+import sys
 import matplotlib.pyplot as plt
 import seaborn as sns
 from datetime import timedelta
 
+# 共用元件 (repo 根目錄下的 common/)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.panel_store import PanelStore, as_panel
+
 # --- Configuration (回測參數設定) ---
 INITIAL_CAPITAL = 100_000.0  # 初始本金
 MAX_POSITIONS = 5            # 最大持倉檔數
@@ -28,7 +33,7 @@ def load_data(base_dir):
     
     # 2. Stock Features (價格數據 OHLCV + ATR)
     stock_path = os.path.join(features_dir, 'stock_features_L0.parquet')
-    stock_df = pd.read_parquet(stock_path)
+    stock_panel = PanelStore.build_or_open(stock_path)
     
     # 3. Regime Signals (L1 防禦訊號)
     regime_path = os.path.join(signals_dir, 'regime_signals.parquet')
@@ -38,7 +43,7 @@ def load_data(base_dir):
     if 'timestamp' in regime.columns:
         regime = regime.set_index('timestamp')
         
-    return scores, stock_df, regime
+    return scores, stock_panel, regime
 
 class CapitalPoolBacktester:
     def __init__(self, stock_df, regime_df, scores_df, 
@@ -49,7 +54,7 @@ class CapitalPoolBacktester:
                  ranking_ascending=False,
                  use_dynamic_exit=True):
         
-        self.stock_df = stock_df
+        self.panel = as_panel(stock_df)
         self.regime_df = regime_df.sort_index()
         self.scores_df = scores_df
         
@@ -69,10 +74,9 @@ class CapitalPoolBacktester:
         self.trade_log = []
         self.pending_orders = [] 
         
-        # 預處理：將 stock_df 轉為以 timestamp 為主索引
+        # 預處理：行情改由 PanelStore 依 (日期, 標的) 直接查詢
         print(f"Initializing Backtester ({ranking_col}, DynamicExit={use_dynamic_exit})...")
-        self.daily_data = self.stock_df.reorder_levels(['timestamp', 'symbol']).sort_index()
-        self.all_dates = self.daily_data.index.get_level_values('timestamp').unique().sort_values()
+        self.all_dates = self.panel.active_dates()
         
     def run(self):
         # print(f"Starting Backtest from {self.all_dates[0].date()} to {self.all_dates[-1].date()}...")
@@ -81,16 +85,15 @@ class CapitalPoolBacktester:
             if i == 0: continue 
             
             # 1. 取得今日行情
-            try:
-                today_bar = self.daily_data.loc[current_date]
-            except KeyError:
+            today_bar = self.panel.day(current_date)
+            if today_bar is None:
                 continue
 
             # 計算權益 (Mark-to-Market)
             current_equity = self.cash
             for sym, pos in self.positions.items():
-                if sym in today_bar.index:
-                    current_equity += pos['shares'] * today_bar.loc[sym]['Close']
+                if sym in today_bar:
+                    current_equity += pos['shares'] * today_bar[sym]['Close']
                 else:
                     current_equity += pos['shares'] * pos['entry_price']
             
@@ -99,8 +102,8 @@ class CapitalPoolBacktester:
                 if symbol in self.positions: continue
                 if self.cash <= 0: break
                 
-                if symbol in today_bar.index:
-                    open_price = today_bar.loc[symbol]['Open']
+                if symbol in today_bar:
+                    open_price = today_bar[symbol]['Open']
                     buy_price = open_price * (1 + self.slippage)
                     
                     target_amt = current_equity * (1.0 / self.max_positions)
@@ -109,7 +112,7 @@ class CapitalPoolBacktester:
                     
                     if shares > 0:
                         self.cash -= shares * buy_price
-                        atr = today_bar.loc[symbol].get('ATR_14', buy_price * 0.02)
+                        atr = today_bar[symbol].get('ATR_14', buy_price * 0.02)
                         if pd.isna(atr): atr = buy_price * 0.02
                         
                         self.positions[symbol] = {
@@ -125,9 +128,9 @@ class CapitalPoolBacktester:
             to_sell = []
             for symbol, pos in self.positions.items():
                 pos['days_held'] += 1
-                if symbol not in today_bar.index: continue
+                if symbol not in today_bar: continue
                 
-                bar = today_bar.loc[symbol]
+                bar = today_bar[symbol]
                 high_price = bar['High']
                 close_price = bar['Close']
                 
@@ -165,8 +168,8 @@ class CapitalPoolBacktester:
             # --- C. 更新權益 ---
             updated_equity = self.cash
             for sym, pos in self.positions.items():
-                if sym in today_bar.index:
-                    updated_equity += pos['shares'] * today_bar.loc[sym]['Close']
+                if sym in today_bar:
+                    updated_equity += pos['shares'] * today_bar[sym]['Close']
                 else:
                     updated_equity += pos['shares'] * pos['entry_price']
             
@@ -204,13 +207,13 @@ class CapitalPoolBacktester:
 
         return pd.DataFrame(self.equity_curve).set_index('timestamp'), pd.DataFrame(self.trade_log)
 
-def run_voo_benchmark(stock_df, start_date, end_date, initial_capital=100000.0):
+def run_voo_benchmark(panel, start_date, end_date, initial_capital=100000.0):
     print("Simulating VOO Benchmark...")
-    target_symbol = 'VOO' if 'VOO' in stock_df.index.get_level_values('symbol') else 'SPY'
-    if target_symbol not in stock_df.index.get_level_values('symbol'):
+    target_symbol = 'VOO' if 'VOO' in panel.symbol_index else 'SPY'
+    if target_symbol not in panel.symbol_index:
         return pd.DataFrame()
         
-    df = stock_df.xs(target_symbol, level='symbol').sort_index()
+    df = panel.symbol_frame(target_symbol, ['Open', 'Close'])
     df = df[(df.index >= start_date) & (df.index <= end_date)]
     if df.empty: return pd.DataFrame()
     
@@ -224,7 +227,7 @@ def main():
     os.makedirs(ANALYSIS_DIR, exist_ok=True)
     
     print("=== V5.1 Multi-Strategy Capital Pool Backtest ===")
-    scores, stock_df, regime = load_data(SCRIPT_DIR)
+    scores, stock_panel, regime = load_data(SCRIPT_DIR)
     
     # 定義要比較的策略
     strategies = {
@@ -251,7 +254,7 @@ def main():
     for name, config in strategies.items():
         print(f"\n--- Running {name} ---")
         backtester = CapitalPoolBacktester(
-            stock_df, regime, scores,
+            stock_panel, regime, scores,
             initial_capital=INITIAL_CAPITAL,
             max_positions=MAX_POSITIONS,
             slippage=SLIPPAGE,
@@ -268,7 +271,7 @@ def main():
         start_date = equity_curves[first_strategy].index.min()
         end_date = equity_curves[first_strategy].index.max()
         
-        voo_eq = run_voo_benchmark(stock_df, start_date, end_date, INITIAL_CAPITAL)
+        voo_eq = run_voo_benchmark(stock_panel, start_date, end_date, INITIAL_CAPITAL)
         if not voo_eq.empty:
             equity_curves['VOO (Buy&Hold)'] = voo_eq['equity']
             
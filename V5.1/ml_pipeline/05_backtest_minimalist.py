@@ -1,8 +1,13 @@
 import pandas as pd
 import numpy as np
 import os
+import sys
 import matplotlib.pyplot as plt
 
+# 共用元件 (repo 根目錄下的 common/)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.panel_store import PanelStore, as_panel
+
 # --- Configuration ---
 INITIAL_CAPITAL = 100_000.0
 MAX_POSITIONS = 5
@@ -16,35 +21,33 @@ def load_data(base_dir):
     if not os.path.exists(stock_path):
         raise FileNotFoundError(f"Missing {stock_path}")
     print(f"Loading stock features from {stock_path}...")
-    stock_df = pd.read_parquet(stock_path)
-    return stock_df
+    # 特徵檔展開為 PanelStore ({stock_path}.panel/，特徵檔更新時才重建)
+    return PanelStore.build_or_open(stock_path)
 
 class MinimalistBacktester:
     def __init__(self, stock_df, initial_capital=100000.0):
-        self.stock_df = stock_df
+        self.panel = as_panel(stock_df)
         self.initial_capital = initial_capital
         self.cash = initial_capital
         self.positions = {} 
         self.equity_curve = []
         self.trade_log = []
-        self.daily_data = self.stock_df.reorder_levels(['timestamp', 'symbol']).sort_index()
-        self.all_dates = self.daily_data.index.get_level_values('timestamp').unique().sort_values()
+        self.all_dates = self.panel.active_dates()
         
     def run(self):
         print(f"Running Final Minimalist Backtest ({self.all_dates[0].date()} to {self.all_dates[-1].date()})...")
         print("Logic: RSI(2) < 10 & Price > SMA(200) | No Pyramiding | Hold 5 Days")
         
         for i, current_date in enumerate(self.all_dates):
-            try:
-                today_bar = self.daily_data.loc[current_date]
-            except KeyError:
+            today_bar = self.panel.day(current_date)
+            if today_bar is None:
                 continue
                 
             # 1. Update Equity
             current_equity = self.cash
             for sym, pos in self.positions.items():
-                if sym in today_bar.index:
-                    price = today_bar.loc[sym]['Close']
+                if sym in today_bar:
+                    price = today_bar[sym]['Close']
                     if pd.isna(price): price = pos['entry_price']
                     current_equity += pos['shares'] * price
                 else:
@@ -55,8 +58,8 @@ class MinimalistBacktester:
             for symbol, pos in self.positions.items():
                 pos['days_held'] += 1
                 if pos['days_held'] >= HOLD_DAYS:
-                    if symbol in today_bar.index:
-                        exit_price = today_bar.loc[symbol]['Close'] * (1 - SLIPPAGE)
+                    if symbol in today_bar:
+                        exit_price = today_bar[symbol]['Close'] * (1 - SLIPPAGE)
                         if pd.isna(exit_price): continue
                         
                         revenue = pos['shares'] * exit_price
@@ -76,9 +79,10 @@ class MinimalistBacktester:
             # 3. Entry Logic
             open_slots = MAX_POSITIONS - len(self.positions)
             if open_slots > 0 and self.cash > 0:
-                candidates = today_bar[
-                    (today_bar['RSI_2'] < RSI_THRESHOLD) & 
-                    (today_bar['Dist_SMA_200'] > 0)
+                bars = today_bar.frame(['Close', 'RSI_2', 'Dist_SMA_200'])
+                candidates = bars[
+                    (bars['RSI_2'] < RSI_THRESHOLD) & 
+                    (bars['Dist_SMA_200'] > 0)
                 ]
                 
                 if not candidates.empty:
@@ -119,8 +123,8 @@ def main():
     ANALYSIS_DIR = os.path.join(SCRIPT_DIR, 'analysis')
     os.makedirs(ANALYSIS_DIR, exist_ok=True)
     
-    stock_df = load_data(SCRIPT_DIR)
-    backtester = MinimalistBacktester(stock_df, initial_capital=INITIAL_CAPITAL)
+    stock_panel = load_data(SCRIPT_DIR)
+    backtester = MinimalistBacktester(stock_panel, initial_capital=INITIAL_CAPITAL)
     equity, trades = backtester.run()
     
     if equity.empty:
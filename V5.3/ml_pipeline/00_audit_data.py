@@ -1,11 +1,16 @@
 import pandas as pd
 import numpy as np
 import os
+import sys
 import json
 import shutil
 import matplotlib.pyplot as plt
 from data_loader import DataLoader
 
+# 共用元件 (repo 根目錄下的 common/)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.frame_schema import read_compact_parquet
+
 def get_script_dir():
     return os.path.dirname(os.path.abspath(__file__))
 
@@ -238,7 +243,7 @@ def main():
         print("Error: universe_daily.parquet not found. Run 01_format_data.py first.")
         return
 
-    universe_df = pd.read_parquet(parquet_path).reset_index()
+    universe_df = read_compact_parquet(parquet_path, compute_dtypes=True).reset_index()
     print(f"Data Loaded. Shape: {universe_df.shape}")
 
     # 2. 執行審計 (Input -> Output)
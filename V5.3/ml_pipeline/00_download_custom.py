@@ -1,25 +1,23 @@
 import os
+import sys
 import pandas as pd
-import yfinance as yf
 # 引入 DataLoader
 from data_loader import DataLoader 
 
+# 共用元件 (repo 根目錄下的 common/)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.bar_store import BarStore
+from common.raw_dataset import write_raw_dataset
+
 def get_script_dir():
     return os.path.dirname(os.path.abspath(__file__))
 
 def download_data(tickers, start_date, end_date):
-    """Downloads 1d OHLCV data for a list of tickers."""
-    # [Optimized] 加入 group_by='ticker' 確保多標的格式統一
-    return yf.download(
-        tickers,
-        start=start_date,
-        end=end_date,
-        interval='1d',
-        auto_adjust=True,
-        timeout=30,
-        threads=True,
-        group_by='ticker' 
-    )
+    """
+    Loads 1d OHLCV data for a list of tickers via the shared BarStore
+    (只下載本地尚未覆蓋的區間)，回傳 {symbol: DataFrame}。
+    """
+    return BarStore().get_bars(tickers, start_date, end_date, interval='1d')
 
 def main():
     print("=== V5.3 Step 2.1: Data Expansion (Macro & Tickers) ===")
@@ -61,28 +59,27 @@ def main():
 
     # Output paths (維持存入 data/custom)
     output_dir = os.path.join(script_dir, 'data', 'custom')
-    tickers_output_path = os.path.join(output_dir, 'raw_tickers.pkl')
-    macro_output_path = os.path.join(output_dir, 'raw_macro.pkl')
+    # [V5.3] 以 symbol/year 分區的長格式 Parquet 取代 raw_*.pkl
+    tickers_output_dir = os.path.join(output_dir, 'raw', 'tickers')
+    macro_output_dir = os.path.join(output_dir, 'raw', 'macro')
     os.makedirs(output_dir, exist_ok=True)
 
     # --- 1. Download Ticker Data ---
     print(f"\n[1/2] Downloading Stock Data for {len(target_tickers)} tickers...")
-    daily_tickers_df = download_data(target_tickers, START_DATE, END_DATE)
+    ticker_bars = download_data(target_tickers, START_DATE, END_DATE)
 
-    # Package and Save
-    output_tickers_data = {'daily': daily_tickers_df}
-    pd.to_pickle(output_tickers_data, tickers_output_path)
-    print(f"Saved stocks to: {tickers_output_path}")
+    write_raw_dataset(ticker_bars, tickers_output_dir)
+    print(f"Saved stocks to: {tickers_output_dir}")
 
     # --- 2. Download Macro Data (V5.3 Expanded) ---
     # 新增 HYG (高收益債) 與 IEF (7-10年公債) 用於 L1 混合防禦
     macro_tickers = ['SPY', 'QQQ', 'IWO', 'VTI', '^VIX', '^TNX', 'HYG', 'IEF']
     
     print(f"\n[2/2] Downloading Macro Data ({len(macro_tickers)} symbols)...")
-    macro_df = download_data(macro_tickers, START_DATE, END_DATE)
+    macro_bars = download_data(macro_tickers, START_DATE, END_DATE)
     
-    pd.to_pickle(macro_df, macro_output_path)
-    print(f"Saved macro to: {macro_output_path}")
+    write_raw_dataset(macro_bars, macro_output_dir)
+    print(f"Saved macro to: {macro_output_dir}")
     
     print("\nData download complete.")
 
@@ -1,9 +1,14 @@
 
 import os
-import yfinance as yf
+import sys
 import pandas as pd
 import requests
 
+# 共用元件 (repo 根目錄下的 common/)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.bar_store import BarStore
+from common.raw_dataset import write_raw_dataset
+
 def get_script_dir():
     return os.path.dirname(os.path.abspath(__file__))
 
@@ -35,15 +40,8 @@ def get_fallback_tickers():
     ]
 
 def download_data(tickers, start_date, end_date):
-    """Downloads 1d OHLCV data for a list of tickers."""
-    return yf.download(
-        tickers,
-        start=start_date,
-        end=end_date,
-        interval='1d',
-        auto_adjust=True,
-        timeout=30
-    )
+    """Loads 1d OHLCV data for a list of tickers via the shared BarStore (incremental)."""
+    return BarStore().get_bars(tickers, start_date, end_date, interval='1d')
 
 def main():
     """
@@ -59,8 +57,8 @@ def main():
 
     # Output directories and files (in ./data/)
     output_dir = os.path.join(script_dir, 'data', 'index')
-    tickers_output_path = os.path.join(output_dir, 'raw_tickers.pkl')
-    macro_output_path = os.path.join(output_dir, 'raw_macro.pkl')
+    tickers_output_dir = os.path.join(output_dir, 'raw', 'tickers')
+    macro_output_dir = os.path.join(output_dir, 'raw', 'macro')
 
     # Ensure output directory exists
     os.makedirs(output_dir, exist_ok=True)
@@ -84,22 +82,20 @@ def main():
 
     # --- Download Index Ticker Data ---
     print(f"Downloading daily data for {len(index_tickers)} index tickers...")
-    daily_tickers_df = download_data(index_tickers, START_DATE, END_DATE)
-
-    # --- CRUCIAL: Package into dictionary for downstream compatibility ---
-    output_tickers_data = {'daily': daily_tickers_df}
+    ticker_bars = download_data(index_tickers, START_DATE, END_DATE)
 
-    print(f"Saving index ticker data to: {tickers_output_path}")
-    pd.to_pickle(output_tickers_data, tickers_output_path)
+    # Long-format symbol/year partitioned dataset (取代 raw_tickers.pkl)
+    print(f"Saving index ticker data to: {tickers_output_dir}")
+    write_raw_dataset(ticker_bars, tickers_output_dir)
     print("Index ticker data saved successfully.")
 
     # --- Download Macro Data ---
     macro_tickers = ['SPY', 'QQQ', 'IWO', 'VTI', '^VIX', 'TNX']
     print(f"Downloading daily data for {len(macro_tickers)} macro indicators...")
-    macro_df = download_data(macro_tickers, START_DATE, END_DATE)
+    macro_bars = download_data(macro_tickers, START_DATE, END_DATE)
 
-    print(f"Saving macro data to: {macro_output_path}")
-    pd.to_pickle(macro_df, macro_output_path)
+    print(f"Saving macro data to: {macro_output_dir}")
+    write_raw_dataset(macro_bars, macro_output_dir)
     print("Macro data saved successfully.")
 
 if __name__ == '__main__':
@@ -1,6 +1,13 @@
 import os
+import sys
 import pandas as pd
 
+# 共用元件 (repo 根目錄下的 common/)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.raw_dataset import dataset_exists, read_metadata, stream_to_parquet
+from common.reshape import wide_to_long
+from common.frame_schema import compact_frame, to_table, write_compact_parquet
+
 def get_script_dir():
     """Returns the directory of the currently running script."""
     return os.path.dirname(os.path.abspath(__file__))
@@ -42,7 +49,11 @@ def format_ticker_data(data_dict):
     """
     df = data_dict['daily']
     print(f"  - Formatting Ticker Data. Shape: {df.shape}")
-    
+
+    if isinstance(df.columns, pd.MultiIndex):
+        # Legacy pickle 的寬表：直接 reshape (date x symbol x field) block，dtype 只轉換一次，index 由 codes 建立
+        return wide_to_long(df)
+
     df_stacked = robust_stack(df)
     
     # Standardize column names
@@ -100,7 +111,11 @@ def format_macro_data(df):
     So we should save it as (timestamp, symbol) or Long format.
     """
     print(f"  - Formatting Macro Data. Shape: {df.shape}")
-    
+
+    if isinstance(df.columns, pd.MultiIndex):
+        # Legacy pickle 的寬表 (同 format_ticker_data)
+        return wide_to_long(df)
+
     df_stacked = robust_stack(df)
     
     df_stacked.columns = df_stacked.columns.str.lower()
@@ -147,6 +162,9 @@ def main():
 
         # Define paths
         base_data_dir = os.path.join(script_dir, 'data', track)
+        raw_tickers_dir = os.path.join(base_data_dir, 'raw', 'tickers')
+        raw_macro_dir = os.path.join(base_data_dir, 'raw', 'macro')
+        # Legacy (舊版 00 產出的 pickle，僅在新格式不存在時使用)
         raw_tickers_path = os.path.join(base_data_dir, 'raw_tickers.pkl')
         raw_macro_path = os.path.join(base_data_dir, 'raw_macro.pkl')
 
@@ -154,34 +172,49 @@ def main():
         market_output_path = os.path.join(base_data_dir, 'market_indicators.parquet')
 
         # Process Tickers
-        if os.path.exists(raw_tickers_path):
-            print(f"Loading raw tickers from: {raw_tickers_path}")
+        if dataset_exists(raw_tickers_dir):
+            meta = read_metadata(raw_tickers_dir)
+            print(f"Streaming raw tickers from: {raw_tickers_dir} ({len(meta['symbols'])} symbols)")
+            if stream_to_parquet(raw_tickers_dir, universe_output_path, index=('timestamp', 'symbol'),
+                                 order='timestamp', transform=compact_frame, to_table=to_table):
+                print("Universe data saved successfully.")
+            else:
+                print("Warning: Formatted ticker data is empty.")
+        elif os.path.exists(raw_tickers_path):
+            print(f"Loading legacy raw tickers from: {raw_tickers_path}")
             raw_tickers_data = pd.read_pickle(raw_tickers_path)
             formatted_tickers = format_ticker_data(raw_tickers_data)
 
             if not formatted_tickers.empty:
                 print(f"Saving formatted universe data to: {universe_output_path}")
-                formatted_tickers.to_parquet(universe_output_path)
+                write_compact_parquet(formatted_tickers, universe_output_path)
                 print("Universe data saved successfully.")
             else:
                 print("Warning: Formatted ticker data is empty.")
         else:
-            print(f"Warning: Ticker data not found for track '{track}' at {raw_tickers_path}")
+            print(f"Warning: Ticker data not found for track '{track}' at {raw_tickers_dir}")
 
         # Process Macro Indicators
-        if os.path.exists(raw_macro_path):
-            print(f"Loading raw macro data from: {raw_macro_path}")
+        if dataset_exists(raw_macro_dir):
+            print(f"Streaming raw macro data from: {raw_macro_dir}")
+            if stream_to_parquet(raw_macro_dir, market_output_path, index=('timestamp', 'symbol'),
+                                 order='timestamp', transform=compact_frame, to_table=to_table):
+                print("Market indicators saved successfully.")
+            else:
+                print("Warning: Formatted macro data is empty.")
+        elif os.path.exists(raw_macro_path):
+            print(f"Loading legacy raw macro data from: {raw_macro_path}")
             raw_macro_df = pd.read_pickle(raw_macro_path)
             formatted_macro = format_macro_data(raw_macro_df)
 
             if not formatted_macro.empty:
                 print(f"Saving formatted market indicators to: {market_output_path}")
-                formatted_macro.to_parquet(market_output_path)
+                write_compact_parquet(formatted_macro, market_output_path)
                 print("Market indicators saved successfully.")
             else:
                 print("Warning: Formatted macro data is empty.")
         else:
-            print(f"Warning: Macro data not found for track '{track}' at {raw_macro_path}")
+            print(f"Warning: Macro data not found for track '{track}' at {raw_macro_dir}")
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
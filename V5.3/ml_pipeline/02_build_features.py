@@ -1,7 +1,14 @@
+import argparse
 import os
+import sys
 import pandas as pd
 import numpy as np
-import pandas_ta as ta
+
+# 共用元件 (repo 根目錄下的 common/)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.frame_schema import read_compact_parquet, write_compact_parquet
+from common.feature_graph import FeatureGraph
+from common.indicators import BarMatrix, amihud, atr, down_vol_prop, rsi, sma
 
 def get_script_dir():
     """Returns the directory of the currently running script."""
@@ -49,52 +56,40 @@ def calculate_macro_features(df):
 
     return features.dropna(how='all')
 
-def calculate_stock_features(df):
+def build_feature_graph():
     """
-    Calculates technical indicators + V5.3 Microstructure Features.
+    Stock feature DAG (common.feature_graph)：每個特徵宣告輸入與參數，
+    重建時只重算新增 / 失效的節點，以及原始資料有變動的標的。
     """
-    # 確保按標的分組
-    # Use transform for indicators that operate on a single series
-    df['SMA_200'] = df.groupby(level='symbol')['close'].transform(lambda x: ta.sma(x, length=200))
-    df['RSI_2'] = df.groupby(level='symbol')['close'].transform(lambda x: ta.rsi(x, length=2))
+    graph = FeatureGraph(['open', 'high', 'low', 'close', 'volume'])
+
+    # min_bars: 與 pandas_ta 相同，K 棒數不足的標的整段為 NaN
+    graph.add('SMA_200', sma, ['close'], {'length': 200}, min_bars=200)
+    graph.add('RSI_2', rsi, ['close'], {'length': 2}, min_bars=3)
 
     # --- V5.3 New Features ---
     # 1. Amihud Illiquidity (Price Impact)
-    # Formula: Abs(Ret) / (Price * Volume)
-    # 我們取 20 日平均來平滑
-    def calc_amihud(group):
-        ret = group['close'].pct_change().abs()
-        dollar_vol = group['close'] * group['volume']
-        # 避免除以零
-        dollar_vol = dollar_vol.replace(0, np.nan)
-        amihud = (ret / dollar_vol)
-        return amihud.rolling(20).mean()
-
-    df['Amihud_Illiquidity'] = df.groupby(level='symbol', group_keys=False).apply(calc_amihud)
+    # Formula: Abs(Ret) / (Price * Volume)，取 20 日平均來平滑 (成交額為 0 視為 NaN)
+    graph.add('Amihud_Illiquidity', amihud, ['close', 'volume'], {'length': 20})
 
     # 2. Down Volume Proportion (Distribution Pressure)
     # Formula: Sum(Vol where Close < Open) / Sum(Total Vol) over 10 days
-    def calc_down_vol_prop(group):
-        is_down = (group['close'] < group['open']).astype(int)
-        down_vol = group['volume'] * is_down
-        down_sum = down_vol.rolling(10).sum()
-        total_sum = group['volume'].rolling(10).sum()
-        return down_sum / total_sum.replace(0, np.nan)
-
-    df['Down_Vol_Prop'] = df.groupby(level='symbol', group_keys=False).apply(calc_down_vol_prop)
-
-    # ATR Calculation (Robust Loop)
-    all_atr = []
-    for symbol, group in df.groupby(level='symbol'):
-        atr = ta.atr(high=group['high'], low=group['low'], close=group['close'], length=14)
-        all_atr.append(atr)
-
-    if all_atr:
-        atr_series = pd.concat(all_atr)
-        df['ATR_14'] = atr_series
-    else:
-        df['ATR_14'] = pd.NA
+    graph.add('Down_Vol_Prop', down_vol_prop, ['open', 'close', 'volume'], {'length': 10})
 
+    # ATR (Wilder, presma)
+    graph.add('ATR_14', atr, ['high', 'low', 'close'], {'length': 14}, min_bars=15)
+    return graph
+
+def calculate_stock_features(df, cache_dir=None, workers=1):
+    """
+    Calculates technical indicators + V5.3 Microstructure Features.
+    各指標以 common.indicators 在 (bar x symbol) 矩陣上一次算完；
+    cache_dir 指定時經由 feature graph 快取，只重算有變動的部分；
+    workers > 1 時把標的切給多個行程 (原始 OHLCV 以 shared memory 共用)。
+    """
+    features = build_feature_graph().compute(df, cache_dir=cache_dir, workers=workers)
+    for col in features.columns:
+        df[col] = features[col].to_numpy()
     return df
 
 def calculate_market_breadth(df):
@@ -102,7 +97,8 @@ def calculate_market_breadth(df):
     Calculates the market breadth (percentage of stocks with Close > SMA_200).
     """
     if 'SMA_200' not in df.columns:
-        df['SMA_200'] = df.groupby(level='symbol')['close'].transform(lambda x: ta.sma(x, length=200))
+        bars = BarMatrix.from_long(df, ['close'])
+        df['SMA_200'] = bars.to_series(sma(bars['close'], 200), min_bars=200)
 
     df['above_sma200'] = (df['close'] > df['SMA_200']).astype(int)
 
@@ -110,7 +106,7 @@ def calculate_market_breadth(df):
     breadth.columns = ['market_breadth']
     return breadth
 
-def main():
+def main(workers=1):
     print("=== V5.3 Step 2.2: Feature Engineering (L1 Macro + L3 Micro) ===")
     script_dir = get_script_dir()
 
@@ -138,11 +134,13 @@ def main():
         stock_feat_path = os.path.join(track_features_dir, 'stock_features.parquet')
         macro_feat_path = os.path.join(track_features_dir, 'macro_features.parquet')
         breadth_path = os.path.join(track_features_dir, 'market_breadth.parquet')
+        # 各特徵節點的快取 (刪除此資料夾即可強制全部重算)
+        feature_cache_dir = os.path.join(track_features_dir, 'cache')
 
         # 1. Process Macro Features (L1)
         if os.path.exists(market_path):
             print("Calculating L1 Macro Features...")
-            market_df = pd.read_parquet(market_path)
+            market_df = read_compact_parquet(market_path, compute_dtypes=True)
             macro_features = calculate_macro_features(market_df)
             if not macro_features.empty:
                 macro_features.to_parquet(macro_feat_path)
@@ -157,13 +155,14 @@ def main():
         # 2. Process Stock Features (L2/L3)
         if os.path.exists(universe_path):
             print("Calculating L3 Microstructure & Stock Features...")
-            universe_df = pd.read_parquet(universe_path)
+            # 以 float64 運算指標，輸出時再轉回精簡 schema
+            universe_df = read_compact_parquet(universe_path, compute_dtypes=True)
             universe_df.sort_index(inplace=True)
 
-            stock_features = calculate_stock_features(universe_df)
+            stock_features = calculate_stock_features(universe_df, cache_dir=feature_cache_dir, workers=workers)
             
             # Save Stock Features
-            stock_features.to_parquet(stock_feat_path)
+            write_compact_parquet(stock_features, stock_feat_path)
             print(f"Saved: {stock_feat_path}")
 
             # 3. Calculate Breadth (Context)
@@ -179,4 +178,7 @@ def main():
     print("\nFeature Engineering Complete.")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=1, help='processes for the stock feature build')
+    args = parser.parse_args()
+    main(workers=args.workers)
\ No newline at end of file
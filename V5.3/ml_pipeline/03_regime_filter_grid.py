@@ -0,0 +1,129 @@
+import os
+import sys
+import io
+import argparse
+import contextlib
+import importlib.util
+import time
+import numpy as np
+import pandas as pd
+
+# 共用元件 (repo 根目錄下的 common/)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.frame_schema import read_compact_parquet
+from common.regime_grid import COMBINE, MACRO_LOGIC, backtest_crash_matrix, crash_matrix, regime_configs
+
+# 敏感度分析：一次評估數百組 L1 混合防禦設定 (breadth 門檻 x MA 視窗 x 邏輯組合)，
+# 不必修改 03_build_regime_filter 重跑整條 pipeline。
+# 回測為簡化版：crash (T-1 收盤) 時隔日開盤清倉、空手，否則持有 SPY (open -> 次日 open)，進出各扣 cost。
+
+DEFAULT_THRESHOLDS = np.round(np.arange(0.05, 0.41, 0.01), 2)
+DEFAULT_MA_WINDOWS = [5, 10, 20, 50, 100, 200]
+REFERENCE_CONFIGS = {
+    'V5.3 (03_build_regime_filter)': (0.15, 20, 'and', 'or'),
+    'V5.2 (breadth < 20%)': (0.20, None, None, 'breadth'),
+}
+
+def get_script_dir():
+    """Returns the directory of the currently running script."""
+    return os.path.dirname(os.path.abspath(__file__))
+
+def load_hybrid_filter(script_dir):
+    """載入 03_build_regime_filter.generate_hybrid_signals (檔名以數字開頭，無法直接 import)。"""
+    path = os.path.join(script_dir, '03_build_regime_filter.py')
+    spec = importlib.util.spec_from_file_location('build_regime_filter', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.generate_hybrid_signals
+
+def load_spy_open_returns(track_dir):
+    """SPY open_t -> open_{t+1} 報酬 (market_indicators.parquet)；找不到時回傳 None。"""
+    market_path = os.path.join(track_dir, 'market_indicators.parquet')
+    if not os.path.exists(market_path):
+        return None
+    df = read_compact_parquet(market_path, compute_dtypes=True).reset_index()
+    if 'symbol' not in df.columns:
+        return None
+    spy = df[df['symbol'].str.upper() == 'SPY'].set_index('timestamp').sort_index()
+    if spy.empty:
+        return None
+    return (spy['open'].shift(-1) / spy['open'] - 1).rename('SPY_Open_Ret')
+
+def find_config(configs, threshold, window, logic, combine):
+    mask = (configs['combine'] == combine)
+    mask &= configs['breadth_threshold'].isna() if threshold is None else np.isclose(configs['breadth_threshold'], threshold)
+    mask &= configs['ma_window'].isna() if window is None else (configs['ma_window'] == window)
+    mask &= configs['macro_logic'].isna() if logic is None else (configs['macro_logic'] == logic)
+    rows = configs.index[mask.fillna(False).to_numpy(dtype=bool)]
+    return rows[0] if len(rows) else None
+
+def main(track='custom', thresholds=DEFAULT_THRESHOLDS, ma_windows=DEFAULT_MA_WINDOWS, cost=0.001, top=10):
+    print("=== V5.3 L1 Regime Filter Grid (Sensitivity Study) ===")
+    script_dir = get_script_dir()
+    track_dir = os.path.join(script_dir, 'data', track)
+    features_dir = os.path.join(track_dir, 'features')
+    output_dir = os.path.join(script_dir, 'analysis')
+    os.makedirs(output_dir, exist_ok=True)
+
+    breadth_path = os.path.join(features_dir, 'market_breadth.parquet')
+    macro_path = os.path.join(features_dir, 'macro_features.parquet')
+    if not os.path.exists(breadth_path):
+        print(f"Error: Breadth data not found at {breadth_path}. Run 02_build_features.py first.")
+        return None
+    breadth_df = pd.read_parquet(breadth_path).sort_index()
+    if os.path.exists(macro_path):
+        macro_df = pd.read_parquet(macro_path).sort_index()
+    else:
+        print("Warning: Macro features not found. Macro conditions are always False (Breadth-only mode).")
+        macro_df = pd.DataFrame()
+    returns = load_spy_open_returns(track_dir)
+    if returns is None:
+        print(f"Error: SPY not found in {track_dir}/market_indicators.parquet (needed for the batched backtest).")
+        return None
+
+    configs = regime_configs(thresholds, ma_windows, macro_logic=MACRO_LOGIC, combine=COMBINE)
+    breadth = breadth_df['market_breadth']
+    dates = breadth.index
+    t0 = time.perf_counter()
+    crash = crash_matrix(configs, breadth, macro_df)
+    metrics = backtest_crash_matrix(crash, returns.reindex(dates).to_numpy(), dates=dates, cost=cost)
+    elapsed = time.perf_counter() - t0
+    print(f"Evaluated {len(configs)} configs x {len(dates)} days in {elapsed:.2f}s "
+          f"({dates[0].date()} ~ {dates[-1].date()}, cost {cost:.2%} per switch)")
+
+    # 檢查：V5.3 寫死的設定與 03_build_regime_filter 的輸出逐日相同
+    ref_row = find_config(configs, *REFERENCE_CONFIGS['V5.3 (03_build_regime_filter)'])
+    if ref_row is not None:
+        generate_hybrid_signals = load_hybrid_filter(script_dir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            signals = generate_hybrid_signals(breadth_df.copy(), macro_df.copy())
+        same = np.array_equal(crash[ref_row], (signals['signal'] == 2).to_numpy())
+        print(f"V5.3 default config reproduces 03_build_regime_filter signals: {same}")
+
+    results = pd.concat([configs, metrics], axis=1)
+    results.insert(0, 'reference', '')
+    for name, cfg in REFERENCE_CONFIGS.items():
+        row = find_config(configs, *cfg)
+        if row is not None:
+            results.loc[row, 'reference'] = name
+    results = results.sort_values('Sharpe', ascending=False)
+    out_path = os.path.join(output_dir, f'regime_filter_grid_{track}.csv')
+    results.to_csv(out_path, index=False)
+
+    pd.set_option('display.width', 200)
+    print(f"\n[Top {top} by Sharpe]")
+    print(results.head(top).to_string(index=False))
+    print("\n[Reference Configs]")
+    print(results[results['reference'] != ''].to_string(index=False))
+    print(f"\nGrid results saved to {out_path}")
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--track', default='custom', choices=['custom', 'index'])
+    parser.add_argument('--thresholds', type=float, nargs='+', default=list(DEFAULT_THRESHOLDS))
+    parser.add_argument('--ma-windows', type=int, nargs='+', default=DEFAULT_MA_WINDOWS)
+    parser.add_argument('--cost', type=float, default=0.001, help='cost per exposure switch (one way)')
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+    main(track=args.track, thresholds=args.thresholds, ma_windows=args.ma_windows, cost=args.cost, top=args.top)
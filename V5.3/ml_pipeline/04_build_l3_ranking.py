@@ -1,6 +1,22 @@
 import pandas as pd
 import os
+import sys
 import numpy as np
+import pyarrow.parquet as pq
+
+# 共用元件 (repo 根目錄下的 common/)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.cross_rank import CrossSection, rank_score, row_order, top_k, top_k_frame
+from common.frame_schema import read_features, write_compact_parquet
+
+# --- 綜合評分公式 ---
+# 各因子的每日截面百分位排名 (pct rank，越小代表數值越小)，分數 = sum(權重 * (1 - rank))：
+# RSI 低 (超賣)、Amihud 低 (流動性好)、Down_Vol_Prop 低 (拋壓小) 皆為高分。權重可調整，目前 RSI 1.0 + 微結構各 0.5
+L3_WEIGHTS = {'RSI_2': 1.0, 'Amihud_Illiquidity': 0.5, 'Down_Vol_Prop': 0.5}
+
+# 只輸出每日前 K 名 (top_k)。06 / 07 回測需要完整分數 (逐檔 shift 成 prev_L3_Rank_Score)，
+# 每日前幾名是在回測器內對 L2 候選以 top_k 選出，故預設 None = 全部輸出
+TOP_K = None
 
 def get_script_dir():
     return os.path.dirname(os.path.abspath(__file__))
@@ -19,62 +35,58 @@ def main():
         base_dir = os.path.join(script_dir, 'data', track)
         features_path = os.path.join(base_dir, 'features', 'stock_features.parquet')
         output_dir = os.path.join(base_dir, 'signals')
-        output_path = os.path.join(output_dir, 'l3_rank_scores.csv')
+        output_path = os.path.join(output_dir, 'l3_rank_scores.parquet')
 
         if not os.path.exists(features_path):
             print(f"Warning: Features not found at {features_path}. Skipping.")
             continue
 
-        print("Loading features...")
-        df = pd.read_parquet(features_path)
-
-        # 檢查必要欄位 (來自 Step 2.2)
-        req_cols = ['RSI_2', 'Amihud_Illiquidity', 'Down_Vol_Prop']
-        missing = [c for c in req_cols if c not in df.columns]
+        # 檢查必要欄位 (來自 Step 2.2)，只讀取需要的欄位
+        req_cols = list(L3_WEIGHTS)
+        available = pq.read_schema(features_path).names
+        missing = [c for c in req_cols if c not in available]
         if missing:
             print(f"Error: Missing columns {missing}. Please re-run 02_build_features.py.")
             continue
 
+        print("Loading features...")
+        df = read_features(features_path, columns=req_cols)
+
         print("Calculating Ranking Scores...")
-        
-        # 為了避免 SettingWithCopyWarning，先拷貝需要的欄位
-        score_df = df[req_cols].copy()
 
         # --- 計算每日截面排名 (Cross-Sectional Rank) ---
-        # 使用 pct=True 將排名標準化到 0~1 之間
-        # Rank 越小代表數值越小
-        
-        # 1. RSI Rank: 我們喜歡低 RSI
-        # Rank 低 (e.g. 0.01) -> (1 - 0.01) = 0.99 分 -> 高分
-        rsi_rank = score_df.groupby(level='timestamp')['RSI_2'].rank(pct=True, ascending=True)
-
-        # 2. Amihud Rank: 我們喜歡低衝擊 (流動性好)
-        # Rank 低 -> 高分
-        amihud_rank = score_df.groupby(level='timestamp')['Amihud_Illiquidity'].rank(pct=True, ascending=True)
-
-        # 3. DownVol Rank: 我們喜歡低拋壓
-        # Rank 低 -> 高分
-        downvol_rank = score_df.groupby(level='timestamp')['Down_Vol_Prop'].rank(pct=True, ascending=True)
-
-        # --- 綜合評分公式 ---
-        # 權重可調整，目前設定：RSI (1.0) + 微結構 (各 0.5)
-        # 總分越高越好
-        score_df['L3_Rank_Score'] = (1 - rsi_rank) * 1.0 + \
-                                    (1 - amihud_rank) * 0.5 + \
-                                    (1 - downvol_rank) * 0.5
-
-        # 儲存結果
+        # (date x symbol) 矩陣上每列一次排序，結果與 groupby(level='timestamp').rank(pct=True) 相同
+        cs = CrossSection.from_long(df, req_cols)
+        score = rank_score(cs, L3_WEIGHTS)
+
+        if TOP_K:
+            cols, valid = top_k(score, TOP_K)
+            rows = np.broadcast_to(np.arange(len(cols))[:, None], cols.shape)[valid]
+            cols, daily_rank = cols[valid], np.nonzero(valid)[1] + 1
+            index = pd.MultiIndex.from_arrays([cs.dates[rows], cs.symbols[cols]], names=['timestamp', 'symbol'])
+            out_df = pd.DataFrame({'L3_Rank_Score': score[rows, cols], 'RSI_2': cs['RSI_2'][rows, cols],
+                                   'L3_Rank': daily_rank.astype(np.int32)}, index=index)
+        else:
+            # L3_Rank: 當日名次 (1 = 分數最高，無分數者排在最後)
+            order = row_order(score, present=cs.present)
+            daily_rank = np.empty_like(order)
+            np.put_along_axis(daily_rank, order, np.arange(1, order.shape[1] + 1)[None, :], axis=1)
+
+            # 只保留分數與 RSI (供回測參考)
+            out_df = pd.DataFrame({'L3_Rank_Score': cs.to_series(score).to_numpy(),
+                                   'RSI_2': df['RSI_2'].to_numpy(),
+                                   'L3_Rank': cs.to_series(daily_rank).to_numpy().astype(np.int32)},
+                                  index=df.index)
+
+        # 儲存結果 (精簡 Parquet；分數保留 float64，回測排序才與計算時一致)
         os.makedirs(output_dir, exist_ok=True)
-        
-        # 只保留分數與 RSI (供回測參考)
-        out_df = score_df[['L3_Rank_Score', 'RSI_2']]
-        out_df.to_csv(output_path)
+        write_compact_parquet(out_df, output_path, keep_float64=('L3_Rank_Score',))
         print(f"Saved ranking scores to: {output_path}")
-        
+
         # 驗證：顯示最新日期的 Top 5
         try:
-            latest_date = df.index.get_level_values('timestamp').max()
-            top_picks = out_df.xs(latest_date, level='timestamp').sort_values('L3_Rank_Score', ascending=False).head(5)
+            latest_date = cs.dates[-1]
+            top_picks = top_k_frame(cs, score, 5, name='L3_Rank_Score').xs(latest_date, level='timestamp')
             print(f"\n[Preview] Top 5 Picks for {latest_date.date()}:")
             print(top_picks)
         except Exception as e:
@@ -1,11 +1,16 @@
 import pandas as pd
 import numpy as np
 import os
+import sys
 import matplotlib.pyplot as plt
-import yfinance as yf
 from backtesting_utils import run_backtest
 from data_loader import DataLoader
 
+# 共用元件 (repo 根目錄下的 common/)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.data_provider import get_provider
+from common.frame_schema import read_compact_parquet
+
 # --- 輔助函數：計算績效指標 ---
 def calculate_metrics(curve):
     if curve is None or curve.empty:
@@ -43,7 +48,7 @@ def load_data(base_dir):
 
     try:
         print(f"Loading features from {features_path}...")
-        features_df = pd.read_parquet(features_path)
+        features_df = read_compact_parquet(features_path, compute_dtypes=True)
         print(f"Loading regime signals from {regime_path}...")
         regime_signals_df = pd.read_parquet(regime_path)
     except FileNotFoundError as e:
@@ -64,7 +69,7 @@ def load_data(base_dir):
 def get_spy_benchmark(start_date, end_date, initial_capital=100000.0):
     print(f"Downloading SPY Benchmark ({start_date.date()} to {end_date.date()})...")
     try:
-        df = yf.download("SPY", start=start_date, end=end_date, interval="1d", auto_adjust=True, progress=False)
+        df = get_provider().download(["SPY"], start=start_date, end=end_date, interval="1d").get("SPY", pd.DataFrame())
         if df.empty: return pd.Series(dtype=float)
         
         # 處理 yfinance 多層索引
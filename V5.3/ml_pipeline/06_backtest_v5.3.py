@@ -1,10 +1,17 @@
 import pandas as pd
 import numpy as np
 import os
+import sys
 import matplotlib.pyplot as plt
 from data_loader import DataLoader
 from risk_manager import RiskManager
 
+# 共用元件 (repo 根目錄下的 common/)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.cross_rank import top_k
+from common.frame_schema import read_compact_parquet
+from common.panel_store import PanelStore, as_panel
+
 # --- Configuration ---
 INITIAL_CAPITAL = 100_000.0
 MAX_POSITIONS = 5
@@ -15,8 +22,8 @@ class V5_3_Backtester:
     def __init__(self, stock_df, regime_df, rank_df, breadth_df, 
                  initial_capital=100000.0, max_positions=5):
         
-        # 1. 數據排序
-        self.stock_df = stock_df.sort_index()
+        # 1. 數據排序 (stock_df 可為 PanelStore 或長表 DataFrame)
+        self.panel = as_panel(stock_df)
         self.regime_df = regime_df.sort_index()
         self.rank_df = rank_df.sort_index()
         self.breadth_df = breadth_df.sort_index()
@@ -30,23 +37,42 @@ class V5_3_Backtester:
         # 為了安全，先檢查欄位是否存在
         cols_to_shift = ['RSI_2', 'SMA_200', 'close', 'ATR_14']
         # 處理大小寫相容性 (若 01_format 沒轉好)
-        col_map = {c: c for c in self.stock_df.columns}
+        col_map = {c: c for c in self.panel.fields}
         # 嘗試找對應的欄位名 (Case insensitive search)
         for target in cols_to_shift:
-            for c in self.stock_df.columns:
+            for c in self.panel.fields:
                 if c.lower() == target.lower():
                     col_map[target] = c
                     break
         
         # 建立 prev_ 欄位
-        self.stock_df['prev_RSI_2'] = self.stock_df.groupby('symbol')[col_map.get('RSI_2', 'RSI_2')].shift(1)
-        self.stock_df['prev_SMA_200'] = self.stock_df.groupby('symbol')[col_map.get('SMA_200', 'SMA_200')].shift(1)
-        self.stock_df['prev_close'] = self.stock_df.groupby('symbol')[col_map.get('close', 'close')].shift(1)
-        self.stock_df['prev_ATR_14'] = self.stock_df.groupby('symbol')[col_map.get('ATR_14', 'ATR_14')].shift(1)
+        self.panel.add_shifted('prev_RSI_2', col_map.get('RSI_2', 'RSI_2'))
+        self.panel.add_shifted('prev_SMA_200', col_map.get('SMA_200', 'SMA_200'))
+        self.panel.add_shifted('prev_close', col_map.get('close', 'close'))
+        self.panel.add_shifted('prev_ATR_14', col_map.get('ATR_14', 'ATR_14'))
 
         # Rank Scores: Group by symbol and shift
+        # 對齊到 PanelStore (has_L3_Rank 標記當日是否有分數，對應原本的 inner join)
+        self.rank_dates = set()
         if not self.rank_df.empty:
             self.rank_df['prev_L3_Rank_Score'] = self.rank_df.groupby('symbol')['L3_Rank_Score'].shift(1)
+            prev_rank, has_rank = self.panel.align(self.rank_df['prev_L3_Rank_Score'])
+            self.panel.add_field('prev_L3_Rank_Score', prev_rank)
+            self.panel.add_field('has_L3_Rank', has_rank)
+            self.rank_dates = set(self.rank_df.index.get_level_values('timestamp'))
+
+        # L2 候選只看 T-1 欄位 (與持倉無關)，可一次算好每天的候選，再以 top_k 取每天排序最前的 max_positions 檔
+        # (進場時依序取前 open_slots 個，open_slots <= max_positions)
+        p = self.panel
+        l2 = (p.present & p.active &
+              (p.field('prev_RSI_2') < 10) &
+              (p.field('prev_close') > p.field('prev_SMA_200')))
+        self.has_candidates = l2.any(axis=1)
+        if not self.rank_df.empty:
+            # prev_L3_Rank_Score 由高到低，只保留當日有分數的標的
+            self.l3_top = top_k(prev_rank, max_positions, present=l2 & has_rank)
+        # Fallback 順序：prev_RSI_2 由低到高
+        self.rsi_top = top_k(p.field('prev_RSI_2'), max_positions, ascending=True, present=l2)
 
         # Regime & Breadth: 直接 shift (Time Series)
         self.regime_df['prev_signal'] = self.regime_df['signal'].shift(1)
@@ -62,9 +88,8 @@ class V5_3_Backtester:
         self.equity_curve = []
         self.trade_log = []
         
-        # 4. 準備每日迭代數據
-        self.daily_data = self.stock_df.reorder_levels(['timestamp', 'symbol']).sort_index()
-        self.all_dates = self.daily_data.index.get_level_values('timestamp').unique().sort_values()
+        # 4. 準備每日迭代數據 (PanelStore: 日期 / 標的皆為 O(1) 查詢)
+        self.all_dates = self.panel.active_dates()
 
     def get_market_context(self, date):
         """取得 T-1 的 L1 狀態與市場寬度 (用於 T 日決策)"""
@@ -96,9 +121,8 @@ class V5_3_Backtester:
             trailing_k = 1.5 if breadth < 0.30 else 3.0
             
             # 2. 取得今日 (T) 數據 (用於執行)
-            try:
-                today_bar = self.daily_data.loc[date]
-            except KeyError:
+            today_bar = self.panel.day(date)
+            if today_bar is None:
                 continue
 
             # --- A. L1 混合防禦 (Liquidation) ---
@@ -111,10 +135,10 @@ class V5_3_Backtester:
                 # --- B. L4 動態出場 (Trailing Stop) ---
                 symbols_to_check = list(self.positions.keys())
                 for sym in symbols_to_check:
-                    if sym not in today_bar.index: continue
+                    if sym not in today_bar: continue
                     
                     pos = self.positions[sym]
-                    row = today_bar.loc[sym]
+                    row = today_bar[sym]
                     
                     # 更新最高價 (用 T 日 High)
                     current_high = row['high'] # Lowercase
@@ -144,32 +168,25 @@ class V5_3_Backtester:
         if open_slots <= 0 or self.cash < 1000:
             return
 
-        # 篩選 L2 訊號 (使用 prev_ T-1 欄位)
-        candidates = today_bar[
-            (today_bar['prev_RSI_2'] < 10) & 
-            (today_bar['prev_close'] > today_bar['prev_SMA_200']) 
-        ]
-        
-        if candidates.empty:
+        # L2 訊號 (使用 prev_ T-1 欄位) 已在初始化時對整個 panel 算好
+        p = self.panel
+        i = p.date_index[date]
+        if not self.has_candidates[i]:
             return
 
-        # L3 排序 (使用 prev_L3_Rank_Score)
-        if date in self.rank_df.index.get_level_values('timestamp'):
-            ranks = self.rank_df.xs(date, level='timestamp')
-            # 這裡我們需要 ranks 裡的 prev_L3_Rank_Score
-            # 因為 ranks 是從 self.rank_df (含 prev) 切出來的
-            
-            # 安全合併
-            candidates = candidates.join(ranks[['prev_L3_Rank_Score']], how='inner')
-            candidates = candidates.sort_values('prev_L3_Rank_Score', ascending=False)
+        # L3 排序 (使用 prev_L3_Rank_Score)：每日排序最前的候選已預先算好，依序取前 open_slots 個
+        if date in self.rank_dates:
+            cols, valid = self.l3_top
         else:
             # Fallback
-            candidates = candidates.sort_values('prev_RSI_2', ascending=True)
+            cols, valid = self.rsi_top
 
-        targets = candidates.head(open_slots)
+        targets = cols[i][valid[i]][:open_slots]
 
-        for sym, row in targets.iterrows():
+        for j in targets:
+            sym = p.symbols[j]
             if sym in self.positions: continue
+            row = today_bar[sym]
             
             # T 日開盤買入
             price = row['open'] # Lowercase
@@ -196,8 +213,8 @@ class V5_3_Backtester:
         
         if override_price:
             price = override_price
-        elif sym in today_bar.index:
-            price = today_bar.loc[sym]['open'] # Lowercase
+        elif sym in today_bar:
+            price = today_bar[sym]['open'] # Lowercase
         else:
             price = pos['entry_price']
 
@@ -223,8 +240,8 @@ class V5_3_Backtester:
     def _update_equity(self, date, today_bar):
         curr_eq = self.cash
         for sym, pos in self.positions.items():
-            if sym in today_bar.index:
-                price = today_bar.loc[sym]['close'] # Lowercase
+            if sym in today_bar:
+                price = today_bar[sym]['close'] # Lowercase
                 curr_eq += pos['shares'] * price
             else:
                 curr_eq += pos['shares'] * pos['entry_price']
@@ -239,26 +256,30 @@ def load_track_data(base_dir, track):
     feat_path = os.path.join(track_dir, 'features', 'stock_features.parquet')
     # Signal paths are in data/{track}/signals
     regime_path = os.path.join(track_dir, 'signals', 'regime_signals.parquet')
-    rank_path = os.path.join(track_dir, 'signals', 'l3_rank_scores.csv')
+    rank_path = os.path.join(track_dir, 'signals', 'l3_rank_scores.parquet')
+    legacy_rank_path = os.path.join(track_dir, 'signals', 'l3_rank_scores.csv')  # 舊版 04 輸出
     breadth_path = os.path.join(track_dir, 'features', 'market_breadth.parquet')
     
     if not os.path.exists(feat_path): return None, None, None, None
     
-    stock_df = pd.read_parquet(feat_path)
+    # 特徵檔展開為 PanelStore ({feat_path}.panel/，特徵檔更新時才重建)
+    stock_panel = PanelStore.build_or_open(feat_path)
     regime_df = pd.read_parquet(regime_path)
     breadth_df = pd.read_parquet(breadth_path)
     
     if os.path.exists(rank_path):
-        rank_df = pd.read_csv(rank_path)
+        rank_df = read_compact_parquet(rank_path, compute_dtypes=True)
+    elif os.path.exists(legacy_rank_path):
+        rank_df = pd.read_csv(legacy_rank_path)
         rank_df['timestamp'] = pd.to_datetime(rank_df['timestamp'])
         rank_df = rank_df.set_index(['timestamp', 'symbol'])
     else:
         rank_df = pd.DataFrame()
         
-    return stock_df, regime_df, rank_df, breadth_df
+    return stock_panel, regime_df, rank_df, breadth_df
 
-def filter_tickers(df, tickers):
-    return df[df.index.get_level_values('symbol').isin(tickers)]
+def filter_tickers(panel, tickers):
+    return panel.restrict(tickers)
 
 def main():
     script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -1,10 +1,17 @@
 import pandas as pd
 import numpy as np
 import os
+import sys
 import matplotlib.pyplot as plt
 from data_loader import DataLoader
 from risk_manager import RiskManager
 
+# 共用元件 (repo 根目錄下的 common/)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.cross_rank import top_k
+from common.frame_schema import read_compact_parquet
+from common.panel_store import PanelStore, as_panel
+
 # --- Configuration ---
 INITIAL_CAPITAL = 100_000.0
 MAX_POSITIONS = 5
@@ -21,7 +28,8 @@ class AblationBacktester:
                  force_equal_weight=False
                  ):
         
-        self.stock_df = stock_df.sort_index()
+        # stock_df 可為 PanelStore (各情境共用同一份) 或長表 DataFrame
+        self.panel = as_panel(stock_df)
         self.regime_df = regime_df.sort_index()
         self.rank_df = rank_df.sort_index()
         self.breadth_df = breadth_df.sort_index()
@@ -44,26 +52,44 @@ class AblationBacktester:
         self.equity_curve = []
         self.trade_log = []
         
-        self.daily_data = self.stock_df.reorder_levels(['timestamp', 'symbol']).sort_index()
-        self.all_dates = self.daily_data.index.get_level_values('timestamp').unique().sort_values()
+        self.all_dates = self.panel.active_dates()
 
     def _precalculate_signals(self):
         # Shift logic (Anti-Lookahead)
         cols_to_shift = ['RSI_2', 'SMA_200', 'close', 'ATR_14']
-        col_map = {c: c for c in self.stock_df.columns}
+        col_map = {c: c for c in self.panel.fields}
         for target in cols_to_shift:
-            for c in self.stock_df.columns:
+            for c in self.panel.fields:
                 if c.lower() == target.lower():
                     col_map[target] = c
                     break
         
-        self.stock_df['prev_RSI_2'] = self.stock_df.groupby('symbol')[col_map.get('RSI_2', 'RSI_2')].shift(1)
-        self.stock_df['prev_SMA_200'] = self.stock_df.groupby('symbol')[col_map.get('SMA_200', 'SMA_200')].shift(1)
-        self.stock_df['prev_close'] = self.stock_df.groupby('symbol')[col_map.get('close', 'close')].shift(1)
-        self.stock_df['prev_ATR_14'] = self.stock_df.groupby('symbol')[col_map.get('ATR_14', 'ATR_14')].shift(1)
+        self.panel.add_shifted('prev_RSI_2', col_map.get('RSI_2', 'RSI_2'))
+        self.panel.add_shifted('prev_SMA_200', col_map.get('SMA_200', 'SMA_200'))
+        self.panel.add_shifted('prev_close', col_map.get('close', 'close'))
+        self.panel.add_shifted('prev_ATR_14', col_map.get('ATR_14', 'ATR_14'))
 
+        # 對齊到 PanelStore (has_L3_Rank 標記當日是否有分數，對應原本的 inner join)
+        self.rank_dates = set()
         if not self.rank_df.empty:
             self.rank_df['prev_L3_Rank_Score'] = self.rank_df.groupby('symbol')['L3_Rank_Score'].shift(1)
+            prev_rank, has_rank = self.panel.align(self.rank_df['prev_L3_Rank_Score'])
+            self.panel.add_field('prev_L3_Rank_Score', prev_rank)
+            self.panel.add_field('has_L3_Rank', has_rank)
+            self.rank_dates = set(self.rank_df.index.get_level_values('timestamp'))
+
+        # L2 候選只看 T-1 欄位 (與持倉無關)，可一次算好每天的候選，再以 top_k 取每天排序最前的 max_positions 檔
+        # (進場時依序取前 open_slots 個，open_slots <= max_positions)
+        p = self.panel
+        l2 = (p.present & p.active &
+              (p.field('prev_RSI_2') < 10) &
+              (p.field('prev_close') > p.field('prev_SMA_200')))
+        self.has_candidates = l2.any(axis=1)
+        if not self.rank_df.empty:
+            # prev_L3_Rank_Score 由高到低，只保留當日有分數的標的
+            self.l3_top = top_k(prev_rank, self.max_positions, present=l2 & has_rank)
+        # Fallback 順序：prev_RSI_2 由低到高
+        self.rsi_top = top_k(p.field('prev_RSI_2'), self.max_positions, ascending=True, present=l2)
 
         self.regime_df['prev_signal'] = self.regime_df['signal'].shift(1)
         self.breadth_df['prev_market_breadth'] = self.breadth_df['market_breadth'].shift(1)
@@ -94,9 +120,8 @@ class AblationBacktester:
             regime, breadth = self.get_market_context(date)
             trailing_k = 1.5 if breadth < 0.30 else 3.0
             
-            try:
-                today_bar = self.daily_data.loc[date]
-            except KeyError:
+            today_bar = self.panel.day(date)
+            if today_bar is None:
                 continue
 
             # --- A. L1 Liquidation ---
@@ -108,9 +133,9 @@ class AblationBacktester:
                 # --- B. Exits (L4 or Fixed) ---
                 symbols_to_check = list(self.positions.keys())
                 for sym in symbols_to_check:
-                    if sym not in today_bar.index: continue
+                    if sym not in today_bar: continue
                     pos = self.positions[sym]
-                    row = today_bar.loc[sym]
+                    row = today_bar[sym]
                     
                     pos['days_held'] += 1
                     
@@ -143,27 +168,24 @@ class AblationBacktester:
         if open_slots <= 0 or self.cash < 1000:
             return
 
-        # L2 Signal
-        candidates = today_bar[
-            (today_bar['prev_RSI_2'] < 10) & 
-            (today_bar['prev_close'] > today_bar['prev_SMA_200']) 
-        ]
-        
-        if candidates.empty: return
+        # L2 Signal (已在 _precalculate_signals 對整個 panel 算好)
+        p = self.panel
+        i = p.date_index[date]
+        if not self.has_candidates[i]: return
 
-        # L3 Sorting (Ablation)
-        if self.use_l3 and (date in self.rank_df.index.get_level_values('timestamp')):
-            ranks = self.rank_df.xs(date, level='timestamp')
-            candidates = candidates.join(ranks[['prev_L3_Rank_Score']], how='inner')
-            candidates = candidates.sort_values('prev_L3_Rank_Score', ascending=False)
+        # L3 Sorting (Ablation)：每日排序最前的候選已預先算好，依序取前 open_slots 個
+        if self.use_l3 and (date in self.rank_dates):
+            cols, valid = self.l3_top
         else:
             # Fallback to RSI (V5.1/V5.2 Logic)
-            candidates = candidates.sort_values('prev_RSI_2', ascending=True)
+            cols, valid = self.rsi_top
 
-        targets = candidates.head(open_slots)
+        targets = cols[i][valid[i]][:open_slots]
 
-        for sym, row in targets.iterrows():
+        for j in targets:
+            sym = p.symbols[j]
             if sym in self.positions: continue
+            row = today_bar[sym]
             
             price = row['open']
             atr = row['prev_ATR_14']
@@ -198,8 +220,8 @@ class AblationBacktester:
         
         if override_price:
             price = override_price
-        elif sym in today_bar.index:
-            price = today_bar.loc[sym]['open'] 
+        elif sym in today_bar:
+            price = today_bar[sym]['open'] 
         else:
             price = pos['entry_price']
 
@@ -220,8 +242,8 @@ class AblationBacktester:
     def _update_equity(self, date, today_bar):
         curr_eq = self.cash
         for sym, pos in self.positions.items():
-            if sym in today_bar.index:
-                price = today_bar.loc[sym]['close'] 
+            if sym in today_bar:
+                price = today_bar[sym]['close'] 
                 curr_eq += pos['shares'] * price
             else:
                 curr_eq += pos['shares'] * pos['entry_price']
@@ -232,16 +254,19 @@ def load_data(base_dir, track='custom'):
     track_dir = os.path.join(base_dir, 'data', track)
     feat_path = os.path.join(track_dir, 'features', 'stock_features.parquet')
     regime_path = os.path.join(track_dir, 'signals', 'regime_signals.parquet')
-    rank_path = os.path.join(track_dir, 'signals', 'l3_rank_scores.csv')
+    rank_path = os.path.join(track_dir, 'signals', 'l3_rank_scores.parquet')
+    legacy_rank_path = os.path.join(track_dir, 'signals', 'l3_rank_scores.csv')  # 舊版 04 輸出
     breadth_path = os.path.join(track_dir, 'features', 'market_breadth.parquet')
     
     if not os.path.exists(feat_path): return None, None, None, None
-    stock = pd.read_parquet(feat_path)
+    stock = PanelStore.build_or_open(feat_path)
     regime = pd.read_parquet(regime_path)
     breadth = pd.read_parquet(breadth_path)
     rank = pd.DataFrame()
     if os.path.exists(rank_path):
-        rank = pd.read_csv(rank_path)
+        rank = read_compact_parquet(rank_path, compute_dtypes=True)
+    elif os.path.exists(legacy_rank_path):
+        rank = pd.read_csv(legacy_rank_path)
         rank['timestamp'] = pd.to_datetime(rank['timestamp'])
         rank = rank.set_index(['timestamp', 'symbol'])
     return stock, regime, rank, breadth
@@ -249,7 +274,7 @@ def load_data(base_dir, track='custom'):
 def load_spy_benchmark(base_dir, track='custom'):
     market_path = os.path.join(base_dir, 'data', track, 'market_indicators.parquet')
     if not os.path.exists(market_path): return pd.Series()
-    df = pd.read_parquet(market_path).reset_index()
+    df = read_compact_parquet(market_path, compute_dtypes=True).reset_index()
     
     if 'symbol' in df.columns:
         spy_df = df[df['symbol'].str.upper() == 'SPY'].copy()
@@ -261,8 +286,8 @@ def load_spy_benchmark(base_dir, track='custom'):
     price = spy_df['close']
     return (price / price.iloc[0]) * INITIAL_CAPITAL
 
-def filter_tickers(df, tickers):
-    return df[df.index.get_level_values('symbol').isin(tickers)]
+def filter_tickers(panel, tickers):
+    return panel.restrict(tickers)
 
 def calculate_metrics(curve):
     if curve.empty: return {}
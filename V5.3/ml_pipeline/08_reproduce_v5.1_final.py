@@ -1,11 +1,16 @@
 import pandas as pd
 import numpy as np
 import os
+import sys
 import matplotlib.pyplot as plt
-import yfinance as yf
-from data_loader import DataLoader
+from data_loader import DataLoader, load_features
 from backtesting_utils import analyze_performance
 
+# 共用元件 (repo 根目錄下的 common/)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.data_provider import get_provider
+from common.panel_store import as_panel
+
 # --- 設定：2025 專屬回測 ---
 START_DATE = '2025-01-01'
 CONFIG = {
@@ -16,31 +21,20 @@ CONFIG = {
     'transaction_cost': 0.0005   # 交易成本 5bps
 }
 
-def load_data(base_dir, track='custom'):
-    features_path = os.path.join(base_dir, 'data', track, 'features', 'stock_features.parquet')
-    if not os.path.exists(features_path):
-        print(f"[Error] Data not found at {features_path}")
-        return None
-    print(f"Loading features from {features_path}...")
-    df = pd.read_parquet(features_path)
-    return df.sort_index()
+# 回測只用到這幾個欄位；T-1 訊號需要起始日前一根 K 棒，因此多讀一小段緩衝
+FEATURE_COLUMNS = ['open', 'close', 'RSI_2', 'SMA_200']
+LOOKBACK_BUFFER = pd.Timedelta(days=14)
 
-def filter_data_by_tickers(df, tickers):
-    """篩選出指定清單的數據 (支援 MultiIndex)"""
-    if 'symbol' in df.index.names:
-        valid_tickers = set(df.index.get_level_values('symbol').unique())
-        target_tickers = [t for t in tickers if t in valid_tickers]
-        return df[df.index.get_level_values('symbol').isin(target_tickers)].copy()
-    elif 'symbol' in df.columns:
-        valid_tickers = set(df['symbol'].unique())
-        target_tickers = [t for t in tickers if t in valid_tickers]
-        return df[df['symbol'].isin(target_tickers)].copy()
-    return pd.DataFrame()
+def load_data(base_dir, track='custom', tickers=None, start=None, end=None):
+    """只讀取回測需要的欄位、標的與日期區間 (projection / predicate pushdown)"""
+    if start is not None:
+        start = pd.Timestamp(start) - LOOKBACK_BUFFER
+    return load_features(track, columns=FEATURE_COLUMNS, start=start, end=end, symbols=tickers, base_dir=base_dir)
 
 def get_spy_benchmark(start_date, end_date, initial_capital):
     """下載並計算 SPY 同期績效"""
     print(f"Downloading SPY Benchmark ({start_date} - {end_date})...")
-    spy = yf.download("SPY", start=start_date, end=end_date, interval="1d", auto_adjust=True, progress=False)
+    spy = get_provider().download(["SPY"], start=start_date, end=end_date, interval="1d").get("SPY", pd.DataFrame())
     
     if spy.empty: return pd.Series()
     
@@ -61,23 +55,22 @@ def run_strict_hold_backtest(df, config):
     """V5.1 極簡回測邏輯 (Strict Time Stop)"""
     print(f"Running Strict Hold Backtest (From {START_DATE})...")
     
+    panel = as_panel(df)
+
     # 1. 預先計算 T-1 訊號
-    df['prev_RSI_2'] = df.groupby(level='symbol')['RSI_2'].shift(1)
-    df['prev_SMA_200'] = df.groupby(level='symbol')['SMA_200'].shift(1)
-    df['prev_close'] = df.groupby(level='symbol')['close'].shift(1)
+    prev_rsi = panel.add_shifted('prev_RSI_2', 'RSI_2')
+    prev_sma = panel.add_shifted('prev_SMA_200', 'SMA_200')
+    prev_close = panel.add_shifted('prev_close', 'close')
     
     # 進場訊號
-    df['entry_signal'] = (df['prev_RSI_2'] < 10) & (df['prev_close'] > df['prev_SMA_200'])
+    panel.add_field('entry_signal', (prev_rsi < 10) & (prev_close > prev_sma))
     
     # 2. 時間過濾 (只保留 2025 之後的數據)
-    df = df[df.index.get_level_values('timestamp') >= pd.Timestamp(START_DATE)]
+    all_dates = panel.active_dates(start=START_DATE)
     
-    if df.empty:
+    if all_dates.empty:
         print("[Error] No data found after start date.")
         return pd.DataFrame(), pd.DataFrame()
-
-    daily_data = df.reorder_levels(['timestamp', 'symbol']).sort_index()
-    all_dates = daily_data.index.get_level_values('timestamp').unique().sort_values()
     
     cash = config['initial_capital']
     positions = {} 
@@ -89,9 +82,8 @@ def run_strict_hold_backtest(df, config):
     max_pos = config['max_positions']
 
     for date in all_dates:
-        try:
-            today_bar = daily_data.loc[date]
-        except KeyError:
+        today_bar = panel.day(date)
+        if today_bar is None:
             continue
             
         # --- A. 出場 (Time Exit) ---
@@ -99,8 +91,8 @@ def run_strict_hold_backtest(df, config):
         for sym, pos in positions.items():
             pos['days_held'] += 1
             if pos['days_held'] >= config['hold_days']:
-                if sym in today_bar.index:
-                    price = today_bar.loc[sym]['open']
+                if sym in today_bar:
+                    price = today_bar[sym]['open']
                     shares = pos['shares']
                     value = shares * price * (1 - slippage)
                     net_proceeds = value - (value * cost_rate)
@@ -118,8 +110,8 @@ def run_strict_hold_backtest(df, config):
         # --- B. 權益更新 ---
         curr_equity = cash
         for sym, pos in positions.items():
-            if sym in today_bar.index:
-                price = today_bar.loc[sym]['close']
+            if sym in today_bar:
+                price = today_bar[sym]['close']
                 curr_equity += pos['shares'] * price
             else:
                 curr_equity += pos['shares'] * pos['entry_price']
@@ -128,7 +120,8 @@ def run_strict_hold_backtest(df, config):
         # --- C. 進場 (Equal Weight) ---
         open_slots = max_pos - len(positions)
         if open_slots > 0:
-            candidates = today_bar[today_bar['entry_signal']]
+            bars = today_bar.frame()
+            candidates = bars[bars['entry_signal']]
             if not candidates.empty:
                 candidates = candidates.sort_values('prev_RSI_2', ascending=True)
                 target_per_trade = curr_equity / max_pos
@@ -169,13 +162,12 @@ def main():
     loader = DataLoader(SCRIPT_DIR, normal_file='final_asset_pool.json', toxic_file='final_toxic_asset_pool.json')
     target_tickers = loader.get_all_tickers()
     
-    # 2. 載入與篩選數據
-    df = load_data(SCRIPT_DIR, track='custom')
+    # 2. 載入數據 (只讀 START_DATE 之後、Final Pool 標的的必要欄位)
+    df = load_data(SCRIPT_DIR, track='custom', tickers=target_tickers, start=START_DATE)
     if df is None: return
-    df_subset = filter_data_by_tickers(df, target_tickers)
     
     # 3. 執行策略回測
-    equity, trades = run_strict_hold_backtest(df_subset, CONFIG)
+    equity, trades = run_strict_hold_backtest(df, CONFIG)
     
     if not equity.empty:
         # 4. 取得 SPY 基準
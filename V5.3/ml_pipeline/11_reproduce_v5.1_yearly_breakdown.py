@@ -1,11 +1,16 @@
 import pandas as pd
 import numpy as np
 import os
+import sys
 import matplotlib.pyplot as plt
-import yfinance as yf
-from data_loader import DataLoader
+from data_loader import DataLoader, load_features
 from backtesting_utils import analyze_performance
 
+# 共用元件 (repo 根目錄下的 common/)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.data_provider import get_provider
+from common.panel_store import as_panel
+
 # --- 基礎設定 ---
 CONFIG = {
     'initial_capital': 100_000.0,
@@ -15,30 +20,20 @@ CONFIG = {
     'transaction_cost': 0.0005   # 交易成本 5bps
 }
 
-def load_data(base_dir, track='custom'):
-    features_path = os.path.join(base_dir, 'data', track, 'features', 'stock_features.parquet')
-    if not os.path.exists(features_path):
-        print(f"[Error] Data not found at {features_path}")
-        return None
-    print(f"Loading features from {features_path}...")
-    df = pd.read_parquet(features_path)
-    return df.sort_index()
+# 回測只用到這幾個欄位；T-1 訊號需要起始日前一根 K 棒，因此多讀一小段緩衝
+FEATURE_COLUMNS = ['open', 'close', 'RSI_2', 'SMA_200']
+LOOKBACK_BUFFER = pd.Timedelta(days=14)
 
-def filter_data_by_tickers(df, tickers):
-    if 'symbol' in df.index.names:
-        valid_tickers = set(df.index.get_level_values('symbol').unique())
-        target_tickers = [t for t in tickers if t in valid_tickers]
-        return df[df.index.get_level_values('symbol').isin(target_tickers)].copy()
-    elif 'symbol' in df.columns:
-        valid_tickers = set(df['symbol'].unique())
-        target_tickers = [t for t in tickers if t in valid_tickers]
-        return df[df['symbol'].isin(target_tickers)].copy()
-    return pd.DataFrame()
+def load_data(base_dir, track='custom', tickers=None, start=None, end=None):
+    """只讀取回測需要的欄位、標的與日期區間 (projection / predicate pushdown)"""
+    if start is not None:
+        start = pd.Timestamp(start) - LOOKBACK_BUFFER
+    return load_features(track, columns=FEATURE_COLUMNS, start=start, end=end, symbols=tickers, base_dir=base_dir)
 
 def get_spy_benchmark(start_date, end_date, initial_capital):
     print(f"  Downloading SPY Benchmark ({start_date.date()} - {end_date.date()})...")
     # yfinance 只能下載到最新日期，如果 end_date 是過去，需要切片
-    spy = yf.download("SPY", start=start_date, end=end_date + pd.Timedelta(days=5), interval="1d", auto_adjust=True, progress=False)
+    spy = get_provider().download(["SPY"], start=start_date, end=end_date + pd.Timedelta(days=5), interval="1d").get("SPY", pd.DataFrame())
     
     if spy.empty: return pd.Series()
     
@@ -69,26 +64,21 @@ def run_backtest_for_period(df, start_date, end_date, config, year_label):
     print(f"\n--- Processing Year: {year_label} ({start_date.date()} to {end_date.date()}) ---")
     
     # 1. 預先計算 T-1 訊號 (在全量數據上計算，確保邊界日的 T-1 數據存在)
-    # 為了避免 SettingWithCopyWarning，先 copy
-    df = df.copy()
-    df['prev_RSI_2'] = df.groupby(level='symbol')['RSI_2'].shift(1)
-    df['prev_SMA_200'] = df.groupby(level='symbol')['SMA_200'].shift(1)
-    df['prev_close'] = df.groupby(level='symbol')['close'].shift(1)
+    # (as_panel 產生獨立的 view，prev_ 欄位不會寫回共用的 PanelStore)
+    panel = as_panel(df)
+    prev_rsi = panel.add_shifted('prev_RSI_2', 'RSI_2')
+    prev_sma = panel.add_shifted('prev_SMA_200', 'SMA_200')
+    prev_close = panel.add_shifted('prev_close', 'close')
     
     # 進場訊號
-    df['entry_signal'] = (df['prev_RSI_2'] < 10) & (df['prev_close'] > df['prev_SMA_200'])
+    panel.add_field('entry_signal', (prev_rsi < 10) & (prev_close > prev_sma))
     
     # 2. 時間切片 (Slice)
-    mask = (df.index.get_level_values('timestamp') >= start_date) & \
-           (df.index.get_level_values('timestamp') <= end_date)
-    period_df = df[mask].copy()
+    all_dates = panel.active_dates(start=start_date, end=end_date)
     
-    if period_df.empty:
+    if all_dates.empty:
         print(f"[Warning] No data found for {year_label}.")
         return pd.Series(), [], {}
-
-    daily_data = period_df.reorder_levels(['timestamp', 'symbol']).sort_index()
-    all_dates = daily_data.index.get_level_values('timestamp').unique().sort_values()
     
     # 3. 初始化回測變數 (資金重置)
     cash = config['initial_capital']
@@ -102,9 +92,8 @@ def run_backtest_for_period(df, start_date, end_date, config, year_label):
 
     # 4. 回測迴圈
     for date in all_dates:
-        try:
-            today_bar = daily_data.loc[date]
-        except KeyError:
+        today_bar = panel.day(date)
+        if today_bar is None:
             continue
             
         # --- A. 出場 (Time Exit) ---
@@ -112,8 +101,8 @@ def run_backtest_for_period(df, start_date, end_date, config, year_label):
         for sym, pos in positions.items():
             pos['days_held'] += 1
             if pos['days_held'] >= config['hold_days']:
-                if sym in today_bar.index:
-                    price = today_bar.loc[sym]['open']
+                if sym in today_bar:
+                    price = today_bar[sym]['open']
                     shares = pos['shares']
                     value = shares * price * (1 - slippage)
                     net_proceeds = value - (value * cost_rate)
@@ -131,8 +120,8 @@ def run_backtest_for_period(df, start_date, end_date, config, year_label):
         # --- B. 權益更新 ---
         curr_equity = cash
         for sym, pos in positions.items():
-            if sym in today_bar.index:
-                price = today_bar.loc[sym]['close']
+            if sym in today_bar:
+                price = today_bar[sym]['close']
                 curr_equity += pos['shares'] * price
             else:
                 curr_equity += pos['shares'] * pos['entry_price']
@@ -141,7 +130,8 @@ def run_backtest_for_period(df, start_date, end_date, config, year_label):
         # --- C. 進場 (Equal Weight) ---
         open_slots = max_pos - len(positions)
         if open_slots > 0:
-            candidates = today_bar[today_bar['entry_signal']]
+            bars = today_bar.frame()
+            candidates = bars[bars['entry_signal']]
             if not candidates.empty:
                 candidates = candidates.sort_values('prev_RSI_2', ascending=True)
                 target_per_trade = curr_equity / max_pos
@@ -202,12 +192,7 @@ def main():
     loader = DataLoader(SCRIPT_DIR, normal_file='final_asset_pool.json', toxic_file='final_toxic_asset_pool.json')
     target_tickers = loader.get_all_tickers()
     
-    # 2. 載入數據
-    df = load_data(SCRIPT_DIR, track='custom')
-    if df is None: return
-    df_subset = filter_data_by_tickers(df, target_tickers)
-    
-    # 3. 定義年份區間
+    # 2. 定義年份區間
     periods = [
         {'label': '2024 Full Year', 'start': pd.Timestamp('2024-01-01'), 'end': pd.Timestamp('2024-12-31')},
         {'label': '2025 YTD',       'start': pd.Timestamp('2025-01-01'), 'end': pd.Timestamp('2025-12-31')} # 到最新數據
@@ -216,8 +201,10 @@ def main():
     summary_list = []
 
     for p in periods:
-        # A. 執行策略
-        equity, trades, met = run_backtest_for_period(df_subset, p['start'], p['end'], CONFIG, p['label'])
+        # A. 載入該年度數據 (只讀必要欄位與該年度的 row groups) 並執行策略
+        df = load_data(SCRIPT_DIR, track='custom', tickers=target_tickers, start=p['start'], end=p['end'])
+        if df is None: return
+        equity, trades, met = run_backtest_for_period(df, p['start'], p['end'], CONFIG, p['label'])
         
         if not equity.empty:
             # B. 執行 SPY 基準
@@ -260,7 +247,7 @@ def main():
         else:
             print(f"  [Info] No trades for {p['label']}")
 
-    # 4. 輸出總表
+    # 3. 輸出總表
     if summary_list:
         res_df = pd.DataFrame(summary_list)
         print("\n" + "="*80)
@@ -1,5 +1,10 @@
 import json
 import os
+import sys
+
+# 共用元件 (repo 根目錄下的 common/)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.frame_schema import read_features
 
 class DataLoader:
     """
@@ -54,6 +59,20 @@ class DataLoader:
             
         return cleaned_list
 
+def load_features(track='custom', columns=None, start=None, end=None, symbols=None, base_dir=None):
+    """
+    讀取 data/{track}/features/stock_features.parquet 的子集 (欄位投影 + 日期 / 標的過濾下推至 Parquet)。
+    start / end 皆含；回傳 (timestamp, symbol) 索引、float64 欄位的 DataFrame，檔案不存在時回傳 None。
+    """
+    if base_dir is None:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+    path = os.path.join(base_dir, 'data', track, 'features', 'stock_features.parquet')
+    if not os.path.exists(path):
+        print(f"[Error] Data not found at {path}")
+        return None
+    print(f"[DataLoader] Loading features from {path} (columns={columns}, {start} ~ {end})...")
+    return read_features(path, columns=columns, start=start, end=end, symbols=symbols)
+
 # 簡單測試用
 if __name__ == "__main__":
     loader = DataLoader()
@@ -1,12 +1,16 @@
+import os
+import sys
 import json
-import time
 import re
 import pandas as pd
 import numpy as np
-import yfinance as yf
-from tqdm import tqdm
 import config
 
+# 共用元件 (repo 根目錄下的 common/)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.bar_store import BarStore
+from common.fetcher import concurrent_downloader, tqdm_progress
+
 def load_tickers_from_json(file_path):
     """讀取 JSON 並移除交易所前綴"""
     try:
@@ -19,32 +23,26 @@ def load_tickers_from_json(file_path):
         return []
 
 def fetch_data(tickers):
-    """下載 OHLC 資料並處理 MultiIndex"""
-    data_dict = {}
+    """
+    下載 OHLC 資料 (auto_adjust=True 還原股價)。
+    透過共用 BarStore 本地快取：只下載尚未覆蓋的日期區間，其餘直接讀取本地 Parquet。
+    缺漏部分以並行 + token bucket 限速逐檔下載 (取代舊版 time.sleep 序列迴圈)。
+    """
     print(f"Fetching data for {len(tickers)} tickers...")
-    
-    for ticker in tqdm(tickers):
-        try:
-            time.sleep(config.REQUEST_DELAY)
-            df = yf.download(
-                ticker, 
-                start=config.START_DATE, 
-                end=config.END_DATE, 
-                auto_adjust=True, 
-                progress=False
-            )
-            
-            if isinstance(df.columns, pd.MultiIndex):
-                df.columns = df.columns.get_level_values(0)
+    downloader = concurrent_downloader(
+        max_workers=config.MAX_WORKERS,
+        rate=config.REQUESTS_PER_SECOND,
+        max_retries=config.MAX_RETRIES,
+        progress=tqdm_progress('Downloading')
+    )
+    bars = BarStore(downloader=downloader).get_bars(tickers, config.START_DATE, config.END_DATE, interval='1d')
 
-            if not df.empty and 'Open' in df.columns and 'Close' in df.columns:
-                data_dict[ticker] = df
-            else:
-                pass 
-                # print(f"[Warning] {ticker} missing data.")
-        except Exception as e:
-            print(f"[Error] Failed to fetch {ticker}: {e}")
-            
+    data_dict = {}
+    for ticker, df in bars.items():
+        if 'Open' in df.columns and 'Close' in df.columns:
+            data_dict[ticker] = df
+        else:
+            print(f"[Warning] {ticker} missing Open/Close columns.")
     return data_dict
 
 def calculate_rsi(series, period=2):
@@ -1,12 +1,16 @@
+import os
+import sys
 import json
-import time
 import re
 import pandas as pd
 import numpy as np
-import yfinance as yf
-from tqdm import tqdm
 import config
 
+# 共用元件 (repo 根目錄下的 common/)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.bar_store import BarStore
+from common.fetcher import concurrent_downloader, tqdm_progress
+
 def load_tickers_from_json(file_path):
     """讀取 JSON 並移除交易所前綴 (如 NASDAQ:TSLA -> TSLA)"""
     try:
@@ -23,40 +27,25 @@ def load_tickers_from_json(file_path):
 
 def fetch_data(tickers):
     """
-    下載 OHLC 資料。
-    使用 auto_adjust=True 還原除權息價格，確保報酬率計算正確。
-    並針對 yfinance 可能回傳 MultiIndex 的問題進行修復。
+    下載 OHLC 資料 (auto_adjust=True 還原股價)。
+    透過共用 BarStore 本地快取：只下載尚未覆蓋的日期區間，其餘直接讀取本地 Parquet。
+    缺漏部分以並行 + token bucket 限速逐檔下載 (取代舊版 time.sleep 序列迴圈)。
     """
-    data_dict = {}
     print(f"Fetching data for {len(tickers)} tickers...")
-    
-    for ticker in tqdm(tickers):
-        try:
-            # 加入延遲避免 Rate Limit
-            time.sleep(config.REQUEST_DELAY)
-            
-            df = yf.download(
-                ticker, 
-                start=config.START_DATE, 
-                end=config.END_DATE, 
-                auto_adjust=True,  # 關鍵：使用還原股價
-                progress=False
-            )
-            
-            # --- [Fix] 處理 yfinance 回傳 MultiIndex 欄位的問題 ---
-            if isinstance(df.columns, pd.MultiIndex):
-                # 如果欄位是 ('Open', 'TSLA') 這種格式，取第一層 ('Open')
-                df.columns = df.columns.get_level_values(0)
+    downloader = concurrent_downloader(
+        max_workers=config.MAX_WORKERS,
+        rate=config.REQUESTS_PER_SECOND,
+        max_retries=config.MAX_RETRIES,
+        progress=tqdm_progress('Downloading')
+    )
+    bars = BarStore(downloader=downloader).get_bars(tickers, config.START_DATE, config.END_DATE, interval='1d')
 
-            if not df.empty:
-                # 簡單的資料檢查 (確保扁平化後有 Open/Close)
-                if 'Open' in df.columns and 'Close' in df.columns:
-                    data_dict[ticker] = df
-                else:
-                    print(f"[Warning] {ticker} missing Open/Close columns after download.")
-        except Exception as e:
-            print(f"[Error] Failed to fetch {ticker}: {e}")
-            
+    data_dict = {}
+    for ticker, df in bars.items():
+        if 'Open' in df.columns and 'Close' in df.columns:
+            data_dict[ticker] = df
+        else:
+            print(f"[Warning] {ticker} missing Open/Close columns.")
     return data_dict
 
 def calculate_decomposed_returns(df):
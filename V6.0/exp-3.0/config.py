@@ -24,4 +24,6 @@ RISK_FREE_RATE = 0.04    # 用於計算夏普比率 (4%)
 BENCHMARK_TICKER = ['SPY'] 
 
 # --- 下載設定 ---
-REQUEST_DELAY = 1.0  # 避免觸發 Rate Limit 的延遲秒數 (1秒)
+MAX_WORKERS = 8            # 同時進行中的下載請求數
+REQUESTS_PER_SECOND = 4.0  # Token bucket 速率上限，避免觸發 Rate Limit
+MAX_RETRIES = 3            # 單一標的失敗 (含 429) 的重試次數，退避含 jitter
@@ -9,8 +9,6 @@ from datetime import datetime, timedelta
 
 import pandas as pd
 import numpy as np
-import yfinance as yf
-import pandas_ta as ta
 import xgboost as xgb
 from pandas.tseries.holiday import USFederalHolidayCalendar
 from pandas.tseries.offsets import CustomBusinessDay
@@ -23,9 +21,17 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 RESOURCE_DIR = os.path.join(BASE_DIR, '..', 'resource')
 OUTPUT_DIR = os.path.join(BASE_DIR, 'output')
 MODEL_PATH = os.path.join(OUTPUT_DIR, 'exp_07_model.joblib')
+# 日線指標的增量狀態 (兩支 generator 共用)
+STATE_PATH = os.path.join(OUTPUT_DIR, 'daily_indicator_state.json')
 
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# 共用元件 (repo 根目錄下的 common/)
+sys.path.append(os.path.join(BASE_DIR, '..', '..'))
+from common.bar_store import to_wide
+from common.data_provider import get_provider
+from common.indicator_state import IndicatorStateStore
+
 # [修改點 1] 指定讀取 Holding Pool
 TARGET_POOL_FILE = '2025_holding_asset_pool.json'
 
@@ -59,31 +65,29 @@ def get_calendar_status():
 
 def get_current_vix():
     try:
-        df = yf.download("^VIX", period="5d", interval="1d", progress=False)
+        df = get_provider().download(["^VIX"], period="5d", interval="1d")["^VIX"]
         return float(df['Close'].iloc[-1])
     except:
         return 20.0
 
-def download_data(tickers):
-    # 下載足夠的歷史數據以計算 RSI(14)
-    data = yf.download(tickers, period="3mo", interval="1d", progress=False, auto_adjust=True, threads=True)
+def download_data(tickers, store):
+    # 資料來源由 DATA_PROVIDER 決定 (yfinance / replay)
+    provider = get_provider()
+    # 日線指標改為增量狀態 (common.indicator_state)：只下載各標的上次之後的 K 棒，首次執行才抓完整歷史
+    partial = store.refresh(provider, tickers)
+    store.save()
     
     # 取得最新盤前/盤中數據 (1m) 用於計算即時 Gap/Fade
-    intra = yf.download(tickers, period="5d", interval="1m", prepost=True, progress=False, auto_adjust=True, threads=True)
+    intra = to_wide(provider.download(tickers, period="5d", interval="1m", prepost=True))
     
-    return data, intra
+    return partial, intra
 
-def calculate_metrics(ticker, df_daily, df_intra, vix_val):
-    """計算所有欄位所需的數值"""
+def calculate_metrics(ticker, snap, df_intra, vix_val):
+    """計算所有欄位所需的數值 (snap = IndicatorStateStore.snapshot())"""
     try:
-        # 強制轉數值
-        for c in ['Open', 'High', 'Low', 'Close', 'Volume']:
-            df_daily[c] = pd.to_numeric(df_daily[c], errors='coerce')
-        
-        df_daily = df_daily.dropna()
-        if len(df_daily) < 20: return None
+        if snap is None or snap['n_bars'] < 20: return None
 
-        prev_close = float(df_daily['Close'].iloc[-1])
+        prev_close = float(snap['close'])
         
         # 取得即時價格 (Intraday Last) & 盤前高點 (Pre-Market High)
         curr_price = prev_close
@@ -102,7 +106,7 @@ def calculate_metrics(ticker, df_daily, df_intra, vix_val):
 
         # 1. 基礎指標
         gap_pct = (curr_price - prev_close) / prev_close
-        atr = ta.atr(df_daily['High'], df_daily['Low'], df_daily['Close'], length=14).iloc[-1]
+        atr = snap['atr']
         atr_pct = atr / prev_close
         
         # Fade% = (High - Curr) / High (僅在 Gap Up 時有意義，但也算出數值)
@@ -111,10 +115,10 @@ def calculate_metrics(ticker, df_daily, df_intra, vix_val):
             fade_pct = (pre_high - curr_price) / pre_high
 
         # 2. AI 特徵 (Exp-07)
-        rsi = ta.rsi(df_daily['Close'], length=14).iloc[-1]
+        rsi = snap['rsi']
         
-        vol_ma20 = df_daily['Volume'].rolling(20).mean().iloc[-2] # T-1 的 MA
-        vol_last = df_daily['Volume'].iloc[-1]
+        vol_ma20 = snap['vol_ma_prev'] # T-1 的 MA
+        vol_last = snap['volume']
         vol_ratio = vol_last / vol_ma20 if vol_ma20 > 0 else 1.0
         
         features = pd.DataFrame([[rsi, atr_pct, vol_ratio, gap_pct, vix_val]], 
@@ -156,25 +160,15 @@ def generate_report():
     
     # 3. 下載數據
     print(f"[{datetime.now().strftime('%H:%M:%S')}] 正在下載 {len(tickers)} 檔股票數據...")
-    daily_data, intra_data = download_data(tickers)
-    
-    # 4. 處理 Single/Multi Index
-    if isinstance(daily_data.columns, pd.MultiIndex):
-        daily_data = daily_data.stack(level=1, future_stack=True).rename_axis(['Date', 'Ticker']).reset_index()
-    else:
-        daily_data['Ticker'] = tickers[0]
-        daily_data = daily_data.reset_index()
-
-    # 轉成 Dict 方便存取
-    daily_map = {t: g.set_index('Date') for t, g in daily_data.groupby('Ticker')}
+    store = IndicatorStateStore(STATE_PATH)
+    partial_bars, intra_data = download_data(tickers, store)
     
     results = []
     
-    # 5. 計算 Loop
+    # 4. 計算 Loop
     for t in tickers:
-        if t not in daily_map: continue
-        
-        metrics = calculate_metrics(t, daily_map[t], intra_data, curr_vix)
+        snap = store.snapshot(t, partial_bars.get(t))
+        metrics = calculate_metrics(t, snap, intra_data, curr_vix)
         if not metrics: continue
         
         gap = metrics['gap_pct']
@@ -220,7 +214,7 @@ def generate_report():
             'Decision': ai_dec
         })
 
-    # 6. 排序與列印
+    # 5. 排序與列印
     results.sort(key=lambda x: x['Gap%'], reverse=True)
     
     print("\n" + "=" * 115)
@@ -245,4 +239,6 @@ def generate_report():
     print(f"\n[Saved] {csv_path}")
 
 if __name__ == '__main__':
-    generate_report()
\ No newline at end of file
+    t_start = time.perf_counter()
+    generate_report()
+    print(get_provider().timing_summary(time.perf_counter() - t_start))
\ No newline at end of file
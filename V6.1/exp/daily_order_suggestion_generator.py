@@ -9,8 +9,6 @@ from datetime import datetime, timedelta
 
 import pandas as pd
 import numpy as np
-import yfinance as yf
-import pandas_ta as ta
 
 # --- 設定 ---
 warnings.filterwarnings('ignore')
@@ -20,9 +18,17 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 RESOURCE_DIR = os.path.join(BASE_DIR, '..', 'resource')
 OUTPUT_DIR = os.path.join(BASE_DIR, 'output')
 MODEL_PATH = os.path.join(OUTPUT_DIR, 'exp_07_model.joblib')
+# 日線指標的增量狀態 (兩支 generator 共用；manual_gap_signal.yaml 以 actions/cache 跨次保存)
+STATE_PATH = os.path.join(OUTPUT_DIR, 'daily_indicator_state.json')
 
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# 共用元件 (repo 根目錄下的 common/)
+sys.path.append(os.path.join(BASE_DIR, '..', '..'))
+from common.bar_store import to_wide
+from common.data_provider import get_provider
+from common.indicator_state import IndicatorStateStore
+
 # 指定讀取 Holding Pool
 TARGET_POOL_FILE = '2025_holding_asset_pool.json'
 
@@ -54,29 +60,27 @@ def get_calendar_status():
 
 def get_current_vix():
     try:
-        df = yf.download("^VIX", period="5d", interval="1d", progress=False)
+        df = get_provider().download(["^VIX"], period="5d", interval="1d")["^VIX"]
         return float(df['Close'].iloc[-1])
     except:
         return 20.0
 
-def download_data(tickers):
-    # 下載日線 (計算 ATR, RSI, 昨收)
-    data = yf.download(tickers, period="1mo", interval="1d", progress=False, auto_adjust=True, threads=True)
+def download_data(tickers, store):
+    # 資料來源由 DATA_PROVIDER 決定 (yfinance / replay)
+    provider = get_provider()
+    # 日線 (ATR, RSI, 昨收) 改為增量狀態 (common.indicator_state)：只下載各標的上次之後的 K 棒
+    partial = store.refresh(provider, tickers)
+    store.save()
     # 下載盤前數據 (檢查是否 Hit)
-    intra = yf.download(tickers, period="5d", interval="5m", prepost=True, progress=False, auto_adjust=True, threads=True)
-    return data, intra
+    intra = to_wide(provider.download(tickers, period="5d", interval="5m", prepost=True))
+    return partial, intra
 
-def calculate_metrics(ticker, df_daily, df_intra, vix_val):
-    """計算所有顯示欄位"""
+def calculate_metrics(ticker, snap, df_intra, vix_val):
+    """計算所有顯示欄位 (snap = IndicatorStateStore.snapshot())"""
     try:
-        for c in ['Open', 'High', 'Low', 'Close', 'Volume']:
-            if c in df_daily.columns:
-                df_daily[c] = pd.to_numeric(df_daily[c], errors='coerce')
-        
-        df_daily = df_daily.dropna()
-        if len(df_daily) < 5: return None
+        if snap is None or snap['n_bars'] < 5: return None
 
-        prev_close = float(df_daily['Close'].iloc[-1])
+        prev_close = float(snap['close'])
         target_price = prev_close * (1 + TAKE_PROFIT_PCT)
         
         # 取得即時價格 & 盤前高點
@@ -97,7 +101,8 @@ def calculate_metrics(ticker, df_daily, df_intra, vix_val):
 
         # 基礎指標
         gap_pct = (curr_price - prev_close) / prev_close
-        atr = ta.atr(df_daily['High'], df_daily['Low'], df_daily['Close'], length=14).iloc[-1]
+        atr = snap['atr']
+        if pd.isna(atr): return None  # 不足 15 根 K 棒 (原本 ta.atr 回傳 None)
         atr_pct = atr / prev_close
         
         # Fade% (回吐幅度)
@@ -115,9 +120,9 @@ def calculate_metrics(ticker, df_daily, df_intra, vix_val):
              status = "Weak"
         
         # AI 特徵
-        rsi = ta.rsi(df_daily['Close'], length=14).iloc[-1]
-        vol_ma20 = df_daily['Volume'].rolling(20).mean().iloc[-2]
-        vol_ratio = df_daily['Volume'].iloc[-1] / vol_ma20 if vol_ma20 > 0 else 1.0
+        rsi = snap['rsi']
+        vol_ma20 = snap['vol_ma_prev']
+        vol_ratio = snap['volume'] / vol_ma20 if vol_ma20 > 0 else 1.0
         
         features = pd.DataFrame([[rsi, atr_pct, vol_ratio, gap_pct, vix_val]], 
                                 columns=['RSI_14', 'ATR_Pct', 'Vol_Ratio', 'Gap_Pct', 'VIX'])
@@ -160,23 +165,15 @@ def generate_report():
     
     # 3. 下載數據
     print(f"[{datetime.now().strftime('%H:%M:%S')}] 正在下載 {len(tickers)} 檔股票數據...")
-    daily_data, intra_data = download_data(tickers)
-    
-    if isinstance(daily_data.columns, pd.MultiIndex):
-        daily_data = daily_data.stack(level=1, future_stack=True).rename_axis(['Date', 'Ticker']).reset_index()
-    else:
-        daily_data['Ticker'] = tickers[0]
-        daily_data = daily_data.reset_index()
-
-    daily_map = {t: g.set_index('Date') for t, g in daily_data.groupby('Ticker')}
+    store = IndicatorStateStore(STATE_PATH)
+    partial_bars, intra_data = download_data(tickers, store)
     
     results = []
     
     # 4. 計算 Loop
     for t in tickers:
-        if t not in daily_map: continue
-        
-        metrics = calculate_metrics(t, daily_map[t], intra_data, curr_vix)
+        snap = store.snapshot(t, partial_bars.get(t))
+        metrics = calculate_metrics(t, snap, intra_data, curr_vix)
         if not metrics: continue
         
         # AI Predict
@@ -230,4 +227,6 @@ def generate_report():
     print(f"\n[Saved] {csv_path}")
 
 if __name__ == '__main__':
-    generate_report()
\ No newline at end of file
+    t_start = time.perf_counter()
+    generate_report()
+    print(get_provider().timing_summary(time.perf_counter() - t_start))
\ No newline at end of file
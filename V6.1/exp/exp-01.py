@@ -1,8 +1,8 @@
 import os
+import sys
 import json
 import pandas as pd
 import numpy as np
-import yfinance as yf
 import pandas_ta as ta
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import classification_report
@@ -10,6 +10,10 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import time
 
+# 共用元件 (repo 根目錄下的 common/)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.bar_store import BarStore
+
 # --- 1. 實驗配置 (擴充版) ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 RESOURCE_DIR = os.path.join(BASE_DIR, '..', '..', 'V6.0', 'resource')
@@ -50,50 +54,23 @@ def load_tickers():
 def fetch_data(tickers):
     """
     下載長週期數據 (2015-2025)
+    經由共用 BarStore 本地快取，只下載尚未覆蓋的區間。
     """
-    print(f"Downloading data for {len(tickers)} tickers ({TRAIN_START} ~ {TEST_END})...")
-    
-    try:
-        data = yf.download(
-            tickers, 
-            start=TRAIN_START, 
-            end=TEST_END, 
-            interval='1d', 
-            auto_adjust=True, 
-            progress=True,
-            timeout=60,
-            threads=True
-        )
-    except Exception as e:
-        print(f"[Critical Error] Batch download failed: {e}")
-        return {}
-    
-    # 處理 MultiIndex
-    if isinstance(data.columns, pd.MultiIndex):
-        try:
-            # Pandas 2.x
-            data = data.stack(level=1, future_stack=True).rename_axis(['Date', 'Ticker']).reset_index()
-        except TypeError:
-            # Pandas 1.x
-            data = data.stack(level=1).rename_axis(['Date', 'Ticker']).reset_index()
-            
-        data_dict = {}
-        for ticker, group in data.groupby('Ticker'):
-            df = group.set_index('Date').sort_index()
-            
-            # 簡單過濾無效數據
-            if df['Close'].sum() == 0 or df.empty:
-                print(f"  [Warning] {ticker} has no valid data. Dropping.")
-                continue
-            
-            # 確保欄位
-            df = df[['Open', 'High', 'Low', 'Close', 'Volume']]
-            data_dict[ticker] = df
-            
-        print(f"Successfully processed {len(data_dict)} tickers.")
-        return data_dict
-        
-    return {}
+    print(f"Loading data for {len(tickers)} tickers ({TRAIN_START} ~ {TEST_END})...")
+    bars = BarStore().get_bars(tickers, TRAIN_START, TEST_END, interval='1d')
+
+    data_dict = {}
+    for ticker, df in bars.items():
+        # 簡單過濾無效數據
+        if df.empty or df['Close'].sum() == 0:
+            print(f"  [Warning] {ticker} has no valid data. Dropping.")
+            continue
+
+        # 確保欄位
+        data_dict[ticker] = df[['Open', 'High', 'Low', 'Close', 'Volume']]
+
+    print(f"Successfully processed {len(data_dict)} tickers.")
+    return data_dict
 
 def calculate_features_and_labels(data_dict):
     """
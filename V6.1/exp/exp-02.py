@@ -1,13 +1,17 @@
 import os
+import sys
 import json
 import pandas as pd
 import numpy as np
-import yfinance as yf
 import pandas_ta as ta
 import matplotlib.pyplot as plt
 import seaborn as sns
 from datetime import datetime
 
+# 共用元件 (repo 根目錄下的 common/)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.bar_store import BarStore
+
 # --- 1. 實驗配置 ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 # 假設資源檔在 V6.0/resource，請根據實際路徑調整
@@ -53,41 +57,17 @@ def load_tickers():
     return sorted(list(set([t for t in clean_tickers if t not in indices])))
 
 def fetch_data(tickers):
-    """下載 OHLCV 數據"""
-    print(f"Downloading data for {len(tickers)} tickers ({DATA_START} ~ {TEST_END})...")
-    try:
-        data = yf.download(
-            tickers, 
-            start=DATA_START, 
-            end=TEST_END, 
-            interval='1d', 
-            auto_adjust=True, 
-            progress=True,
-            timeout=60,
-            threads=True
-        )
-    except Exception as e:
-        print(f"[Critical Error] Batch download failed: {e}")
-        return {}
-    
-    # 處理 yfinance 格式 (MultiIndex columns)
-    if isinstance(data.columns, pd.MultiIndex):
-        try:
-            # Pandas 2.x
-            data = data.stack(level=1, future_stack=True).rename_axis(['Date', 'Ticker']).reset_index()
-        except TypeError:
-            # Pandas 1.x
-            data = data.stack(level=1).rename_axis(['Date', 'Ticker']).reset_index()
-            
-        data_dict = {}
-        for ticker, group in data.groupby('Ticker'):
-            df = group.set_index('Date').sort_index()
-            # 簡單過濾
-            if df.empty or df['Close'].isna().all(): continue
-            data_dict[ticker] = df[['Open', 'High', 'Low', 'Close', 'Volume']]
-            
-        return data_dict
-    return {}
+    """載入 OHLCV 數據 (經由共用 BarStore 本地快取)"""
+    print(f"Loading data for {len(tickers)} tickers ({DATA_START} ~ {TEST_END})...")
+    bars = BarStore().get_bars(tickers, DATA_START, TEST_END, interval='1d')
+
+    data_dict = {}
+    for ticker, df in bars.items():
+        # 簡單過濾
+        if df.empty or df['Close'].isna().all(): continue
+        data_dict[ticker] = df[['Open', 'High', 'Low', 'Close', 'Volume']]
+
+    return data_dict
 
 def calculate_strategy_returns(df, strategies):
     """
@@ -1,13 +1,17 @@
 import os
+import sys
 import json
 import pandas as pd
 import numpy as np
-import yfinance as yf
-import pandas_ta as ta
 import matplotlib.pyplot as plt
 from xgboost import XGBClassifier
 import joblib
 
+# 共用元件 (repo 根目錄下的 common/)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.bar_store import BarStore, to_long
+from common.indicators import atr, rsi
+
 # --- 1. 設定與參數 ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 RESOURCE_DIR = os.path.join(BASE_DIR, '..', 'resource')
@@ -37,27 +41,11 @@ def load_tickers():
 
 def fetch_data(tickers):
     all_tickers = tickers + ['^VIX']
-    print(f"Downloading data for {len(all_tickers)} tickers...")
-    
-    # 下載數據
-    data = yf.download(
-        all_tickers, start=TRAIN_START, end=TEST_END, 
-        interval='1d', auto_adjust=True, progress=True, threads=True
-    )
+    print(f"Loading data for {len(all_tickers)} tickers...")
     
-    # 處理 MultiIndex Column (將 Ticker 轉為 Column)
-    if isinstance(data.columns, pd.MultiIndex):
-        # 嘗試堆疊數據 (相容不同 pandas 版本)
-        try:
-            data = data.stack(level=1, future_stack=True)
-        except TypeError:
-            data = data.stack(level=1)
-        
-        data = data.rename_axis(['Date', 'Ticker']).reset_index()
-    else:
-        # 單一股票的情況 (通常不會發生，因為我們加了 ^VIX)
-        data['Ticker'] = all_tickers[0]
-        data = data.reset_index()
+    # 經由共用 BarStore 本地快取 (只下載缺漏區間)，轉為長表格 (Date, Ticker)
+    bars = BarStore().get_bars(all_tickers, TRAIN_START, TEST_END, interval='1d')
+    data = to_long(bars, date_name='Date', symbol_name='Ticker')
 
     # 強制將 Date 轉為 datetime 並正規化 (移除時區與時間)
     data['Date'] = pd.to_datetime(data['Date']).dt.tz_localize(None).dt.normalize()
@@ -105,8 +93,10 @@ def build_features(df, vix_df):
     if len(df) < 15: return pd.DataFrame()
     
     try:
-        df['RSI_14'] = ta.rsi(df['Close'], length=14)
-        df['ATR_14'] = ta.atr(df['High'], df['Low'], df['Close'], length=14)
+        # common.indicators (numba 核心)，與 ta.rsi / ta.atr 相同結果；輸入為單欄 (bar x 1) 矩陣
+        high, low, close = (df[[col]].to_numpy(dtype=np.float64) for col in ['High', 'Low', 'Close'])
+        df['RSI_14'] = rsi(close, 14)[:, 0]
+        df['ATR_14'] = atr(high, low, close, 14)[:, 0]
         df['ATR_Pct'] = df['ATR_14'] / df['Prev_Close']
     except Exception:
         # 若計算失敗，填入 NaN
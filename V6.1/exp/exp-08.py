@@ -1,12 +1,16 @@
 import os
+import sys
 import json
 import pandas as pd
 import numpy as np
-import yfinance as yf
 import pandas_ta as ta
 import matplotlib.pyplot as plt
 from datetime import datetime
 
+# 共用元件 (repo 根目錄下的 common/)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.bar_store import BarStore, to_long
+
 # --- 設定 ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 RESOURCE_DIR = os.path.join(BASE_DIR, '..', 'resource')
@@ -25,16 +29,9 @@ def load_tickers():
         return list(set([t.split(':')[-1].strip().replace('.', '-') for t in json.load(f)]))
 
 def fetch_data(tickers):
-    print(f"Downloading data for {len(tickers)} tickers...")
-    df = yf.download(tickers, start=START_DATE, end=END_DATE, interval='1d', auto_adjust=True, progress=True, threads=True)
-    
-    if isinstance(df.columns, pd.MultiIndex):
-        df = df.stack(level=1, future_stack=True).rename_axis(['Date', 'Ticker']).reset_index()
-    else:
-        df['Ticker'] = tickers[0]
-        df = df.reset_index()
-        
-    return df
+    print(f"Loading data for {len(tickers)} tickers...")
+    bars = BarStore().get_bars(tickers, START_DATE, END_DATE, interval='1d')
+    return to_long(bars, date_name='Date', symbol_name='Ticker')
 
 def run_blind_limit_test(df):
     """核心回測邏輯"""
@@ -0,0 +1,5 @@
+"""
+Shared data & compute components used across V5.x ml_pipeline and V6.x experiments.
+
+各版本腳本以 sys.path 指向 repo 根目錄後 `from common.xxx import ...` 使用。
+"""
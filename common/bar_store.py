@@ -0,0 +1,259 @@
+"""
+Local incremental OHLCV bar store (共用 K 線快取).
+
+所有實驗原本每次執行都重新 yf.download 完整 2015~2025 歷史，
+BarStore 將下載過的 K 線依 interval / symbol / year 切分存成 Parquet，
+之後只下載「尚未覆蓋」的日期區間，其餘直接讀本地檔案。
+
+Layout:
+    {root}/{interval}/{symbol}/{year}.parquet
+    {root}/{interval}/{symbol}/_coverage.json   # 已下載過的 [start, end) 區間
+
+Notes:
+    - 價格採 auto_adjust=True (與各腳本一致)。除權息後歷史還原價會變動，
+      若需要與 yfinance 最新還原價完全一致，請用 refresh=True 重新下載。
+    - 今日 (含) 之後的區間不會被標記為已覆蓋，因為當日 K 線尚未收定。
+"""
+import json
+import os
+
+import pandas as pd
+
+from common.data_provider import OHLCV_COLUMNS, get_provider
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+DEFAULT_STORE_DIR = os.environ.get('BAR_STORE_DIR', os.path.join(REPO_ROOT, 'data', 'bar_store'))
+
+def _to_day(value, ceil=False):
+    """Normalizes a date-like value to a tz-naive midnight Timestamp."""
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is not None:
+        ts = ts.tz_localize(None)
+    day = ts.normalize()
+    if ceil and ts != day:
+        day += pd.Timedelta(days=1)
+    return day
+
+
+def _merge_ranges(ranges):
+    """Merges overlapping / touching [start, end) day ranges."""
+    merged = []
+    for s, e in sorted(ranges):
+        if merged and s <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], e)
+        else:
+            merged.append([s, e])
+    return merged
+
+
+def _subtract_ranges(start, end, covered):
+    """Returns the parts of [start, end) not inside any covered range."""
+    missing = []
+    cursor = start
+    for s, e in covered:
+        if e <= cursor:
+            continue
+        if s >= end:
+            break
+        if s > cursor:
+            missing.append((cursor, min(s, end)))
+        cursor = max(cursor, e)
+        if cursor >= end:
+            break
+    if cursor < end:
+        missing.append((cursor, end))
+    return missing
+
+
+class BarStore:
+    """
+    On-disk OHLCV cache partitioned by interval / symbol / year.
+
+    Usage:
+        store = BarStore()
+        bars = store.get_bars(['AAPL', 'MSFT'], '2015-01-01', '2025-11-30')
+        bars['AAPL']  # DataFrame[Open, High, Low, Close, Volume]
+    """
+    def __init__(self, root=None, downloader=None):
+        self.root = root or DEFAULT_STORE_DIR
+        # downloader(symbols, start, end, interval, prepost) -> {symbol: DataFrame}
+        # 預設使用 DATA_PROVIDER 指定的 provider (yfinance / replay / record)
+        self.downloader = downloader or get_provider().download
+
+    # --- Paths ---
+    def _interval_key(self, interval, prepost):
+        return f"{interval}_prepost" if prepost else interval
+
+    def _symbol_dir(self, symbol, interval, prepost):
+        safe_symbol = symbol.replace(os.sep, '_')
+        return os.path.join(self.root, self._interval_key(interval, prepost), safe_symbol)
+
+    # --- Coverage bookkeeping ---
+    def _load_coverage(self, symbol, interval, prepost):
+        path = os.path.join(self._symbol_dir(symbol, interval, prepost), '_coverage.json')
+        if not os.path.exists(path):
+            return []
+        with open(path, 'r') as f:
+            raw = json.load(f)
+        return [[pd.Timestamp(s), pd.Timestamp(e)] for s, e in raw.get('ranges', [])]
+
+    def _save_coverage(self, symbol, interval, prepost, ranges):
+        sym_dir = self._symbol_dir(symbol, interval, prepost)
+        os.makedirs(sym_dir, exist_ok=True)
+        payload = {'ranges': [[s.strftime('%Y-%m-%d'), e.strftime('%Y-%m-%d')] for s, e in _merge_ranges(ranges)]}
+        tmp_path = os.path.join(sym_dir, '_coverage.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(payload, f)
+        os.replace(tmp_path, os.path.join(sym_dir, '_coverage.json'))
+
+    def missing_ranges(self, symbol, start, end, interval='1d', prepost=False):
+        """Day ranges within [start, end) that have never been downloaded for symbol."""
+        start, end = _to_day(start), _to_day(end, ceil=True)
+        covered = _merge_ranges(self._load_coverage(symbol, interval, prepost))
+        return _subtract_ranges(start, end, covered)
+
+    # --- Partition I/O ---
+    def _write_bars(self, symbol, df, interval, prepost):
+        if df.empty:
+            return
+        sym_dir = self._symbol_dir(symbol, interval, prepost)
+        os.makedirs(sym_dir, exist_ok=True)
+        for year, part in df.groupby(df.index.year):
+            path = os.path.join(sym_dir, f"{year}.parquet")
+            if os.path.exists(path):
+                existing = pd.read_parquet(path)
+                part = pd.concat([existing, part])
+                part = part[~part.index.duplicated(keep='last')]
+            part = part.sort_index()
+            tmp_path = path + '.tmp'
+            part.to_parquet(tmp_path)
+            os.replace(tmp_path, path)
+
+    def _read_bars(self, symbol, start, end, interval, prepost):
+        sym_dir = self._symbol_dir(symbol, interval, prepost)
+        frames = []
+        for year in range(start.year, end.year + 1):
+            path = os.path.join(sym_dir, f"{year}.parquet")
+            if os.path.exists(path):
+                frames.append(pd.read_parquet(path))
+        if not frames:
+            return pd.DataFrame(columns=OHLCV_COLUMNS)
+
+        df = pd.concat(frames).sort_index()
+        idx = df.index
+        lo, hi = start, end
+        if getattr(idx, 'tz', None) is not None:
+            # 盤中資料帶時區 (America/New_York)，以當地日期切片
+            lo, hi = lo.tz_localize(idx.tz), hi.tz_localize(idx.tz)
+        return df[(idx >= lo) & (idx < hi)]
+
+    # --- Public API ---
+    def get_bars(self, symbols, start, end, interval='1d', prepost=False, refresh=False):
+        """
+        Returns {symbol: DataFrame} for [start, end), downloading only uncovered ranges.
+        Symbols with no data in the range are omitted from the result.
+        """
+        if isinstance(symbols, str):
+            symbols = [symbols]
+        symbols = list(dict.fromkeys(symbols))
+        start, end = _to_day(start), _to_day(end, ceil=True)
+        horizon = _to_day(pd.Timestamp.now())
+
+        # 1. 計算缺漏區間，並把相同區間的標的合併成一次批次下載
+        pending = {}
+        for sym in symbols:
+            if refresh:
+                gaps = [(start, end)]
+            else:
+                gaps = self.missing_ranges(sym, start, end, interval, prepost)
+            for gap in gaps:
+                pending.setdefault(gap, []).append(sym)
+
+        if pending:
+            n_missing = len({s for syms in pending.values() for s in syms})
+            print(f"[BarStore] {n_missing}/{len(symbols)} symbols need download ({len(pending)} range batches).")
+        else:
+            print(f"[BarStore] All {len(symbols)} symbols served from local store ({interval}).")
+
+        # 2. 下載缺漏區間並寫入分區
+        for (gap_start, gap_end), batch in pending.items():
+            fetched = self.downloader(batch, gap_start, gap_end, interval, prepost)
+            # 批次下載中失敗的標的與真的沒有資料的標的一樣是空的 (群組下載給全 NaN 欄)：
+            # 只有回傳資料的標的才標記覆蓋；空的標的若同批有其他標的有資料 (連線正常)，再單獨重抓一次，
+            # 仍為空才視為「該區間確實無資料」。整批皆空 (多半是連線 / 限速問題) 則不標記，下次重抓。
+            batch_ok = any(not df.empty for df in fetched.values())
+            for sym in batch:
+                df = fetched.get(sym)
+                if df is None or df.empty:
+                    if not batch_ok:
+                        continue
+                    df = self.downloader([sym], gap_start, gap_end, interval, prepost).get(sym)
+                    if df is None:
+                        df = pd.DataFrame(columns=OHLCV_COLUMNS)
+                if not df.empty:
+                    self._write_bars(sym, df, interval, prepost)
+                if gap_start < horizon:
+                    ranges = self._load_coverage(sym, interval, prepost)
+                    ranges.append([gap_start, min(gap_end, horizon)])
+                    self._save_coverage(sym, interval, prepost, ranges)
+
+        # 3. 從本地讀取完整區間
+        bars = {}
+        for sym in symbols:
+            df = self._read_bars(sym, start, end, interval, prepost)
+            if not df.empty:
+                bars[sym] = df
+        return bars
+
+
+def to_wide(bars):
+    """
+    Rebuilds the yf.download multi-ticker layout: columns (Price, Ticker), union date index.
+    用於仍以寬表格交接的舊流程 (例如 V5.x 01_format_data)。
+    """
+    if not bars:
+        return pd.DataFrame(columns=pd.MultiIndex.from_arrays([[], []], names=['Price', 'Ticker']))
+    wide = pd.concat(bars, axis=1)
+    wide = wide.swaplevel(0, 1, axis=1).sort_index(axis=1)
+    wide.columns.names = ['Price', 'Ticker']
+    return wide.sort_index()
+
+
+def to_long(bars, date_name='Date', symbol_name='Ticker'):
+    """Stacks {symbol: DataFrame} into a long frame with [date_name, symbol_name, OHLCV] columns."""
+    if not bars:
+        return pd.DataFrame(columns=[date_name, symbol_name] + OHLCV_COLUMNS)
+    long_df = pd.concat(bars, names=[symbol_name, date_name])
+    long_df = long_df.reset_index()
+    return long_df[[date_name, symbol_name] + [c for c in OHLCV_COLUMNS if c in long_df.columns]]
+
+
+# 簡單測試用
+if __name__ == "__main__":
+    import tempfile
+
+    # 群組下載中暫時失敗 (空結果) 的標的不可被標記為已覆蓋
+    calls = []
+
+    def flaky_download(symbols, start, end, interval='1d', prepost=False):
+        calls.append(list(symbols))
+        idx = pd.bdate_range(start, end - pd.Timedelta(days=1), name='Date')
+        bars = {s: pd.DataFrame({c: 1.0 for c in OHLCV_COLUMNS}, index=idx) for s in symbols}
+        if len(symbols) > 1:
+            bars['FLAKY'] = bars['FLAKY'].iloc[:0]   # 批次中失敗
+        bars.pop('GONE', None)                       # 真的沒有資料
+        return bars
+
+    fake = BarStore(root=tempfile.mkdtemp(), downloader=flaky_download)
+    got = fake.get_bars(['OK', 'FLAKY', 'GONE'], '2020-01-01', '2020-02-01')
+    assert sorted(got) == ['FLAKY', 'OK'] and calls[1:] == [['FLAKY'], ['GONE']]
+    assert not fake.missing_ranges('GONE', '2020-01-01', '2020-02-01')  # 單獨重抓仍為空 -> 確實無資料
+    calls.clear()
+    fake.get_bars(['OK', 'FLAKY', 'GONE'], '2020-01-01', '2020-02-01')
+    assert calls == []
+    print("Per-symbol re-check of empty batch results: OK")
+
+    store = BarStore()
+    demo = store.get_bars(['SPY', 'QQQ'], '2024-01-01', '2024-02-01')
+    for sym, df in demo.items():
+        print(sym, df.shape, df.index.min(), df.index.max())
@@ -0,0 +1,97 @@
+"""
+Scaling benchmark: multi-process stock feature build (common.feature_graph, workers=1..N).
+
+以 V5.1 02_build_features_l0_v5 的各標的特徵 (RSI / SMA / BB / ATR / 量能) 組成 feature graph，
+對合成的 (timestamp, symbol) 宇宙計時 compute(workers=w)，並確認每種 workers 的結果與單行程完全相同。
+speedup / efficiency 以 workers=1 為基準；compute 內的 BarMatrix 建立與結果收集仍在主行程 (序列部分)。
+
+Usage:
+    python common/benchmarks/bench_feature_build.py [--symbols 2000] [--bars 2520] [--workers 1 2 4 8] [--repeat 3]
+"""
+import argparse
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.feature_graph import FeatureGraph
+from common.indicators import atr, bbands_pctb, pct_change, rsi, sma
+
+
+def make_universe(n_symbols, n_bars, seed=0):
+    """Synthetic OHLCV universe; 部分標的晚上市，並隨機缺漏 2% 的 K 棒。"""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2015-01-01', periods=n_bars)
+    symbols = [f"S{i:04d}" for i in range(n_symbols)]
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, (n_bars, n_symbols)), axis=0))
+    open_ = close * (1 + rng.normal(0, 0.01, close.shape))
+    data = {
+        'Open': open_, 'High': np.maximum(open_, close) * 1.01, 'Low': np.minimum(open_, close) * 0.99,
+        'Close': close, 'Volume': rng.integers(1e5, 1e7, close.shape).astype(np.float64),
+    }
+    idx = pd.MultiIndex.from_product([dates, symbols], names=['timestamp', 'symbol'])
+    df = pd.DataFrame({k: v.reshape(-1) for k, v in data.items()}, index=idx)
+    late = rng.integers(0, n_bars // 2, n_symbols) * (rng.random(n_symbols) < 0.3)
+    keep = (np.arange(n_bars)[:, None] >= late).reshape(-1) & (rng.random(len(df)) > 0.02)
+    return df[keep]
+
+
+def v51_graph():
+    graph = FeatureGraph(['Open', 'High', 'Low', 'Close', 'Volume'])
+    graph.add('RSI_2', rsi, ['Close'], {'length': 2}, min_bars=3)
+    graph.add('RSI_14', rsi, ['Close'], {'length': 14}, min_bars=15)
+    graph.add('SMA_200', sma, ['Close'], {'length': 200}, min_bars=200)
+    graph.add('Dist_SMA_200', lambda close, sma_200: (close / sma_200) - 1, ['Close', 'SMA_200'])
+    graph.add('BB_PctB', bbands_pctb, ['Close'], {'length': 20, 'std': 2.0}, min_bars=20)
+    graph.add('ATR_14', atr, ['High', 'Low', 'Close'], {'length': 14}, min_bars=15)
+    graph.add('ATR_Norm', lambda atr_14, close: atr_14 / close, ['ATR_14', 'Close'])
+    graph.add('Vol_MA_20', sma, ['Volume'], {'length': 20}, min_bars=20)
+    graph.add('Rel_Vol', lambda volume, vol_ma_20: volume / vol_ma_20, ['Volume', 'Vol_MA_20'])
+    graph.add('Ret_1d', pct_change, ['Close'])
+    return graph
+
+
+def best_of(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        times.append(time.perf_counter() - t0)
+    return min(times), out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--symbols', type=int, default=2000)
+    parser.add_argument('--bars', type=int, default=2520)
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    warnings.simplefilter('ignore', RuntimeWarning)
+    df = make_universe(args.symbols, args.bars)
+    graph = v51_graph()
+    print(f"Universe: {args.symbols} symbols x {args.bars} bars ({len(df):,} rows), "
+          f"{len(graph.features)} features, {os.cpu_count()} CPUs")
+    graph.compute(df.iloc[:1000])  # numba JIT 編譯不計入
+
+    print(f"{'workers':>8} {'time (s)':>9} {'speedup':>8} {'efficiency':>11}")
+    base = ref = None
+    for w in args.workers:
+        elapsed, out = best_of(lambda: graph.compute(df, workers=w), args.repeat)
+        if ref is None:
+            base, ref = elapsed, out
+        else:
+            pd.testing.assert_frame_equal(out, ref, check_exact=True)
+        speedup = base / elapsed
+        print(f"{w:>8} {elapsed:>9.2f} {speedup:>7.2f}x {speedup / w:>10.0%}")
+    print("All worker counts match workers=1 exactly.")
+
+
+if __name__ == '__main__':
+    main()
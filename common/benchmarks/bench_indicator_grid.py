@@ -0,0 +1,66 @@
+"""
+Benchmark: parameter-grid indicators (rsi_grid / atr_grid) vs one rsi() / atr() call per length.
+
+參數掃描原本每個 length 從頭重算一次；grid 版本共用 diff / true range，一趟迴圈更新所有 length。
+兩種 backend (numba / numpy) 各自計時，並確認 grid[i] 與單獨呼叫的結果逐位元相同。
+
+Usage:
+    python common/benchmarks/bench_indicator_grid.py [--bars 2520] [--symbols 500] [--lengths 2 3 5 7 10 14 21 28]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common import indicator_kernels
+from common.benchmarks.bench_indicator_kernels import make_matrices
+from common.indicators import atr, atr_grid, rsi, rsi_grid
+
+
+def timed(fn, repeat):
+    """Best-of-repeat seconds; 結果不保留 (避免另一組大陣列佔用記憶體影響計時)。"""
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bars', type=int, default=2520)
+    parser.add_argument('--symbols', type=int, default=500)
+    parser.add_argument('--lengths', type=int, nargs='+', default=[2, 3, 5, 7, 10, 14, 21, 28])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    high, low, close = make_matrices(args.bars, args.symbols)
+    lengths = args.lengths
+    print(f"Matrix: {args.bars} bars x {args.symbols} symbols, lengths={lengths}")
+    print(f"{'backend':<7} {'indicator':<5} {'per-length':>11} {'grid':>9} {'speedup':>8}")
+
+    for backend in indicator_kernels.BACKENDS:
+        previous = indicator_kernels.set_backend(backend)
+        rsi_grid(close[:30], lengths), atr_grid(high[:30], low[:30], close[:30], lengths)  # numba JIT 編譯不計入
+        rsi(close[:30], 2), atr(high[:30], low[:30], close[:30], 2)
+        cases = [
+            ('RSI', lambda: [rsi(close, n) for n in lengths], lambda: rsi_grid(close, lengths)),
+            ('ATR', lambda: [atr(high, low, close, n) for n in lengths], lambda: atr_grid(high, low, close, lengths)),
+        ]
+        for name, single, grid in cases:
+            t_single = timed(single, args.repeat)
+            t_grid = timed(grid, args.repeat)
+            out, ref = grid(), single()
+            assert all(np.array_equal(out[i], ref[i], equal_nan=True) for i in range(len(lengths))), (backend, name)
+            del out, ref
+            print(f"{backend:<7} {name:<5} {t_single:>10.3f}s {t_grid:>8.3f}s {t_single / t_grid:>7.1f}x")
+        indicator_kernels.set_backend(previous)
+    print("grid[i] is bit-identical to the per-length call on every backend.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Micro-benchmark: recursive indicator kernels (common.indicator_kernels) — numba vs NumPy fallback.
+
+對 (bar x symbol) 矩陣計時 RSI_2 / RSI_14 / ATR_14 / EMA_20 在兩種 backend 下的時間，
+並檢查兩種 backend 的一致性 (抽樣 --parity-symbols 欄，含 NaN 缺口與晚上市)：
+RSI / ATR 一律與 common.indicator_reference 的逐根參考實作比對 (不需 pandas_ta)；
+裝有 pandas_ta 時另與其逐欄結果比對 (含 EMA，以 requirements.txt 釘選的 0.4.71b0 量測)。
+
+Usage:
+    python common/benchmarks/bench_indicator_kernels.py [--bars 1260] [--sizes 100 1000 5000] [--repeat 3]
+"""
+import argparse
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common import indicator_kernels, indicator_reference
+from common.indicators import atr, ema, rsi
+
+
+def make_matrices(n_bars, n_symbols, seed=0):
+    """Synthetic high / low / close matrices; 部分標的晚上市 (前段 NaN)，並隨機挖掉 1% 的 K 棒。"""
+    rng = np.random.default_rng(seed)
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, (n_bars, n_symbols)), axis=0))
+    high = close * (1 + rng.uniform(0, 0.02, close.shape))
+    low = close * (1 - rng.uniform(0, 0.02, close.shape))
+    late = rng.integers(0, n_bars // 2, n_symbols) * (rng.random(n_symbols) < 0.3)
+    gaps = (np.arange(n_bars)[:, None] < late) | (rng.random(close.shape) < 0.01)
+    for mat in (close, high, low):
+        mat[gaps] = np.nan
+    return high, low, close
+
+
+def kernels(high, low, close):
+    return {
+        'RSI_2': lambda: rsi(close, 2),
+        'RSI_14': lambda: rsi(close, 14),
+        'ATR_14': lambda: atr(high, low, close, 14),
+        'EMA_20': lambda: ema(close, 20),
+    }
+
+
+def pandas_ta_reference(ta, high, low, close, j):
+    h, l, c = (pd.Series(m[:, j]) for m in (high, low, close))
+    return {
+        'RSI_2': ta.rsi(c, length=2),
+        'RSI_14': ta.rsi(c, length=14),
+        'ATR_14': ta.atr(h, l, c, length=14),
+        'EMA_20': ta.ema(c, length=20),
+    }
+
+
+def hand_written_reference(high, low, close, j):
+    h, l, c = (m[:, j] for m in (high, low, close))
+    return {
+        'RSI_2': indicator_reference.rsi_reference(c, 2),
+        'RSI_14': indicator_reference.rsi_reference(c, 14),
+        'ATR_14': indicator_reference.atr_reference(h, l, c, 14),
+    }
+
+
+def best_of(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bars', type=int, default=1260)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--parity-symbols', type=int, default=50)
+    args = parser.parse_args()
+
+    try:
+        import pandas_ta as ta
+    except ImportError:
+        ta = None
+        print("pandas_ta not installed: checking RSI / ATR against the hand-written reference only.")
+    if not indicator_kernels.NUMBA_AVAILABLE:
+        print("numba not installed: timing the NumPy fallback only.")
+
+    backends = indicator_kernels.BACKENDS
+    previous = indicator_kernels.get_backend()
+
+    # 一致性：兩種 backend 都需與手寫參考實作 (以及 pandas_ta，若有安裝) 相同
+    high, low, close = make_matrices(args.bars, args.parity_symbols, seed=1)
+    refs = [hand_written_reference(high, low, close, j) for j in range(close.shape[1])]
+    for backend in backends:
+        indicator_kernels.set_backend(backend)
+        for name, fn in kernels(high, low, close).items():
+            if name not in refs[0]:
+                continue
+            out = fn()
+            for j, ref in enumerate(refs):
+                indicator_reference.assert_close(f"{backend} {name} column {j}", out[:, j], ref[name])
+    print(f"Parity with the hand-written RSI / ATR reference ({args.parity_symbols} symbols, "
+          f"backends: {', '.join(backends)}): OK")
+
+    if ta is not None:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            refs = [pandas_ta_reference(ta, high, low, close, j) for j in range(close.shape[1])]
+        for backend in backends:
+            indicator_kernels.set_backend(backend)
+            for name, fn in kernels(high, low, close).items():
+                out = fn()
+                for j, ref in enumerate(refs):
+                    assert np.allclose(out[:, j], ref[name].to_numpy(), rtol=1e-10, equal_nan=True), \
+                        f"{backend} {name} column {j}"
+        print(f"Parity with pandas_ta {ta.version} ({args.parity_symbols} symbols, "
+              f"backends: {', '.join(backends)}): OK")
+
+    header = f"{'symbols':>8} {'indicator':>10}" + ''.join(f" {b + ' (ms)':>12}" for b in backends)
+    if len(backends) > 1:
+        header += f" {'speedup':>8}"
+    print(header)
+    for n in args.sizes:
+        high, low, close = make_matrices(args.bars, n)
+        for name, fn in kernels(high, low, close).items():
+            times = []
+            for backend in backends:
+                indicator_kernels.set_backend(backend)
+                fn()  # numba 第一次呼叫需要編譯 (cache=True 後只有第一次執行會發生)
+                times.append(best_of(fn, args.repeat))
+            line = f"{n:>8} {name:>10}" + ''.join(f" {t * 1e3:>12.1f}" for t in times)
+            if len(times) > 1:
+                line += f" {times[1] / times[0]:>7.1f}x"
+            print(line)
+    indicator_kernels.set_backend(previous)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+Benchmark: vectorized indicator engine (common.indicators) vs per-symbol pandas_ta loops.
+
+舊做法 (V5.1 build_stock_features / V5.3 calculate_stock_features) 逐標的呼叫 pandas_ta，
+新做法每個指標對 (bar x symbol) 矩陣只算一次。兩者結果需在容許誤差內一致。
+
+RSI / ATR 另外與 common.indicator_reference 的逐根參考實作比對 (前 --reference-symbols 個標的，不需 pandas_ta)；
+pandas_ta 的一致性以 requirements.txt 釘選的 0.4.71b0 量測，未安裝時只列出引擎本身的時間。
+標的數大於 --legacy-max 時，舊做法只跑前 --legacy-max 個標的並線性外推 (表中標示 *)，避免 5,000 檔時等上數分鐘。
+
+Usage:
+    python common/benchmarks/bench_indicators.py [--sizes 100 1000 5000] [--years 5] [--legacy-max 1000]
+"""
+import argparse
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common import indicator_reference
+from common.indicators import (BarMatrix, amihud, atr, bbands_pctb, down_vol_prop, rel_vol, rolling_var,
+                               rsi, sma)
+
+INDICATORS = ['RSI_2', 'RSI_14', 'SMA_200', 'BB_PctB', 'ATR_14', 'Rel_Vol', 'Amihud_Illiquidity', 'Down_Vol_Prop']
+
+
+def make_bars(n_symbols, n_years, seed=0):
+    """Synthetic daily OHLCV, (timestamp, symbol) 索引；各標的上市日不同 (長度不一)。"""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2015-01-01', periods=252 * n_years)
+    frames = []
+    for i in range(n_symbols):
+        n = len(dates) - int(rng.integers(0, len(dates) // 2))
+        close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+        open_ = close * (1 + rng.normal(0, 0.01, n))
+        frames.append(pd.DataFrame({
+            'timestamp': dates[-n:], 'symbol': f"S{i:04d}",
+            'open': open_, 'high': np.maximum(open_, close) * 1.01, 'low': np.minimum(open_, close) * 0.99,
+            'close': close, 'volume': rng.integers(1e5, 1e7, n).astype(float),
+        }))
+    return pd.concat(frames).set_index(['timestamp', 'symbol']).sort_index()
+
+
+def legacy_features(df, ta):
+    """舊做法：逐標的 pandas_ta / pandas (與原本 02_build_features 腳本相同的寫法)。"""
+    out = []
+    for symbol, group in df.groupby(level='symbol'):
+        g = group.droplevel('symbol')
+        res = pd.DataFrame(index=group.index)
+        for name, values in [
+            ('RSI_2', ta.rsi(g['close'], length=2)),
+            ('RSI_14', ta.rsi(g['close'], length=14)),
+            ('SMA_200', ta.sma(g['close'], length=200)),
+            ('ATR_14', ta.atr(g['high'], g['low'], g['close'], length=14)),
+        ]:
+            res[name] = np.nan if values is None else values.to_numpy()
+        bbands = ta.bbands(g['close'], length=20, std=2)
+        res['BB_PctB'] = np.nan if bbands is None else bbands.filter(like='BBP_').iloc[:, 0].to_numpy()
+        vol_ma = ta.sma(g['volume'], length=20)
+        res['Rel_Vol'] = np.nan if vol_ma is None else (g['volume'] / vol_ma).to_numpy()
+
+        ret = g['close'].pct_change().abs()
+        dollar_vol = (g['close'] * g['volume']).replace(0, np.nan)
+        res['Amihud_Illiquidity'] = (ret / dollar_vol).rolling(20).mean().to_numpy()
+        is_down = (g['close'] < g['open']).astype(int)
+        total = g['volume'].rolling(10).sum()
+        res['Down_Vol_Prop'] = ((g['volume'] * is_down).rolling(10).sum() / total.replace(0, np.nan)).to_numpy()
+        out.append(res)
+    return pd.concat(out).reindex(df.index)[INDICATORS]
+
+
+def engine_features(df):
+    bars = BarMatrix.from_long(df, ['open', 'high', 'low', 'close', 'volume'])
+    close, volume = bars['close'], bars['volume']
+    return pd.DataFrame({
+        'RSI_2': bars.to_series(rsi(close, 2), min_bars=3),
+        'RSI_14': bars.to_series(rsi(close, 14), min_bars=15),
+        'SMA_200': bars.to_series(sma(close, 200), min_bars=200),
+        'BB_PctB': bars.to_series(bbands_pctb(close, 20, 2.0), min_bars=20),
+        'ATR_14': bars.to_series(atr(bars['high'], bars['low'], close, 14), min_bars=15),
+        'Rel_Vol': bars.to_series(rel_vol(volume, 20), min_bars=20),
+        'Amihud_Illiquidity': bars.to_series(amihud(close, volume, 20)),
+        'Down_Vol_Prop': bars.to_series(down_vol_prop(bars['open'], close, volume, 10)),
+    })
+
+
+def check_parity(legacy, engine, df):
+    # 標準差為 0 的視窗 %B 只是 epsilon 雜訊，不比較
+    bars = BarMatrix.from_long(df, ['close'])
+    flat = (bars.to_series(rolling_var(bars['close'], 20)) == 0).to_numpy()
+    for col in INDICATORS:
+        a, b = legacy[col].to_numpy(dtype=float), engine[col].to_numpy(dtype=float)
+        # atol 以該欄的量級為準 (例如 close 接近 lower band 時 %B 接近 0，只能比較絕對誤差)
+        ok = np.isclose(a, b, rtol=1e-8, atol=1e-10 * np.nanmax(np.abs(a)), equal_nan=True)
+        if col == 'BB_PctB':
+            ok |= flat
+        assert ok.all(), f"{col}: {(~ok).sum()} mismatches"
+
+
+def check_reference(engine, df, n_symbols):
+    """RSI_2 / RSI_14 / ATR_14 vs the hand-written loops in common.indicator_reference (不需 pandas_ta)。"""
+    ref = indicator_reference
+    for symbol in df.index.get_level_values('symbol').unique()[:n_symbols]:
+        g = df.xs(symbol, level='symbol')
+        out = engine.xs(symbol, level='symbol')
+        ref.assert_close(f"RSI_2 {symbol}", out['RSI_2'], ref.rsi_reference(g['close'], 2))
+        ref.assert_close(f"RSI_14 {symbol}", out['RSI_14'], ref.rsi_reference(g['close'], 14))
+        ref.assert_close(f"ATR_14 {symbol}", out['ATR_14'], ref.atr_reference(g['high'], g['low'], g['close'], 14))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--legacy-max', type=int, default=1000)
+    parser.add_argument('--reference-symbols', type=int, default=20)
+    args = parser.parse_args()
+
+    try:
+        import pandas_ta as ta
+    except ImportError:
+        ta = None
+        print("pandas_ta not installed: reporting engine timings only.")
+
+    print(f"{'symbols':>8} {'rows':>10} {'engine (s)':>11} {'pandas_ta (s)':>14} {'speedup':>8}")
+    for n in args.sizes:
+        df = make_bars(n, args.years)
+        t0 = time.perf_counter()
+        engine = engine_features(df)
+        t_engine = time.perf_counter() - t0
+        check_reference(engine, df, args.reference_symbols)
+
+        if ta is None:
+            print(f"{n:>8} {len(df):>10} {t_engine:>11.2f} {'-':>14} {'-':>8}")
+            continue
+
+        subset = df
+        if n > args.legacy_max:
+            keep = df.index.get_level_values('symbol').isin([f"S{i:04d}" for i in range(args.legacy_max)])
+            subset = df[keep]
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            t0 = time.perf_counter()
+            legacy = legacy_features(subset, ta)
+            t_legacy = (time.perf_counter() - t0) * n / min(n, args.legacy_max)
+        check_parity(legacy, engine.loc[subset.index], subset)
+        mark = '*' if n > args.legacy_max else ' '
+        print(f"{n:>8} {len(df):>10} {t_engine:>11.2f} {t_legacy:>13.2f}{mark} {t_legacy / t_engine:>7.1f}x")
+    print(f"Parity with the hand-written RSI / ATR reference (first {args.reference_symbols} symbols): OK")
+    if ta is not None:
+        print(f"Parity with pandas_ta {ta.version}: OK  (* = extrapolated from the first --legacy-max symbols)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Benchmark: L3 walk-forward training, per-fold LGBMRanker.fit vs common.lgb_dataset.BinnedRankingData.
+
+舊做法 (V5.1 04_train_meta_labeling_l3 預設)：每折 LGBMRanker.fit(DataFrame)，各自分箱、重建 query group，最後全資料再分箱一次。
+新做法 (--binned-cache)：全部候選分箱一次 (可存成 binary 檔)，各折是共用 bin mappers 的列子集。
+全資料模型必須完全相同；各折模型的分箱邊界改來自全樣本，只報告 NDCG@3 的差異。
+
+Usage:
+    python common/benchmarks/bench_lgb_dataset.py [--days 2520] [--max-candidates 60] [--features 11] [--splits 5]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import TimeSeriesSplit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.cross_rank import quantile_grades
+from common.lgb_dataset import BinnedRankingData
+
+LGBM_PARAMS = {'objective': 'lambdarank', 'metric': 'ndcg', 'ndcg_eval_at': [1, 3, 5], 'boosting_type': 'gbdt',
+               'n_estimators': 150, 'learning_rate': 0.05, 'num_leaves': 31, 'label_gain': [0, 1, 3, 7],
+               'random_state': 42, 'verbose': -1}
+
+
+def make_candidates(n_days, max_candidates, n_features, seed=0):
+    """Synthetic L3 matrix (symbol, timestamp) 依 timestamp 排序；等級 = 每日 Target_Return 的分位數等級。"""
+    rng = np.random.default_rng(seed)
+    days = pd.bdate_range('2015-01-01', periods=n_days)
+    counts = rng.integers(1, max_candidates + 1, n_days)
+    ts = np.repeat(days, counts)
+    symbols = np.concatenate([rng.choice(2000, n, replace=False) for n in counts])
+    idx = pd.MultiIndex.from_arrays([[f"S{s:04d}" for s in symbols], ts], names=['symbol', 'timestamp'])
+    X = pd.DataFrame(rng.normal(size=(len(idx), n_features)), index=idx, columns=[f"f{i}" for i in range(n_features)])
+    target = pd.Series(0.01 * X['f0'] + rng.normal(0, 0.03, len(idx)), index=idx)
+    y = quantile_grades(target, level='timestamp', q=[0, 0.5, 0.8, 0.95, 1.0], min_size=4)
+    X = X.sort_index(level='timestamp')
+    return X, y.reindex(X.index)
+
+
+def per_fold(X, y, splits):
+    """04 的預設路徑：每折 LGBMRanker.fit。"""
+    timestamps = X.index.get_level_values('timestamp')
+    unique_dates = timestamps.unique()
+    scores = []
+    for train_idx, test_idx in TimeSeriesSplit(n_splits=splits).split(unique_dates):
+        train_mask = timestamps.isin(unique_dates[train_idx])
+        test_mask = timestamps.isin(unique_dates[test_idx])
+        X_train, X_test = X[train_mask], X[test_mask]
+        model = lgb.LGBMRanker(**LGBM_PARAMS).fit(
+            X_train, y[train_mask], group=X_train.groupby(level='timestamp', sort=False).size().values,
+            eval_set=[(X_test, y[test_mask])], eval_group=[X_test.groupby(level='timestamp', sort=False).size().values])
+        scores.append(model.best_score_['valid_0']['ndcg@3'])
+    final = lgb.LGBMRanker(**LGBM_PARAMS).fit(X, y, group=X.groupby(level='timestamp', sort=False).size().values)
+    return scores, final
+
+
+def binned_folds(X, y, splits, cache_dir):
+    """--binned-cache 路徑：分箱一次，各折為列子集。"""
+    timestamps = X.index.get_level_values('timestamp')
+    data = BinnedRankingData(X, y, timestamps, LGBM_PARAMS, cache_dir=cache_dir)
+    scores = []
+    for train_idx, test_idx in TimeSeriesSplit(n_splits=splits).split(np.arange(data.n_days)):
+        booster = data.train((train_idx[0], train_idx[-1] + 1), valid=(test_idx[0], test_idx[-1] + 1))
+        scores.append(booster.best_score['valid_0']['ndcg@3'])
+    return scores, data.train((0, data.n_days))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=2520)
+    parser.add_argument('--max-candidates', type=int, default=60)
+    parser.add_argument('--features', type=int, default=11)
+    parser.add_argument('--splits', type=int, default=5)
+    args = parser.parse_args()
+    warnings.simplefilter('ignore')
+
+    X, y = make_candidates(args.days, args.max_candidates, args.features)
+    print(f"Candidates: {len(X)} rows x {X.shape[1]} features over {args.days} days, {args.splits} folds + final")
+
+    t0 = time.perf_counter()
+    ref_scores, ref_final = per_fold(X, y, args.splits)
+    t_ref = time.perf_counter() - t0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        t0 = time.perf_counter()
+        new_scores, new_final = binned_folds(X, y, args.splits, tmp)
+        t_new = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        cached_scores, _ = binned_folds(X, y, args.splits, tmp)
+        t_cached = time.perf_counter() - t0
+    assert cached_scores == new_scores
+
+    t0 = time.perf_counter()
+    BinnedRankingData(X, y, X.index.get_level_values('timestamp'), LGBM_PARAMS)
+    t_bin = time.perf_counter() - t0
+
+    assert np.array_equal(ref_final.predict(X), new_final.predict(X))
+    print(f"Per-fold LGBMRanker.fit: {t_ref:.2f}s | shared bins: {t_new:.2f}s (binning {t_bin:.2f}s) | "
+          f"from binary cache: {t_cached:.2f}s | speedup {t_ref / t_new:.2f}x")
+    print(f"Fold NDCG@3 per-fold bins: {np.round(ref_scores, 4).tolist()} (mean {np.mean(ref_scores):.4f})")
+    print(f"Fold NDCG@3 shared bins:   {np.round(new_scores, 4).tolist()} (mean {np.mean(new_scores):.4f})")
+    print("Final model identical.")
+
+
+if __name__ == '__main__':
+    main()
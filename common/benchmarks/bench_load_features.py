@@ -0,0 +1,112 @@
+"""
+Benchmark: projected / filtered feature loading (common.frame_schema.read_features).
+
+比較「整檔讀入再切片」與「欄位投影 + 日期 / 標的條件下推」的 wall time、峰值記憶體，
+並由 Parquet metadata 計算實際需要讀取的 column chunk 位元組比例
+(row group 的 timestamp statistics 與查詢區間不重疊者整段跳過)。
+
+Usage:
+    python common/benchmarks/bench_load_features.py [--symbols 500] [--years 10] [--features 30]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.frame_schema import build_filters, read_compact_parquet, read_features, write_compact_parquet
+
+QUERY_COLUMNS = ['open', 'high', 'low', 'close', 'RSI_2']
+
+
+def make_features(n_symbols, n_years, n_features, seed=0):
+    """Synthetic stock_features: (timestamp, symbol) 索引、OHLCV + n_features 個指標欄位。"""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2015-01-01', periods=252 * n_years)
+    symbols = [f"S{i:04d}" for i in range(n_symbols)]
+    idx = pd.MultiIndex.from_product([dates, symbols], names=['timestamp', 'symbol'])
+    cols = ['open', 'high', 'low', 'close', 'RSI_2'] + [f"feat_{i}" for i in range(n_features - 5)]
+    df = pd.DataFrame(rng.random((len(idx), len(cols))) * 100, index=idx, columns=cols)
+    df['volume'] = rng.integers(1e5, 1e7, len(idx)).astype(float)
+    return df
+
+
+def scanned_fraction(path, columns, start, end):
+    """Fraction of column-chunk bytes touched: 只計算 timestamp 區間重疊的 row groups 與被投影的欄位。"""
+    meta = pq.ParquetFile(path).metadata
+    names = [meta.schema.column(i).name for i in range(meta.num_columns)]
+    ts_col = names.index('timestamp')
+    wanted = set(columns) | {'timestamp', 'symbol'}
+    total = touched = 0
+    for r in range(meta.num_row_groups):
+        rg = meta.row_group(r)
+        stats = rg.column(ts_col).statistics
+        overlap = stats is None or not (stats.max < start or stats.min > end)
+        for c in range(rg.num_columns):
+            size = rg.column(c).total_compressed_size
+            total += size
+            if overlap and names[c] in wanted:
+                touched += size
+    return touched / total
+
+
+def measure(fn):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    t0 = time.perf_counter()
+    out = fn()
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return out, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--symbols', type=int, default=500)
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--features', type=int, default=30)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'stock_features.parquet')
+    write_compact_parquet(make_features(args.symbols, args.years, args.features), path)
+    meta = pq.ParquetFile(path).metadata
+    print(f"File: {os.path.getsize(path) / 1e6:.1f} MB, {meta.num_rows} rows, "
+          f"{meta.num_columns} columns, {meta.num_row_groups} row groups")
+
+    last_year = pd.Timestamp(pq.read_table(path, columns=['timestamp'])['timestamp'].to_pandas().max().year, 1, 1)
+    start, end = last_year - pd.DateOffset(years=1), last_year - pd.Timedelta(days=1)
+    symbols = [f"S{i:04d}" for i in range(0, args.symbols, 5)]
+
+    def full_then_slice():
+        df = read_compact_parquet(path, compute_dtypes=True)
+        ts = df.index.get_level_values('timestamp')
+        mask = (ts >= start) & (ts <= end) & df.index.get_level_values('symbol').isin(symbols)
+        return df.loc[mask, QUERY_COLUMNS]
+
+    def pushdown():
+        return read_features(path, columns=QUERY_COLUMNS, start=start, end=end, symbols=symbols)
+
+    old, t_old, peak_old = measure(full_then_slice)
+    new, t_new, peak_new = measure(pushdown)
+    pd.testing.assert_frame_equal(old, new)
+    print(f"Query: {len(QUERY_COLUMNS)} columns, {start.date()} ~ {end.date()}, {len(symbols)} symbols "
+          f"-> {len(new)} rows | filters={build_filters(path, start, end)}")
+    print("Parity: OK")
+
+    print(f"{'path':<18} {'wall (s)':>9} {'peak (MB)':>10}")
+    for name, t, peak in [('full read + slice', t_old, peak_old), ('read_features', t_new, peak_new)]:
+        print(f"{name:<18} {t:>9.3f} {peak / 1e6:>10.1f}")
+    frac = scanned_fraction(path, QUERY_COLUMNS, start, end)
+    print(f"Speedup: {t_old / t_new:.1f}x | Peak memory reduction: {peak_old / peak_new:.1f}x | "
+          f"Column-chunk bytes read: {frac:.1%} of file")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark: intraday 5m bars -> daily session features (common.session_features).
+
+合成 N 檔 x 一年的 5m K 棒 (04:00~20:00 美東、含盤前盤後、UTC tz-naive 儲存，與 yfinance 相同)，
+對 session_features() 計時，並與 pandas groupby((symbol, 美東日期)) 的寫法比對 RTH / 盤前欄位。
+
+Usage:
+    python common/benchmarks/bench_session_features.py [--symbols 200] [--days 252] [--repeat 3]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.session_features import MARKET_TZ, early_close_days, session_features
+
+
+def make_bars(n_symbols, n_days, seed=0):
+    """Synthetic 5m bars；每檔隨機缺漏 3% 的 K 棒。"""
+    rng = np.random.default_rng(seed)
+    days = pd.bdate_range('2024-01-02', periods=n_days)
+    clock = pd.timedelta_range('04:00:00', '19:55:00', freq='5min')
+    local = (days.values[:, None] + clock.values[None, :]).reshape(-1)
+    utc = pd.DatetimeIndex(local).tz_localize(MARKET_TZ).tz_convert('UTC').tz_localize(None)
+    n = len(utc)
+    ret = rng.normal(0, 0.002, (n, n_symbols))
+    close = 50 * np.exp(np.cumsum(ret, axis=0))
+    open_ = close / np.exp(ret)
+    idx = pd.MultiIndex.from_product([[f"S{i:03d}" for i in range(n_symbols)], utc], names=['symbol', 'timestamp'])
+    df = pd.DataFrame({
+        'Open': open_.T.reshape(-1), 'High': np.maximum(open_, close).T.reshape(-1) * 1.001,
+        'Low': np.minimum(open_, close).T.reshape(-1) * 0.999, 'Close': close.T.reshape(-1),
+        'Volume': rng.integers(100, 10000, n * n_symbols).astype(np.float64),
+    }, index=idx)
+    return df[rng.random(len(df)) > 0.03]
+
+
+def reference(bars):
+    """pandas 寫法：轉美東時間後依時刻切段 (含提早收盤日)，再 groupby (symbol, date)。"""
+    local = bars.reset_index()
+    local['timestamp'] = local['timestamp'].dt.tz_localize('UTC').dt.tz_convert(MARKET_TZ)
+    local['date'] = local['timestamp'].dt.tz_localize(None).dt.normalize()
+    t = local['timestamp'].dt.hour * 60 + local['timestamp'].dt.minute
+    early = pd.to_datetime(sorted(early_close_days(local['date'].dt.year.unique())))
+    close_t = np.where(local['date'].isin(early), 780, 960)
+    rth = local[(t >= 570) & (t < close_t)].groupby(['symbol', 'date'])
+    pm = local[(t >= 240) & (t < 570)].groupby(['symbol', 'date'])
+    out = pd.DataFrame({'open': rth['Open'].first(), 'close': rth['Close'].last(), 'pm_high': pm['High'].max()})
+    prev = out.groupby(level='symbol')['close'].shift(1)
+    out['Overnight_Gap'] = out['open'] / prev - 1
+    out['PM_High_Pct'] = out['pm_high'] / prev - 1
+    return out.rename_axis(['symbol', 'timestamp'])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--symbols', type=int, default=200)
+    parser.add_argument('--days', type=int, default=252)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    bars = make_bars(args.symbols, args.days)
+    print(f"Bars: {args.symbols} symbols x {args.days} days of 5m ({len(bars):,} rows)")
+
+    times = []
+    for _ in range(args.repeat):
+        t0 = time.perf_counter()
+        sess = session_features(bars)
+        times.append(time.perf_counter() - t0)
+    print(f"session_features: {min(times):.2f}s -> {len(sess):,} symbol-days, {sess.shape[1]} features")
+
+    t0 = time.perf_counter()
+    ref = reference(bars)
+    print(f"pandas groupby reference (2 of the features): {time.perf_counter() - t0:.2f}s")
+    ref = ref.reindex(sess.index)
+    for col in ['Overnight_Gap', 'PM_High_Pct']:
+        assert np.allclose(sess[col], ref[col], equal_nan=True, rtol=1e-12), col
+    print("Overnight_Gap / PM_High_Pct match the groupby reference.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmark: wide -> long conversion (V5.3 01_format_data).
+
+比較舊路徑 (stack -> reset_index -> rename -> set_index -> 逐欄 to_numeric)
+與 common.reshape.wide_to_long 的 wall time 與峰值記憶體 (tracemalloc)。
+
+Usage:
+    python common/benchmarks/bench_wide_to_long.py [--symbols 200] [--years 10]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.reshape import wide_to_long
+
+
+def make_wide(n_symbols, n_years, seed=0):
+    """Synthetic yf.download(group_by='ticker') 寬表：(Ticker, Price) 欄位，含上市前 NaN。"""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2015-01-01', periods=252 * n_years, name='Date')
+    symbols = [f"S{i:04d}" for i in range(n_symbols)]
+    fields = ['Open', 'High', 'Low', 'Close', 'Volume']
+    data = rng.random((len(dates), n_symbols * len(fields))) * 100
+    cols = pd.MultiIndex.from_product([symbols, fields], names=['Ticker', 'Price'])
+    wide = pd.DataFrame(data, index=dates, columns=cols)
+    # 模擬部分標的晚上市
+    for sym in symbols[::7]:
+        wide.loc[wide.index[:300], sym] = np.nan
+    return wide
+
+
+def legacy_format(df):
+    """Reference: the original robust_stack + format_ticker_data path."""
+    l0 = df.columns.get_level_values(0)
+    stack_level = 1 if ('Close' in l0 or 'Open' in l0) else 0
+    df_stacked = df.stack(level=stack_level, future_stack=True).reset_index()
+    df_stacked.columns = df_stacked.columns.str.lower()
+    df_stacked = df_stacked.rename(columns={'date': 'timestamp', 'ticker': 'symbol'})
+    df_stacked['timestamp'] = pd.to_datetime(df_stacked['timestamp'])
+    df_stacked = df_stacked.set_index(['timestamp', 'symbol']).sort_index()
+    for col in ['open', 'high', 'low', 'close', 'volume']:
+        if col in df_stacked.columns:
+            df_stacked[col] = pd.to_numeric(df_stacked[col], errors='coerce')
+    return df_stacked
+
+
+def measure(fn, df):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    t0 = time.perf_counter()
+    out = fn(df)
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return out, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--symbols', type=int, default=200)
+    parser.add_argument('--years', type=int, default=10)
+    args = parser.parse_args()
+
+    wide = make_wide(args.symbols, args.years)
+    input_mb = wide.memory_usage(deep=True).sum() / 1e6
+    print(f"Input: {wide.shape[0]} dates x {args.symbols} symbols x 5 fields ({input_mb:.1f} MB)")
+
+    old, t_old, peak_old = measure(legacy_format, wide)
+    new, t_new, peak_new = measure(wide_to_long, wide)
+
+    # 欄位名稱 (columns.name) 也必須與舊路徑相同，不可用 new[old.columns] 重排 (會沿用 old 的名稱)
+    pd.testing.assert_frame_equal(old, new, check_names=True)
+    for layout in [wide.iloc[:50, :25], wide.iloc[:50, :25].swaplevel(0, 1, axis=1).sort_index(axis=1)]:
+        pd.testing.assert_frame_equal(legacy_format(layout), wide_to_long(layout), check_names=True)
+    print("Parity: OK (identical values, index, column names and dtypes; both column layouts)")
+
+    print(f"{'path':<14} {'wall (s)':>9} {'peak (MB)':>10} {'peak / input':>13}")
+    for name, t, peak in [('legacy stack', t_old, peak_old), ('wide_to_long', t_new, peak_new)]:
+        print(f"{name:<14} {t:>9.3f} {peak / 1e6:>10.1f} {peak / 1e6 / input_mb:>12.2f}x")
+    print(f"Speedup: {t_old / t_new:.1f}x | Peak memory reduction: {peak_old / peak_new:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
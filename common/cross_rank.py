@@ -0,0 +1,438 @@
+"""
+Cross-sectional rank / score engine on wide (date x symbol) matrices.
+
+舊做法 (V5.3 04_build_l3_ranking) 對長表做三次 groupby(level='timestamp').rank(pct=True)，
+回測器再於每天的候選清單上 sort_values。這裡把因子排成日期對齊的矩陣，每列 (每天) 一次向量化：
+
+    cs = CrossSection.from_long(df, ['RSI_2', 'Amihud_Illiquidity', 'Down_Vol_Prop'])
+    score = rank_score(cs, {'RSI_2': 1.0, 'Amihud_Illiquidity': 0.5, 'Down_Vol_Prop': 0.5})
+    df['L3_Rank_Score'] = cs.to_series(score)
+    cols, valid = top_k(score, 5)          # 每天分數最高的 5 檔 (不排序整列)
+    order = row_order(score)               # 每天由高到低的標的順序 (回測器預先算好，不必逐日排序)
+
+pct_rank 與 pandas rank(pct=True, method='average', na_option='keep') 的結果完全相同
+(同值取平均名次、NaN 不參與排名也不計入分母)。
+
+quantile_grades 是 LambdaRank 的每日等級標籤 (V5.1 04_train_meta_labeling_l3)：長表一次排序，
+取代 groupby(level='timestamp').apply(qcut(rank(method='first'))) 的逐日 Python 迴圈，結果完全相同。
+"""
+import numpy as np
+import pandas as pd
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+from common.indicator_kernels import use_numba
+
+# 排名 key 的 NaN 層 (高位)：排在所有有值者 (含 +inf = 0xFFF0...) 之後
+NAN_KEY = np.uint64(0xFFF8000000000000)
+
+
+class CrossSection:
+    """Long (timestamp, symbol) frame <-> date-aligned (date x symbol) matrices; present 標記當天有資料的標的。"""
+
+    def __init__(self, index, rows, cols, dates, symbols, matrices):
+        self.index = index
+        self.rows = rows
+        self.cols = cols
+        self.dates = dates
+        self.symbols = symbols
+        self.matrices = matrices
+        self.flat = rows * len(symbols) + cols  # 長表每列在 (date x symbol) 矩陣攤平後的位置
+        self.present = np.zeros((len(dates), len(symbols)), dtype=bool)
+        self.present.reshape(-1)[self.flat] = True
+
+    @classmethod
+    def from_long(cls, df, columns, symbol_level='symbol', time_level='timestamp'):
+        rows, dates = _level_codes(df.index, time_level)
+        cols, symbols = _level_codes(df.index, symbol_level)
+        cs = cls(df.index, rows, cols, dates, symbols, {})
+        for col in columns:
+            cs.matrices[col] = cs.to_matrix(df[col].to_numpy(dtype=np.float64, na_value=np.nan))
+        return cs
+
+    def __getitem__(self, col):
+        return self.matrices[col]
+
+    def to_matrix(self, values):
+        mat = np.full(self.present.shape, np.nan, dtype=np.float64)
+        mat.reshape(-1)[self.flat] = values
+        return mat
+
+    def to_series(self, values, name=None):
+        """Maps a (date x symbol) result back onto the original long index."""
+        return pd.Series(np.ravel(values)[self.flat], index=self.index, name=name)
+
+
+def _level_codes(index, level):
+    """
+    (codes, sorted uniques) of one index level；MultiIndex 的 levels 已排序時直接用 codes，省去 factorize。
+    未用到的 level 值在這裡剔除 (比 remove_unused_levels 重建整個 MultiIndex 便宜)。
+    """
+    if isinstance(index, pd.MultiIndex):
+        i = index._get_level_number(level)
+        uniques = index.levels[i]
+        codes = np.asarray(index.codes[i], dtype=np.intp)
+        if uniques.is_monotonic_increasing and (len(codes) == 0 or codes.min() >= 0):
+            used = np.zeros(len(uniques), dtype=bool)
+            used[codes] = True
+            if used.all():
+                return codes, uniques
+            return (np.cumsum(used) - 1)[codes], uniques[used]
+    return pd.factorize(index.get_level_values(level), sort=True)
+
+
+# --- numba kernels (pct_rank / rank_score / top_k) ---
+def _rank_key_loop(x, bits, keys):
+    # 保序的 uint64 (負數整個取反、正數設最高位；-0.0 視同 0.0)，低 bits 位換成欄位編號；NaN 一律為 NAN_KEY
+    n, m = x.shape
+    high = ~np.uint64((1 << bits) - 1)
+    sign = np.uint64(1) << np.uint64(63)
+    for i in range(n):
+        for j in range(m):
+            v = x[i, j]
+            if v != v:
+                k = NAN_KEY
+            else:
+                b = np.float64(v + 0.0).view(np.uint64)
+                k = (~b if b & sign else b | sign) & high
+            keys[i, j] = k | np.uint64(j)
+    return keys
+
+
+def _rank_sorted_loop(x, keys, bits, out, weight, invert, accumulate):
+    # keys 已逐列排序；term = weight * pct_rank (invert 時為 weight * (1 - pct_rank))，accumulate 時加到 out 上
+    n, m = x.shape
+    low = np.uint64((1 << bits) - 1)
+    cols = np.empty(m, dtype=np.int64)
+    vals = np.empty(m)
+    for i in range(n):
+        xi = x[i]
+        ki = keys[i]
+        oi = out[i]
+        valid = m
+        inverted = False
+        for j in range(m):
+            c = np.int64(ki[j] & low)
+            v = xi[c]
+            if v != v:  # NaN 的 key 最大，其後全是 NaN
+                valid = j
+                for a in range(j, m):
+                    oi[np.int64(ki[a] & low)] = np.nan
+                break
+            cols[j] = c
+            vals[j] = v
+            if j > 0 and v < vals[j - 1]:
+                inverted = True
+        if inverted:
+            # 截掉的低位只會讓高位相同的值依欄位編號排：逆序都在相鄰的小區段內，插入排序即可修正
+            for a in range(1, valid):
+                v = vals[a]
+                if v < vals[a - 1]:
+                    c = cols[a]
+                    b = a - 1
+                    while b >= 0 and vals[b] > v:
+                        vals[b + 1] = vals[b]
+                        cols[b + 1] = cols[b]
+                        b -= 1
+                    vals[b + 1] = v
+                    cols[b + 1] = c
+        # 同值區段 [j, e)：平均名次 ((j + e - 1) / 2 + 1) / valid，與 pandas rank(pct=True) 相同
+        j = 0
+        while j < valid:
+            e = j + 1
+            while e < valid and vals[e] == vals[j]:
+                e += 1
+            r = ((j + e - 1) / 2.0 + 1.0) / valid
+            term = ((1.0 - r) if invert else r) * weight
+            if accumulate:
+                for a in range(j, e):
+                    oi[cols[a]] += term
+            else:
+                for a in range(j, e):
+                    oi[cols[a]] = term
+            j = e
+    return out
+
+
+def _top_k_loop(x, present, use_present, negate, k, cols, valid):
+    # 每列一趟：維持前 k 名的有序緩衝區，比較 (層, 值)；同值時先出現 (欄位較小) 者在前，與 row_order 相同
+    n, m = x.shape
+    tiers = np.empty(k, dtype=np.int64)
+    vals = np.empty(k)
+    for i in range(n):
+        count = 0
+        for j in range(m):
+            v = x[i, j]
+            if use_present and not present[i, j]:
+                tier = 2
+                v = 0.0
+            elif v != v:
+                tier = 1
+                v = 0.0
+            else:
+                tier = 0
+                v = -v if negate else v
+            if count == k and not (tier < tiers[k - 1] or (tier == tiers[k - 1] and v < vals[k - 1])):
+                continue
+            pos = count if count < k else k - 1
+            while pos > 0 and (tier < tiers[pos - 1] or (tier == tiers[pos - 1] and v < vals[pos - 1])):
+                tiers[pos] = tiers[pos - 1]
+                vals[pos] = vals[pos - 1]
+                cols[i, pos] = cols[i, pos - 1]
+                pos -= 1
+            tiers[pos] = tier
+            vals[pos] = v
+            cols[i, pos] = j
+            if count < k:
+                count += 1
+        for a in range(k):
+            valid[i, a] = tiers[a] < 2 if use_present else tiers[a] == 0
+    return cols, valid
+
+
+if njit is not None:
+    _jit = njit(cache=True, nogil=True, error_model='numpy')
+    _rank_keys_numba = _jit(_rank_key_loop)
+    _rank_sorted_numba = _jit(_rank_sorted_loop)
+    _top_k_numba = _jit(_top_k_loop)
+else:
+    _rank_keys_numba = _rank_sorted_numba = _top_k_numba = None
+
+
+def pct_rank(x, backend=None):
+    """
+    Percentile rank within each row = pandas rank(pct=True) (method='average')。
+    numba：每列的值與欄位編號壓成 uint64 key，以 np.sort 排序 (比 argsort 快一個數量級)，再一趟算同值平均名次；
+    未安裝 numba 時改用 _pct_rank_numpy。兩者結果完全相同。
+    """
+    x = np.asarray(x, dtype=np.float64)
+    if use_numba(backend) and x.size:
+        return _rank_terms_numba(x, np.empty_like(x), 1.0, invert=False, accumulate=False, keys=None)
+    return _pct_rank_numpy(x)
+
+
+def _rank_terms_numba(x, out, weight, invert, accumulate, keys=None):
+    x = np.ascontiguousarray(x)
+    bits = max(1, (x.shape[1] - 1).bit_length())
+    keys = _rank_keys_numba(x, bits, np.empty(x.shape, dtype=np.uint64) if keys is None else keys)
+    keys.sort(axis=1)
+    return _rank_sorted_numba(x, keys, bits, out, float(weight), invert, accumulate)
+
+
+def _pct_rank_numpy(x):
+    """
+    每列 argsort 一次 (NaN 排在最後；同值取平均，不需 stable sort)，同值區段以起迄位置取平均名次，再除以該列非 NaN 的個數。
+    """
+    n, m = x.shape
+    order = np.argsort(x, axis=1)
+    xs = np.take_along_axis(x, order, axis=1)
+    valid = ~np.isnan(xs)
+    pos = np.broadcast_to(np.arange(m), (n, m))
+
+    # 同值區段 (ties)：start = 區段第一個位置、end = 最後一個位置 (NaN != NaN，各自成一段)
+    first = np.ones((n, m), dtype=bool)
+    first[:, 1:] = xs[:, 1:] != xs[:, :-1]
+    last = np.ones((n, m), dtype=bool)
+    last[:, :-1] = first[:, 1:]
+    start = np.maximum.accumulate(np.where(first, pos, 0), axis=1)
+    end = np.minimum.accumulate(np.where(last, pos, m - 1)[:, ::-1], axis=1)[:, ::-1]
+
+    count = valid.sum(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ranked = np.where(valid, ((start + end) / 2.0 + 1.0) / count, np.nan)
+    out = np.empty_like(ranked)
+    np.put_along_axis(out, order, ranked, axis=1)
+    return out
+
+
+GRADE_QUANTILES = (0, 0.5, 0.8, 0.95, 1.0)
+
+
+def _qcut_edges(n, q):
+    """pd.qcut 對 rank 1..n 算出的分界 (Series.quantile，與 qcut 內部同一算法，逐位元相同)。"""
+    return pd.Series(np.arange(1, n + 1, dtype=np.float64)).quantile(list(q)).to_numpy()
+
+
+def quantile_grades(values, level='timestamp', q=GRADE_QUANTILES, min_size=4):
+    """
+    Per-group grades 0..len(q)-2 of a long Series, identical to
+
+        def get_daily_grades(group):
+            if len(group) < min_size:
+                return (group > 0).astype(int)
+            try:
+                return pd.qcut(group.rank(method='first'), q=q, labels=range(len(q) - 1)).astype(int)
+            except Exception:
+                return (group > 0).astype(int)
+        values.groupby(level=level, group_keys=False).apply(get_daily_grades)
+
+    (回傳值對齊 values 的原始順序)。rank(method='first') = 組內穩定排序的位置 (同值依原本順序)；
+    qcut 的分界只與組大小 n 有關，每種 n 算一次；grade = 分界 e1..e_k 中小於 rank 的個數。
+    含 NaN 的組 (qcut 結果無法轉 int) 與分界重複的組 (qcut 會 raise) 改用 (value > 0)，與 except 分支相同。
+    """
+    codes, _ = _level_codes(values.index, level)
+    codes = np.asarray(codes, dtype=np.intp)
+    x = values.to_numpy(dtype=np.float64, na_value=np.nan)
+    grades = (x > 0).astype(np.int64)
+    if len(x) == 0:
+        return pd.Series(grades, index=values.index, name=values.name)
+
+    sizes = np.bincount(codes)
+    has_nan = np.bincount(codes, weights=np.isnan(x), minlength=len(sizes)) > 0
+    qcut_group = (sizes >= min_size) & ~has_nan
+    unique_sizes = np.unique(sizes[qcut_group])
+    edges = np.array([_qcut_edges(n, q) for n in unique_sizes]).reshape(len(unique_sizes), len(q))
+    bad = (np.diff(edges, axis=1) <= 0).any(axis=1)  # 分界重複 -> qcut raise
+    if bad.any():
+        qcut_group &= ~np.isin(sizes, unique_sizes[bad])
+    rows = np.flatnonzero(qcut_group[codes])
+    if len(rows) == 0:
+        return pd.Series(grades, index=values.index, name=values.name)
+
+    # 組內名次：依 (組, 值) 穩定排序 (lexsort 為 stable，同值保留原本順序 = method='first')
+    order = np.lexsort((x, codes))
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    rank = np.empty(len(x), dtype=np.float64)
+    rank[order] = np.arange(len(x)) - starts[codes[order]] + 1
+
+    row_edges = edges[np.searchsorted(unique_sizes, sizes[codes[rows]])]
+    grades[rows] = (row_edges[:, 1:] < rank[rows, None]).sum(axis=1)
+    return pd.Series(grades, index=values.index, name=values.name)
+
+
+def rank_score(cs, weights, higher_is_better=()):
+    """
+    Weighted sum of per-day percentile ranks: sum(w * (1 - pct_rank))，因子值越小分數越高；
+    列在 higher_is_better 的因子改用 w * pct_rank。任一因子為 NaN 則分數為 NaN (與長表寫法相同)。
+    """
+    if use_numba() and cs.present.size and weights:
+        # 名次、加權與加總在同一趟完成，不產生中間矩陣 (運算順序與下方相同，結果逐位元一致)
+        score = np.empty(cs.present.shape)
+        keys = np.empty(cs.present.shape, dtype=np.uint64)
+        for i, (name, weight) in enumerate(weights.items()):
+            _rank_terms_numba(cs[name], score, weight, invert=name not in higher_is_better, accumulate=i > 0,
+                              keys=keys)
+        return score
+    score = None
+    for name, weight in weights.items():
+        rank = _pct_rank_numpy(cs[name])
+        term = (rank if name in higher_is_better else 1 - rank) * weight
+        score = term if score is None else score + term
+    return score
+
+
+def row_order(values, ascending=False, present=None):
+    """
+    Column order of each row sorted by value (預設由高到低)，同值依欄位順序 (symbol 字母序)。
+    與 sort_values(na_position='last') 相同，有資料但值為 NaN 者排在最後；present=False 的欄再排其後。
+    """
+    x = np.asarray(values, dtype=np.float64)
+    # 分層 (有值 / NaN / present=False) 後依值穩定排序；lexsort 為 stable，同值保留欄位順序
+    nan = np.isnan(x)
+    tier = nan.astype(np.int8) if present is None else np.where(present, nan, 2).astype(np.int8)
+    key = np.where(tier > 0, 0.0, x if ascending else -x)
+    return np.lexsort((key, tier), axis=1)
+
+
+def top_k(values, k, ascending=False, present=None, backend=None):
+    """
+    Each row's best k columns (不排序整列)，順序與 row_order(values, ascending, present)[:, :k] 相同。
+    Returns (cols, valid)：cols 為 (n_dates, k) 欄位索引；valid 標記該名次是否有分數 (當天不足 k 檔時為 False)。
+    給定 present 時 valid 改為標記 present (有資料但分數為 NaN 者也算，排在有分數者之後)，可直接當作每日候選清單：
+        cols, valid = top_k(score, max_positions, present=candidates)   # candidates: 每日符合條件的 (date x symbol)
+        targets = cols[i][valid[i]]
+    numba：每列一趟維持前 k 名 (_top_k_loop)；否則以 argpartition 取前 k 名再排序。
+    """
+    x = np.ascontiguousarray(values, dtype=np.float64)
+    k = min(k, x.shape[1])
+    if k == 0:
+        return np.zeros((len(x), 0), dtype=np.int64), np.zeros((len(x), 0), dtype=bool)
+    if use_numba(backend):
+        use_present = present is not None
+        present = np.ascontiguousarray(present, dtype=bool) if use_present else np.empty((0, 0), dtype=bool)
+        return _top_k_numba(x, present, use_present, not ascending, k, np.empty((len(x), k), dtype=np.int64),
+                           np.empty((len(x), k), dtype=bool))
+    if present is not None:
+        cols = row_order(x, ascending, present)[:, :k]
+        return cols, np.take_along_axis(np.asarray(present, dtype=bool), cols, axis=1)
+    key = x if ascending else -x  # NaN 在 argpartition / lexsort 中排在 inf 之後
+    kth = np.take_along_axis(key, np.argpartition(key, k - 1, axis=1)[:, k - 1:k], axis=1)
+    # 第 k 名若有同值，argpartition 任意挑一檔；改為取所有更好的 + 同值中欄位最小的幾檔 (與 row_order 一致)
+    nan, kth_nan = np.isnan(key), np.isnan(kth)
+    better = (key < kth) | (~nan & kth_nan)
+    tied = (key == kth) | (nan & kth_nan)
+    take = better | (tied & (np.cumsum(tied, axis=1) <= k - better.sum(axis=1, keepdims=True)))
+    part = np.nonzero(take)[1].reshape(len(key), k)
+    part_key = np.take_along_axis(key, part, axis=1)
+    # 再依 (分數, 欄位) 排序這 k 檔
+    order = np.lexsort((part, part_key), axis=1)
+    cols = np.take_along_axis(part, order, axis=1)
+    return cols, ~np.isnan(np.take_along_axis(x, cols, axis=1))
+
+
+def top_k_frame(cs, values, k, name='score', ascending=False):
+    """top_k() as a long DataFrame (timestamp, rank) -> symbol, score；只含有分數的名次。"""
+    cols, valid = top_k(values, k, ascending=ascending)
+    rows = np.broadcast_to(np.arange(len(cols))[:, None], cols.shape)[valid]
+    ranks = np.broadcast_to(np.arange(1, cols.shape[1] + 1), cols.shape)[valid]
+    cols = cols[valid]
+    index = pd.MultiIndex.from_arrays([cs.dates[rows], ranks], names=['timestamp', 'rank'])
+    return pd.DataFrame({'symbol': cs.symbols[cols], name: values[rows, cols]}, index=index)
+
+
+# 簡單測試用
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    idx = pd.MultiIndex.from_product([pd.bdate_range('2024-01-01', periods=50), [f"S{i:02d}" for i in range(30)]],
+                                     names=['timestamp', 'symbol'])
+    df = pd.DataFrame({'a': rng.integers(0, 5, len(idx)).astype(float), 'b': rng.random(len(idx))}, index=idx)
+    df.loc[df.sample(frac=0.1, random_state=1).index, 'a'] = np.nan
+    df = df.sample(frac=0.9, random_state=2)  # 部分標的某些天沒有資料
+
+    cs = CrossSection.from_long(df, ['a', 'b'])
+    for col in ['a', 'b']:
+        ref = df.groupby(level='timestamp')[col].rank(pct=True)
+        assert np.array_equal(cs.to_series(pct_rank(cs[col])).to_numpy(), ref.to_numpy(), equal_nan=True), col
+    score = rank_score(cs, {'a': 1.0, 'b': 0.5})
+    print(top_k_frame(cs, score, 3).head(6))
+
+    # 排序 key 的邊界：只差最低位的值 (截位後 key 相同)、±0、±inf、NaN、present=False
+    x = 1 + rng.integers(0, 3, (40, 300)) * np.finfo(float).eps
+    x[:, :20] = [-0.0, 0.0, np.inf, -np.inf] * 5
+    x[rng.random(x.shape) < 0.1] = np.nan
+    present = rng.random(x.shape) < 0.9
+    ref = pd.DataFrame(x).rank(axis=1, pct=True).to_numpy()
+    rows = np.arange(len(x))[:, None]
+    for backend in ['numba', 'numpy']:
+        assert np.array_equal(pct_rank(x, backend=backend), ref, equal_nan=True), backend
+    for ascending in [False, True]:
+        for mask in [None, present]:
+            order = row_order(x, ascending, mask)
+            tier = np.where(True if mask is None else mask, np.isnan(x), 2)
+            key = np.where(tier > 0, 0.0, x if ascending else -x)
+            for i in range(len(x)):
+                expected = sorted(range(x.shape[1]), key=lambda j: (tier[i, j], key[i, j], j))
+                assert np.array_equal(order[i], expected), (ascending, i)
+            # top_k：前 k 名與 row_order 相同；valid = 有分數 (present 給定時為 present)
+            for backend in ['numba', 'numpy']:
+                cols, valid = top_k(x, 7, ascending, mask, backend=backend)
+                assert np.array_equal(cols, order[:, :7]), (backend, ascending)
+                assert np.array_equal(valid, tier[rows, cols] < (1 if mask is None else 2)), (backend, ascending)
+    print("pct_rank matches pandas rank(pct=True); row_order / top_k match sorted(): OK")
+
+    def get_daily_grades(group):
+        if len(group) < 4:
+            return (group > 0).astype(int)
+        try:
+            return pd.qcut(group.rank(method='first'), q=list(GRADE_QUANTILES), labels=[0, 1, 2, 3]).astype(int)
+        except Exception:
+            return (group > 0).astype(int)
+
+    target = df['a'] - 2  # 整數值製造同值；部分天只剩少數標的
+    target = target[rng.random(len(target)) > 0.3 * (target.index.get_level_values('timestamp').day % 3)]
+    ref = target.groupby(level='timestamp', group_keys=False).apply(get_daily_grades)
+    assert quantile_grades(target).reindex(ref.index).equals(ref)
+    print("quantile_grades matches groupby.apply(qcut(rank(method='first'))): OK")
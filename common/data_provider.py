@@ -0,0 +1,294 @@
+"""
+Pluggable market-data providers (行情資料來源介面).
+
+各腳本原本直接呼叫 yf.download(...)，每支都有自己的 group_by / auto_adjust / prepost
+組合與 MultiIndex 清理。這裡統一成 DataProvider 介面，輸出固定為
+{symbol: DataFrame[Open, High, Low, Close, Volume]}：
+
+    - YFinanceProvider : 線上 yfinance (auto_adjust=True)
+    - ReplayProvider   : 從錄製好的 Parquet fixtures 回放，可模擬網路延遲 (完全離線、結果可重現)
+    - RecordingProvider: 包裝其他 provider，邊下載邊把結果寫成 fixtures
+
+切換方式 (環境變數，腳本不需修改)：
+    DATA_PROVIDER=yfinance | replay | record   (預設 yfinance)
+    DATA_FIXTURE_DIR=<path>                    (預設 <repo>/data/fixtures)
+    REPLAY_LATENCY=<seconds>                   (每次呼叫模擬延遲，預設 0)
+
+Fixture layout:
+    {fixture_dir}/{interval}[_prepost]/{symbol}.parquet
+
+每個 provider 都會累計 I/O 時間 (io_seconds)，timing_summary() 可區分一個步驟的
+wall time 中有多少是 I/O、多少是運算。
+"""
+import os
+import re
+import time
+from typing import Dict, Optional, Protocol, Sequence
+
+import numpy as np
+import pandas as pd
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+DEFAULT_FIXTURE_DIR = os.environ.get('DATA_FIXTURE_DIR', os.path.join(REPO_ROOT, 'data', 'fixtures'))
+
+OHLCV_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+
+class DataProvider(Protocol):
+    """
+    download(symbols, start, end, interval, prepost, period) -> {symbol: OHLCV DataFrame}
+
+    start/end 為 [start, end)；或改用 yfinance 風格的 period ('5d', '1mo', '3mo', '10y', 'max')。
+    下載失敗的標的不會出現在結果中；請求成功但區間內無資料者為空 DataFrame。
+    """
+    name: str
+    io_seconds: float
+    calls: int
+
+    def download(self, symbols: Sequence[str], start=None, end=None, interval: str = '1d',
+                 prepost: bool = False, period: Optional[str] = None) -> Dict[str, pd.DataFrame]:
+        ...
+
+
+def split_by_symbol(raw, symbols):
+    """
+    Splits a yf.download result into {symbol: OHLCV DataFrame}.
+    Handles (Price, Ticker), (Ticker, Price) and flat single-ticker layouts.
+    Rows where every price field is NaN (e.g. before IPO) are dropped.
+    """
+    bars = {}
+    if raw is None or raw.empty:
+        return bars
+
+    if isinstance(raw.columns, pd.MultiIndex):
+        l0 = raw.columns.get_level_values(0)
+        ticker_level = 1 if ('Close' in l0 or 'Open' in l0) else 0
+        available = set(raw.columns.get_level_values(ticker_level))
+        for sym in symbols:
+            if sym not in available:
+                continue
+            bars[sym] = raw.xs(sym, axis=1, level=ticker_level)
+    else:
+        # 單一標的且未分組時 yfinance 回傳扁平欄位
+        if len(symbols) == 1:
+            bars[symbols[0]] = raw
+
+    for sym, df in list(bars.items()):
+        cols = [c for c in OHLCV_COLUMNS if c in df.columns]
+        df = df[cols].dropna(how='all', subset=[c for c in cols if c != 'Volume'])
+        df.columns.name = None
+        bars[sym] = df
+    return bars
+
+
+def interval_key(interval, prepost=False):
+    return f"{interval}_prepost" if prepost else interval
+
+
+def period_to_offset(period):
+    """'5d' / '3mo' / '10y' / '2wk' / '730d' -> pd.DateOffset; 'max' -> None."""
+    if period is None or period == 'max':
+        return None
+    m = re.fullmatch(r'(\d+)(d|wk|mo|y)', period)
+    if not m:
+        raise ValueError(f"Unsupported period: {period}")
+    n, unit = int(m.group(1)), m.group(2)
+    return {
+        'd': pd.DateOffset(days=n),
+        'wk': pd.DateOffset(weeks=n),
+        'mo': pd.DateOffset(months=n),
+        'y': pd.DateOffset(years=n),
+    }[unit]
+
+
+class BaseProvider:
+    """共用的 I/O 計時與呼叫統計。子類別實作 _download()。"""
+    name = 'base'
+
+    def __init__(self):
+        self.io_seconds = 0.0
+        self.calls = 0
+
+    def download(self, symbols, start=None, end=None, interval='1d', prepost=False, period=None):
+        if isinstance(symbols, str):
+            symbols = [symbols]
+        symbols = list(dict.fromkeys(symbols))
+        t0 = time.perf_counter()
+        try:
+            return self._download(symbols, start, end, interval, prepost, period)
+        finally:
+            self.io_seconds += time.perf_counter() - t0
+            self.calls += 1
+
+    def _download(self, symbols, start, end, interval, prepost, period):
+        raise NotImplementedError
+
+    def timing_summary(self, wall_seconds):
+        """Formats the I/O vs compute split of a step's wall time."""
+        io = min(self.io_seconds, wall_seconds)
+        compute = wall_seconds - io
+        pct = io / wall_seconds * 100 if wall_seconds > 0 else 0.0
+        return (f"[Timing] provider={self.name} wall={wall_seconds:.2f}s | "
+                f"I/O={io:.2f}s ({pct:.0f}%, {self.calls} calls) | compute={compute:.2f}s")
+
+
+class YFinanceProvider(BaseProvider):
+    """Online provider: one batched yf.download per call (auto_adjust=True, group_by='ticker')."""
+    name = 'yfinance'
+
+    def __init__(self, timeout=30):
+        super().__init__()
+        self.timeout = timeout
+
+    def _download(self, symbols, start, end, interval, prepost, period):
+        import yfinance as yf
+
+        kwargs = dict(
+            interval=interval,
+            auto_adjust=True,
+            prepost=prepost,
+            group_by='ticker',
+            progress=False,
+            threads=True,
+            timeout=self.timeout
+        )
+        if period is not None:
+            kwargs['period'] = period
+        else:
+            kwargs['start'] = start
+            kwargs['end'] = end
+        try:
+            raw = yf.download(symbols, **kwargs)
+        except Exception as e:
+            print(f"[DataProvider] yfinance download failed for {len(symbols)} symbols: {e}")
+            return {}
+        return split_by_symbol(raw, symbols)
+
+
+class ReplayProvider(BaseProvider):
+    """
+    Offline provider serving recorded Parquet fixtures.
+    period 以 fixture 最後一根 K 棒為基準往回切，確保每次回放結果相同。
+    latency / per_symbol_latency 用於模擬網路延遲 (秒)。
+    """
+    name = 'replay'
+
+    def __init__(self, fixture_dir=None, latency=0.0, per_symbol_latency=0.0):
+        super().__init__()
+        self.fixture_dir = fixture_dir or DEFAULT_FIXTURE_DIR
+        self.latency = latency
+        self.per_symbol_latency = per_symbol_latency
+
+    def fixture_path(self, symbol, interval, prepost=False):
+        safe_symbol = symbol.replace(os.sep, '_')
+        return os.path.join(self.fixture_dir, interval_key(interval, prepost), f"{safe_symbol}.parquet")
+
+    def _download(self, symbols, start, end, interval, prepost, period):
+        time.sleep(self.latency + self.per_symbol_latency * len(symbols))
+
+        bars = {}
+        for sym in symbols:
+            path = self.fixture_path(sym, interval, prepost)
+            if not os.path.exists(path):
+                continue
+            df = pd.read_parquet(path).sort_index()
+            df = self._slice(df, start, end, period)
+            if not df.empty:
+                bars[sym] = df
+        return bars
+
+    @staticmethod
+    def _slice(df, start, end, period):
+        if df.empty:
+            return df
+        idx = df.index
+        tz = getattr(idx, 'tz', None)
+
+        def _ts(value):
+            ts = pd.Timestamp(value)
+            if tz is not None and ts.tzinfo is None:
+                ts = ts.tz_localize(tz)
+            elif tz is None and ts.tzinfo is not None:
+                ts = ts.tz_localize(None)
+            return ts
+
+        if period is not None:
+            offset = period_to_offset(period)
+            if offset is None:
+                return df
+            return df[idx > idx.max().normalize() - offset]
+
+        mask = np.ones(len(idx), dtype=bool)
+        if start is not None:
+            mask &= idx >= _ts(start)
+        if end is not None:
+            mask &= idx < _ts(end)
+        return df[mask]
+
+
+class RecordingProvider(BaseProvider):
+    """包裝任一 provider，將下載結果合併寫入 fixture 目錄 (供 ReplayProvider 使用)。"""
+    name = 'record'
+
+    def __init__(self, inner=None, fixture_dir=None):
+        super().__init__()
+        self.inner = inner or YFinanceProvider()
+        self.replay = ReplayProvider(fixture_dir)
+
+    def _download(self, symbols, start, end, interval, prepost, period):
+        bars = self.inner.download(symbols, start, end, interval, prepost, period)
+        for sym, df in bars.items():
+            path = self.replay.fixture_path(sym, interval, prepost)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if os.path.exists(path):
+                existing = pd.read_parquet(path)
+                df = pd.concat([existing, df])
+                df = df[~df.index.duplicated(keep='last')]
+            tmp_path = path + '.tmp'
+            df.sort_index().to_parquet(tmp_path)
+            os.replace(tmp_path, path)
+        return bars
+
+
+_PROVIDER = None
+
+
+def get_provider(name=None):
+    """
+    Returns the process-wide provider selected by DATA_PROVIDER (或指定 name)。
+    同一行程共用同一個 instance，因此 io_seconds 會累計整個步驟的 I/O 時間。
+    """
+    global _PROVIDER
+    name = name or os.environ.get('DATA_PROVIDER', 'yfinance')
+    if _PROVIDER is not None and _PROVIDER.name == name:
+        return _PROVIDER
+
+    if name == 'yfinance':
+        provider = YFinanceProvider()
+    elif name == 'replay':
+        provider = ReplayProvider(latency=float(os.environ.get('REPLAY_LATENCY', 0.0)))
+    elif name == 'record':
+        provider = RecordingProvider()
+    else:
+        raise ValueError(f"Unknown DATA_PROVIDER: {name} (expected yfinance / replay / record)")
+    _PROVIDER = provider
+    return provider
+
+
+# 簡單測試用
+if __name__ == "__main__":
+    import tempfile
+
+    fixture_dir = tempfile.mkdtemp()
+    idx = pd.bdate_range('2024-01-01', '2024-06-28', name='Date')
+    demo = pd.DataFrame({'Open': 1.0, 'High': 2.0, 'Low': 0.5, 'Close': 1.5, 'Volume': 100}, index=idx)
+    os.makedirs(os.path.join(fixture_dir, '1d'), exist_ok=True)
+    demo.to_parquet(os.path.join(fixture_dir, '1d', 'DEMO.parquet'))
+
+    replay = ReplayProvider(fixture_dir, latency=0.05)
+    t0 = time.perf_counter()
+    out = replay.download(['DEMO', 'MISSING'], period='1mo')
+    print({k: (v.index.min().date(), v.index.max().date(), len(v)) for k, v in out.items()})
+    out = replay.download('DEMO', start='2024-03-01', end='2024-04-01')
+    print({k: (v.index.min().date(), v.index.max().date(), len(v)) for k, v in out.items()})
+    print(replay.timing_summary(time.perf_counter() - t0))
@@ -0,0 +1,328 @@
+"""
+Feature dependency graph with content-hash caching (02_build_features 用).
+
+以前新增一個特徵 (例如 V5.1 的 sector 特徵、V5.3 的 Amihud) 就得把所有標的的所有指標整個重算。
+這裡把每個特徵宣告成一個節點，明確列出輸入 (原始欄位或其他節點) 與參數：
+
+    graph = FeatureGraph(['open', 'high', 'low', 'close', 'volume'])
+    graph.add('SMA_200', sma, ['close'], {'length': 200}, min_bars=200)
+    graph.add('RSI_2', rsi, ['close'], {'length': 2}, min_bars=3)
+    graph.add('Dist_SMA_200', lambda close, sma_200: close / sma_200 - 1, ['close', 'SMA_200'])
+    features = graph.compute(df, cache_dir=os.path.join(track_features_dir, 'cache'))
+
+- 節點函式與 common.indicators 相同：輸入 / 輸出都是 (bar x symbol) 矩陣 (BarMatrix 排列)，
+  各標的獨立計算，因此只重算部分標的的結果與整體重算完全相同。
+- 節點 key = hash(名稱, 函式原始碼, 參數, min_bars, version, 各輸入節點的 key)；
+  程式碼或參數改了，該節點與所有下游節點都會失效。函式內部呼叫的 helper 改動偵測不到，需手動調高 version。
+- 每個標的另有原始資料 hash (timestamp + 原始欄位)，節點 key 未變時只重算資料有變動 / 新增的標的。
+- 快取為 cache_dir/{節點}.parquet + manifest.json；刪除 cache_dir 即可強制全部重算。
+- compute(..., workers=N)：待算標的切成 N 段交給 fork 出來的行程，(field, bar, symbol) 面板只在
+  multiprocessing.shared_memory 配置一次，子行程直接讀原始欄位並把結果寫回自己負責的欄。
+"""
+import hashlib
+import inspect
+import json
+import multiprocessing as mp
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from common.indicators import BarMatrix
+
+GRAPH_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+
+
+def _digest(*parts):
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(str(part).encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def code_fingerprint(fn):
+    """Module + qualified name + source of fn (原始碼取不到時只用名稱)。"""
+    try:
+        source = inspect.getsource(fn)
+    except (OSError, TypeError):
+        source = ''
+    return _digest(getattr(fn, '__module__', ''), getattr(fn, '__qualname__', repr(fn)), source)
+
+
+def symbol_hashes(df, columns, symbol_level='symbol', time_level='timestamp'):
+    """{symbol: hash of its (timestamp, columns) rows}；列的順序不影響結果。"""
+    sym_codes, symbols = pd.factorize(df.index.get_level_values(symbol_level), sort=True)
+    ts = df.index.get_level_values(time_level)
+    rows = pd.DataFrame({'__ts': ts.to_numpy()}).assign(
+        **{str(c): df[c].to_numpy() for c in columns})
+    row_hash = pd.util.hash_pandas_object(rows, index=False).to_numpy()
+
+    order = np.lexsort((ts.to_numpy(), sym_codes))
+    bounds = np.cumsum(np.bincount(sym_codes, minlength=len(symbols)))[:-1]
+    chunks = np.split(row_hash[order], bounds)
+    return {sym: hashlib.sha1(chunk.tobytes()).hexdigest() for sym, chunk in zip(symbols, chunks)}
+
+
+class Feature:
+    """One node of the graph: values = fn(*input matrices, **params)，再套用 min_bars。"""
+
+    def __init__(self, name, fn, inputs, params=None, min_bars=0, version=1):
+        self.name = name
+        self.fn = fn
+        self.inputs = list(inputs)
+        self.params = dict(params or {})
+        self.min_bars = min_bars
+        self.version = version
+
+    def __repr__(self):
+        args = ', '.join(self.inputs + [f"{k}={v}" for k, v in self.params.items()])
+        return f"{self.name} = {getattr(self.fn, '__name__', 'fn')}({args})"
+
+
+class FeatureGraph:
+    """Ordered feature nodes over a set of raw columns; compute() 依宣告順序 (即拓撲順序) 計算。"""
+
+    def __init__(self, raw_columns, symbol_level='symbol', time_level='timestamp'):
+        self.raw_columns = list(raw_columns)
+        self.symbol_level = symbol_level
+        self.time_level = time_level
+        self.features = {}
+
+    def add(self, name, fn, inputs, params=None, min_bars=0, version=1):
+        if name in self.features or name in self.raw_columns:
+            raise ValueError(f"Feature '{name}' is already defined.")
+        for col in inputs:
+            if col not in self.features and col not in self.raw_columns:
+                raise ValueError(f"Feature '{name}': unknown input '{col}' (輸入必須先宣告)。")
+        self.features[name] = Feature(name, fn, inputs, params, min_bars, version)
+        return self
+
+    def node_keys(self):
+        keys = {}
+        for name, feat in self.features.items():
+            inputs = [keys.get(col, f"raw:{col}") for col in feat.inputs]
+            keys[name] = _digest(GRAPH_VERSION, name, code_fingerprint(feat.fn),
+                                 json.dumps(feat.params, sort_keys=True, default=repr),
+                                 feat.min_bars, feat.version, *inputs)
+        return keys
+
+    def compute(self, df, cache_dir=None, columns=None, workers=1):
+        """
+        Returns a DataFrame of feature values aligned with df.index.
+        cache_dir=None 時全部重算；columns 指定只回傳部分節點 (依賴仍會計算)。
+        workers > 1 時把待算標的切給 process pool (見 _run_parallel)。
+        """
+        keys = self.node_keys()
+        names = list(self.features)
+        sym = df.index.get_level_values(self.symbol_level)
+        raw_hash = symbol_hashes(df, self.raw_columns, self.symbol_level, self.time_level)
+        symbols = list(raw_hash)
+
+        # 1. 各節點需要重算的標的：節點 key 改變 -> 全部；否則只有原始資料變動 / 新增者
+        manifest = _load_manifest(cache_dir) if cache_dir else {}
+        values = {}
+        dirty = {}
+        for name in names:
+            values[name] = np.full(len(df), np.nan)
+            entry = manifest.get(name)
+            dirty[name] = set(symbols)
+            if entry is not None and entry.get('key') == keys[name]:
+                changed = {s for s in symbols if entry['symbols'].get(s) != raw_hash[s]}
+                cached = _read_node(cache_dir, name) if len(changed) < len(symbols) else None
+                if cached is not None:
+                    values[name][:] = cached.reindex(df.index).to_numpy()
+                    dirty[name] = changed
+
+        # 2. 有任一節點要重算的標的排成一個 (field, bar, symbol) 面板：原始欄位 + 各節點 (已快取的值先填入)
+        work = set().union(*dirty.values())
+        if work:
+            work_mask = sym.isin(list(work))
+            bars = BarMatrix.from_long(df.loc[work_mask, self.raw_columns], self.raw_columns,
+                                       self.symbol_level, self.time_level)
+            fields = self.raw_columns + names
+            todo = np.array([np.isin(bars.symbols, list(dirty[name])) for name in names]).reshape(len(names), -1)
+            shape = (len(fields), int(bars.n_bars.max()), len(bars.symbols))
+
+            def fill(panel):
+                for k, col in enumerate(self.raw_columns):
+                    panel[k] = bars[col]
+                for k, name in enumerate(names, start=len(self.raw_columns)):
+                    panel[k] = bars.to_matrix(values[name][work_mask])
+
+            def collect(panel):
+                for k, name in enumerate(names, start=len(self.raw_columns)):
+                    values[name][work_mask] = np.take(panel[k], bars.flat)
+
+            if workers > 1 and len(bars.symbols) > 1 and _can_fork():
+                _run_parallel(self, fields, shape, fill, collect, todo, bars.n_bars, workers)
+            else:
+                if workers > 1:
+                    print("  [FeatureGraph] Warning: 'fork' start method unavailable, computing serially.")
+                panel = np.empty(shape)
+                fill(panel)
+                _compute_columns(list(self.features.values()), fields, panel, todo, bars.n_bars,
+                                 np.arange(shape[2]))
+                collect(panel)
+
+        # 3. 快取：有重算或標的集合改變的節點才重寫；manifest 最後寫
+        if cache_dir:
+            new_manifest = {}
+            for k, (name, feat) in enumerate(self.features.items()):
+                entry = manifest.get(name)
+                n_dirty = len(dirty[name])
+                if n_dirty or entry is None or set(entry['symbols']) != set(symbols):
+                    _write_node(cache_dir, name, pd.Series(values[name], index=df.index, name=name))
+                if n_dirty:
+                    print(f"  [FeatureGraph] {feat!r}: recomputed {n_dirty}/{len(symbols)} symbols")
+                new_manifest[name] = {'key': keys[name], 'symbols': raw_hash}
+            _save_manifest(cache_dir, new_manifest)
+            n_cached = sum(1 for name in names if not dirty[name])
+            print(f"  [FeatureGraph] {n_cached}/{len(names)} features fully cached.")
+
+        names = columns or names
+        return pd.DataFrame({name: values[name] for name in names}, index=df.index)
+
+
+def _compute_columns(features, fields, panel, todo, n_bars, cols):
+    """
+    Computes every node (宣告順序) for the symbol columns cols of panel, in place.
+    todo[k, j]：節點 k 在標的 j 是否需要重算；不需要的欄位保留已填入的快取值。
+    各標的彼此獨立，所以不同行程可以各自負責一段 cols 寫入同一個面板。
+    """
+    field_index = {f: i for i, f in enumerate(fields)}
+    for k, feat in enumerate(features):
+        js = cols[todo[k, cols]]
+        if not len(js):
+            continue
+        args = [panel[field_index[col]][:, js] for col in feat.inputs]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result = np.array(feat.fn(*args, **feat.params), dtype=np.float64)
+        if feat.min_bars:
+            # 與 BarMatrix.to_series(min_bars=...) 相同：K 棒數不足的標的整段為 NaN
+            result[:, n_bars[js] < feat.min_bars] = np.nan
+        panel[field_index[feat.name]][:, js] = result
+
+
+# --- Parallel build ---
+_FORK_JOB = None  # fork 前設定，子行程直接繼承 (graph 內的 lambda 無法 pickle)
+
+
+def _can_fork():
+    return 'fork' in mp.get_all_start_methods()
+
+
+def _run_parallel(graph, fields, shape, fill, collect, todo, n_bars, workers):
+    """
+    Publishes the (field, bar, symbol) panel once in multiprocessing.shared_memory and splits the
+    symbol columns across a fork-based pool. 子行程繼承同一段 MAP_SHARED 映射，
+    原始 OHLCV 不經過 pickle，結果直接寫回預先配置好的面板 (各行程負責不重疊的欄)。
+    """
+    global _FORK_JOB
+    shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * 8, 1))
+    try:
+        panel = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        fill(panel)
+        chunks = [c for c in np.array_split(np.arange(shape[2]), workers) if len(c)]
+        _FORK_JOB = (list(graph.features.values()), fields, panel, todo, n_bars)
+        try:
+            with mp.get_context('fork').Pool(len(chunks)) as pool:
+                pool.map(_compute_chunk, chunks)
+        finally:
+            _FORK_JOB = None
+        collect(panel)
+        del panel
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _compute_chunk(cols):
+    features, fields, panel, todo, n_bars = _FORK_JOB
+    _compute_columns(features, fields, panel, todo, n_bars, cols)
+    return len(cols)
+
+
+# --- Cache files ---
+def _load_manifest(cache_dir):
+    path = os.path.join(cache_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+        return data['features'] if data.get('version') == GRAPH_VERSION else {}
+    except Exception as e:
+        print(f"  [FeatureGraph] Failed to load {path}, recomputing all features: {e}")
+        return {}
+
+
+def _save_manifest(cache_dir, manifest):
+    # 節點檔先寫、manifest 最後寫：中途中斷時 manifest 仍描述舊狀態，下次只會多算不會誤用
+    path = os.path.join(cache_dir, MANIFEST_NAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'version': GRAPH_VERSION, 'features': manifest}, f)
+    os.replace(tmp_path, path)
+
+
+def _node_path(cache_dir, name):
+    return os.path.join(cache_dir, f"{name}.parquet")
+
+
+def _read_node(cache_dir, name):
+    path = _node_path(cache_dir, name)
+    if not os.path.exists(path):
+        return None
+    try:
+        return pd.read_parquet(path)[name]
+    except Exception as e:
+        print(f"  [FeatureGraph] Failed to read cached {name}: {e}")
+        return None
+
+
+def _write_node(cache_dir, name, series):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _node_path(cache_dir, name)
+    series.to_frame().to_parquet(path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+# 簡單測試用
+if __name__ == "__main__":
+    import tempfile
+    import time
+
+    from common.indicators import atr, rsi, sma
+
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range('2020-01-01', periods=600)
+    symbols = [f"S{i:03d}" for i in range(200)]
+    idx = pd.MultiIndex.from_product([dates, symbols], names=['timestamp', 'symbol'])
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, (len(dates), len(symbols))), axis=0)).reshape(-1)
+    df = pd.DataFrame({'high': close * 1.01, 'low': close * 0.99, 'close': close}, index=idx)
+
+    def make_graph(with_atr):
+        graph = FeatureGraph(['high', 'low', 'close'])
+        graph.add('SMA_200', sma, ['close'], {'length': 200}, min_bars=200)
+        graph.add('RSI_2', rsi, ['close'], {'length': 2}, min_bars=3)
+        graph.add('Dist_SMA_200', lambda close, sma_200: close / sma_200 - 1, ['close', 'SMA_200'])
+        if with_atr:
+            graph.add('ATR_14', atr, ['high', 'low', 'close'], {'length': 14}, min_bars=15)
+        return graph
+
+    changed = df.copy()
+    changed.loc[changed.index.get_level_values('symbol') == 'S007', 'close'] *= 1.1
+
+    cache_dir = tempfile.mkdtemp()
+    for label, graph, frame in [('cold', make_graph(False), df), ('warm', make_graph(False), df),
+                                ('+ATR_14', make_graph(True), df), ('S007 changed', make_graph(True), changed)]:
+        print(f"--- {label} ---")
+        t0 = time.perf_counter()
+        cached = graph.compute(frame, cache_dir=cache_dir)
+        elapsed = time.perf_counter() - t0
+        full = graph.compute(frame)
+        assert np.allclose(cached.to_numpy(), full.to_numpy(), rtol=0, atol=0, equal_nan=True)
+        print(f"  {elapsed:.2f}s, identical to full recompute")
@@ -0,0 +1,271 @@
+"""
+Concurrent rate-limited fetcher (並行 + 限速下載器).
+
+取代舊版「逐檔下載 + time.sleep(REQUEST_DELAY)」的序列迴圈：
+    - TokenBucket 控制整體請求速率 (requests / second，允許小量 burst)
+    - ThreadPoolExecutor 限制同時進行中的請求數
+    - 每檔標的獨立重試，指數退避 + jitter，避免同時撞牆
+    - progress callback 回報進度
+
+回傳格式與舊版 fetch_data 相同：{ticker: DataFrame}，失敗 / 無資料的標的不會出現在結果中。
+fetch_one 必須以例外回報失敗 (空結果也要 raise，見 require_bars)，重試迴圈才看得到。
+"""
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+from common.data_provider import OHLCV_COLUMNS
+
+
+class RateLimitError(Exception):
+    """Provider 回報被限速 (HTTP 429 類型錯誤)。"""
+
+
+class EmptyResultError(Exception):
+    """Provider 沒有回傳任何 K 棒 (可能是暫時失敗，重試)。"""
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket.
+    rate: 每秒補充的 token 數；capacity: 最多可累積的 token 數 (允許的 burst 大小)。
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1.0):
+        """Blocks until `tokens` are available, then consumes them."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def _is_rate_limited(exc):
+    if isinstance(exc, RateLimitError):
+        return True
+    # yfinance 會以 YFRateLimitError / 含 "Too Many Requests" 訊息的例外回報
+    name = type(exc).__name__
+    return 'RateLimit' in name or '429' in str(exc) or 'Too Many Requests' in str(exc)
+
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=30.0, rate_limited=False):
+    """Full-jitter exponential backoff. 被限速時退避加倍。"""
+    ceiling = min(max_delay, base_delay * (2 ** attempt) * (2 if rate_limited else 1))
+    return random.uniform(0, ceiling)
+
+
+def fetch_concurrent(symbols, fetch_one, max_workers=8, rate=4.0, burst=None,
+                     max_retries=3, base_delay=1.0, max_delay=30.0, progress=None):
+    """
+    Fetches every symbol with `fetch_one(symbol) -> DataFrame | None` concurrently.
+
+    Args:
+        max_workers: 同時進行中的請求上限。
+        rate / burst: token bucket 參數 (每秒請求數 / 最大 burst)。
+        max_retries: 每檔標的首次失敗後的重試次數。
+        progress: callback(done, total, symbol, error)；error 為 None 表示成功。
+
+    Returns:
+        {symbol: DataFrame}，空結果或重試耗盡的標的會被略過。
+    """
+    symbols = list(dict.fromkeys(symbols))
+    bucket = TokenBucket(rate, burst)
+    total = len(symbols)
+    results = {}
+    done = 0
+    done_lock = threading.Lock()
+
+    def _worker(symbol):
+        last_exc = None
+        for attempt in range(max_retries + 1):
+            bucket.acquire()
+            try:
+                return fetch_one(symbol), None
+            except Exception as e:
+                last_exc = e
+                if attempt < max_retries:
+                    time.sleep(backoff_delay(attempt, base_delay, max_delay, _is_rate_limited(e)))
+        return None, last_exc
+
+    if total == 0:
+        return results
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, total))) as pool:
+        futures = {pool.submit(_worker, sym): sym for sym in symbols}
+        for fut in as_completed(futures):
+            symbol = futures[fut]
+            df, error = fut.result()
+            if error is not None:
+                print(f"[Error] Failed to fetch {symbol}: {error}")
+            elif df is not None and not df.empty:
+                results[symbol] = df
+            with done_lock:
+                done += 1
+                if progress is not None:
+                    progress(done, total, symbol, error)
+    return results
+
+
+def tqdm_progress(desc=None):
+    """Returns a progress callback backed by tqdm (若未安裝 tqdm 則每 10% 印一行)。"""
+    state = {}
+    try:
+        from tqdm import tqdm
+    except ImportError:
+        tqdm = None
+
+    def _callback(done, total, symbol, error):
+        if tqdm is not None:
+            if 'bar' not in state:
+                state['bar'] = tqdm(total=total, desc=desc)
+            state['bar'].update(1)
+            if done == total:
+                state.pop('bar').close()
+        else:
+            step = max(1, total // 10)
+            if done % step == 0 or done == total:
+                print(f"{desc or 'Fetching'}: {done}/{total}")
+
+    return _callback
+
+
+def require_bars(symbol, df):
+    """空結果視為失敗 (raise)，交給 fetch_concurrent 重試；否則原樣回傳。"""
+    if df is None or df.empty:
+        raise EmptyResultError(f"No data returned for {symbol}")
+    return df
+
+
+def yf_fetch_one(start, end, interval='1d', prepost=False):
+    """
+    Builds a single-ticker yfinance fetch function for fetch_concurrent.
+
+    yf.download 會在內部吞掉每檔的錯誤 (含 429) 並回傳空表，重試 / 限速退避永遠不會觸發；
+    這裡改用 Ticker.history(raise_errors=True) 讓錯誤往外拋，空結果也視為失敗。
+    輸出格式與 yf.download(auto_adjust=True) 相同：OHLCV 欄，日線以上的 index 不帶時區。
+    """
+    import yfinance as yf
+
+    intraday = interval[-1] in 'mh'
+
+    def _fetch(symbol):
+        df = yf.Ticker(symbol).history(
+            start=start,
+            end=end,
+            interval=interval,
+            auto_adjust=True,
+            prepost=prepost,
+            timeout=30,
+            raise_errors=True
+        )
+        df = require_bars(symbol, df)
+        df = df[[c for c in OHLCV_COLUMNS if c in df.columns]]
+        if not intraday and df.index.tz is not None:
+            df.index = df.index.tz_localize(None)
+        df.columns.name = None
+        return df
+
+    return _fetch
+
+
+def concurrent_downloader(max_workers=8, rate=4.0, burst=None, max_retries=3, progress=None,
+                          fetch_factory=yf_fetch_one):
+    """
+    Adapts fetch_concurrent to the BarStore downloader signature:
+        downloader(symbols, start, end, interval, prepost) -> {symbol: DataFrame}
+    """
+    def _download(symbols, start, end, interval='1d', prepost=False):
+        fetch_one = fetch_factory(start, end, interval, prepost)
+        return fetch_concurrent(symbols, fetch_one, max_workers=max_workers, rate=rate, burst=burst,
+                                max_retries=max_retries, progress=progress)
+
+    return _download
+
+
+class FakeProvider:
+    """
+    本地假資料源：模擬網路延遲與 429 限速錯誤，用於測試並行 / 重試 / 限速行為。
+    """
+    def __init__(self, latency=0.2, jitter=0.1, error_rate=0.2, max_rps=None, n_bars=250, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.max_rps = max_rps
+        self.n_bars = n_bars
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._recent = []
+        self.calls = 0
+        self.errors = 0
+
+    def fetch(self, symbol):
+        with self._lock:
+            self.calls += 1
+            now = time.monotonic()
+            self._recent = [t for t in self._recent if now - t < 1.0]
+            self._recent.append(now)
+            over_limit = self.max_rps is not None and len(self._recent) > self.max_rps
+            fail = over_limit or self._rng.random() < self.error_rate
+            delay = self.latency + self._rng.uniform(0, self.jitter)
+            if fail:
+                self.errors += 1
+        time.sleep(delay)
+        if fail:
+            raise RateLimitError(f"429 Too Many Requests ({symbol})")
+
+        idx = pd.bdate_range('2024-01-01', periods=self.n_bars, name='Date')
+        close = 100 + pd.Series(range(self.n_bars), index=idx, dtype=float) * 0.1
+        return pd.DataFrame({
+            'Open': close, 'High': close + 1, 'Low': close - 1, 'Close': close, 'Volume': 1_000_000
+        }, index=idx)
+
+
+# 簡單測試用
+if __name__ == "__main__":
+    tickers = [f"T{i:03d}" for i in range(150)]
+
+    provider = FakeProvider(latency=0.2, error_rate=0.15, max_rps=25)
+    t0 = time.perf_counter()
+    data = fetch_concurrent(tickers, provider.fetch, max_workers=16, rate=20, burst=20,
+                            max_retries=5, base_delay=0.2, progress=tqdm_progress('fake'))
+    elapsed = time.perf_counter() - t0
+
+    print(f"Fetched {len(data)}/{len(tickers)} tickers in {elapsed:.1f}s "
+          f"(calls={provider.calls}, injected errors={provider.errors})")
+    print(f"Serial loop w/ 1s sleep would take ~{len(tickers) * (1.0 + provider.latency):.0f}s")
+
+    # 空結果 / 429 必須進入重試迴圈 (真實 provider 的 429 以 YFRateLimitError 之類的例外拋出)
+    class YFRateLimitError(Exception):
+        pass
+
+    attempts = {}
+    bars = FakeProvider(latency=0, error_rate=0).fetch('X')
+
+    def flaky_fetch(symbol):
+        n = attempts[symbol] = attempts.get(symbol, 0) + 1
+        if symbol == 'EMPTY' and n < 3:
+            return require_bars(symbol, bars.iloc[:0])
+        if symbol == 'THROTTLED' and n < 3:
+            raise YFRateLimitError("Too Many Requests. Rate limited. Try after a while.")
+        return require_bars(symbol, bars if symbol != 'GONE' else None)
+
+    errors = {}
+    data = fetch_concurrent(['EMPTY', 'THROTTLED', 'GONE'], flaky_fetch, rate=100, max_retries=3, base_delay=0.01,
+                            progress=lambda done, total, symbol, error: errors.update({symbol: error}))
+    assert sorted(data) == ['EMPTY', 'THROTTLED'] and attempts == {'EMPTY': 3, 'THROTTLED': 3, 'GONE': 4}
+    assert _is_rate_limited(YFRateLimitError()) and isinstance(errors['GONE'], EmptyResultError)
+    print("Empty results and 429s are retried: OK")
@@ -0,0 +1,138 @@
+"""
+Compact dtype schema for universe / feature Parquet files.
+
+universe_daily.parquet / stock_features.parquet 原本全部是 float64 + object symbol，
+這裡統一成較精簡的型別 (約可縮小 2~3 倍的檔案與記憶體)：
+
+    - 價格 / 指標 : float32   (float64 -> float32，7 位有效數字對股價與技術指標足夠)
+    - volume      : Int64     (pandas nullable 整數；缺值保持 <NA>，不可當成 0 成交量，否則 Rel_Vol / Amihud 會誤判)
+    - symbol      : category  (Parquet 端為 dictionary<int32, string>)
+    - timestamp   : 以時間排序寫出，搭配 row-group statistics 讓讀取端能跳過不需要的區段
+
+讀取：
+    read_compact_parquet(path)                      -> 保持精簡型別 (round-trip)
+    read_compact_parquet(path, compute_dtypes=True) -> float64 (volume 的 <NA> -> NaN) / object symbol，供運算與回測使用
+    read_features(path, columns, start, end, symbols) -> 只讀需要的欄位與 row groups (pushdown)
+        (numpy 2 的型別提升規則下，Python float 與 np.float32 運算結果仍為 float32，
+         資金帳務若混入 float32 會累積誤差，因此回測一律以 float64 執行)
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+DEFAULT_ROW_GROUP_SIZE = 64_000
+SYMBOL_TYPE = pa.dictionary(pa.int32(), pa.string())
+
+
+def _is_volume(name):
+    return str(name).lower() == 'volume'
+
+
+def compact_frame(df, keep_float64=()):
+    """Returns a copy of df with the compact schema applied (columns and 'symbol' index level)."""
+    out = df.copy()
+    for col in out.columns:
+        dtype = out[col].dtype
+        if _is_volume(col):
+            if pd.api.types.is_numeric_dtype(dtype):
+                out[col] = out[col].round().astype('Int64')
+        elif dtype == np.float64 and col not in keep_float64:
+            out[col] = out[col].astype(np.float32)
+        elif col == 'symbol':
+            out[col] = out[col].astype('category')
+
+    # MultiIndex 的 symbol level 本身即為 codes + unique levels，寫檔時再轉 dictionary
+    return out
+
+
+def to_table(df):
+    """DataFrame (compact) -> Arrow table with a fixed dictionary<int32, string> symbol type."""
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    if 'symbol' in table.schema.names:
+        i = table.schema.get_field_index('symbol')
+        table = table.set_column(i, pa.field('symbol', SYMBOL_TYPE), table.column(i).cast(SYMBOL_TYPE))
+    return table
+
+
+def sort_for_storage(df):
+    """(timestamp, symbol) 時間主序排序；若 index 不含 timestamp 則維持 sort_index()。"""
+    if isinstance(df.index, pd.MultiIndex) and 'timestamp' in df.index.names:
+        order = ['timestamp'] + [n for n in df.index.names if n != 'timestamp']
+        return df.sort_index(level=order, sort_remaining=False)
+    return df.sort_index()
+
+
+def write_compact_parquet(df, path, row_group_size=DEFAULT_ROW_GROUP_SIZE, keep_float64=()):
+    """Writes df with the compact schema, time-sorted, with row-group statistics."""
+    table = to_table(compact_frame(sort_for_storage(df), keep_float64=keep_float64))
+    tmp_path = path + '.tmp'
+    pq.write_table(table, tmp_path, row_group_size=row_group_size, write_statistics=True)
+    os.replace(tmp_path, path)
+
+
+def to_compute_dtypes(df):
+    """float32 / nullable Int64 (volume) -> float64 (<NA> -> NaN), categorical symbol -> object (運算 / 回測用)。"""
+    out = df
+    float_cols = [c for c in df.columns if df[c].dtype == np.float32 or isinstance(df[c].dtype, pd.Int64Dtype)]
+    if float_cols:
+        out = out.astype({c: np.float64 for c in float_cols})
+    if 'symbol' in out.columns and isinstance(out['symbol'].dtype, pd.CategoricalDtype):
+        out = out.assign(symbol=out['symbol'].astype(object))
+    if isinstance(out.index, pd.MultiIndex) and 'symbol' in out.index.names:
+        level = out.index.names.index('symbol')
+        if isinstance(out.index.levels[level], pd.CategoricalIndex):
+            out.index = out.index.set_levels(out.index.levels[level].astype(object), level=level)
+    elif isinstance(out.index, pd.CategoricalIndex):
+        out.index = out.index.astype(object)
+    return out
+
+
+def read_compact_parquet(path, columns=None, filters=None, compute_dtypes=False):
+    """
+    Reads a Parquet file written by write_compact_parquet (或任何舊檔，向下相容)。
+    filters 直接傳給 pyarrow，可利用 timestamp row-group statistics 跳過不需要的區段。
+    """
+    df = pd.read_parquet(path, columns=columns, filters=filters)
+    return to_compute_dtypes(df) if compute_dtypes else df
+
+
+def build_filters(path, start=None, end=None, symbols=None):
+    """
+    [start, end] (皆含) 與 symbols -> pyarrow filters。
+    timestamp 依檔案 schema 的時區對齊，避免 naive / tz-aware 比較錯誤。
+    """
+    schema = pq.read_schema(path)
+    filters = []
+    if start is not None or end is not None:
+        tz = schema.field('timestamp').type.tz
+        for bound, op in ((start, '>='), (end, '<=')):
+            if bound is None:
+                continue
+            ts = pd.Timestamp(bound)
+            if tz is not None and ts.tzinfo is None:
+                ts = ts.tz_localize(tz)
+            elif tz is None and ts.tzinfo is not None:
+                ts = ts.tz_localize(None)
+            filters.append(('timestamp', op, ts))
+    if symbols is not None:
+        filters.append(('symbol', 'in', list(symbols)))
+    return filters or None
+
+
+def read_features(path, columns=None, start=None, end=None, symbols=None, compute_dtypes=True):
+    """
+    Column-projected, date / symbol filtered read (projection + predicate pushdown).
+
+    只解碼 columns 指定的欄位 (index 欄位會自動帶入)；檔案以 timestamp 排序寫出，
+    因此 start / end 可藉由 row-group statistics 直接跳過整段不需要的資料。
+    """
+    filters = build_filters(path, start=start, end=end, symbols=symbols)
+    return read_compact_parquet(path, columns=columns, filters=filters, compute_dtypes=compute_dtypes)
+
+
+def footprint(df):
+    """In-RAM size in MB (deep)."""
+    return df.memory_usage(deep=True, index=True).sum() / 1e6
@@ -0,0 +1,122 @@
+"""
+Group-relative features on wide (date x symbol) matrices.
+
+舊做法 (V5.1 02_build_features_l0_v5)：寫死的 SECTOR_MAP，逐一 sector ETF 算 RSI / 報酬，再以
+(timestamp, sector) 查表對回每一檔。這裡把「標的 -> 群組」抽成 GroupMap (靜態 ETF 對照、GICS 檔、
+或分群結果皆可)，群組基準為 (date x group) 矩陣，以 codes 陣列一次 gather 回 (date x symbol)：
+
+    groups = GroupMap(SECTOR_MAP)                      # 或 GroupMap.read('gics.csv') / GroupMap.from_labels(symbols, labels)
+    codes = groups.codes(cs.symbols, bench.columns)    # 每檔標的對應的基準欄位 (-1 = 不屬於任何群組)
+    df['RSI_Divergence'] = cs.to_series(relative(cs['RSI_14'], bench_rsi, codes))
+
+群組沒有現成的基準序列 (ETF) 時，member_index() 以成員的等權日報酬合成群組指數，
+之後與 ETF 走同一條路 (RSI / 報酬 -> gather)，新增一個相對特徵只是多一次向量化 gather。
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+class GroupMap:
+    """Symbol -> group mapping (靜態 dict、檔案、或分群標籤)；不在對照表中的標的不屬於任何群組。"""
+
+    def __init__(self, mapping):
+        self.mapping = {str(k): str(v) for k, v in mapping.items() if v is not None and not pd.isna(v)}
+
+    @classmethod
+    def from_labels(cls, symbols, labels):
+        """Data-driven clusters (例如 KMeans 的 labels_)；標籤為負數者視為未分群。"""
+        return cls({s: f"G{int(g)}" for s, g in zip(symbols, labels) if int(g) >= 0})
+
+    @classmethod
+    def read(cls, path):
+        """
+        .json : {"NVDA": "XLK", ...}
+        .csv  : 兩欄 symbol,group (例如 GICS sector / industry)，欄名不拘，取前兩欄。
+        """
+        if os.path.splitext(path)[1].lower() == '.json':
+            with open(path, 'r', encoding='utf-8') as f:
+                return cls(json.load(f))
+        table = pd.read_csv(path, dtype=str)
+        return cls(dict(zip(table.iloc[:, 0].str.strip(), table.iloc[:, 1].str.strip())))
+
+    def __len__(self):
+        return len(self.mapping)
+
+    @property
+    def groups(self):
+        return pd.Index(sorted(set(self.mapping.values())))
+
+    def codes(self, symbols, groups=None):
+        """Column index (into groups) of each symbol's group；沒有群組或群組不在 groups 中者為 -1。"""
+        groups = self.groups if groups is None else pd.Index(groups)
+        labels = pd.Index(symbols).map(lambda s: self.mapping.get(s))
+        return groups.get_indexer(labels)
+
+
+def gather(group_values, codes):
+    """(date x group) -> (date x symbol)：每檔取其群組的欄位，codes == -1 者為 NaN。"""
+    group_values = np.asarray(group_values, dtype=np.float64)
+    padded = np.concatenate([group_values, np.full((len(group_values), 1), np.nan)], axis=1)
+    return padded[:, np.where(codes < 0, group_values.shape[1], codes)]
+
+
+def relative(values, group_values, codes):
+    """Stock minus group benchmark (例如 RSI_Divergence、Rel_Strength_Daily)。"""
+    return np.asarray(values, dtype=np.float64) - gather(group_values, codes)
+
+
+def group_mean(values, codes, n_groups):
+    """
+    Equal-weight mean of each group's members per date (略過 NaN)；當天沒有成員資料的群組為 NaN。
+    以 (symbol x group) one-hot 矩陣做一次矩陣乘法，不逐群組迴圈。
+    """
+    values = np.asarray(values, dtype=np.float64)
+    member = codes >= 0
+    onehot = np.zeros((len(codes), n_groups))
+    onehot[np.nonzero(member)[0], codes[member]] = 1.0
+    valid = ~np.isnan(values)
+    total = np.where(valid, values, 0.0) @ onehot
+    count = valid.astype(np.float64) @ onehot
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, total / count, np.nan)
+
+
+def member_index(returns, codes, n_groups):
+    """
+    Synthetic group "close" from members' equal-weight daily returns: cumprod(1 + mean return)，起點 1.0。
+    在群組第一筆成員資料之前為 NaN；中途沒有成員資料的日期沿用前一天的值。
+    """
+    mean_ret = group_mean(returns, codes, n_groups)
+    started = np.maximum.accumulate(~np.isnan(mean_ret), axis=0)
+    close = np.cumprod(1.0 + np.nan_to_num(mean_ret), axis=0)
+    return np.where(started, close, np.nan)
+
+
+# 簡單測試用
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range('2024-01-01', periods=60)
+    symbols = pd.Index(['AAA', 'BBB', 'CCC', 'DDD', 'EEE'])
+    ret = pd.DataFrame(rng.normal(0, 0.02, (len(dates), len(symbols))), index=dates, columns=symbols)
+    ret.iloc[:10, 1] = np.nan  # BBB 晚上市
+
+    groups = GroupMap({'AAA': 'X', 'BBB': 'X', 'CCC': 'Y', 'DDD': 'Y'})  # EEE 無群組
+    codes = groups.codes(symbols)
+    bench = group_mean(ret.to_numpy(), codes, len(groups.groups))
+    rel = relative(ret.to_numpy(), bench, codes)
+
+    # 對照長表寫法：每天每群組的平均，再以 (timestamp, group) 查表
+    long = ret.stack().rename('ret').reset_index()
+    long.columns = ['timestamp', 'symbol', 'ret']
+    long['group'] = long['symbol'].map(groups.mapping)
+    ref_bench = long.groupby(['timestamp', 'group'])['ret'].mean()
+    keys = pd.MultiIndex.from_arrays([long['timestamp'], long['group']])
+    ref = long['ret'].to_numpy() - ref_bench.reindex(keys).to_numpy()
+    got = pd.DataFrame(rel, index=dates, columns=symbols).stack(future_stack=True)
+    got = got.reindex(pd.MultiIndex.from_frame(long[['timestamp', 'symbol']])).to_numpy()
+    assert np.allclose(got, ref, equal_nan=True)
+    print(pd.DataFrame(member_index(ret.to_numpy(), codes, 2), index=dates, columns=groups.groups).tail(3))
+    print("group_mean / relative match groupby + lookup: OK")
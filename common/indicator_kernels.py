@@ -0,0 +1,305 @@
+"""
+Recursive indicator kernels (Wilder RMA / EMA) with an optional numba JIT path.
+
+RMA / EMA 是逐根遞迴的 (今天的值依賴昨天)，無法像 rolling sum 一樣沿時間軸向量化。
+common.indicators 的 RSI / ATR / EMA 都經由這裡的 ewm() 計算整個 (bar x symbol) 矩陣：
+
+    numba  : 一次 JIT 呼叫跑完整個矩陣 (逐列、列內逐欄，每欄各自處理 NaN 缺口)；
+             RSI / ATR 另有融合核心 (rsi_numba / atr_numba)，連 diff / true range 一起算，不產生中間矩陣
+    numpy  : 未安裝 numba 時的後備實作，逐列迴圈、每列對所有標的向量化
+參數網格 (rsi_grid_numba / atr_grid_numba)：diff / true range 每根只算一次，同一趟迴圈更新所有 length 的狀態；
+NumPy 後備則把各 length 的輸入並排成一個矩陣，以每欄各自的 alpha 跑一次 ewm。
+
+兩者都重現 pandas ewm(alpha, adjust=False, ignore_na=False).mean() 的語意
+(pandas_ta 未安裝 TA-Lib 時 rma / ema 的實作)。
+
+    set_backend('numpy')    # 強制使用 NumPy (比對 / 除錯用)，回傳原本的 backend
+"""
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+NUMBA_AVAILABLE = njit is not None
+BACKENDS = ('numba', 'numpy') if NUMBA_AVAILABLE else ('numpy',)
+_backend = BACKENDS[0]
+
+
+def set_backend(name):
+    """Selects 'numba' or 'numpy' for ewm(); returns the previous backend."""
+    global _backend
+    if name not in BACKENDS:
+        print(f"Warning: indicator backend '{name}' not available, keeping '{_backend}'.")
+        return _backend
+    previous, _backend = _backend, name
+    return previous
+
+
+def get_backend():
+    return _backend
+
+
+def _ewm_numpy(x, alpha):
+    # alpha 可為純量或每欄一個 (shape = x.shape[1:])
+    decay = 1.0 - alpha
+    out = np.empty_like(x)
+    if len(x) == 0:
+        return out
+    weighted = x[0].copy()
+    old_wt = np.ones(x.shape[1:])
+    out[0] = weighted
+    for t in range(1, len(x)):
+        cur = x[t]
+        obs = ~np.isnan(cur)
+        started = ~np.isnan(weighted)
+
+        # ignore_na=False：尚未開始以外，每一列 (含 NaN) 都讓舊權重衰減
+        old_wt = np.where(started, old_wt * decay, old_wt)
+        update = started & obs
+        blended = (old_wt * weighted + alpha * cur) / (old_wt + alpha)
+        weighted = np.where(update & (weighted != cur), blended, weighted)
+        old_wt = np.where(update, 1.0, old_wt)
+        weighted = np.where(~started & obs, cur, weighted)
+        out[t] = weighted
+    return out
+
+
+def _ewm_step(w, old_wt, cur, alpha, decay):
+    # 與 pandas._libs.window.aggregations.ewm (adjust=False, ignore_na=False) 相同的單步遞迴
+    if w == w:
+        old_wt *= decay
+        if cur == cur:
+            if w != cur:
+                w = (old_wt * w + alpha * cur) / (old_wt + alpha)
+            old_wt = 1.0
+    elif cur == cur:
+        w = cur
+    return w, old_wt
+
+
+def _ewm_loop(x, alpha):
+    n, m = x.shape
+    decay = 1.0 - alpha
+    out = np.empty_like(x)
+    weighted = np.full(m, np.nan)
+    old_wt = np.ones(m)
+    for t in range(n):
+        for j in range(m):
+            weighted[j], old_wt[j] = _ewm_step(weighted[j], old_wt[j], x[t, j], alpha, decay)
+            out[t, j] = weighted[j]
+    return out
+
+
+def _rsi_loop(close, length, scalar):
+    # diff -> 正 / 負部分 -> 兩條 RMA -> scalar * up / (up + |down|)，一次走完不產生中間矩陣
+    n, m = close.shape
+    alpha = 1.0 / length
+    decay = 1.0 - alpha
+    out = np.empty_like(close)
+    up = np.full(m, np.nan)
+    up_wt = np.ones(m)
+    down = np.full(m, np.nan)
+    down_wt = np.ones(m)
+    for t in range(n):
+        for j in range(m):
+            diff = close[t, j] - close[t - 1, j] if t > 0 else np.nan
+            positive = 0.0 if diff < 0 else diff
+            negative = 0.0 if diff > 0 else diff
+            up[j], up_wt[j] = _ewm_step(up[j], up_wt[j], positive, alpha, decay)
+            down[j], down_wt[j] = _ewm_step(down[j], down_wt[j], negative, alpha, decay)
+            out[t, j] = scalar * up[j] / (up[j] + abs(down[j]))
+    return out
+
+
+def _atr_loop(high, low, close, length, eps):
+    # true range (pandas_ta non_zero_range + 忽略 NaN 的 max) -> presma 起始值 -> RMA
+    n, m = close.shape
+    alpha = 1.0 / length
+    decay = 1.0 - alpha
+    out = np.empty_like(close)
+    bump = np.zeros(m)  # non_zero_range：該欄任一 high - low == 0 則整欄加 eps
+    for t in range(n):
+        for j in range(m):
+            if high[t, j] - low[t, j] == 0:
+                bump[j] = eps
+    head_sum = np.zeros(m)
+    head_count = np.zeros(m)
+    weighted = np.full(m, np.nan)
+    old_wt = np.ones(m)
+    for t in range(n):
+        for j in range(m):
+            tr = abs(high[t, j] - low[t, j] + bump[j])
+            if t > 0:
+                for r in (abs(high[t, j] - close[t - 1, j]), abs(close[t - 1, j] - low[t, j])):
+                    if tr != tr or r > tr:
+                        tr = r
+            if t < length:
+                if tr == tr:
+                    head_sum[j] += tr
+                    head_count[j] += 1
+                tr = np.nan
+                if t == length - 1 and head_count[j] > 0:
+                    tr = head_sum[j] / head_count[j]
+            weighted[j], old_wt[j] = _ewm_step(weighted[j], old_wt[j], tr, alpha, decay)
+            out[t, j] = weighted[j]
+    return out
+
+
+def _rsi_grid_loop(close, lengths, scalar):
+    # _rsi_loop 的多 length 版本：每根 K 棒的 diff 與正 / 負部分只算一次，再更新每個 length 的 RMA 狀態
+    n, m = close.shape
+    k = len(lengths)
+    out = np.empty((k, n, m))
+    alphas = 1.0 / lengths
+    up = np.full((k, m), np.nan)
+    up_wt = np.ones((k, m))
+    down = np.full((k, m), np.nan)
+    down_wt = np.ones((k, m))
+    positive = np.empty(m)
+    negative = np.empty(m)
+    for t in range(n):
+        for j in range(m):
+            diff = close[t, j] - close[t - 1, j] if t > 0 else np.nan
+            positive[j] = 0.0 if diff < 0 else diff
+            negative[j] = 0.0 if diff > 0 else diff
+        for p in range(k):
+            alpha = alphas[p]
+            decay = 1.0 - alpha
+            for j in range(m):
+                up[p, j], up_wt[p, j] = _ewm_step(up[p, j], up_wt[p, j], positive[j], alpha, decay)
+                down[p, j], down_wt[p, j] = _ewm_step(down[p, j], down_wt[p, j], negative[j], alpha, decay)
+                out[p, t, j] = scalar * up[p, j] / (up[p, j] + abs(down[p, j]))
+    return out
+
+
+def _atr_grid_loop(high, low, close, lengths, eps):
+    # _atr_loop 的多 length 版本：每根 K 棒的 true range 與 presma 的累計和只算一次
+    n, m = close.shape
+    k = len(lengths)
+    out = np.empty((k, n, m))
+    alphas = 1.0 / lengths
+    bump = np.zeros(m)
+    for t in range(n):
+        for j in range(m):
+            if high[t, j] - low[t, j] == 0:
+                bump[j] = eps
+    head_sum = np.zeros(m)
+    head_count = np.zeros(m)
+    weighted = np.full((k, m), np.nan)
+    old_wt = np.ones((k, m))
+    tr = np.empty(m)
+    for t in range(n):
+        for j in range(m):
+            value = abs(high[t, j] - low[t, j] + bump[j])
+            if t > 0:
+                for r in (abs(high[t, j] - close[t - 1, j]), abs(close[t - 1, j] - low[t, j])):
+                    if value != value or r > value:
+                        value = r
+            if value == value:
+                head_sum[j] += value
+                head_count[j] += 1
+            tr[j] = value
+        for p in range(k):
+            length = lengths[p]
+            alpha = alphas[p]
+            decay = 1.0 - alpha
+            for j in range(m):
+                x = tr[j]
+                if t < length:
+                    x = np.nan
+                    if t == length - 1 and head_count[j] > 0:
+                        x = head_sum[j] / head_count[j]
+                weighted[p, j], old_wt[p, j] = _ewm_step(weighted[p, j], old_wt[p, j], x, alpha, decay)
+                out[p, t, j] = weighted[p, j]
+    return out
+
+
+if NUMBA_AVAILABLE:
+    # error_model='numpy'：0 / 0 得到 NaN (與 NumPy 相同) 而不是 ZeroDivisionError
+    _jit = njit(cache=True, nogil=True, error_model='numpy')
+    _ewm_step = njit(inline='always', error_model='numpy')(_ewm_step)
+    _ewm_numba = _jit(_ewm_loop)
+    rsi_numba = _jit(_rsi_loop)
+    atr_numba = _jit(_atr_loop)
+    rsi_grid_numba = _jit(_rsi_grid_loop)
+    atr_grid_numba = _jit(_atr_grid_loop)
+else:
+    _ewm_numba = rsi_numba = atr_numba = rsi_grid_numba = atr_grid_numba = None
+
+
+def use_numba(backend=None):
+    return (backend or _backend) == 'numba'
+
+
+def ewm(x, alpha, backend=None):
+    """
+    ewm(alpha, adjust=False).mean() along axis 0 of a 1-D or 2-D float64 array.
+    alpha 也可以是每欄一個的陣列 (參數網格用)，此時一律走 NumPy 路徑。
+    """
+    x = np.asarray(x, dtype=np.float64)
+    if x.ndim == 1:
+        return ewm(x[:, None], alpha, backend)[:, 0]
+    if np.ndim(alpha) > 0:
+        return _ewm_numpy(x, np.asarray(alpha, dtype=np.float64))
+    if use_numba(backend):
+        return _ewm_numba(np.ascontiguousarray(x), float(alpha))
+    return _ewm_numpy(x, alpha)
+
+
+# 簡單測試用
+if __name__ == "__main__":
+    import time
+
+    import pandas as pd
+
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(2000, 500))
+    x[rng.random(x.shape) < 0.02] = np.nan
+    x[:100, :50] = np.nan  # 晚上市
+    ref = pd.DataFrame(x).ewm(alpha=1 / 14, adjust=False).mean().to_numpy()
+
+    for name in BACKENDS:
+        ewm(x[:20], 1 / 14, backend=name)  # numba 第一次呼叫需要編譯
+        t0 = time.perf_counter()
+        out = ewm(x, 1 / 14, backend=name)
+        print(f"{name:<6} {time.perf_counter() - t0:.4f}s  max |diff| vs pandas = {np.nanmax(np.abs(out - ref)):.2e}")
+        assert np.allclose(out, ref, rtol=1e-12, equal_nan=True)
+
+    # RSI / ATR 核心 (純 Python 與 JIT 版本) vs common.indicator_reference 的手算固定值與逐根參考實作
+    from common import indicator_reference as reference
+
+    eps = np.finfo(float).eps
+    fixed = [np.array(v)[:, None] for v in (reference.FIXED_HIGH, reference.FIXED_LOW, reference.FIXED_CLOSE)]
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, (300, 4)), axis=0))
+    high = close * (1 + rng.uniform(0, 0.02, close.shape))
+    low = close * (1 - rng.uniform(0, 0.02, close.shape))
+    high[50:53, 2] = low[50:53, 2]           # high == low：non_zero_range 加 epsilon
+    for mat in (high, low, close):
+        mat[:60, 1] = np.nan                 # 晚上市
+        mat[120, 3] = np.nan                 # 缺一根
+    rsi_loops = [('python', _rsi_loop, _rsi_grid_loop)]
+    atr_loops = [('python', _atr_loop, _atr_grid_loop)]
+    if NUMBA_AVAILABLE:
+        rsi_loops.append(('numba', rsi_numba, rsi_grid_numba))
+        atr_loops.append(('numba', atr_numba, atr_grid_numba))
+    lengths = np.array([2, 14])
+    for name, rsi_fn, rsi_grid_fn in rsi_loops:
+        reference.assert_close(f"{name} rsi fixed", rsi_fn(fixed[2], 2, 100.0)[:, 0], reference.FIXED_RSI_2)
+        grid = rsi_grid_fn(close, lengths, 100.0)
+        for j in range(close.shape[1]):
+            for p, length in enumerate(lengths):
+                expected = reference.rsi_reference(close[:, j], length)
+                reference.assert_close(f"{name} rsi {length} col {j}", rsi_fn(close, length, 100.0)[:, j], expected)
+                reference.assert_close(f"{name} rsi grid {length} col {j}", grid[p, :, j], expected)
+    for name, atr_fn, atr_grid_fn in atr_loops:
+        reference.assert_close(f"{name} atr fixed", atr_fn(*fixed, 2, eps)[:, 0], reference.FIXED_ATR_2)
+        grid = atr_grid_fn(high, low, close, lengths, eps)
+        for j in range(close.shape[1]):
+            for p, length in enumerate(lengths):
+                expected = reference.atr_reference(high[:, j], low[:, j], close[:, j], length)
+                reference.assert_close(f"{name} atr {length} col {j}", atr_fn(high, low, close, length, eps)[:, j],
+                                       expected)
+                reference.assert_close(f"{name} atr grid {length} col {j}", grid[p, :, j], expected)
+    print(f"RSI / ATR kernels vs hand-written reference ({', '.join(n for n, _, _ in rsi_loops)}): OK")
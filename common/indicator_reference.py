@@ -0,0 +1,114 @@
+"""
+Hand-written reference RSI / ATR (逐根純 Python 迴圈，不依賴 pandas_ta / numba / NumPy 向量化)。
+
+common.indicators 與 common.indicator_kernels 的一致性檢查原本只在裝有 pandas_ta 時才執行；
+這裡把 pandas_ta 0.4.71b0 (requirements.txt 釘選的版本，未裝 TA-Lib 時的純 pandas 實作) 的語意
+逐行寫成單一序列的迴圈，讓 __main__ 與 benchmarks 在沒有 pandas_ta 的環境也能驗證：
+
+    rsi_reference : diff -> 正 / 負部分 -> rma(length) -> scalar * up / (up + |down|)
+    atr_reference : true range (non_zero_range + 忽略 NaN 的 max) -> presma 起始值 -> rma(length)
+    rma           : pandas ewm(alpha=1/length, adjust=False, ignore_na=False).mean()
+
+FIXED_* 是一組可手算的固定序列 (length=2，alpha=1/2，結果皆為有理數)，
+推導寫在常數旁，與上面兩個迴圈互相獨立。
+"""
+import math
+
+EPSILON = 2.220446049250313e-16  # np.finfo(float).eps
+
+# 固定序列 (手算驗證用)
+FIXED_CLOSE = [10.0, 11.0, 10.5, 12.0, 11.0, 11.5]
+FIXED_HIGH = [10.5, 11.5, 11.5, 12.5, 12.0, 12.0]
+FIXED_LOW = [9.5, 10.0, 10.0, 11.0, 10.5, 11.0]
+# diff = [nan, 1, -0.5, 1.5, -1, 0.5]
+# up   = rma([nan, 1, 0, 1.5, 0, 0.5])     = [nan, 1, 1/2, 1, 1/2, 1/2]
+# down = rma([nan, 0, -0.5, 0, -1, 0])     = [nan, 0, -1/4, -1/8, -9/16, -9/32]
+# RSI  = 100 * up / (up + |down|)
+FIXED_RSI_2 = [math.nan, 100.0, 200.0 / 3.0, 800.0 / 9.0, 800.0 / 17.0, 64.0]
+# TR   = [1, 1.5, 1.5, 2, 1.5, 1] (high - low 無 0，不加 epsilon)
+# presma：第 2 根 = (1 + 1.5) / 2，之後 atr = (atr + tr) / 2
+FIXED_ATR_2 = [math.nan, 1.25, 1.375, 1.6875, 1.59375, 1.296875]
+
+
+def _isnan(x):
+    return x != x
+
+
+def rma(values, length):
+    """pandas ewm(alpha=1/length, adjust=False, ignore_na=False).mean() 的逐步遞迴。"""
+    alpha = 1.0 / length
+    out = []
+    weighted = math.nan
+    old_wt = 1.0
+    for cur in values:
+        cur = float(cur)
+        if not _isnan(weighted):
+            # 開始後每根 (含 NaN) 都讓舊權重衰減；有值時加權平均並把舊權重重設為 1
+            old_wt *= 1.0 - alpha
+            if not _isnan(cur):
+                if weighted != cur:
+                    weighted = (old_wt * weighted + alpha * cur) / (old_wt + alpha)
+                old_wt = 1.0
+        elif not _isnan(cur):
+            weighted = cur
+        out.append(weighted)
+    return out
+
+
+def rsi_reference(close, length=14, scalar=100.0):
+    """ta.rsi(close, length) (mamode='rma')；不做 pandas_ta 的最小長度檢查。"""
+    close = [float(c) for c in close]
+    diff = [math.nan] + [close[t] - close[t - 1] for t in range(1, len(close))]
+    positive = [0.0 if d < 0 else d for d in diff]
+    negative = [0.0 if d > 0 else d for d in diff]
+    out = []
+    for up, down in zip(rma(positive, length), rma(negative, length)):
+        total = up + abs(down)
+        if _isnan(total) or total == 0:
+            out.append(math.nan)  # 尚未開始，或 0 / 0 (價格完全不動)
+        else:
+            out.append(scalar * up / total)
+    return out
+
+
+def true_range_reference(high, low, close):
+    """ta.true_range (prenan=False)：第一根為 high - low；三個距離取絕對值後忽略 NaN 取最大。"""
+    high, low, close = ([float(v) for v in s] for s in (high, low, close))
+    hl = [h - l for h, l in zip(high, low)]
+    if any(r == 0 for r in hl):
+        hl = [r + EPSILON for r in hl]  # non_zero_range：整條序列一起加 epsilon
+    out = []
+    for t in range(len(close)):
+        prev_close = close[t - 1] if t > 0 else math.nan
+        ranges = [abs(r) for r in (hl[t], high[t] - prev_close, prev_close - low[t]) if not _isnan(r)]
+        out.append(max(ranges) if ranges else math.nan)
+    return out
+
+
+def atr_reference(high, low, close, length=14):
+    """ta.atr(high, low, close, length) (mamode='rma', presma=True)。"""
+    tr = true_range_reference(high, low, close)
+    head = [v for v in tr[:length] if not _isnan(v)]
+    seeded = [math.nan] * min(length - 1, len(tr)) + tr[length - 1:]
+    if len(tr) >= length:
+        seeded[length - 1] = sum(head) / len(head) if head else math.nan
+    return rma(seeded, length)
+
+
+def assert_close(name, out, ref, rtol=1e-10):
+    """逐根比較 (NaN 位置需相同)。"""
+    out, ref = list(out), list(ref)
+    assert len(out) == len(ref), f"{name}: length {len(out)} != {len(ref)}"
+    for t, (a, b) in enumerate(zip(out, ref)):
+        a, b = float(a), float(b)
+        if _isnan(a) or _isnan(b):
+            assert _isnan(a) and _isnan(b), f"{name}[{t}]: {a} vs {b}"
+        else:
+            assert abs(a - b) <= rtol * max(abs(a), abs(b)) + 1e-12, f"{name}[{t}]: {a} vs {b}"
+
+
+# 簡單測試用
+if __name__ == "__main__":
+    assert_close('rsi_reference', rsi_reference(FIXED_CLOSE, 2), FIXED_RSI_2, rtol=1e-15)
+    assert_close('atr_reference', atr_reference(FIXED_HIGH, FIXED_LOW, FIXED_CLOSE, 2), FIXED_ATR_2, rtol=1e-15)
+    print("Reference RSI / ATR on the fixed series: OK")
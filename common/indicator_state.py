@@ -0,0 +1,317 @@
+"""
+Streaming indicator state (盤前儀表板用的增量指標).
+
+V6.1 的 daily_gap_signal_generator / daily_order_suggestion_generator 每次執行都重新下載
+數個月日線，再對每檔重算 ta.atr / ta.rsi / rolling(20).mean() 只為了取 .iloc[-1]。
+這裡把指標寫成可序列化的遞迴狀態，每根新 K 棒 O(1) 更新：
+
+    store = IndicatorStateStore(os.path.join(OUTPUT_DIR, 'daily_indicator_state.json'))
+    partial = store.refresh(get_provider(), tickers)     # 只下載上次之後的 K 棒
+    snap = store.snapshot('NVDA', partial.get('NVDA'))   # {'close', 'rsi', 'atr', 'vol_ma_prev', ...}
+    store.save()
+
+- 已收盤的 K 棒 (日期早於美東今日) 才寫入狀態；今日進行中的 K 棒只在 snapshot() 時暫時套用。
+- 重疊檢查：增量下載從上次最後一根 (含) 開始，若該根收盤價與狀態不符 (除權息 / 分割造成
+  auto_adjust 價格全部改變)，該檔以 cold_period 重新建立。
+- 數值與 pandas_ta (rma / presma) 對同一段 K 棒的結果相同；唯一差異是 ATR 的 non_zero_range
+  需要看完整序列才能決定是否加 epsilon，串流版本不加 (差異 <= 2.2e-16)。
+"""
+import json
+import math
+import os
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import pandas as pd
+
+STATE_VERSION = 1
+MARKET_TZ = ZoneInfo('America/New_York')
+
+
+class EWMState:
+    """One step of pandas ewm(alpha, adjust=False, ignore_na=False) (與 indicator_kernels._ewm_step 相同)。"""
+
+    def __init__(self, alpha, value=math.nan, old_wt=1.0):
+        self.alpha = alpha
+        self.value = value
+        self.old_wt = old_wt
+
+    def update(self, x):
+        if not math.isnan(self.value):
+            self.old_wt *= 1.0 - self.alpha
+            if not math.isnan(x):
+                if self.value != x:
+                    self.value = (self.old_wt * self.value + self.alpha * x) / (self.old_wt + self.alpha)
+                self.old_wt = 1.0
+        elif not math.isnan(x):
+            self.value = x
+        return self.value
+
+    def to_dict(self):
+        return {'value': self.value, 'old_wt': self.old_wt}
+
+
+class RSIState:
+    """Wilder RSI (ta.rsi, mamode='rma')。"""
+
+    def __init__(self, length=14, prev_close=math.nan, up=None, down=None):
+        self.length = length
+        self.prev_close = prev_close
+        self.up = EWMState(1.0 / length, **(up or {}))
+        self.down = EWMState(1.0 / length, **(down or {}))
+
+    def update(self, close):
+        diff = close - self.prev_close
+        self.prev_close = close
+        up = self.up.update(0.0 if diff < 0 else diff)
+        down = self.down.update(0.0 if diff > 0 else diff)
+        total = up + abs(down)
+        return 100.0 * up / total if total != 0 else math.nan
+
+    @property
+    def value(self):
+        up, down = self.up.value, self.down.value
+        total = up + abs(down)
+        return 100.0 * up / total if total != 0 else math.nan
+
+    def to_dict(self):
+        return {'length': self.length, 'prev_close': self.prev_close,
+                'up': self.up.to_dict(), 'down': self.down.to_dict()}
+
+
+class ATRState:
+    """Wilder ATR (ta.atr, presma=True：前 length 根 TR 的平均作為起始值)。"""
+
+    def __init__(self, length=14, prev_close=math.nan, n_bars=0, head_sum=0.0, head_count=0, rma=None):
+        self.length = length
+        self.prev_close = prev_close
+        self.n_bars = n_bars
+        self.head_sum = head_sum
+        self.head_count = head_count
+        self.rma = EWMState(1.0 / length, **(rma or {}))
+
+    def update(self, high, low, close):
+        ranges = [abs(high - low), abs(high - self.prev_close), abs(self.prev_close - low)]
+        valid = [r for r in ranges if not math.isnan(r)]
+        tr = max(valid) if valid else math.nan
+        self.prev_close = close
+        self.n_bars += 1
+
+        if self.n_bars <= self.length:
+            if not math.isnan(tr):
+                self.head_sum += tr
+                self.head_count += 1
+            tr = math.nan
+            if self.n_bars == self.length and self.head_count:
+                tr = self.head_sum / self.head_count
+        return self.rma.update(tr)
+
+    @property
+    def value(self):
+        return self.rma.value
+
+    def to_dict(self):
+        return {'length': self.length, 'prev_close': self.prev_close, 'n_bars': self.n_bars,
+                'head_sum': self.head_sum, 'head_count': self.head_count, 'rma': self.rma.to_dict()}
+
+
+class SMAState:
+    """Rolling mean over the last length bars (min_periods=length，視窗內有 NaN 即為 NaN)。"""
+
+    def __init__(self, length=20, window=None):
+        self.length = length
+        self.window = list(window or [])
+
+    def update(self, x):
+        self.window.append(x)
+        if len(self.window) > self.length:
+            del self.window[0]
+        return self.value
+
+    @property
+    def value(self):
+        if len(self.window) < self.length:
+            return math.nan
+        return sum(self.window) / self.length
+
+    def to_dict(self):
+        return {'length': self.length, 'window': self.window}
+
+
+class TickerState:
+    """RSI_14 / ATR_14 / Volume MA20 for one ticker plus the last committed daily bar."""
+
+    def __init__(self, last_date=None, n_bars=0, close=math.nan, volume=math.nan, vol_ma_prev=math.nan,
+                 rsi=None, atr=None, vol_ma=None):
+        self.last_date = last_date
+        self.n_bars = n_bars
+        self.close = close
+        self.volume = volume
+        self.vol_ma_prev = vol_ma_prev  # 最後一根之前的 MA20 (腳本中的 rolling(20).mean().iloc[-2])
+        self.rsi = RSIState(**(rsi or {'length': 14}))
+        self.atr = ATRState(**(atr or {'length': 14}))
+        self.vol_ma = SMAState(**(vol_ma or {'length': 20}))
+
+    def update(self, date, bar):
+        """Advances one bar; bars at or before last_date and bars with missing OHLCV are ignored."""
+        date = pd.Timestamp(date).strftime('%Y-%m-%d')
+        if self.last_date is not None and date <= self.last_date:
+            return False
+        values = [float(bar[c]) for c in ('Open', 'High', 'Low', 'Close', 'Volume')]
+        if any(math.isnan(v) for v in values):  # 與腳本原本的 df_daily.dropna() 相同
+            return False
+        _, high, low, close, volume = values
+
+        self.rsi.update(close)
+        self.atr.update(high, low, close)
+        self.vol_ma_prev = self.vol_ma.value
+        self.vol_ma.update(volume)
+        self.last_date, self.close, self.volume = date, close, volume
+        self.n_bars += 1
+        return True
+
+    def copy(self):
+        return TickerState.from_dict(json.loads(json.dumps(self.to_dict())))
+
+    def snapshot(self):
+        return {'date': self.last_date, 'n_bars': self.n_bars, 'close': self.close, 'volume': self.volume,
+                'rsi': self.rsi.value, 'atr': self.atr.value, 'vol_ma_prev': self.vol_ma_prev}
+
+    def to_dict(self):
+        return {'last_date': self.last_date, 'n_bars': self.n_bars, 'close': self.close, 'volume': self.volume,
+                'vol_ma_prev': self.vol_ma_prev, 'rsi': self.rsi.to_dict(), 'atr': self.atr.to_dict(),
+                'vol_ma': self.vol_ma.to_dict()}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(**d)
+
+
+def market_today():
+    return datetime.now(MARKET_TZ).strftime('%Y-%m-%d')
+
+
+class IndicatorStateStore:
+    """JSON-backed {ticker: TickerState}; refresh() downloads only the bars each ticker is missing."""
+
+    def __init__(self, path, cold_period='1y'):
+        self.path = path
+        self.cold_period = cold_period
+        self.states = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    data = json.load(f)
+                if data.get('version') == STATE_VERSION:
+                    self.states = {t: TickerState.from_dict(s) for t, s in data['tickers'].items()}
+            except Exception as e:
+                print(f"[IndicatorState] Failed to load {path}, rebuilding: {e}")
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        data = {'version': STATE_VERSION, 'tickers': {t: s.to_dict() for t, s in self.states.items()}}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def advance(self, ticker, df, today=None):
+        """
+        Applies completed bars (日期 < today) of a daily OHLCV frame and returns today's in-progress
+        bar (pd.Series) if there is one, otherwise None.
+        """
+        today = today or market_today()
+        state = self.states.setdefault(ticker, TickerState())
+        partial = None
+        for date, bar in df.sort_index().iterrows():
+            if pd.Timestamp(date).strftime('%Y-%m-%d') >= today:
+                partial = bar
+                continue
+            state.update(date, bar)
+        return partial
+
+    def refresh(self, provider, tickers, today=None):
+        """
+        Brings every ticker up to date. Returns {ticker: in-progress bar of today} for snapshot().
+        已有狀態的標的從 last_date (含) 起增量下載；重疊那根收盤價不符或缺漏者改為 cold rebuild。
+        """
+        today = today or market_today()
+        warm = [t for t in tickers if t in self.states and self.states[t].last_date is not None]
+        cold = [t for t in tickers if t not in warm]
+        partial = {}
+
+        if warm:
+            start = min(self.states[t].last_date for t in warm)
+            bars = provider.download(warm, start=start, interval='1d')
+            for t in warm:
+                df = bars.get(t)
+                if df is None or not self._overlaps(self.states[t], df):
+                    cold.append(t)
+                    continue
+                bar = self.advance(t, df, today)
+                if bar is not None:
+                    partial[t] = bar
+
+        if cold:
+            print(f"[IndicatorState] Building state for {len(cold)} tickers ({self.cold_period} history)...")
+            bars = provider.download(cold, period=self.cold_period, interval='1d')
+            for t in cold:
+                self.states.pop(t, None)
+                if t not in bars:
+                    continue
+                bar = self.advance(t, bars[t], today)
+                if bar is not None:
+                    partial[t] = bar
+        return partial
+
+    @staticmethod
+    def _overlaps(state, df):
+        dates = pd.DatetimeIndex(df.index).strftime('%Y-%m-%d')
+        hit = df['Close'].to_numpy()[dates == state.last_date]
+        return len(hit) == 1 and math.isclose(float(hit[0]), state.close, rel_tol=1e-6)
+
+    def snapshot(self, ticker, partial=None):
+        """Latest indicator values; partial (今日進行中的 K 棒) 只套用在複本上，不寫入狀態。"""
+        state = self.states.get(ticker)
+        if state is None:
+            return None
+        if partial is not None:
+            state = state.copy()
+            state.update(partial.name, partial)
+        return state.snapshot()
+
+
+# 簡單測試用
+if __name__ == "__main__":
+    import tempfile
+
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range('2024-01-01', periods=120)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, len(dates))))
+    df = pd.DataFrame({'Open': close * (1 + rng.normal(0, 0.005, len(dates))),
+                       'High': close * 1.01, 'Low': close * 0.99, 'Close': close,
+                       'Volume': rng.integers(1e5, 1e6, len(dates)).astype(float)}, index=dates)
+
+    # 逐根更新 + 中途存檔 / 讀回，結果需與整段重算相同
+    path = os.path.join(tempfile.mkdtemp(), 'indicator_state.json')
+    store = IndicatorStateStore(path)
+    store.states.clear()
+    store.advance('DEMO', df.iloc[:60], today='2099-01-01')
+    store.save()
+    store = IndicatorStateStore(path)
+    store.advance('DEMO', df.iloc[55:], today='2099-01-01')
+    snap = store.snapshot('DEMO')
+    print(snap)
+
+    try:
+        import pandas_ta as ta
+    except ImportError:
+        ta = None
+    if ta is not None:
+        assert math.isclose(snap['rsi'], ta.rsi(df['Close'], length=14).iloc[-1], rel_tol=1e-10)
+        assert math.isclose(snap['atr'], ta.atr(df['High'], df['Low'], df['Close'], length=14).iloc[-1],
+                            rel_tol=1e-10)
+        assert math.isclose(snap['vol_ma_prev'], df['Volume'].rolling(20).mean().iloc[-2], rel_tol=1e-12)
+        print("Parity with pandas_ta: OK")
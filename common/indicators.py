@@ -0,0 +1,343 @@
+"""
+Vectorized indicator engine on wide (bar x symbol) matrices.
+
+舊做法是逐標的 groupby + pandas_ta (或 transform(lambda ...) / groupby.apply)，
+每個標的、每個指標各呼叫一次 pandas，宇宙一大就是數萬次 Python 呼叫。
+這裡每個指標對整個矩陣只做一次向量化運算 (axis 0 = 時間、axis 1 = 標的)：
+
+    bars = BarMatrix.from_long(df, ['open', 'high', 'low', 'close', 'volume'])
+    df['RSI_2'] = bars.to_series(rsi(bars['close'], 2), min_bars=3)
+    df['ATR_14'] = bars.to_series(atr(bars['high'], bars['low'], bars['close'], 14), min_bars=15)
+
+BarMatrix 的每一欄是該標的「自己的」K 棒序列 (依時間排序、靠上對齊，尾端補 NaN)，
+因此缺漏日期的處理與 groupby('symbol') 完全相同；日期對齊的寬表 (例如 unstack 後的 ETF 收盤價)
+也可直接傳入各指標函式。
+
+與 pandas_ta (未安裝 TA-Lib 時的純 pandas 實作) 的對應 (一致性以 requirements.txt 釘選的 pandas_ta 0.4.71b0 量測)：
+    sma         : ta.sma          (rolling mean, 視窗內有 NaN 即為 NaN)
+    rma         : ta.rma          (ewm(alpha=1/length, adjust=False)，含 NaN 時的權重重新正規化)
+    ema         : ta.ema          (ewm(span=length, adjust=False)，presma=True)
+    rsi         : ta.rsi          (Wilder, mamode='rma')
+    bbands_pctb : ta.bbands BBP_  (ddof=1)
+    true_range  : ta.true_range
+    atr         : ta.atr          (presma=True：前 length 根 TR 的平均作為起始值)
+其餘 (rel_vol / amihud / down_vol_prop) 對應原本腳本中的 pandas 寫法。
+min_bars 對應 pandas_ta 的最小長度檢查 (序列太短時回傳 None)。
+不依賴 pandas_ta 的 RSI / ATR 參考實作與手算固定值見 common.indicator_reference。
+遞迴型指標 (rma / rsi / atr / ema) 經由 common.indicator_kernels.ewm，裝有 numba 時以 JIT 核心計算。
+
+參數掃描用 rsi_grid / atr_grid：一次算出多個 length，回傳 (param x bar x symbol)，
+out[i] 與 rsi(close, lengths[i]) / atr(..., lengths[i]) 逐位元相同，但 diff / true range 只算一次：
+
+    grid = rsi_grid(bars['close'], lengths=[2, 3, 5, 14])
+"""
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from common.indicator_kernels import atr_grid_numba, atr_numba, ewm, rsi_grid_numba, rsi_numba, use_numba
+
+EPSILON = np.finfo(float).eps
+
+
+# --- Layout ---
+class BarMatrix:
+    """Long (timestamp, symbol) frame <-> bar-aligned 2-D matrices (每欄一個標的)。"""
+
+    def __init__(self, index, rows, cols, n_bars, symbols, matrices):
+        self.index = index
+        self.rows = rows
+        self.cols = cols
+        self.n_bars = n_bars
+        self.symbols = symbols
+        self.matrices = matrices
+        # 每列在攤平矩陣中的位置 / 所屬標的的 K 棒數 (to_series 重複使用)
+        self.flat = rows * len(symbols) + cols
+        self.row_bars = n_bars[cols]
+
+    @classmethod
+    def from_long(cls, df, columns, symbol_level='symbol', time_level='timestamp'):
+        sym_codes, symbols = pd.factorize(df.index.get_level_values(symbol_level), sort=True)
+        ts = df.index.get_level_values(time_level).to_numpy()
+        order = np.lexsort((ts, sym_codes))
+
+        n_bars = np.bincount(sym_codes, minlength=len(symbols))
+        starts = np.concatenate([[0], np.cumsum(n_bars)[:-1]])
+        rows = np.empty(len(df), dtype=np.int64)
+        rows[order] = np.arange(len(df)) - np.repeat(starts, n_bars)
+        cols = sym_codes
+
+        bars = cls(df.index, rows, cols, n_bars, symbols, {})
+        for col in columns:
+            bars.matrices[col] = bars.to_matrix(df[col].to_numpy(dtype=np.float64, na_value=np.nan))
+        return bars
+
+    def __getitem__(self, col):
+        return self.matrices[col]
+
+    def to_matrix(self, values):
+        """Values aligned with the long index -> bar-aligned matrix (to_series 的反向)。"""
+        shape = (int(self.n_bars.max()) if len(self.n_bars) else 0, len(self.symbols))
+        mat = np.full(shape, np.nan, dtype=np.float64)
+        mat.reshape(-1)[self.flat] = values
+        return mat
+
+    def to_series(self, values, name=None, min_bars=0):
+        """Maps a bar-aligned result back onto the original long index."""
+        out = np.take(values, self.flat)
+        if min_bars:
+            out[self.row_bars < min_bars] = np.nan
+        return pd.Series(out, index=self.index, name=name)
+
+
+# --- Helpers ---
+def _shift(x, periods=1):
+    out = np.full_like(x, np.nan)
+    if periods < len(x):
+        out[periods:] = x[:-periods]
+    return out
+
+
+def _as_2d(x):
+    """C-contiguous float64 (bar x symbol) view for the numba kernels (1-D -> 單欄)。"""
+    x = np.ascontiguousarray(x, dtype=np.float64)
+    return x.reshape(len(x), -1)
+
+
+def _ffill(x):
+    """Forward fill along axis 0 (每欄獨立)。"""
+    valid = ~np.isnan(x)
+    idx = np.where(valid, np.arange(len(x))[:, None], 0)
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    return np.take_along_axis(x, idx, axis=0)
+
+
+def _non_zero_range(x, y):
+    """pandas_ta.utils.non_zero_range：某欄只要有一個 0，整欄加上 epsilon。"""
+    diff = x - y
+    return diff + EPSILON * (diff == 0).any(axis=0)
+
+
+def rolling_sum(x, length):
+    """Rolling sum with min_periods=length (視窗內有 NaN 即為 NaN)。"""
+    valid = ~np.isnan(x)
+    csum = np.cumsum(np.where(valid, x, 0.0), axis=0)
+    ccount = np.cumsum(valid, axis=0)
+    out = np.full_like(x, np.nan)
+    if length > len(x):
+        return out
+    window = csum[length - 1:].copy()
+    window[1:] -= csum[:-length]
+    count = ccount[length - 1:].copy()
+    count[1:] -= ccount[:-length]
+    out[length - 1:] = np.where(count == length, window, np.nan)
+    return out
+
+
+def rolling_var(x, length, ddof=1):
+    """
+    Rolling variance (min_periods=length)。以 length 次位移累加平方離差 (two-pass)，
+    避免 sum(x^2) - sum(x)^2 的相消誤差；連續相同值的視窗與 pandas 相同回傳 0。
+    """
+    mean = rolling_sum(x, length) / length
+    ssd = np.zeros_like(x)
+    dev = np.empty_like(x)
+    n = len(x)
+    for k in range(min(length, n)):
+        # ssd[t] += (x[t-k] - mean[t])^2；前 length-1 列的 mean 為 NaN，結果自然是 NaN
+        np.subtract(x[:n - k], mean[k:], out=dev[k:])
+        np.square(dev[k:], out=dev[k:])
+        ssd[k:] += dev[k:]
+    var = ssd / (length - ddof)
+
+    # 連續 length 根相同值 -> 0 (pandas roll_var 的 num_consecutive_same_value 規則)
+    t = np.arange(len(x))[:, None]
+    changed = np.ones(x.shape, dtype=bool)
+    changed[1:] = x[1:] != x[:-1]
+    last_change = np.maximum.accumulate(np.where(changed, t, 0), axis=0)
+    var[(t - last_change + 1 >= length) & ~np.isnan(var)] = 0.0
+    return var
+
+
+def pct_change(x):
+    """pandas pct_change() 預設行為 (fill_method='pad')：先 forward fill 再計算。"""
+    filled = _ffill(x)
+    return filled / _shift(filled) - 1
+
+
+# --- Indicators ---
+def sma(x, length):
+    return rolling_sum(x, length) / length
+
+
+def rma(x, length):
+    """Wilder's moving average = ewm(alpha=1/length, adjust=False).mean() (numba 或 NumPy 遞迴)。"""
+    return ewm(x, 1.0 / length)
+
+
+def _presma(x, length):
+    """pandas_ta presma：前 length 根 (略過 NaN) 的平均放在第 length 根，之前設為 NaN。"""
+    x = x.copy()
+    head = x[:length]
+    with np.errstate(invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # 整段皆 NaN 的欄位
+        seed = np.nanmean(head, axis=0) if len(head) else np.full(x.shape[1:], np.nan)
+    x[:length - 1] = np.nan
+    if len(x) >= length:
+        x[length - 1] = seed
+    return x
+
+
+def ema(close, length=10, presma=True):
+    """ta.ema (adjust=False)：ewm(span=length)，presma=True 時以前 length 根的 SMA 起始。"""
+    if presma:
+        close = _presma(close, length)
+    return ewm(close, 2.0 / (length + 1))
+
+
+def rsi(close, length=14, scalar=100.0):
+    if use_numba():
+        return rsi_numba(_as_2d(close), length, float(scalar)).reshape(np.shape(close))
+    diff = close - _shift(close)
+    positive = np.where(diff < 0, 0.0, diff)
+    negative = np.where(diff > 0, 0.0, diff)
+    positive_avg = rma(positive, length)
+    negative_avg = rma(negative, length)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return scalar * positive_avg / (positive_avg + np.abs(negative_avg))
+
+
+def bbands_pctb(close, length=20, std=2.0, ddof=1):
+    """
+    Bollinger %B：(close - lower) / (upper - lower)。
+    視窗內標準差為 0 (連續 length 根相同收盤價) 時 upper == lower，結果只是 epsilon 等級的雜訊，
+    與 pandas_ta 的數值不保證一致 (兩邊都沒有意義)。
+    """
+    mid = sma(close, length)
+    dev = np.sqrt(rolling_var(close, length, ddof=ddof))
+    lower = mid - std * dev
+    upper = mid + std * dev
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return _non_zero_range(close, lower) / _non_zero_range(upper, lower)
+
+
+def true_range(high, low, close):
+    prev_close = _shift(close)
+    ranges = np.stack([_non_zero_range(high, low), high - prev_close, prev_close - low])
+    # 與 DataFrame.abs().max(axis=1) 相同：忽略 NaN，三者皆 NaN 才是 NaN
+    return np.fmax.reduce(np.abs(ranges), axis=0)
+
+
+def atr(high, low, close, length=14):
+    if use_numba():
+        return atr_numba(_as_2d(high), _as_2d(low), _as_2d(close), length, EPSILON).reshape(np.shape(close))
+    # presma：前 length 根 TR 的平均作為第 length 根的起始值
+    return rma(_presma(true_range(high, low, close), length), length)
+
+
+def _grid_lengths(lengths):
+    lengths = np.asarray(lengths, dtype=np.int64)
+    if lengths.ndim != 1 or len(lengths) == 0 or (lengths < 1).any():
+        raise ValueError(f"lengths must be a non-empty list of positive ints, got {lengths.tolist()}")
+    return lengths
+
+
+def _split_params(x, k, shape):
+    """(bar x k*symbol) -> (k, *shape)；NumPy 路徑把各參數並排成一個矩陣，一次 ewm 跑完。"""
+    return x.reshape(len(x), k, -1).transpose(1, 0, 2).reshape((k,) + tuple(shape))
+
+
+def rsi_grid(close, lengths, scalar=100.0):
+    """RSI for several lengths at once -> (len(lengths), *close.shape)。"""
+    lengths = _grid_lengths(lengths)
+    shape = np.shape(close)
+    close = _as_2d(close)
+    if use_numba():
+        return rsi_grid_numba(close, lengths, float(scalar)).reshape((len(lengths),) + shape)
+    k = len(lengths)
+    diff = close - _shift(close)
+    alpha = np.repeat(1.0 / lengths, close.shape[1])
+    positive_avg = ewm(np.tile(np.where(diff < 0, 0.0, diff), (1, k)), alpha)
+    negative_avg = ewm(np.tile(np.where(diff > 0, 0.0, diff), (1, k)), alpha)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out = scalar * positive_avg / (positive_avg + np.abs(negative_avg))
+    return _split_params(out, k, shape)
+
+
+def atr_grid(high, low, close, lengths):
+    """ATR for several lengths at once -> (len(lengths), *close.shape)；true range 只算一次。"""
+    lengths = _grid_lengths(lengths)
+    shape = np.shape(close)
+    high, low, close = _as_2d(high), _as_2d(low), _as_2d(close)
+    if use_numba():
+        return atr_grid_numba(high, low, close, lengths, EPSILON).reshape((len(lengths),) + shape)
+    tr = true_range(high, low, close)
+    seeded = np.concatenate([_presma(tr, int(length)) for length in lengths], axis=1)
+    out = ewm(seeded, np.repeat(1.0 / lengths, close.shape[1]))
+    return _split_params(out, len(lengths), shape)
+
+
+def rel_vol(volume, length=20):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return volume / sma(volume, length)
+
+
+def amihud(close, volume, length=20):
+    """Amihud illiquidity: rolling mean of |ret| / (close * volume)，成交額為 0 視為 NaN。"""
+    ret = np.abs(pct_change(close))
+    dollar_vol = close * volume
+    dollar_vol = np.where(dollar_vol == 0, np.nan, dollar_vol)
+    return sma(ret / dollar_vol, length)
+
+
+def down_vol_prop(open_, close, volume, length=10):
+    """收黑 K 棒成交量 / 總成交量 (rolling length)。"""
+    is_down = (close < open_).astype(np.float64)
+    down_sum = rolling_sum(volume * is_down, length)
+    total_sum = rolling_sum(volume, length)
+    total_sum = np.where(total_sum == 0, np.nan, total_sum)
+    return down_sum / total_sum
+
+
+def as_wide(values, like):
+    """2-D result -> DataFrame with the index / columns of a date-aligned wide frame."""
+    return pd.DataFrame(values, index=like.index, columns=like.columns)
+
+
+# 簡單測試用
+if __name__ == "__main__":
+    from common import indicator_reference as ref
+
+    # 手算固定值 (不依賴 pandas_ta)
+    fixed = [np.array(v) for v in (ref.FIXED_HIGH, ref.FIXED_LOW, ref.FIXED_CLOSE)]
+    ref.assert_close('rsi fixed', rsi(fixed[2], 2), ref.FIXED_RSI_2)
+    ref.assert_close('atr fixed', atr(*fixed, 2), ref.FIXED_ATR_2)
+
+    rng = np.random.default_rng(0)
+    close = pd.DataFrame(100 * np.exp(np.cumsum(rng.normal(0, 0.02, (300, 3)), axis=0)),
+                         index=pd.bdate_range('2024-01-01', periods=300), columns=['AAA', 'BBB', 'CCC'])
+    close.iloc[:40, 1] = np.nan  # BBB 晚上市
+    close.iloc[100, 2] = np.nan  # CCC 缺一根
+    high = close * (1 + rng.uniform(0, 0.02, close.shape))
+    low = close * (1 - rng.uniform(0, 0.02, close.shape))
+    out = as_wide(rsi(close.to_numpy(), 14), close)
+    out_atr = as_wide(atr(high.to_numpy(), low.to_numpy(), close.to_numpy(), 14), close)
+    print(out.tail(3))
+
+    # 逐根純 Python 參考實作
+    for sym in close.columns:
+        ref.assert_close(f"rsi {sym}", out[sym], ref.rsi_reference(close[sym], 14))
+        ref.assert_close(f"atr {sym}", out_atr[sym], ref.atr_reference(high[sym], low[sym], close[sym], 14))
+    print("Parity with the hand-written reference (fixed values + loop): OK")
+
+    try:
+        import pandas_ta as ta
+    except ImportError:
+        ta = None
+    if ta is not None:
+        for sym in close.columns:
+            assert np.allclose(out[sym], ta.rsi(close[sym], length=14), rtol=1e-10, equal_nan=True), sym
+            assert np.allclose(out_atr[sym], ta.atr(high[sym], low[sym], close[sym], length=14),
+                               rtol=1e-10, equal_nan=True), sym
+        print(f"Parity with pandas_ta {ta.version}: OK")
@@ -0,0 +1,149 @@
+"""
+LightGBM ranking dataset binned once and shared by every walk-forward fold (V5.1 04_train_meta_labeling_l3).
+
+LGBMRanker.fit(DataFrame) 每一折都重新把特徵分箱 (bin mappers) 並重建 query group，最後全資料重訓時又分箱一次。
+這裡把整個候選矩陣 (依 timestamp 排序) 分箱成一個 lgb.Dataset，存成 binary 檔；各折只是這個 Dataset 的列子集
+(共用 bin mappers)，query group 由預先算好的每日列偏移量 (day offsets) 切出：
+
+    data = BinnedRankingData(X, y, X.index.get_level_values('timestamp'), lgbm_params, cache_dir=...,
+                             bin_days=(0, 500))        # 分箱邊界只取第一折的訓練期 (第 0..499 天)
+    booster = data.train((0, 500), valid=(500, 600))   # 以第 0..499 天訓練、第 500..599 天評估 (天的編號)
+    booster.best_score['valid_0']['ndcg@3']
+
+- lgbm_params 為 LGBMRanker 的參數，train_params() 轉成 lgb.train 的參數 (n_estimators -> num_boost_round)；
+  在相同分箱下訓練結果與 sklearn 介面完全相同。
+- bin_days：分箱邊界 (bin mappers) 只由這段天數的列建立 (lgb.Dataset(reference=))，其餘列沿用同一組邊界。
+  walk-forward 時給第一折的訓練期：每一折的訓練期都包含它，測試期的特徵分佈不會滲入任何一折；
+  第一折與逐折分箱 (LGBMRanker.fit) 逐位元相同，之後的折只差在邊界少看了後段訓練資料。
+  None = 以全部資料分箱 (含測試期的特徵分佈)，只適合全資料重訓 (此時與 LGBMRanker.fit 相同)。
+- binary 檔名含資料、分箱參數與 bin_days 的 fingerprint，任一改變時自動重建。
+"""
+import os
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+
+from common.feature_graph import _digest
+from common.model_registry import _canonical, frame_fingerprint
+
+# 只屬於 sklearn 介面、lgb.train 不接受的參數
+SKLEARN_ONLY = ('n_estimators', 'n_jobs', 'importance_type', 'class_weight')
+# 影響分箱 / Dataset 建構的參數 (含別名)；只有這些參數改變時 binary 檔才需重建
+DATASET_PARAMS = ('max_bin', 'max_bin_by_feature', 'min_data_in_bin', 'subsample_for_bin', 'bin_construct_sample_cnt',
+                  'min_child_samples', 'min_data_in_leaf', 'feature_pre_filter', 'use_missing', 'zero_as_missing',
+                  'random_state', 'seed', 'data_random_seed', 'linear_tree')
+
+
+def train_params(lgbm_params):
+    """LGBMRanker(**lgbm_params) -> (lgb.train params, num_boost_round)。"""
+    est = lgb.LGBMRanker(**lgbm_params)
+    params = {k: v for k, v in est.get_params().items() if v is not None and k not in SKLEARN_ONLY}
+    if est.n_jobs is not None:
+        params['num_threads'] = est.n_jobs
+    return params, est.n_estimators
+
+
+def day_offsets(timestamps):
+    """Row offsets of each day (rows 依 timestamp 排序)：第 d 天的列為 [offsets[d], offsets[d + 1])。"""
+    ts = np.asarray(timestamps)
+    if len(ts) > 1 and (ts[1:] < ts[:-1]).any():
+        raise ValueError("day_offsets requires rows sorted by timestamp")
+    starts = np.flatnonzero(np.r_[True, ts[1:] != ts[:-1]]) if len(ts) else np.zeros(0, dtype=np.int64)
+    return np.r_[starts, len(ts)].astype(np.int64)
+
+
+class BinnedRankingData:
+    """Full candidate matrix binned once; folds are row subsets sharing its bin mappers (取自 bin_days 的列)。"""
+
+    def __init__(self, X, y, timestamps, lgbm_params, cache_dir=None, bin_days=None):
+        self.params, self.num_boost_round = train_params(lgbm_params)
+        self.offsets = day_offsets(timestamps)
+        self.n_days = len(self.offsets) - 1
+        self.feature_names = [str(c) for c in X.columns]
+        if bin_days is not None and tuple(bin_days) == (0, self.n_days):
+            bin_days = None
+        self.bin_days = None if bin_days is None else (int(bin_days[0]), int(bin_days[1]))
+        dataset_params = {k: v for k, v in self.params.items() if k in DATASET_PARAMS}
+        self.key = _digest(frame_fingerprint(X), frame_fingerprint(pd.Series(np.asarray(y))),
+                           _canonical(dataset_params), _canonical(self.bin_days), lgb.__version__)[:20]
+        self.path = os.path.join(cache_dir, f"binned_{self.key}.bin") if cache_dir else None
+        self.from_cache = self.path is not None and os.path.exists(self.path)
+
+        if self.from_cache:
+            self.full = lgb.Dataset(self.path, params=self.params).construct()
+        else:
+            reference = None
+            if self.bin_days is not None:
+                rows = self.rows(self.bin_days)
+                reference = lgb.Dataset(X.iloc[rows], label=np.asarray(y)[rows], params=self.params,
+                                        feature_name=self.feature_names)
+            self.full = lgb.Dataset(X, label=np.asarray(y), group=np.diff(self.offsets), params=self.params,
+                                    feature_name=self.feature_names, reference=reference).construct()
+            if self.path is not None:
+                os.makedirs(cache_dir, exist_ok=True)
+                tmp_path = self.path + '.tmp'
+                self.full.save_binary(tmp_path)
+                os.replace(tmp_path, self.path)
+
+    def rows(self, days):
+        """Row index range of days = (first_day, end_day) (end_day 不含)。"""
+        return np.arange(self.offsets[days[0]], self.offsets[days[1]])
+
+    def subset(self, days):
+        """Row subset of whole days；query group 直接由 day offsets 給定 (binary 載入的 Dataset 取子集時必須明確指定)。"""
+        if days[0] == 0 and days[1] == self.n_days:
+            return self.full
+        sub = self.full.subset(self.rows(days), params=self.params)
+        sub.set_group(np.diff(self.offsets[days[0]:days[1] + 1]))
+        return sub
+
+    def train(self, days, valid=None, params=None, num_boost_round=None):
+        """
+        Trains a Booster on days (first_day, end_day)；valid = 評估用的天數範圍 (NDCG 記在 booster.best_score['valid_0'])。
+        params / num_boost_round 可覆寫訓練參數 (分箱相關參數須與建構時相同)。
+        """
+        valid_sets = [self.subset(valid)] if valid is not None else []
+        return lgb.train(dict(self.params, **(params or {})), self.subset(days),
+                         num_boost_round=num_boost_round or self.num_boost_round, valid_sets=valid_sets)
+
+
+# 簡單測試用
+if __name__ == "__main__":
+    import tempfile
+    import warnings
+
+    warnings.simplefilter('ignore')
+    rng = np.random.default_rng(0)
+    counts = rng.integers(5, 40, 300)
+    ts = np.repeat(pd.bdate_range('2020-01-01', periods=300), counts)
+    X = pd.DataFrame(rng.normal(size=(len(ts), 6)), columns=[f"f{i}" for i in range(6)])
+    y = np.clip((X['f0'] + rng.normal(size=len(ts)) > 1).astype(int) + (X['f1'] > 1), 0, 3).to_numpy()
+    params = {'objective': 'lambdarank', 'metric': 'ndcg', 'ndcg_eval_at': [1, 3, 5], 'n_estimators': 30,
+              'label_gain': [0, 1, 3, 7], 'random_state': 42, 'verbose': -1}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data = BinnedRankingData(X, y, ts, params, cache_dir=tmp, bin_days=(0, 100))
+        again = BinnedRankingData(X, y, ts, params, cache_dir=tmp, bin_days=(0, 100))
+        assert not data.from_cache and again.from_cache
+        fold = data.train((100, 200), valid=(200, 300))
+        fold_cached = again.train((100, 200), valid=(200, 300))
+        assert np.array_equal(fold.predict(X), fold_cached.predict(X))
+        print(f"fold NDCG@3 = {fold.best_score['valid_0']['ndcg@3']:.4f} (binary cache reproduces it)")
+
+        # 分箱只看 bin_days：第一折 (訓練期 = bin_days) 與逐折分箱的 LGBMRanker.fit 相同，
+        # 且之後的列 (測試期) 改變不影響分箱
+        rows = data.rows((0, 100))
+        first = again.train((0, 100))
+        ref = lgb.LGBMRanker(**params).fit(X.iloc[rows], y[rows], group=counts[:100])
+        assert np.array_equal(first.predict(X), ref.predict(X))
+        X_shifted = X.copy()
+        X_shifted.iloc[rows[-1] + 1:] *= 10
+        shifted = BinnedRankingData(X_shifted, y, ts, params, bin_days=(0, 100))
+        assert np.array_equal(shifted.train((0, 100)).predict(X), first.predict(X))
+        print("bins from the first fold only (== per-fold LGBMRanker.fit, no test-period leakage): OK")
+
+        final = BinnedRankingData(X, y, ts, params).train((0, data.n_days))
+        ref = lgb.LGBMRanker(**params).fit(X, y, group=counts)
+        assert np.array_equal(final.predict(X), ref.predict(X))
+        print("full-data Booster == LGBMRanker.fit: OK")
@@ -0,0 +1,158 @@
+"""
+Fitted-model registry keyed by a training fingerprint (walk-forward 各折的模型重複使用).
+
+03_train_regime_model_l1_rolling / 04_train_meta_labeling_l3 每次執行都把每一折重新訓練一次，
+models/ 下也只留最後一折。這裡把每一折訓練好的 artifacts 存在 registry_dir/{name}/{key}.joblib：
+
+    registry = ModelRegistry(os.path.join(models_dir, 'registry'))
+    key = registry.key('regime_l1', data=train_df[cols], params={'n_components': 3, 'seed': seed},
+                       code=fit_fold, libs=('numpy', 'sklearn', 'hmmlearn'))
+    artifacts = registry.get_or_fit('regime_l1', key, lambda: fit_fold(train_df, seed=seed))
+
+- key = hash(name, 訓練資料 (index + 欄位名稱 + 數值), 超參數, fit 函式原始碼, 函式庫版本)；
+  任何一項改變都會得到新的 key (舊檔保留，不覆寫)。
+- 資料延長一季時，舊折的訓練資料不變 -> 直接載入；只有新的一折需要訓練。
+- 每個 key 另存 {key}.json (訓練時間、資料列數與呼叫端的 info)，方便檢查；刪除 registry_dir 即可強制全部重訓。
+- 寫檔先寫 .tmp 再 os.replace，fork 出來的多個行程同時寫入不同 key 也安全。
+"""
+import hashlib
+import importlib
+import json
+import os
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from common.feature_graph import _digest, code_fingerprint
+
+REGISTRY_VERSION = 1
+
+
+def frame_fingerprint(df):
+    """Hash of a DataFrame / Series (index + 欄位名稱 + 數值，列的順序有影響)。"""
+    if isinstance(df, pd.Series):
+        df = df.to_frame()
+    row_hash = pd.util.hash_pandas_object(df, index=True).to_numpy()
+    return _digest(list(map(str, df.columns)), hashlib.sha1(row_hash.tobytes()).hexdigest())
+
+
+def library_versions(libs):
+    """{module: __version__} (未安裝的函式庫記為 None)。"""
+    versions = {}
+    for name in libs:
+        try:
+            versions[name] = getattr(importlib.import_module(name), '__version__', None)
+        except ImportError:
+            versions[name] = None
+    return versions
+
+
+def _canonical(params):
+    """超參數轉成穩定的字串 (dict 依 key 排序、numpy 純量轉成 Python 值)。"""
+    def default(obj):
+        if isinstance(obj, np.generic):
+            return obj.item()
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        return repr(obj)
+    return json.dumps(params, sort_keys=True, default=default)
+
+
+class ModelRegistry:
+    """Directory of fitted artifacts (registry_dir/{name}/{key}.joblib + {key}.json)。"""
+
+    def __init__(self, registry_dir, refit=False):
+        self.registry_dir = registry_dir
+        self.refit = refit  # True: 一律重新訓練並覆寫 (仍會寫入 registry)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, name, data, params=None, code=None, libs=()):
+        """
+        Fingerprint of one fit。data 可為單一 DataFrame / Series 或其 list (例如 X_train, y_train)；
+        code = fit 函式 (原始碼改了 key 就不同)；libs = 影響結果的函式庫名稱。
+        """
+        frames = data if isinstance(data, (list, tuple)) else [data]
+        parts = [REGISTRY_VERSION, name, *(frame_fingerprint(f) for f in frames), _canonical(params or {}),
+                 code_fingerprint(code) if code is not None else '', _canonical(library_versions(libs))]
+        return _digest(*parts)[:20]
+
+    def _path(self, name, key, ext):
+        return os.path.join(self.registry_dir, name, f"{key}.{ext}")
+
+    def get(self, name, key):
+        """Loads the artifacts stored under key (不存在或讀取失敗時回傳 None)。"""
+        path = self._path(name, key, 'joblib')
+        if self.refit or not os.path.exists(path):
+            return None
+        try:
+            return joblib.load(path)
+        except Exception as e:
+            print(f"  [ModelRegistry] Failed to load {path}, refitting: {e}")
+            return None
+
+    def put(self, name, key, artifacts, info=None):
+        os.makedirs(os.path.join(self.registry_dir, name), exist_ok=True)
+        path = self._path(name, key, 'joblib')
+        joblib.dump(artifacts, path + '.tmp')
+        os.replace(path + '.tmp', path)
+        meta = {'name': name, 'key': key, 'created': time.strftime('%Y-%m-%d %H:%M:%S'), **(info or {})}
+        meta_path = self._path(name, key, 'json')
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f, indent=2, default=str)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def get_or_fit(self, name, key, fit_fn, info=None):
+        """Returns the stored artifacts for key, or fit_fn() (存入 registry 後回傳)。fit_fn 回傳 None 時不存。"""
+        artifacts = self.get(name, key)
+        if artifacts is not None:
+            self.hits += 1
+            return artifacts
+        self.misses += 1
+        t0 = time.perf_counter()
+        artifacts = fit_fn()
+        if artifacts is not None:
+            self.put(name, key, artifacts, dict(info or {}, fit_seconds=round(time.perf_counter() - t0, 3)))
+        return artifacts
+
+    def keys(self, name):
+        folder = os.path.join(self.registry_dir, name)
+        if not os.path.isdir(folder):
+            return []
+        return sorted(f[:-len('.joblib')] for f in os.listdir(folder) if f.endswith('.joblib'))
+
+
+# 簡單測試用
+if __name__ == "__main__":
+    import tempfile
+
+    from sklearn.linear_model import Ridge
+
+    def fit_ridge(train, alpha):
+        return Ridge(alpha=alpha).fit(train[['x']], train['y'])
+
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'x': rng.normal(size=500)}, index=pd.bdate_range('2020-01-01', periods=500))
+    df['y'] = 2 * df['x'] + rng.normal(size=500)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        def run(data, alpha=1.0):
+            registry = ModelRegistry(tmp)
+            models = []
+            for start in range(0, len(data) - 200 + 1, 100):  # 固定 200 天的滾動訓練窗
+                train = data.iloc[start:start + 200]
+                key = registry.key('ridge', train, {'alpha': alpha}, code=fit_ridge, libs=('sklearn',))
+                models.append(registry.get_or_fit('ridge', key, lambda: fit_ridge(train, alpha)))
+            return registry, models
+
+        first, _ = run(df.iloc[:400])
+        again, _ = run(df.iloc[:400])
+        extended, _ = run(df)
+        other, _ = run(df.iloc[:400], alpha=2.0)
+        print(f"first run  : fitted {first.misses}, loaded {first.hits}")
+        print(f"rerun      : fitted {again.misses}, loaded {again.hits}")
+        print(f"+100 days  : fitted {extended.misses}, loaded {extended.hits}")
+        print(f"alpha=2.0  : fitted {other.misses}, loaded {other.hits}")
+        assert (again.misses, extended.misses, other.misses) == (0, 1, first.misses)
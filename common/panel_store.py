@@ -0,0 +1,277 @@
+"""
+PanelStore: memory-mapped date x symbol x field panel (回測共用行情面板).
+
+各回測器原本都會重建 daily_data = stock_df.reorder_levels(['timestamp', 'symbol']).sort_index()，
+再於 Python 迴圈中做 daily_data.loc[date] / today_bar.loc[sym] 查詢 (每次都是 MultiIndex 搜尋)。
+
+PanelStore 把特徵檔一次展開成 dense float64 陣列 values[date, symbol, field]，
+搭配 date / symbol / field -> 整數位置的 dict，查詢皆為 O(1)：
+
+    panel = PanelStore.build_or_open(feat_path)      # 第一次建立 {feat_path}.panel/，之後直接 memmap 開啟
+    panel = panel.restrict(tickers)                  # 只看部分標的 (共用同一份陣列，不複製)
+    panel.add_shifted('prev_close', 'close')         # 依標的 shift(1)，等同 groupby('symbol').shift(1)
+
+    for date in panel.active_dates():
+        today_bar = panel.day(date)
+        if sym in today_bar: price = today_bar[sym]['open']
+        candidates = today_bar.frame()               # 當日橫截面 DataFrame (index = symbol)
+
+檔案以 .npy 儲存並以 mmap_mode='r' 開啟，多個行程同時開啟同一份檔案時共用 OS page cache，不會各自複製。
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+class PanelRow:
+    """Single (date, symbol) bar; supports row['close'] and row.get('ATR_14', default)."""
+    __slots__ = ('_panel', '_i', '_j')
+
+    def __init__(self, panel, i, j):
+        self._panel = panel
+        self._i = i
+        self._j = j
+
+    def __getitem__(self, field):
+        return self._panel.value(self._i, self._j, field)
+
+    def get(self, field, default=None):
+        if not self._panel.has_field(field):
+            return default
+        return self[field]
+
+
+class PanelDay:
+    """One date of the panel; mirrors the today_bar operations used by the backtesters."""
+    __slots__ = ('_panel', '_i', '_mask')
+
+    def __init__(self, panel, i):
+        self._panel = panel
+        self._i = i
+        self._mask = panel.present[i] & panel.active
+
+    def __contains__(self, symbol):
+        j = self._panel.symbol_index.get(symbol)
+        return j is not None and bool(self._mask[j])
+
+    def __getitem__(self, symbol):
+        return PanelRow(self._panel, self._i, self._panel.symbol_index[symbol])
+
+    @property
+    def symbols(self):
+        return self._panel.symbols[self._mask]
+
+    def frame(self, columns=None):
+        """Cross-section DataFrame of present symbols (index 'symbol', sorted)."""
+        js = np.flatnonzero(self._mask)
+        columns = columns or self._panel.all_fields
+        data = {name: self._panel.field(name)[self._i, js] for name in columns}
+        return pd.DataFrame(data, index=pd.Index(self._panel.symbols[js], name='symbol'))
+
+
+class PanelStore:
+    """Dense (date, symbol, field) float64 panel with O(1) integer lookups."""
+
+    def __init__(self, values, present, dates, symbols, fields, active=None, derived=None, path=None):
+        self.values = values
+        self.present = present
+        self.dates = pd.DatetimeIndex(dates)
+        self.symbols = np.asarray(symbols, dtype=object)
+        self.fields = list(fields)
+        self.active = np.ones(len(self.symbols), dtype=bool) if active is None else active
+        self.derived = dict(derived or {})
+        self.path = path
+
+        self.date_index = {d: i for i, d in enumerate(self.dates)}
+        self.symbol_index = {s: j for j, s in enumerate(self.symbols)}
+        self.field_index = {f: k for k, f in enumerate(self.fields)}
+
+    # --- Build / persist ---
+    @classmethod
+    def from_frame(cls, df, fields=None):
+        """Builds an in-memory panel from a long DataFrame indexed by (timestamp, symbol) in any level order."""
+        ts = pd.DatetimeIndex(df.index.get_level_values('timestamp'))
+        sym = df.index.get_level_values('symbol').astype(str)
+        if fields is None:
+            fields = [c for c in df.columns
+                      if pd.api.types.is_numeric_dtype(df[c].dtype) or pd.api.types.is_bool_dtype(df[c].dtype)]
+
+        dates = pd.DatetimeIndex(ts.unique()).sort_values()
+        symbols = pd.Index(sym.unique()).sort_values()
+        d_codes = dates.get_indexer(ts)
+        s_codes = symbols.get_indexer(sym)
+
+        values = np.full((len(dates), len(symbols), len(fields)), np.nan, dtype=np.float64)
+        for k, f in enumerate(fields):
+            values[d_codes, s_codes, k] = df[f].to_numpy(dtype=np.float64, na_value=np.nan)
+        present = np.zeros((len(dates), len(symbols)), dtype=bool)
+        present[d_codes, s_codes] = True
+        return cls(values, present, dates, symbols, fields)
+
+    def save(self, path, source_mtime=None):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'values.npy'), np.ascontiguousarray(self.values))
+        np.save(os.path.join(path, 'present.npy'), np.ascontiguousarray(self.present))
+        meta = {
+            'dates_ns': self.dates.asi8.tolist(),  # UTC ns，時區另存 (避免 DST 造成混合 offset)
+            'tz': str(self.dates.tz) if self.dates.tz is not None else None,
+            'symbols': [str(s) for s in self.symbols],
+            'fields': self.fields,
+            'source_mtime': source_mtime,
+        }
+        tmp_path = os.path.join(path, 'meta.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(path, 'meta.json'))
+
+    @classmethod
+    def open(cls, path):
+        """Opens a saved panel read-only via np.memmap (多行程共用，不複製)。"""
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        values = np.load(os.path.join(path, 'values.npy'), mmap_mode='r')
+        present = np.load(os.path.join(path, 'present.npy'), mmap_mode='r')
+        dates = pd.to_datetime(meta['dates_ns'], unit='ns')
+        if meta['tz'] is not None:
+            dates = dates.tz_localize('UTC').tz_convert(meta['tz'])
+        return cls(values, present, dates, meta['symbols'], meta['fields'], path=path)
+
+    @classmethod
+    def build_or_open(cls, source_path, panel_path=None, loader=None):
+        """
+        Opens {source_path}.panel if it is up to date with source_path, otherwise rebuilds it.
+        loader(source_path) -> DataFrame (預設 pd.read_parquet)。
+        """
+        panel_path = panel_path or source_path + '.panel'
+        source_mtime = os.path.getmtime(source_path)
+        meta_path = os.path.join(panel_path, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r') as f:
+                if json.load(f).get('source_mtime') == source_mtime:
+                    return cls.open(panel_path)
+
+        print(f"Building PanelStore from {source_path}...")
+        df = (loader or pd.read_parquet)(source_path)
+        cls.from_frame(df).save(panel_path, source_mtime=source_mtime)
+        return cls.open(panel_path)
+
+    # --- Views ---
+    def view(self):
+        """Shallow copy sharing the arrays, with its own derived fields (每個回測器各自一份)。"""
+        return PanelStore(self.values, self.present, self.dates, self.symbols, self.fields,
+                          active=self.active.copy(), derived=self.derived, path=self.path)
+
+    def restrict(self, symbols):
+        """View limited to the given symbols (不在 panel 中的標的會被忽略)。"""
+        out = self.view()
+        out.active &= np.isin(self.symbols, list(symbols))
+        return out
+
+    def active_dates(self, start=None, end=None):
+        """Dates on which at least one active symbol has a bar (start / end 皆含)。"""
+        has_bar = (self.present & self.active).any(axis=1)
+        dates = self.dates[has_bar]
+        if start is not None:
+            dates = dates[dates >= pd.Timestamp(start)]
+        if end is not None:
+            dates = dates[dates <= pd.Timestamp(end)]
+        return dates
+
+    @property
+    def empty(self):
+        return not (self.present & self.active).any()
+
+    # --- Lookups ---
+    @property
+    def all_fields(self):
+        return self.fields + list(self.derived)
+
+    def has_field(self, name):
+        return name in self.field_index or name in self.derived
+
+    def field(self, name):
+        """2-D (date, symbol) array for a stored or derived field."""
+        if name in self.derived:
+            return self.derived[name]
+        return self.values[:, :, self.field_index[name]]
+
+    def value(self, i, j, name):
+        if name in self.derived:
+            return self.derived[name][i, j]
+        return self.values[i, j, self.field_index[name]]
+
+    def symbol_frame(self, symbol, columns=None):
+        """All bars of one symbol indexed by timestamp (等同 df.xs(symbol, level='symbol'))。"""
+        j = self.symbol_index[symbol]
+        rows = np.flatnonzero(self.present[:, j])
+        columns = columns or self.all_fields
+        data = {name: self.field(name)[rows, j] for name in columns}
+        return pd.DataFrame(data, index=self.dates[rows].rename('timestamp'))
+
+    def day(self, date):
+        i = self.date_index.get(pd.Timestamp(date))
+        return None if i is None else PanelDay(self, i)
+
+    # --- Derived fields ---
+    def add_field(self, name, array):
+        self.derived[name] = array
+
+    def align(self, series):
+        """
+        Long (timestamp, symbol) Series -> (date, symbol) float64 array + presence mask.
+        不在 panel 中的日期 / 標的會被忽略 (例如把 L3 分數對齊到行情面板)。
+        """
+        i = self.dates.get_indexer(pd.DatetimeIndex(series.index.get_level_values('timestamp')))
+        j = pd.Index(self.symbols).get_indexer(series.index.get_level_values('symbol'))
+        ok = (i >= 0) & (j >= 0)
+        values = np.full(self.present.shape, np.nan, dtype=np.float64)
+        values[i[ok], j[ok]] = series.to_numpy(dtype=np.float64, na_value=np.nan)[ok]
+        mask = np.zeros(self.present.shape, dtype=bool)
+        mask[i[ok], j[ok]] = True
+        return values, mask
+
+    def add_shifted(self, name, source, periods=1):
+        """
+        Per-symbol shift over that symbol's own bars (與 groupby('symbol')[source].shift(periods) 相同，
+        缺漏的日期不算一根 K 棒)。
+        """
+        src = self.field(source)
+        out = np.full(src.shape, np.nan, dtype=np.float64)
+        for j in np.flatnonzero(self.active):
+            rows = np.flatnonzero(self.present[:, j])
+            if len(rows) > periods:
+                out[rows[periods:], j] = src[rows[:-periods], j]
+        self.derived[name] = out
+        return out
+
+
+def as_panel(data):
+    """Accepts a PanelStore or a long (timestamp, symbol) DataFrame and returns a private view."""
+    if isinstance(data, PanelStore):
+        return data.view()
+    return PanelStore.from_frame(data)
+
+
+# 簡單測試用
+if __name__ == "__main__":
+    import tempfile
+
+    idx = pd.MultiIndex.from_product([pd.bdate_range('2024-01-01', periods=5), ['AAA', 'BBB']],
+                                     names=['timestamp', 'symbol'])
+    df = pd.DataFrame({'close': np.arange(10, dtype=float), 'RSI_2': np.linspace(0, 90, 10)}, index=idx)
+    df = df.drop(idx[3])  # BBB 缺一天
+
+    src = os.path.join(tempfile.mkdtemp(), 'features.parquet')
+    df.to_parquet(src)
+    panel = PanelStore.build_or_open(src)
+    panel = PanelStore.build_or_open(src)  # 第二次直接 memmap 開啟
+    print(type(panel.values).__name__, panel.values.shape, panel.fields)
+
+    view = panel.restrict(['BBB'])
+    view.add_shifted('prev_close', 'close')
+    expected = df.xs('BBB', level='symbol')['close'].shift(1)
+    got = [view.day(d)['BBB']['prev_close'] for d in expected.index]
+    assert np.allclose(got, expected.to_numpy(), equal_nan=True)
+    print(view.day(view.active_dates()[2]).frame())
@@ -0,0 +1,305 @@
+"""
+Walk-forward hyperparameter search for the L3 LGBMRanker: successive halving / Hyperband over folds.
+
+V5.1 04_train_meta_labeling_l3 的 LGBMRanker 參數 (n_estimators=150, num_leaves=31, lr=0.05) 為手動設定。
+這裡把每組候選參數放到 walk-forward 各折上訓練，以 OOS 折的 NDCG@k 評分；「折」就是 successive halving 的資源單位：
+
+    folds = day_folds(timestamps.nunique(), n_splits=5)  # [((train_start, train_end), (test_start, test_end)), ...]
+    search, holdout = split_holdout(folds)               # 最後一折不參與搜尋
+    data = BinnedRankingData(X, y, timestamps, dict(LGBM_PARAMS, feature_pre_filter=False), cache_dir=...,
+                             bin_days=folds[0][0])       # 分箱邊界只取第一折的訓練期 (不看測試期)
+    store = TrialStore('models/l3_search/trials.jsonl', study_key(data, search, LGBM_PARAMS))
+    board = hyperband(data, search, SEARCH_SPACE, LGBM_PARAMS, store, eta=3, workers=4)
+    board.iloc[0]                                        # 跑滿所有搜尋折、平均 NDCG@k 最高的候選
+    evaluate_holdout(data, holdout, {trial: params}, LGBM_PARAMS)   # 在保留折上的 NDCG@k (選擇時沒看過)
+
+- successive_halving：候選先只跑最前面 (訓練資料最少、最便宜) 的 min_folds 折，依平均 NDCG@k 保留前 1/eta，
+  存活者才加跑後面的折 (折數依 eta 倍增)，最後一輪跑滿所有折。
+- hyperband：多個 bracket 以不同的起始折數 / 候選數各跑一次 successive halving，避免只看早期折就淘汰掉好的參數。
+- 所有候選共用同一個分箱後的 Dataset (common.lgb_dataset)；建構時須 feature_pre_filter=False 才能改 min_child_samples，
+  分箱邊界以 bin_days 限定在第一折的訓練期 (與 04 --binned-cache 相同)，否則測試期的特徵分佈會滲入各折。
+- 每個 (候選, 折) 的結果一完成就附加到 TrialStore (JSON lines)；中斷後以相同 study 重跑只補算缺少的部分。
+- workers > 1 時以 fork 的 process pool 平行 (子行程繼承分箱後的 Dataset)；每個 trial 固定單執行緒，
+  結果與 workers 數量、完成順序無關。
+- 搜尋折上的最佳分數是被挑出來的，偏樂觀 (selection bias)；split_holdout 保留最後的折不參與搜尋，
+  evaluate_holdout 在保留折上重新評分勝出者與對照組，這才是可報告的分數。
+"""
+import json
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import TimeSeriesSplit
+
+from common.feature_graph import _digest
+from common.lgb_dataset import train_params
+from common.model_registry import _canonical
+
+SEARCH_SPACE = {
+    'num_leaves': [7, 15, 31, 63],
+    'learning_rate': [0.02, 0.05, 0.1],
+    'n_estimators': [100, 150, 300],
+    'min_child_samples': [10, 20, 50, 100],
+    'colsample_bytree': [0.6, 0.8, 1.0],
+    'reg_lambda': [0.0, 1.0, 10.0],
+}
+
+_FORK_JOB = None  # fork 前設定，子行程直接繼承 (分箱後的 Dataset 無法 pickle)
+
+
+def trial_id(params):
+    """Stable id of one candidate (search params only; base params belong to the study)。"""
+    return _digest(_canonical(params))[:12]
+
+
+def sample_candidates(space, n, seed=42):
+    """n distinct random combinations of space (param -> list of values)；組合數不足 n 時全部回傳。"""
+    keys = sorted(space)
+    n = min(n, int(np.prod([len(space[k]) for k in keys])))
+    rng = np.random.default_rng(seed)
+    out = {}
+    while len(out) < n:
+        cand = {k: space[k][rng.integers(len(space[k]))] for k in keys}
+        out.setdefault(trial_id(cand), cand)
+    return list(out.values())
+
+
+def day_folds(n_days, n_splits=5):
+    """TimeSeriesSplit over day positions as contiguous ranges ((train_start, train_end), (test_start, test_end))。"""
+    return [((int(tr[0]), int(tr[-1]) + 1), (int(te[0]), int(te[-1]) + 1))
+            for tr, te in TimeSeriesSplit(n_splits=n_splits).split(np.arange(n_days))]
+
+
+def split_holdout(folds, n_holdout=1):
+    """(search_folds, holdout_folds)：最後 n_holdout 折保留給最終報告，搜尋至少要留一折。"""
+    if not 0 < n_holdout < len(folds):
+        raise ValueError(f"n_holdout must be in [1, {len(folds) - 1}] for {len(folds)} folds, got {n_holdout}")
+    return folds[:-n_holdout], folds[-n_holdout:]
+
+
+def fold_budgets(n_folds, eta=3, min_folds=1):
+    """Number of folds evaluated at each rung: min_folds * eta^i (上限 n_folds)，最後一輪必為 n_folds。"""
+    budgets = []
+    budget = min_folds
+    while budget < n_folds:
+        budgets.append(budget)
+        budget *= eta
+    return budgets + [n_folds]
+
+
+def study_key(data, folds, base_params):
+    """Trials are comparable only within the same binned data, folds and base params。"""
+    return _digest(data.key, _canonical([list(f) for f in folds]), _canonical(base_params))[:20]
+
+
+class TrialStore:
+    """Append-only JSON lines of (trial, fold) results; 只讀取 study 相同的紀錄。"""
+
+    def __init__(self, path, study):
+        self.path = path
+        self.study = study
+        self.records = {}
+        if not os.path.exists(path):
+            return
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # 中斷時寫到一半的最後一行
+                if record.get('study') == study:
+                    self.records[(record['trial'], record['fold'])] = record
+
+    def __contains__(self, key):
+        return key in self.records
+
+    def __len__(self):
+        return len(self.records)
+
+    def add(self, record):
+        record = dict(record, study=self.study)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, 'a+') as f:
+            # 上次中斷留下不完整的最後一行時先換行，避免接在它後面
+            if f.tell() > 0:
+                f.seek(f.tell() - 1)
+                if f.read(1) != '\n':
+                    f.write('\n')
+            f.write(json.dumps(record) + '\n')
+        self.records[(record['trial'], record['fold'])] = record
+
+    def scores(self, trials, n_folds, k=3):
+        """Mean NDCG@k over folds [0, n_folds) of each trial (Series)；缺少的折不計入。"""
+        metric = f'ndcg@{k}'
+        return pd.Series({t: np.mean([self.records[(t, f)]['metrics'][metric] for f in range(n_folds)
+                                      if (t, f) in self.records]) for t in trials}, dtype=float)
+
+    def leaderboard(self, n_folds, k=3):
+        """One row per trial: params, folds done, mean / std / per-fold NDCG@k, fit seconds；跑滿的折數多者優先。"""
+        metric = f'ndcg@{k}'
+        rows = {}
+        for (trial, fold), record in sorted(self.records.items(), key=lambda item: item[0]):
+            row = rows.setdefault(trial, dict(trial=trial, **record['params'], fit_seconds=0.0))
+            row[f'fold_{fold + 1}'] = record['metrics'][metric]
+            row['fit_seconds'] += record['seconds']
+        board = pd.DataFrame(list(rows.values()))
+        if board.empty:
+            return board
+        fold_cols = [f'fold_{f + 1}' for f in range(n_folds) if f'fold_{f + 1}' in board.columns]
+        board['folds'] = board[fold_cols].notna().sum(axis=1)
+        board[f'mean_{metric}'] = board[fold_cols].mean(axis=1)
+        board[f'std_{metric}'] = board[fold_cols].std(axis=1)
+        board = board.sort_values(['folds', f'mean_{metric}', 'trial'], ascending=[False, False, True])
+        front = ['trial', 'folds', f'mean_{metric}', f'std_{metric}']
+        rest = [c for c in board.columns if c not in front + ['fit_seconds']]
+        return board[front + rest + ['fit_seconds']].reset_index(drop=True)
+
+
+def _can_fork():
+    return 'fork' in mp.get_all_start_methods()
+
+
+def _evaluate(task, job=None):
+    data, folds, base_params = job or _FORK_JOB
+    trial, cand, fold = task
+    params, num_boost_round = train_params(dict(base_params, **cand))
+    params['num_threads'] = 1
+    train_days, test_days = folds[fold]
+    t0 = time.perf_counter()
+    booster = data.train(train_days, valid=test_days, params=params, num_boost_round=num_boost_round)
+    return {'trial': trial, 'fold': fold, 'params': cand,
+            'metrics': {m: float(v) for m, v in booster.best_score['valid_0'].items()},
+            'seconds': round(time.perf_counter() - t0, 3)}
+
+
+def _run_tasks(data, folds, base_params, store, tasks, workers):
+    """Evaluates the (trial, params, fold) tasks missing from store; 每完成一個就寫入 store。"""
+    global _FORK_JOB
+    todo = [task for task in tasks if (task[0], task[2]) not in store]
+    if not todo:
+        return 0
+    if workers > 1 and not _can_fork():
+        print("Warning: 'fork' start method not available; running search trials serially.")
+        workers = 1
+    _FORK_JOB = (data, folds, base_params)
+    try:
+        if workers <= 1:
+            for task in todo:
+                store.add(_evaluate(task))
+        else:
+            with mp.get_context('fork').Pool(min(workers, len(todo))) as pool:
+                for record in pool.imap_unordered(_evaluate, todo):
+                    store.add(record)
+    finally:
+        _FORK_JOB = None
+    return len(todo)
+
+
+def evaluate_holdout(data, holdout, candidates, base_params, k=3):
+    """
+    NDCG@k of candidates (trial -> params) on the held-out folds (split_holdout)：各自以保留折的訓練期訓練、
+    測試期評分。回傳 DataFrame (trial x fold_1.. + mean)；不寫入 TrialStore (搜尋永遠看不到這些分數)。
+    """
+    _check_prefilter(data, list(candidates.values()))
+    metric = f'ndcg@{k}'
+    rows = {}
+    for trial, cand in candidates.items():
+        scores = [_evaluate((trial, cand, fold), job=(data, holdout, base_params))['metrics'][metric]
+                  for fold in range(len(holdout))]
+        rows[trial] = dict({f'fold_{f + 1}': v for f, v in enumerate(scores)}, mean=float(np.mean(scores)))
+    return pd.DataFrame.from_dict(rows, orient='index')
+
+
+def _check_prefilter(data, candidates):
+    if data.params.get('feature_pre_filter', True) and any('min_child_samples' in c for c in candidates):
+        raise ValueError("Searching min_child_samples needs the binned data built with feature_pre_filter=False")
+
+
+def successive_halving(data, folds, candidates, base_params, store, eta=3, min_folds=1, k=3, workers=1,
+                       verbose=True, label=''):
+    """
+    Successive halving over walk-forward folds；回傳跑滿所有折的存活候選 trial id (依平均 NDCG@k 排序)。
+    base_params 須與建構 data 時的參數相同 (候選參數覆寫其上)。
+    """
+    _check_prefilter(data, candidates)
+    budgets = fold_budgets(len(folds), eta, min_folds)
+    alive = {trial_id(c): c for c in candidates}
+    for rung, budget in enumerate(budgets):
+        t0 = time.perf_counter()
+        tasks = [(trial, cand, fold) for trial, cand in alive.items() for fold in range(budget)]
+        fitted = _run_tasks(data, folds, base_params, store, tasks, workers)
+        scores = store.scores(alive, budget, k)
+        ranked = sorted(alive, key=lambda t: (-scores[t], t))
+        if verbose:
+            print(f"  {label}Rung {rung + 1}/{len(budgets)}: {len(alive)} candidates x {budget} folds "
+                  f"({fitted} fits, {len(tasks) - fitted} from store, {time.perf_counter() - t0:.1f}s) | "
+                  f"best mean NDCG@{k} = {scores[ranked[0]]:.4f}")
+        if rung < len(budgets) - 1:
+            alive = {t: alive[t] for t in ranked[:max(1, len(alive) // eta)]}
+    return ranked
+
+
+def hyperband(data, folds, space, base_params, store, eta=3, min_folds=1, scale=1, k=3, workers=1, seed=42,
+              verbose=True):
+    """
+    Hyperband: bracket s (s_max..0) samples ceil(scale * (s_max + 1) / (s + 1) * eta^s) candidates and runs
+    successive halving starting at rung s_max - s。回傳 TrialStore.leaderboard (全部 bracket 合併)。
+    """
+    budgets = fold_budgets(len(folds), eta, min_folds)
+    s_max = len(budgets) - 1
+    for s in range(s_max, -1, -1):
+        n = int(np.ceil(scale * (s_max + 1) / (s + 1) * eta ** s))
+        candidates = sample_candidates(space, n, seed=seed + s)
+        if verbose:
+            print(f"Bracket {s_max - s + 1}/{s_max + 1}: {len(candidates)} candidates from {budgets[s_max - s]} fold(s)")
+        successive_halving(data, folds, candidates, base_params, store, eta=eta, min_folds=budgets[s_max - s],
+                           k=k, workers=workers, verbose=verbose)
+    return store.leaderboard(len(folds), k)
+
+
+# 簡單測試用
+if __name__ == "__main__":
+    import tempfile
+    import warnings
+
+    from common.lgb_dataset import BinnedRankingData
+
+    warnings.simplefilter('ignore')
+    rng = np.random.default_rng(0)
+    counts = rng.integers(5, 40, 400)
+    ts = np.repeat(pd.bdate_range('2020-01-01', periods=400), counts)
+    X = pd.DataFrame(rng.normal(size=(len(ts), 6)), columns=[f"f{i}" for i in range(6)])
+    y = np.clip((X['f0'] + rng.normal(size=len(ts)) > 1).astype(int) + (X['f1'] > 1), 0, 3).to_numpy()
+    base = {'objective': 'lambdarank', 'metric': 'ndcg', 'ndcg_eval_at': [1, 3, 5], 'n_estimators': 30,
+            'label_gain': [0, 1, 3, 7], 'random_state': 42, 'verbose': -1, 'feature_pre_filter': False}
+    space = {'num_leaves': [3, 7, 15], 'learning_rate': [0.05, 0.1], 'min_child_samples': [5, 20, 50]}
+
+    folds, holdout = split_holdout(day_folds(len(np.unique(ts)), n_splits=6))
+    data = BinnedRankingData(X, y, ts, base, bin_days=folds[0][0])
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'trials.jsonl')
+        candidates = sample_candidates(space, 9, seed=1)
+        serial = TrialStore(path, study_key(data, folds, base))
+        best = successive_halving(data, folds, candidates, base, serial, eta=3)
+        print(f"{len(serial)} fold fits instead of {len(candidates) * len(folds)}; best trial {best[0]}")
+
+        # 中斷後重跑：同一 study 的結果直接讀回，不再訓練
+        resumed = TrialStore(path, study_key(data, folds, base))
+        assert _run_tasks(data, folds, base, resumed, [(t, None, f) for t, f in resumed.records], 1) == 0
+
+        parallel = TrialStore(os.path.join(tmp, 'parallel.jsonl'), study_key(data, folds, base))
+        successive_halving(data, folds, candidates, base, parallel, eta=3, workers=2, verbose=False)
+        assert parallel.leaderboard(5).drop(columns='fit_seconds').equals(serial.leaderboard(5).drop(columns='fit_seconds'))
+        print("workers=1 and workers=2 identical: OK")
+
+        hb = TrialStore(os.path.join(tmp, 'hb.jsonl'), 'hb')
+        board = hyperband(data, folds, space, base, hb, verbose=True)
+        print(board.head(3).to_string())
+
+        # 保留折：搜尋只用前 5 折，勝出者與對照組 (base) 在第 6 折 (搜尋沒看過的天) 重新評分
+        assert all(test_end <= holdout[0][1][0] for _, (_, test_end) in folds)
+        winner = board.iloc[0]['trial']
+        held = evaluate_holdout(data, holdout, {winner: hb.records[(winner, 0)]['params'], trial_id({}): {}}, base)
+        print(held.to_string())
@@ -0,0 +1,228 @@
+"""
+Long-format raw OHLCV dataset (取代 00_download -> 01_format 之間的 raw pickle 交接).
+
+舊流程：00 把整個寬表格 (Price x Ticker) pickle 成 raw_*.pkl，01 必須整包 unpickle 進記憶體
+再 stack，一份寬表 + 一份長表同時存在 RAM。
+
+新流程：00 直接把每個標的寫成 hive 分區的 Parquet (symbol / year)，schema 固定：
+
+    {root}/symbol={SYMBOL}/year={YYYY}/part-0.parquet
+        timestamp: timestamp[ns] (盤中資料帶時區)
+        open, high, low, close, volume: float64
+    {root}/_metadata.json   # symbols / 時區 / 筆數，供 01 做 metadata-only 檢查
+
+01 以 stream_to_parquet() 一次處理一個標的，邊讀邊寫，不會同時持有整個宇宙的寬表。
+其他步驟可用 read_raw_dataset(symbols=..., start=..., end=...) 只讀需要的分區。
+"""
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+PRICE_COLUMNS = ['open', 'high', 'low', 'close']
+VALUE_COLUMNS = PRICE_COLUMNS + ['volume']
+PARTITIONING = ds.partitioning(pa.schema([('symbol', pa.string()), ('year', pa.int32())]), flavor='hive')
+
+
+def raw_schema(tz=None):
+    """Explicit file schema for one partition (symbol / year 由目錄提供)。"""
+    return pa.schema(
+        [('timestamp', pa.timestamp('ns', tz=tz))] +
+        [(c, pa.float64()) for c in VALUE_COLUMNS]
+    )
+
+
+def _normalize_bars(df):
+    """{Open, High, ...} (任意大小寫) + DatetimeIndex -> lower-case columns with float64 values."""
+    out = df.copy()
+    out.columns = [str(c).lower() for c in out.columns]
+    out = out.reindex(columns=VALUE_COLUMNS).astype('float64')
+    out.index = pd.DatetimeIndex(out.index, name='timestamp')
+    out = out[~out.index.duplicated(keep='last')].sort_index()
+    return out.dropna(how='all', subset=PRICE_COLUMNS)
+
+
+def write_raw_dataset(bars, root):
+    """
+    Writes {symbol: OHLCV DataFrame} as a symbol/year partitioned Parquet dataset.
+    既有的 dataset 會整個被取代 (避免殘留已移除的標的)。
+    """
+    tmp_root = root.rstrip(os.sep) + '.tmp'
+    if os.path.exists(tmp_root):
+        shutil.rmtree(tmp_root)
+    os.makedirs(tmp_root)
+
+    tz = None
+    n_rows = 0
+    symbols = []
+    for symbol, df in bars.items():
+        if df is None or df.empty:
+            continue
+        df = _normalize_bars(df)
+        if df.empty:
+            continue
+        tz = str(df.index.tz) if df.index.tz is not None else None
+        schema = raw_schema(tz)
+        for year, part in df.groupby(df.index.year):
+            part_dir = os.path.join(tmp_root, f"symbol={symbol}", f"year={year}")
+            os.makedirs(part_dir, exist_ok=True)
+            table = pa.Table.from_pandas(part.reset_index(), schema=schema, preserve_index=False)
+            pq.write_table(table, os.path.join(part_dir, 'part-0.parquet'))
+        symbols.append(symbol)
+        n_rows += len(df)
+
+    with open(os.path.join(tmp_root, '_metadata.json'), 'w') as f:
+        json.dump({'symbols': sorted(symbols), 'tz': tz, 'rows': n_rows}, f, indent=2)
+
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    os.replace(tmp_root, root)
+    print(f"  - Raw dataset written: {root} ({len(symbols)} symbols, {n_rows} rows)")
+
+
+def dataset_exists(root):
+    return os.path.exists(os.path.join(root, '_metadata.json'))
+
+
+def read_metadata(root):
+    with open(os.path.join(root, '_metadata.json'), 'r') as f:
+        return json.load(f)
+
+
+def _year_filter(start, end):
+    expr = None
+    if start is not None:
+        expr = ds.field('year') >= pd.Timestamp(start).year
+    if end is not None:
+        cond = ds.field('year') <= pd.Timestamp(end).year
+        expr = cond if expr is None else expr & cond
+    return expr
+
+
+def _slice_time(df, start, end):
+    idx = pd.DatetimeIndex(df['timestamp'])
+    mask = np.ones(len(df), dtype=bool)
+    for bound, op in ((start, 'ge'), (end, 'lt')):
+        if bound is None:
+            continue
+        ts = pd.Timestamp(bound)
+        if idx.tz is not None and ts.tzinfo is None:
+            ts = ts.tz_localize(idx.tz)
+        mask &= (idx >= ts) if op == 'ge' else (idx < ts)
+    return df[mask]
+
+
+def read_raw_dataset(root, symbols=None, start=None, end=None, columns=None):
+    """
+    Reads a long DataFrame [timestamp, symbol, ...] touching only the needed partitions.
+    start / end 為 [start, end)。
+    """
+    dataset = ds.dataset(root, format='parquet', partitioning=PARTITIONING)
+    expr = _year_filter(start, end)
+    if symbols is not None:
+        cond = ds.field('symbol').isin(list(symbols))
+        expr = cond if expr is None else expr & cond
+    cols = ['timestamp', 'symbol'] + list(columns or VALUE_COLUMNS)
+    df = dataset.to_table(columns=cols, filter=expr).to_pandas()
+    return _slice_time(df, start, end).reset_index(drop=True)
+
+
+def iter_symbols(root, symbols=None, start=None, end=None):
+    """Yields (symbol, long DataFrame) one symbol at a time (串流讀取)。"""
+    if symbols is None:
+        symbols = read_metadata(root)['symbols']
+    for symbol in symbols:
+        sym_dir = os.path.join(root, f"symbol={symbol}")
+        if not os.path.isdir(sym_dir):
+            continue
+        df = read_raw_dataset(root, symbols=[symbol], start=start, end=end)
+        if not df.empty:
+            yield symbol, df.sort_values('timestamp', kind='stable')
+
+
+def list_years(root):
+    """Years present in any symbol partition (由目錄名稱取得，不讀資料)。"""
+    years = set()
+    for sym_dir in os.listdir(root):
+        if not sym_dir.startswith('symbol='):
+            continue
+        for year_dir in os.listdir(os.path.join(root, sym_dir)):
+            if year_dir.startswith('year='):
+                years.add(int(year_dir.split('=', 1)[1]))
+    return sorted(years)
+
+
+def iter_years(root, symbols=None):
+    """Yields (year, long DataFrame of all symbols) sorted by (timestamp, symbol)。"""
+    for year in list_years(root):
+        df = read_raw_dataset(root, symbols=symbols, start=f"{year}-01-01", end=f"{year + 1}-01-01")
+        if not df.empty:
+            yield year, df.sort_values(['timestamp', 'symbol'], kind='stable')
+
+
+def stream_to_parquet(root, output_path, index=('timestamp', 'symbol'), rename=None, symbols=None,
+                      order='symbol', transform=None, to_table=None, row_group_size=None):
+    """
+    Streams the raw dataset into a single pandas-compatible Parquet file.
+
+    index: 寫出的 index 欄位順序，例如 V5.3 用 ('timestamp', 'symbol')、V5.1 用 ('symbol', 'timestamp')。
+    rename: 欄位改名 (例如 V5.1 需要 'open' -> 'Open')。
+    order: 'symbol' -> 一次處理一個標的 (檔案以 symbol 為主序)；
+           'timestamp' -> 一次處理一個年度分區，整個檔案以 (timestamp, symbol) 排序，
+                          timestamp 的 row-group statistics 可供讀取端做 predicate pushdown。
+    transform / to_table: 每個 chunk 的 DataFrame 轉換與 Arrow 轉換 (例如 common.frame_schema)。
+    """
+    rename = rename or {}
+    index = list(index)
+    to_table = to_table or (lambda frame: pa.Table.from_pandas(frame, preserve_index=True))
+    chunks = iter_symbols(root, symbols=symbols) if order == 'symbol' else iter_years(root, symbols=symbols)
+
+    tmp_path = output_path + '.tmp'
+    writer = None
+    n_rows = 0
+    n_chunks = 0
+    try:
+        for _, df in chunks:
+            df = df.rename(columns=rename).set_index(index)
+            if transform is not None:
+                df = transform(df)
+            table = to_table(df)
+            if writer is None:
+                schema = table.schema
+                writer = pq.ParquetWriter(tmp_path, schema)
+            writer.write_table(table.cast(schema), row_group_size=row_group_size)
+            n_rows += len(df)
+            n_chunks += 1
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if writer is None:
+        print(f"  - Warning: no data found in {root}")
+        return 0
+    os.replace(tmp_path, output_path)
+    print(f"  - Streamed {n_chunks} {order} chunks / {n_rows} rows -> {output_path}")
+    return n_rows
+
+
+# 簡單測試用
+if __name__ == "__main__":
+    import tempfile
+
+    tmp = tempfile.mkdtemp()
+    idx = pd.bdate_range('2023-06-01', '2024-06-28', name='Date')
+    bars = {s: pd.DataFrame({'Open': 1.0, 'High': 2.0, 'Low': 0.5, 'Close': 1.5, 'Volume': 100}, index=idx)
+            for s in ['AAA', 'BBB', '^VIX']}
+    root = os.path.join(tmp, 'raw')
+    write_raw_dataset(bars, root)
+    print(read_metadata(root))
+    print(read_raw_dataset(root, symbols=['BBB'], start='2024-01-01').head(3))
+
+    out = os.path.join(tmp, 'universe_daily.parquet')
+    stream_to_parquet(root, out)
+    print(pd.read_parquet(out).sort_index().head(3))
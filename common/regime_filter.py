@@ -0,0 +1,241 @@
+"""
+Online regime inference: HMM forward filter + warm IsolationForest scorer, one market-feature row at a time.
+
+批次做法每天載入模型後對整段資料跑 hmm.predict (Viterbi) 只為了取最後一天的狀態。
+RegimeFilter 只保留前向機率向量 (forward probabilities) 與 forward fill 所需的上一列，每天 update() 一列：
+
+    filt = RegimeFilter(hmm_model, scaler, iso_model, state_map, hmm_cols, iso_cols)
+    filt.restore(checkpoint_path)            # 沿用上次的狀態 (模型不同時自動重設)
+    out = filt.update(today_row)             # {'probs', 'HMM_State', 'Anomaly_Score', 'Is_Anomaly'}
+    filt.save(checkpoint_path)
+
+對應關係 (replay 以此驗證)：
+    - probs = hmm.predict_proba(X[:t + 1])[-1] (最後一天的 smoothed posterior 即 filtered posterior)，依 state_map 重排
+    - Anomaly_Score / Is_Anomaly 與 -iso.decision_function / iso.predict 逐位元相同
+      (IsolationForestScorer 把所有樹攤平成陣列，逐層走訪，不經過 sklearn 的輸入檢查與 joblib)
+    - 輸入的前處理與 03_train_regime_model_l1_rolling 相同：HMM 欄位 forward fill 後補 0，IsolationForest 欄位補 0
+注意：批次 OOS 的 HMM_State 是整個測試窗的 Viterbi 路徑 (會用到窗內之後的資料)，線上濾波只用到當天為止，
+兩者的狀態不保證逐日相同。
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+FILTER_VERSION = 1
+
+
+class IsolationForestScorer:
+    """Single-row IsolationForest anomaly score (= -decision_function)，結果與 sklearn 逐位元相同。"""
+
+    def __init__(self, iso_model):
+        if iso_model._max_features != iso_model.n_features_in_:
+            raise ValueError("IsolationForestScorer requires max_features=1.0 (all features per tree)")
+        lefts, rights, features, thresholds, values, roots = [], [], [], [], [], []
+        offset = 0
+        for tree, path_len, avg_len in zip(iso_model.estimators_, iso_model._decision_path_lengths,
+                                           iso_model._average_path_length_per_tree):
+            t = tree.tree_
+            leaf = t.children_left == -1
+            roots.append(offset)
+            # 葉節點指回自己：固定走 max_depth 層即可，不必逐樣本判斷是否已到葉
+            lefts.append(np.where(leaf, np.arange(t.node_count), t.children_left) + offset)
+            rights.append(np.where(leaf, np.arange(t.node_count), t.children_right) + offset)
+            features.append(np.where(leaf, 0, t.feature))
+            thresholds.append(t.threshold)
+            values.append(path_len + avg_len - 1.0)
+            offset += t.node_count
+        # children[2 * node] = 左子節點、children[2 * node + 1] = 右子節點
+        self.children = np.column_stack([np.concatenate(lefts), np.concatenate(rights)]).ravel()
+        self.feature = np.concatenate(features)
+        self.threshold = np.concatenate(thresholds)
+        self.value = np.concatenate(values)
+        self.roots = np.asarray(roots)
+        self.max_depth = max(tree.tree_.max_depth for tree in iso_model.estimators_)
+        self.denominator = len(iso_model.estimators_) * _average_path_length(iso_model._max_samples)
+        self.offset = float(iso_model.offset_)
+
+    def score(self, x):
+        """Anomaly score of one row (越大越異常)；x 依 sklearn 轉為 float32。"""
+        x = np.asarray(x, dtype=np.float32).astype(np.float64)
+        node = self.roots
+        for _ in range(self.max_depth):
+            go_right = x.take(self.feature.take(node)) > self.threshold.take(node)
+            node = self.children.take(2 * node + go_right)
+        # sklearn 逐棵樹累加 depths (依序相加，不用 pairwise sum)
+        depth = np.cumsum(self.value[node])[-1:]
+        if self.denominator == 0:
+            return 1.0 + self.offset
+        # 用陣列版 np.power (與 Python 的純量 pow 在最後一位可能不同)
+        return float(np.power(2.0, -depth / self.denominator)[0]) + self.offset
+
+
+def _average_path_length(n):
+    """sklearn.ensemble._iforest._average_path_length for one n。"""
+    if n <= 1:
+        return 0.0
+    if n == 2:
+        return 1.0
+    return 2.0 * (np.log(n - 1.0) + np.euler_gamma) - 2.0 * (n - 1.0) / n
+
+
+class RegimeFilter:
+    """HMM forward filter + IsolationForest scorer with a JSON checkpoint。"""
+
+    def __init__(self, hmm_model, scaler, iso_model, state_map, hmm_cols, iso_cols):
+        self.hmm_cols = list(hmm_cols)
+        self.iso_cols = list(iso_cols)
+        self.state_map = {int(k): int(v) for k, v in state_map.items()}
+        self.n_states = hmm_model.n_components
+        # state_map: 原始 state -> 語意 state (0=Bull, 1=Chop, 2=Crash)
+        self.order = np.empty(self.n_states, dtype=np.int64)
+        for raw, mapped in self.state_map.items():
+            self.order[mapped] = raw
+
+        self.scaler_mean = np.asarray(scaler.mean_, dtype=np.float64)
+        self.scaler_scale = np.asarray(scaler.scale_, dtype=np.float64)
+        self.startprob = np.asarray(hmm_model.startprob_, dtype=np.float64)
+        self.transmat = np.asarray(hmm_model.transmat_, dtype=np.float64)
+        covars = np.asarray(hmm_model.covars_)
+        self.means = np.asarray(hmm_model.means_)
+        self.precisions = np.linalg.inv(covars)
+        d = self.means.shape[1]
+        self.log_norm = -0.5 * (d * np.log(2 * np.pi) + np.linalg.slogdet(covars)[1])
+        self.iso = IsolationForestScorer(iso_model)
+        self.model_id = _model_id(hmm_model, scaler, iso_model)
+        self.reset()
+
+    def reset(self):
+        self.alpha = None
+        self.last_hmm_row = np.full(len(self.hmm_cols), np.nan)
+        self.last_timestamp = None
+        self.n_obs = 0
+
+    def _log_emission(self, x):
+        diff = x - self.means
+        maha = np.einsum('ki,kij,kj->k', diff, self.precisions, diff)
+        return self.log_norm - 0.5 * maha
+
+    def update(self, row, timestamp=None):
+        """
+        Ingests one row (dict / Series，含 hmm_cols 與 iso_cols)；回傳當天的 filtered 機率 (語意順序) 與異常分數。
+        """
+        hmm_x = np.array([row.get(c, np.nan) for c in self.hmm_cols], dtype=np.float64)
+        hmm_x = np.where(np.isnan(hmm_x), self.last_hmm_row, hmm_x)  # forward fill
+        self.last_hmm_row = hmm_x
+        scaled = (np.nan_to_num(hmm_x) - self.scaler_mean) / self.scaler_scale
+
+        # scaled forward recursion：alpha_t ∝ (alpha_{t-1} @ A) * b_t，每步正規化 (emission 先減最大值避免 underflow)
+        log_b = self._log_emission(scaled)
+        b = np.exp(log_b - log_b.max())
+        prior = self.startprob if self.alpha is None else self.alpha @ self.transmat
+        alpha = prior * b
+        total = alpha.sum()
+        if not total > 0:
+            print("Warning: regime filter observation has zero likelihood under every state; using emission only.")
+            alpha, total = b, b.sum()
+        self.alpha = alpha / total
+        self.n_obs += 1
+        if timestamp is not None:
+            self.last_timestamp = str(timestamp)
+
+        probs = self.alpha[self.order]
+        iso_x = np.nan_to_num(np.array([row.get(c, np.nan) for c in self.iso_cols], dtype=np.float64))
+        anomaly_score = self.iso.score(iso_x)
+        return {
+            'probs': probs,
+            'HMM_State': int(np.argmax(probs)),
+            'Anomaly_Score': anomaly_score,
+            'Is_Anomaly': int(anomaly_score > 0),  # decision_function < 0 <=> predict == -1
+        }
+
+    def replay(self, df):
+        """Runs update() over every row of df (依時間排序)，回傳與 03 的 regime_signals 同欄位的 DataFrame。"""
+        import pandas as pd
+
+        rows = []
+        for ts, row in zip(df.index, df.to_dict('records')):
+            out = self.update(row, ts)
+            rows.append([out['HMM_State'], out['Is_Anomaly'], out['Anomaly_Score'], *out['probs']])
+        cols = ['HMM_State', 'Is_Anomaly', 'Anomaly_Score'] + [f'Prob_State_{k}' for k in range(self.n_states)]
+        return pd.DataFrame(rows, index=df.index, columns=cols)
+
+    # --- Checkpoint ---
+    def save(self, path):
+        state = {
+            'version': FILTER_VERSION,
+            'model_id': self.model_id,
+            'last_timestamp': self.last_timestamp,
+            'n_obs': self.n_obs,
+            'alpha': None if self.alpha is None else self.alpha.tolist(),
+            'last_hmm_row': [None if np.isnan(v) else float(v) for v in self.last_hmm_row],
+        }
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+    def restore(self, path):
+        """Loads a checkpoint；檔案不存在、版本或模型不同時重設並回傳 False。"""
+        self.reset()
+        if not os.path.exists(path):
+            return False
+        try:
+            with open(path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning: cannot read regime filter checkpoint {path}: {e}")
+            return False
+        if state.get('version') != FILTER_VERSION or state.get('model_id') != self.model_id:
+            print("Info: regime model changed since the last checkpoint; filter state reset.")
+            return False
+        self.alpha = None if state['alpha'] is None else np.asarray(state['alpha'])
+        self.last_hmm_row = np.array([np.nan if v is None else v for v in state['last_hmm_row']])
+        self.last_timestamp = state['last_timestamp']
+        self.n_obs = state['n_obs']
+        return True
+
+
+def _model_id(hmm_model, scaler, iso_model):
+    """Fingerprint of the fitted parameters (換模型後 checkpoint 失效)。"""
+    h = hashlib.sha1()
+    for arr in (hmm_model.startprob_, hmm_model.transmat_, hmm_model.means_, hmm_model.covars_,
+                scaler.mean_, scaler.scale_, [iso_model.offset_]):
+        h.update(np.ascontiguousarray(arr, dtype=np.float64).tobytes())
+    return h.hexdigest()[:16]
+
+
+# 簡單測試用
+if __name__ == "__main__":
+    import time
+    import warnings
+
+    import pandas as pd
+    from hmmlearn.hmm import GaussianHMM
+    from sklearn.ensemble import IsolationForest
+    from sklearn.preprocessing import StandardScaler
+
+    warnings.simplefilter('ignore')
+    rng = np.random.default_rng(0)
+    regime = np.repeat(rng.integers(0, 3, 20), 40)
+    df = pd.DataFrame(rng.normal(size=(800, 3)) * (1 + regime[:, None]), columns=['a', 'b', 'c'],
+                      index=pd.bdate_range('2020-01-01', periods=800))
+    train, test = df.iloc[:600], df.iloc[600:]
+    scaler = StandardScaler().fit(train)
+    hmm = GaussianHMM(3, covariance_type='full', n_iter=50, random_state=0).fit(scaler.transform(train))
+    iso = IsolationForest(contamination=0.05, random_state=0).fit(train)
+
+    filt = RegimeFilter(hmm, scaler, iso, {0: 0, 1: 1, 2: 2}, ['a', 'b', 'c'], ['a', 'b', 'c'])
+    out = filt.replay(test)
+    X = scaler.transform(test)
+    ref_probs = np.array([hmm.predict_proba(X[:t + 1])[-1] for t in range(len(X))])
+    assert np.allclose(out[['Prob_State_0', 'Prob_State_1', 'Prob_State_2']].to_numpy(), ref_probs, atol=1e-9)
+    assert np.array_equal(out['Anomaly_Score'].to_numpy(), -iso.decision_function(test))
+
+    last_row = test.iloc[-1].to_dict()
+    t0 = time.perf_counter()
+    for _ in range(1000):
+        filt.update(last_row)
+    print(f"update(): {(time.perf_counter() - t0) * 1000:.1f} us / row")
+    print("forward filter == predict_proba prefix, anomaly score == sklearn: OK")
@@ -0,0 +1,165 @@
+"""
+Hybrid regime filter grid: crash signals for many configs as one (config x date) matrix + a batched backtest.
+
+V5.3 03_build_regime_filter 的 generate_hybrid_signals 寫死了一組設定：
+    Crash = (market_breadth < 15%) OR (Junk_Bond_Stress < MA20 AND Risk_Off_Flow > MA20)
+V5.2 則是 breadth < 20% 單一條件。要比較不同設定，原本只能改程式重跑整條 pipeline。這裡：
+
+    configs = regime_configs(thresholds=np.arange(0.05, 0.41, 0.01), ma_windows=[10, 20, 50],
+                             macro_logic=('and', 'or'), combine=('or', 'and', 'breadth', 'macro'))
+    crash = crash_matrix(configs, breadth_df['market_breadth'], macro_df)   # bool (n_configs, n_dates)
+    metrics = backtest_crash_matrix(crash, returns, dates=breadth_df.index)   # 每個 config 一列
+
+- breadth 門檻一次 broadcast 出 (門檻 x 日期)；每個 MA 視窗只算一次 rolling mean (與 02_build_features 的
+  *_MA20 相同算法，在 macro 自己的日期上算完再對齊 breadth，與 generate_hybrid_signals 的 left join 一致)，
+  各 config 只是從這些列取出再做 AND / OR。
+- combine: 'or' = breadth | macro (V5.3)、'and' = breadth & macro、'breadth' = 只看 breadth (V5.2)、'macro' = 只看 macro。
+  macro_logic: 'and' = 高收益債轉弱 AND 避險資金流入 (V5.3)、'or' = 兩者其一。
+  不會用到的參數 ('breadth' 不看 MA / macro_logic，'macro' 不看門檻) 記為 NaN / None，不重複展開。
+- 沒有 macro 欄位 (index track) 時 macro 條件全為 False，與 generate_hybrid_signals 的 fallback 相同。
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+
+MACRO_LOGIC = ('and', 'or')
+COMBINE = ('or', 'and', 'breadth', 'macro')
+
+
+def regime_configs(thresholds, ma_windows=(20,), macro_logic=('and',), combine=('or',)):
+    """Config table (breadth_threshold, ma_window, macro_logic, combine)；每列對應 crash 矩陣的一列。"""
+    for name, values, allowed in (('macro_logic', macro_logic, MACRO_LOGIC), ('combine', combine, COMBINE)):
+        unknown = set(values) - set(allowed)
+        if unknown:
+            raise ValueError(f"Unknown {name} {sorted(unknown)}; expected one of {allowed}")
+    rows = []
+    for comb in combine:
+        uses_breadth = comb != 'macro'
+        uses_macro = comb != 'breadth'
+        for thr, window, logic in itertools.product(thresholds if uses_breadth else [np.nan],
+                                                    ma_windows if uses_macro else [np.nan],
+                                                    macro_logic if uses_macro else [None]):
+            rows.append((float(thr), window, logic, comb))
+    configs = pd.DataFrame(rows, columns=['breadth_threshold', 'ma_window', 'macro_logic', 'combine'])
+    configs['ma_window'] = configs['ma_window'].astype('Int64')
+    return configs.drop_duplicates(ignore_index=True)
+
+
+def macro_conditions(macro_df, ma_windows, index):
+    """
+    {(window, logic): bool array over index}；macro_df 缺 Junk_Bond_Stress / Risk_Off_Flow 時全為 False。
+    """
+    n = len(index)
+    if macro_df is None or not {'Junk_Bond_Stress', 'Risk_Off_Flow'} <= set(macro_df.columns):
+        return {(w, logic): np.zeros(n, dtype=bool) for w in ma_windows for logic in MACRO_LOGIC}
+    junk = macro_df['Junk_Bond_Stress']
+    flow = macro_df['Risk_Off_Flow']
+    junk_now = junk.reindex(index).to_numpy()
+    flow_now = flow.reindex(index).to_numpy()
+    out = {}
+    for w in ma_windows:
+        # NaN 的比較結果為 False (與 pandas 的 < / > 相同)
+        stress_down = junk_now < junk.rolling(w).mean().reindex(index).to_numpy()
+        fear_up = flow_now > flow.rolling(w).mean().reindex(index).to_numpy()
+        out[(w, 'and')] = stress_down & fear_up
+        out[(w, 'or')] = stress_down | fear_up
+    return out
+
+
+def crash_matrix(configs, breadth, macro_df=None):
+    """
+    Crash signal of every config: bool ndarray (n_configs, n_dates)，日期為 breadth.index。
+    breadth: market_breadth Series；macro_df: 02_build_features 的 macro_features (Junk_Bond_Stress, Risk_Off_Flow)。
+    """
+    index = breadth.index
+    n_dates = len(index)
+    crash = np.zeros((len(configs), n_dates), dtype=bool)
+
+    thr = configs['breadth_threshold'].to_numpy(dtype=float)
+    uses_breadth = ~np.isnan(thr)
+    if uses_breadth.any():
+        # (config x date) 一次比較；NaN breadth -> False
+        crash[uses_breadth] = breadth.to_numpy(dtype=float)[None, :] < thr[uses_breadth, None]
+
+    uses_macro = configs['combine'].to_numpy() != 'breadth'
+    if uses_macro.any():
+        windows = sorted(configs.loc[uses_macro, 'ma_window'].astype(int).unique())
+        macro = macro_conditions(macro_df, windows, index)
+        keys = list(macro)
+        stacked = np.stack([macro[k] for k in keys])
+        key_pos = {k: i for i, k in enumerate(keys)}
+        rows = np.flatnonzero(uses_macro)
+        sel = stacked[[key_pos[(int(w), l)] for w, l in
+                       zip(configs['ma_window'].to_numpy()[rows], configs['macro_logic'].to_numpy()[rows])]]
+        comb = configs['combine'].to_numpy()[rows]
+        crash[rows] = np.where((comb == 'macro')[:, None], sel,
+                               np.where((comb == 'and')[:, None], crash[rows] & sel, crash[rows] | sel))
+    return crash
+
+
+def backtest_crash_matrix(crash, returns, dates=None, cost=0.001, periods_per_year=252):
+    """
+    Batched exposure backtest：crash[k, t-1] 為 True 時第 t 天空手 (T-1 收盤的訊號，T 日執行)，否則持有。
+    returns[t] = 第 t 天持有可得的報酬 (例如 open_t -> open_{t+1})；每次進出場扣 cost (單邊)。
+    回傳每個 config 的 Total Return / CAGR / Sharpe / MaxDD / Exposure / Switches (DataFrame，列順序同 crash)。
+    """
+    crash = np.asarray(crash, dtype=bool)
+    r = np.nan_to_num(np.asarray(returns, dtype=float))
+    exposure = np.ones(crash.shape, dtype=float)
+    exposure[:, 1:] = ~crash[:, :-1]
+    switches = np.abs(np.diff(exposure, axis=1, prepend=1.0))
+    daily = exposure * r[None, :] - cost * switches
+
+    equity = np.cumprod(1.0 + daily, axis=1)
+    total = equity[:, -1] - 1.0
+    drawdown = (equity / np.maximum.accumulate(np.maximum(equity, 1.0), axis=1) - 1.0).min(axis=1)
+    std = daily.std(axis=1, ddof=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = np.where(std > 0, daily.mean(axis=1) / std * np.sqrt(periods_per_year), 0.0)
+    if dates is not None and len(dates) > 1:
+        years = (dates[-1] - dates[0]).days / 365.25
+    else:
+        years = crash.shape[1] / periods_per_year
+    cagr = np.where(equity[:, -1] > 0, equity[:, -1] ** (1.0 / years) - 1.0, -1.0) if years > 0 else total
+    return pd.DataFrame({
+        'Total Return': total,
+        'CAGR': cagr,
+        'Sharpe': sharpe,
+        'MaxDD': drawdown,
+        'Exposure': exposure.mean(axis=1),
+        'Crash_Days': crash.sum(axis=1),
+        'Switches': switches.sum(axis=1).astype(int),
+    })
+
+
+# 簡單測試用
+if __name__ == "__main__":
+    import time
+
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range('2008-01-01', periods=4000)
+    level = np.empty(len(dates))
+    level[0] = 0.55
+    for t in range(1, len(dates)):  # AR(1) 的 breadth，偶爾跌破 20%
+        level[t] = 0.55 + 0.99 * (level[t - 1] - 0.55) + rng.normal(0, 0.03)
+    breadth = pd.Series(np.clip(level, 0, 1), index=dates)
+    macro = pd.DataFrame({'Junk_Bond_Stress': np.exp(np.cumsum(rng.normal(0, 0.004, len(dates)))),
+                          'Risk_Off_Flow': np.exp(np.cumsum(rng.normal(0, 0.006, len(dates))))}, index=dates)
+    returns = rng.normal(0.0004, 0.012, len(dates))
+
+    configs = regime_configs(np.round(np.arange(0.05, 0.41, 0.01), 2), [5, 10, 20, 50, 100, 200],
+                             macro_logic=MACRO_LOGIC, combine=COMBINE)
+    t0 = time.perf_counter()
+    crash = crash_matrix(configs, breadth, macro)
+    metrics = backtest_crash_matrix(crash, returns, dates)
+    elapsed = time.perf_counter() - t0
+
+    # 對照：V5.3 的寫死規則 (breadth < 15% OR (junk < MA20 AND flow > MA20))
+    ref = (breadth < 0.15) | ((macro['Junk_Bond_Stress'] < macro['Junk_Bond_Stress'].rolling(20).mean()) &
+                              (macro['Risk_Off_Flow'] > macro['Risk_Off_Flow'].rolling(20).mean()))
+    row = configs.index[(configs['breadth_threshold'] == 0.15) & (configs['ma_window'] == 20) &
+                        (configs['macro_logic'] == 'and') & (configs['combine'] == 'or')][0]
+    assert np.array_equal(crash[row], ref.to_numpy())
+    print(f"{len(configs)} configs x {len(dates)} days: crash matrix + backtest in {elapsed * 1000:.0f} ms")
+    print(pd.concat([configs, metrics], axis=1).sort_values('Sharpe', ascending=False).head(5).to_string())
@@ -0,0 +1,72 @@
+"""
+Zero-copy style wide -> long reshaping for yfinance-style panels.
+
+df.stack(...).reset_index() + rename + set_index + 逐欄 pd.to_numeric 每一步都會複製整個宇宙。
+wide_to_long() 直接把 (date x symbol x field) 的 NumPy block 填好後 reshape 成長表：
+    - 每個欄位只做一次 dtype 轉換 (直接寫入目標 float64 陣列)
+    - reshape (T, S, F) -> (T*S, F) 為 view，不另外複製
+    - (timestamp, symbol) MultiIndex 直接由 codes 建立，不產生 tuple
+
+V5.3 01_format_data 只有在讀取舊版 00 產出的寬表 pickle (raw_tickers.pkl / raw_macro.pkl) 時才會用到；
+新的 00 直接寫出長表 raw dataset (common.raw_dataset)，01 以 stream_to_parquet 處理，不經過寬表。
+輸出與舊的 stack 路徑完全相同，包含欄位名稱 (columns.name 沿用欄位所在 level 的名稱，例如 'Price')。
+"""
+import numpy as np
+import pandas as pd
+
+PRICE_FIELDS = {'open', 'high', 'low', 'close', 'adj close', 'volume'}
+
+
+def detect_levels(columns):
+    """Returns (field_level, symbol_level) for a 2-level (Price, Ticker) / (Ticker, Price) column index."""
+    l0 = {str(v).lower() for v in columns.get_level_values(0)}
+    l1 = {str(v).lower() for v in columns.get_level_values(1)}
+    if l0 & PRICE_FIELDS:
+        return 0, 1
+    if l1 & PRICE_FIELDS:
+        return 1, 0
+    return 0, 1
+
+
+def wide_to_long(df, index_names=('timestamp', 'symbol'), lower=True, dtype=np.float64, drop=('adj close',)):
+    """
+    Converts a wide frame with (Price, Ticker) or (Ticker, Price) columns into a long frame
+    indexed by (timestamp, symbol), sorted by timestamp then symbol.
+
+    與 df.stack(future_stack=True) 相同：不會丟棄全 NaN 的列 (例如上市前的日期)。
+    """
+    field_level, symbol_level = detect_levels(df.columns)
+
+    raw_fields = df.columns.get_level_values(field_level)
+    fields_key = raw_fields.str.lower() if lower else raw_fields
+    keep = ~fields_key.isin(list(drop))
+
+    fields = pd.Index(pd.unique(fields_key[keep]))
+    symbols = pd.Index(pd.unique(df.columns.get_level_values(symbol_level)[keep])).sort_values()
+    dates = pd.DatetimeIndex(df.index)
+
+    # 日期若未排序，以 row_order 在填值時重排 (不額外複製原始 DataFrame)
+    row_order = None
+    if not dates.is_monotonic_increasing:
+        row_order = np.argsort(dates.values, kind='stable')
+        dates = dates[row_order]
+
+    f_codes = fields.get_indexer(fields_key)
+    s_codes = symbols.get_indexer(df.columns.get_level_values(symbol_level))
+
+    n_t, n_s, n_f = len(dates), len(symbols), len(fields)
+    block = np.full((n_t, n_s, n_f), np.nan, dtype=dtype)
+    for j in np.flatnonzero(keep):
+        col = df.iloc[:, j]
+        values = pd.to_numeric(col, errors='coerce').to_numpy(dtype=dtype, na_value=np.nan) \
+            if col.dtype == object else col.to_numpy(dtype=dtype, na_value=np.nan)
+        block[:, s_codes[j], f_codes[j]] = values if row_order is None else values[row_order]
+
+    index = pd.MultiIndex(
+        levels=[dates.rename(None), symbols],
+        codes=[np.repeat(np.arange(n_t), n_s), np.tile(np.arange(n_s), n_t)],
+        names=list(index_names),
+        verify_integrity=False
+    )
+    columns = pd.Index(list(fields), name=df.columns.names[field_level])
+    return pd.DataFrame(block.reshape(n_t * n_s, n_f), index=index, columns=columns, copy=False)
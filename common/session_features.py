@@ -0,0 +1,221 @@
+"""
+Intraday bars -> per-day, per-symbol session features (US/Eastern).
+
+V5.1 的 universe_60m.parquet 與 V6.x 實驗下載的 5m / 1m K 棒原本都沒有進入日線特徵。
+這裡把長表 (symbol, timestamp) 的盤中 K 棒依「標的 x 美東交易日」切段，每一段以 ufunc.reduceat
+一次算完 (不逐標的、逐日迴圈)：
+
+    sess = session_features(bars_60m, first_minutes=60)
+    stock_features = join_session_features(stock_features, sess)
+
+Session 定義 (K 棒時間 = 該棒的起始時間)：
+    盤前 (premarket) : 04:00 <= t < 09:30
+    正規盤 (RTH)      : 09:30 <= t < 收盤 (16:00；提早收盤日 13:00，見 early_close_days)
+    盤後             : 不使用
+時區：tz-aware 的 timestamp 轉成美東時間；tz-naive 視為 UTC (與 yfinance 盤中資料的處理相同)，
+夏令時間由 tz_convert 處理。first_minutes / last_minutes 的實際涵蓋範圍受 K 棒週期限制
+(例如 60m K 棒時 first_minutes=30 仍會包含整根 09:30 的 K 棒)。
+
+輸出欄位 (index = (symbol, timestamp)，timestamp 為交易日 00:00、tz-naive，可直接對上日線)：
+    Overnight_Gap      : RTH 開盤 / 前一交易日 RTH 收盤 - 1
+    PM_High_Pct        : 盤前最高 / 前一交易日 RTH 收盤 - 1
+    PM_Low_Pct         : 盤前最低 / 前一交易日 RTH 收盤 - 1
+    PM_Drift           : 盤前最後收盤 / 盤前第一個開盤 - 1
+    OR_Range_{N}m      : 開盤後 N 分鐘 (最高 - 最低) / RTH 開盤
+    Last{M}m_Ret       : 收盤前 M 分鐘的報酬 (最後收盤 / 該區段第一個開盤 - 1)
+    Last{M}m_Vol_Share : 收盤前 M 分鐘成交量 / 全日 RTH 成交量
+    VWAP               : RTH 成交量加權均價 (典型價 (H + L + C) / 3)
+    Close_VWAP_Dist    : RTH 收盤 / VWAP - 1
+注意：這些特徵在當天收盤 (盤前欄位在 09:30) 才確定，與日線的 Close 同一時點。
+"""
+import datetime
+
+import numpy as np
+import pandas as pd
+
+MARKET_TZ = 'America/New_York'
+PREMARKET_OPEN = 4 * 60
+RTH_OPEN = 9 * 60 + 30
+RTH_CLOSE = 16 * 60
+EARLY_CLOSE = 13 * 60
+
+NS_PER_MINUTE = 60 * 10**9
+NS_PER_DAY = 24 * 60 * NS_PER_MINUTE
+
+
+def early_close_days(years):
+    """
+    NYSE 13:00 提早收盤日：7/3 (7/4 為週二~週五時)、感恩節隔天、12/24 (週一~週四)。
+    回傳 datetime.date 的集合；特殊公告的臨時調整不在此列。
+    """
+    days = set()
+    for y in years:
+        for d in (datetime.date(y, 7, 3), datetime.date(y, 12, 24)):
+            if d.weekday() <= 3:
+                days.add(d)
+        nov1 = datetime.date(y, 11, 1)
+        thanksgiving = nov1 + datetime.timedelta(days=(3 - nov1.weekday()) % 7 + 21)
+        days.add(thanksgiving + datetime.timedelta(days=1))
+    return days
+
+
+def _close_minutes(day_numbers):
+    """Session close (minute of day) for each day number (days since 1970-01-01)；以日期範圍查表，不逐列轉日期。"""
+    if len(day_numbers) == 0:
+        return np.zeros(0, dtype=np.int64)
+    first, last = int(day_numbers.min()), int(day_numbers.max())
+    span = pd.date_range(pd.Timestamp(first, unit='D'), pd.Timestamp(last, unit='D'))
+    early = early_close_days(range(span[0].year, span[-1].year + 1))
+    table = np.where(np.isin(span.date, list(early)), EARLY_CLOSE, RTH_CLOSE)
+    return table[day_numbers - first]
+
+
+def _local_clock(timestamps, tz=MARKET_TZ):
+    """(day number, minute of day) in market time；tz-naive 視為 UTC。"""
+    ts = pd.DatetimeIndex(timestamps)
+    if ts.tz is None:
+        ts = ts.tz_localize('UTC')
+    wall = ts.tz_convert(tz).tz_localize(None).as_unit('ns').asi8
+    return wall // NS_PER_DAY, (wall % NS_PER_DAY) // NS_PER_MINUTE
+
+
+class _Segments:
+    """Contiguous (symbol, day) runs of the rows selected by mask (資料已依 symbol、時間排序)。"""
+
+    def __init__(self, keys, mask):
+        self.idx = np.flatnonzero(mask)
+        k = keys[self.idx]
+        first = np.ones(len(k), dtype=bool)
+        first[1:] = k[1:] != k[:-1]
+        self.starts = np.flatnonzero(first)
+        self.ends = np.append(self.starts[1:], len(k)) - 1
+        self.keys = k[self.starts]
+
+    def first(self, x):
+        return x[self.idx][self.starts]
+
+    def last(self, x):
+        return x[self.idx][self.ends]
+
+    def max(self, x):
+        return np.fmax.reduceat(x[self.idx], self.starts) if len(self.starts) else np.zeros(0)
+
+    def min(self, x):
+        return np.fmin.reduceat(x[self.idx], self.starts) if len(self.starts) else np.zeros(0)
+
+    def sum(self, x):
+        return np.add.reduceat(np.nan_to_num(x[self.idx]), self.starts) if len(self.starts) else np.zeros(0)
+
+    def align(self, values, keys):
+        """Values on another segment table's keys (該段不存在者為 NaN)。"""
+        pos = np.searchsorted(self.keys, keys)
+        pos = np.minimum(pos, max(len(self.keys) - 1, 0))
+        hit = (self.keys[pos] == keys) if len(self.keys) else np.zeros(len(keys), dtype=bool)
+        return np.where(hit, values[pos] if len(values) else np.nan, np.nan)
+
+
+def session_features(bars, first_minutes=30, last_minutes=30, tz=MARKET_TZ,
+                     symbol_level='symbol', time_level='timestamp'):
+    """
+    Long intraday bars (symbol, timestamp) with OHLCV (大小寫皆可) -> daily session features。
+    只有當天有 RTH K 棒的 (symbol, day) 才會輸出。
+    """
+    cols = {c.lower(): c for c in bars.columns}
+    o, h, l, c, v = (bars[cols[k]].to_numpy(dtype=np.float64, na_value=np.nan)
+                     for k in ('open', 'high', 'low', 'close', 'volume'))
+    sym, symbols = pd.factorize(bars.index.get_level_values(symbol_level))
+    day, minute = _local_clock(bars.index.get_level_values(time_level), tz)
+
+    # 依 (symbol, 當地時間) 排序 (已排序時略過)；yfinance 缺資料的列 (Close 為 NaN) 不算
+    clock = day * 1440 + minute
+    if np.any(sym[1:] < sym[:-1]) or np.any((sym[1:] == sym[:-1]) & (clock[1:] < clock[:-1])):
+        order = np.lexsort((clock, sym))
+        o, h, l, c, v, sym, day, minute = (a[order] for a in (o, h, l, c, v, sym, day, minute))
+    valid = ~np.isnan(c)
+    if not valid.all():
+        o, h, l, c, v, sym, day, minute = (a[valid] for a in (o, h, l, c, v, sym, day, minute))
+    keys = (sym.astype(np.int64) << 32) | (day - day.min() if len(day) else day)
+
+    close_min = _close_minutes(day)
+    rth = (minute >= RTH_OPEN) & (minute < close_min)
+    pm = (minute >= PREMARKET_OPEN) & (minute < RTH_OPEN)
+
+    s_rth = _Segments(keys, rth)
+    rth_open, rth_close = s_rth.first(o), s_rth.last(c)
+    rth_vol = s_rth.sum(v)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        vwap = s_rth.sum((h + l + c) / 3.0 * v) / np.where(rth_vol > 0, rth_vol, np.nan)
+
+    # 前一交易日收盤：同標的的上一段 RTH
+    out_sym = s_rth.first(sym)
+    prev_close = np.full(len(rth_close), np.nan)
+    same = np.zeros(len(rth_close), dtype=bool)
+    same[1:] = out_sym[1:] == out_sym[:-1]
+    prev_close[1:] = rth_close[:-1]
+    prev_close[~same] = np.nan
+
+    s_pm = _Segments(keys, pm)
+    s_or = _Segments(keys, rth & (minute < RTH_OPEN + first_minutes))
+    s_last = _Segments(keys, rth & (minute >= close_min - last_minutes))
+    last_ret = s_last.last(c) / s_last.first(o) - 1
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        data = {
+            'Overnight_Gap': rth_open / prev_close - 1,
+            'PM_High_Pct': s_pm.align(s_pm.max(h), s_rth.keys) / prev_close - 1,
+            'PM_Low_Pct': s_pm.align(s_pm.min(l), s_rth.keys) / prev_close - 1,
+            'PM_Drift': s_pm.align(s_pm.last(c) / s_pm.first(o) - 1, s_rth.keys),
+            f'OR_Range_{first_minutes}m': s_or.align(s_or.max(h) - s_or.min(l), s_rth.keys) / rth_open,
+            f'Last{last_minutes}m_Ret': s_last.align(last_ret, s_rth.keys),
+            f'Last{last_minutes}m_Vol_Share': s_last.align(s_last.sum(v), s_rth.keys) / np.where(rth_vol > 0, rth_vol, np.nan),
+            'VWAP': vwap,
+            'Close_VWAP_Dist': rth_close / vwap - 1,
+        }
+    index = pd.MultiIndex.from_arrays(
+        [symbols[out_sym], pd.to_datetime(s_rth.first(day), unit='D')], names=['symbol', 'timestamp'])
+    return pd.DataFrame(data, index=index)
+
+
+def join_session_features(features, sess, symbol_level='symbol', time_level='timestamp', tz=MARKET_TZ):
+    """
+    Adds session feature columns onto a daily (symbol, timestamp) / (timestamp, symbol) frame。
+    日線 timestamp 若為 tz-aware，先轉成美東日期；沒有盤中資料的日子為 NaN。
+    """
+    dates = pd.DatetimeIndex(features.index.get_level_values(time_level))
+    if dates.tz is not None:
+        dates = dates.tz_convert(tz).tz_localize(None)
+    keys = pd.MultiIndex.from_arrays([features.index.get_level_values(symbol_level), dates.normalize()],
+                                     names=['symbol', 'timestamp'])
+    aligned = sess.reindex(keys)
+    out = features.copy()
+    for col in sess.columns:
+        out[col] = aligned[col].to_numpy()
+    return out
+
+
+# 簡單測試用
+if __name__ == "__main__":
+    # 2024-11-29 (感恩節隔天，13:00 收盤) 與 2024-03-11 (夏令時間第一個交易日)，5m K 棒含盤前盤後
+    frames = []
+    for day in ['2024-03-08', '2024-03-11', '2024-11-27', '2024-11-29']:
+        local = pd.date_range(f"{day} 04:00", f"{day} 19:55", freq='5min', tz=MARKET_TZ)
+        price = 100 + np.arange(len(local)) * 0.01
+        frames.append(pd.DataFrame({'Open': price, 'High': price + 0.05, 'Low': price - 0.05,
+                                    'Close': price + 0.01, 'Volume': 1000.0},
+                                   index=local.tz_convert('UTC').tz_localize(None)))
+    bars = pd.concat(frames)
+    bars.index = pd.MultiIndex.from_product([['AAA'], bars.index], names=['symbol', 'timestamp'])
+    sess = session_features(bars, first_minutes=30, last_minutes=30)
+    print(sess.T)
+
+    # 對照逐日 pandas 寫法
+    local = bars.droplevel('symbol').tz_localize('UTC').tz_convert(MARKET_TZ)
+    for d, g in local.groupby(local.index.date):
+        close_t = '13:00' if d == datetime.date(2024, 11, 29) else '16:00'
+        rth = g.between_time('09:30', close_t, inclusive='left')
+        last = g.between_time(f"{int(close_t[:2]) - 1}:30", close_t, inclusive='left')
+        row = sess.loc[('AAA', pd.Timestamp(d))]
+        assert np.isclose(row['Last30m_Ret'], last['Close'].iloc[-1] / last['Open'].iloc[0] - 1)
+        vwap = ((rth['High'] + rth['Low'] + rth['Close']) / 3 * rth['Volume']).sum() / rth['Volume'].sum()
+        assert np.isclose(row['VWAP'], vwap)
+    print("session features match per-day pandas: OK")
@@ -0,0 +1,129 @@
+"""
+Walk-forward (rolling window) executor for per-fold model refits.
+
+舊做法 (V5.1 03_train_regime_model_l1_rolling) 以 for 迴圈依序訓練每一折；各折彼此獨立，
+這裡把「切折 -> 每折訓練 / 預測 -> 收集結果」抽成共用流程，workers > 1 時交給 fork 的 process pool：
+
+    results = run_walk_forward(market_df, train_and_predict_fold, train_window=504, step=63, workers=4)
+    for fold, result in results:   # 依折的順序
+        ...
+
+fold_fn(train_df, test_df, seed=..., **fold_kwargs) 由呼叫端提供，回傳任意可 pickle 的結果 (None = 該折略過)。
+每折的 seed 由 (seed, fold.id) 經 SeedSequence 推導，與 workers 數量、排程順序無關；
+每折執行時 BLAS / OpenMP 限制為單執行緒，因此 workers=1 與 workers=N 的結果完全相同。
+chain=True 時各折依序執行，並以 prev= 傳入上一折 (非 None) 的結果 (例如 warm start 用上一折的模型起始)。
+"""
+import multiprocessing as mp
+from collections import namedtuple
+
+import numpy as np
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+# 位置皆為 df 的列號：train = [train_start, train_end)、test = [test_start, test_end)
+Fold = namedtuple('Fold', ['id', 'train_start', 'train_end', 'test_start', 'test_end', 'seed'])
+
+_FORK_JOB = None  # fork 前設定，子行程直接繼承 (不必 pickle 整個 DataFrame)
+
+
+def fold_seed(seed, fold_id):
+    """Deterministic per-fold seed derived from the base seed (SeedSequence, 各折互不相關)。"""
+    return int(np.random.SeedSequence([seed, fold_id]).generate_state(1)[0])
+
+
+def rolling_folds(n_rows, train_window, step, seed=42):
+    """Train on the previous train_window rows, test on the next step rows (最後一折可能較短)。"""
+    return [Fold(k, i - train_window, i, i, min(i + step, n_rows), fold_seed(seed, k))
+            for k, i in enumerate(range(train_window, n_rows, step))]
+
+
+def _can_fork():
+    return 'fork' in mp.get_all_start_methods()
+
+
+def _call_fold(df, fold_fn, fold_kwargs, fold):
+    train_df = df.iloc[fold.train_start:fold.train_end]
+    test_df = df.iloc[fold.test_start:fold.test_end]
+    if threadpool_limits is None:
+        return fold_fn(train_df, test_df, seed=fold.seed, **fold_kwargs)
+    with threadpool_limits(limits=1):
+        return fold_fn(train_df, test_df, seed=fold.seed, **fold_kwargs)
+
+
+def _run_forked(fold):
+    df, fold_fn, fold_kwargs = _FORK_JOB
+    return _call_fold(df, fold_fn, fold_kwargs, fold)
+
+
+def _describe(df, fold):
+    idx = df.index
+    fmt = (lambda ts: ts.date()) if hasattr(idx[0], 'date') else (lambda ts: ts)
+    return (f"Train[{fmt(idx[fold.train_start])} ~ {fmt(idx[fold.train_end - 1])}] -> "
+            f"Predict[{fmt(idx[fold.test_start])} ~ {fmt(idx[fold.test_end - 1])}]")
+
+
+def run_walk_forward(df, fold_fn, train_window, step, workers=1, seed=42, verbose=True, chain=False,
+                     **fold_kwargs):
+    """
+    Runs fold_fn over all rolling folds of df (依時間排序)；回傳 [(Fold, result), ...] (依折的順序)。
+    workers > 1 時以 fork 的 process pool 平行執行 (不支援 fork 的平台改為單行程並印出警告)；
+    chain=True 時後一折依賴前一折，一律單行程。
+    """
+    global _FORK_JOB
+    folds = rolling_folds(len(df), train_window, step, seed)
+    if not folds:
+        return []
+    if chain and workers > 1:
+        print("Warning: chained walk-forward folds depend on the previous fold; running serially.")
+        workers = 1
+    if workers > 1 and not _can_fork():
+        print("Warning: 'fork' start method not available; running walk-forward folds serially.")
+        workers = 1
+    workers = min(workers, len(folds))
+
+    def report(fold):
+        if verbose:
+            print(f"Processing Fold {fold.id + 1}/{len(folds)}: {_describe(df, fold)}")
+
+    if workers <= 1:
+        results = []
+        prev = None
+        for fold in folds:
+            report(fold)
+            kwargs = dict(fold_kwargs, prev=prev) if chain else fold_kwargs
+            result = _call_fold(df, fold_fn, kwargs, fold)
+            if result is not None:
+                prev = result
+            results.append((fold, result))
+        return results
+
+    _FORK_JOB = (df, fold_fn, fold_kwargs)
+    try:
+        with mp.get_context('fork').Pool(workers) as pool:
+            # imap 依折的順序回傳，進度訊息照順序印出
+            results = []
+            for fold, result in zip(folds, pool.imap(_run_forked, folds)):
+                report(fold)
+                results.append((fold, result))
+    finally:
+        _FORK_JOB = None
+    return results
+
+
+# 簡單測試用
+if __name__ == "__main__":
+    import pandas as pd
+
+    df = pd.DataFrame({'x': np.arange(1000.0)}, index=pd.bdate_range('2020-01-01', periods=1000))
+
+    def fold_mean(train_df, test_df, seed):
+        noise = np.random.default_rng(seed).normal()
+        return pd.Series(train_df['x'].mean() + noise, index=test_df.index)
+
+    serial = run_walk_forward(df, fold_mean, 252, 63, verbose=False)
+    forked = run_walk_forward(df, fold_mean, 252, 63, workers=3)
+    assert all(a[1].equals(b[1]) and a[0] == b[0] for a, b in zip(serial, forked))
+    print(f"{len(serial)} folds; workers=1 and workers=3 identical: OK")